@@ -1,6 +1,13 @@
-import re
+import itertools
+import math
 import os
 
+import numpy as np
+
+import gcode_io
+from layer import last_z_part_index
+from profiling import run_main
+
 def get_total_layers(lines):
     """
     Determines the total number of layers by parsing layer comments.
@@ -8,13 +15,35 @@ def get_total_layers(lines):
     """
     max_layer = 0
     for line in lines:
-        match = re.search(r"; \(--- Layer (\d+)", line)
+        match = gcode_io.LAYER_COMMENT_PATTERN.search(line)
         if match:
             layer_num = int(match.group(1))
             if layer_num > max_layer:
                 max_layer = layer_num
     return max_layer
 
+def iter_layer_heights(layers_per_block_a, initial_lh_h, delta_lh_d):
+    """
+    Endless generator of (layer_number, block_index, individual_lh, cumulative_z) for the block schedule.
+    Non-positive layer heights are forced to 0.001mm with a warning.
+    """
+    current_cumulative_z = 0.0
+    layer_number_1_indexed = 0
+    while True:
+        layer_number_1_indexed += 1
+        block_index_0_indexed = (layer_number_1_indexed - 1) // layers_per_block_a
+        
+        current_individual_lh = initial_lh_h + (block_index_0_indexed * delta_lh_d)
+        
+        if current_individual_lh <= 0:
+            print(f"警告: 计算得出 Layer {layer_number_1_indexed} 的独立层高为 {current_individual_lh:.3f}mm (<=0)。")
+            print("这可能导致G-code问题。建议检查输入参数 a, h, d。")
+            current_individual_lh = 0.001 
+            print(f"         已将 Layer {layer_number_1_indexed} 的层高强制设为 {current_individual_lh:.3f}mm。")
+
+        current_cumulative_z += current_individual_lh
+        yield layer_number_1_indexed, block_index_0_indexed, current_individual_lh, current_cumulative_z
+
 def calculate_target_z_for_layers(total_layers, layers_per_block_a, initial_lh_h, delta_lh_d):
     """
     Calculates the target Z height at the end of each layer.
@@ -24,143 +53,495 @@ def calculate_target_z_for_layers(total_layers, layers_per_block_a, initial_lh_h
         return []
 
     target_z_at_layer_end = [0.0] * total_layers
-    current_cumulative_z = 0.0
 
     print("\n调试信息: 计划的每层独立层高和累积Z值：")
     print("----------------------------------------------------")
     print("| Layer # | Block Idx | Individual LH | Cumulative Z |")
     print("|---------|-----------|---------------|--------------|")
 
-    for i in range(total_layers):
-        layer_number_1_indexed = i + 1
-        block_index_0_indexed = (layer_number_1_indexed - 1) // layers_per_block_a
-        
-        current_individual_lh = initial_lh_h + (block_index_0_indexed * delta_lh_d)
-        
-        if current_individual_lh <= 0:
-            print(f"警告: 计算得出 Layer {layer_number_1_indexed} 的独立层高为 {current_individual_lh:.3f}mm (<=0)。")
-            print("这可能导致G-code问题。建议检查输入参数 a, h, d。")
-            current_individual_lh = 0.001 
-            print(f"         已将 Layer {layer_number_1_indexed} 的层高强制设为 {current_individual_lh:.3f}mm。")
-
-        current_cumulative_z += current_individual_lh
+    schedule = iter_layer_heights(layers_per_block_a, initial_lh_h, delta_lh_d)
+    for i, (layer_number_1_indexed, block_index_0_indexed, current_individual_lh, current_cumulative_z) in zip(range(total_layers), schedule):
         target_z_at_layer_end[i] = current_cumulative_z
         print(f"| {layer_number_1_indexed:<7} | {block_index_0_indexed:<9} | {current_individual_lh:<13.3f} | {current_cumulative_z:<12.3f} |")
     
     print("----------------------------------------------------\n")
     return target_z_at_layer_end
 
+def make_lazy_target_z(layers_per_block_a, initial_lh_h, delta_lh_d):
+    """
+    Returns target_z(layer_number) that extends the schedule only as far as the layers actually seen,
+    for inputs whose total layer count is not known in advance (e.g. stdin).
+    """
+    schedule = iter_layer_heights(layers_per_block_a, initial_lh_h, delta_lh_d)
+    target_z_at_layer_end = []
+
+    def target_z(layer_number):
+        while len(target_z_at_layer_end) < layer_number:
+            target_z_at_layer_end.append(next(schedule)[3])
+        return target_z_at_layer_end[layer_number - 1]
+
+    return target_z
+
 def get_last_z_indices(lines):
     """
     Finds the line index and part index of the very last Z command in the file.
     """
-    last_z_line_global_idx = -1
-    last_z_part_idx_in_line = -1
-
     for i in range(len(lines) - 1, -1, -1):
-        line_content_scan = lines[i]
-        stripped_line_scan = line_content_scan.strip()
-        if not stripped_line_scan or stripped_line_scan.startswith(";") or stripped_line_scan.startswith("("):
+        j = last_z_part_index(lines[i])
+        if j != -1:
+            return i, j
+    return -1, -1
+
+def has_z_word(line_content):
+    """
+    True if retarget_z_words would rewrite a word of this line in a layer.
+    """
+    stripped_line = line_content.strip()
+    if not stripped_line or stripped_line.startswith(";") or stripped_line.startswith("("):
+        return False
+    return any(part.startswith("Z") for part in stripped_line.split())
+
+def retarget_z_words(line_content, layer_num, target_z, keep_part_idx=-1):
+    """
+    Replaces every Z word of a G-code line in layer layer_num with target_z(layer_num), except the one at keep_part_idx.
+    Lines before the first layer comment (layer_num 0) are left unchanged.
+    """
+    stripped_line = line_content.strip()
+    if not stripped_line or stripped_line.startswith(";") or stripped_line.startswith("("):
+        return line_content
+
+    parts = stripped_line.split()
+    modified_parts = []
+    line_has_changed = False
+
+    for part_idx, part_val in enumerate(parts):
+        if part_val.startswith("Z"):
+            if part_idx == keep_part_idx:
+                modified_parts.append(part_val)
+            elif layer_num > 0:
+                new_z_for_current_layer = target_z(layer_num)
+                modified_parts.append(f"Z{new_z_for_current_layer:.3f}")
+                line_has_changed = True
+            else:
+                modified_parts.append(part_val) 
+        else:
+            modified_parts.append(part_val)
+    
+    if line_has_changed:
+        return " ".join(modified_parts) + "\n"
+    return line_content
+
+def iter_variable_lh_lines(lines, target_z):
+    """
+    Generator over the rewritten lines. The very last Z word of the file (the final safe Z lift) is kept,
+    so the most recent Z-bearing line is held back, together with the lines after it, until the next one arrives.
+    """
+    current_gcode_layer_num = 0 
+    pending = [] # [(line, layer)] of the most recent Z-bearing line, then the already rewritten lines after it
+    pending_line_idx = -1
+
+    for line_idx, line_content in enumerate(lines):
+        layer_comment_match = gcode_io.LAYER_COMMENT_PATTERN.search(line_content)
+        if layer_comment_match:
+            current_gcode_layer_num = int(layer_comment_match.group(1))
+
+        if last_z_part_index(line_content) != -1:
+            if pending:
+                yield retarget_z_words(*pending[0], target_z)
+                yield from pending[1:]
+            pending = [(line_content, current_gcode_layer_num)]
+            pending_line_idx = line_idx
             continue
 
-        parts_scan = stripped_line_scan.split()
-        found_z_in_this_line_scan = False
-        for j in range(len(parts_scan) - 1, -1, -1):
-            if parts_scan[j].startswith("Z"):
-                try:
-                    float(parts_scan[j][1:]) 
-                    last_z_line_global_idx = i
-                    last_z_part_idx_in_line = j
-                    found_z_in_this_line_scan = True
-                    break 
-                except ValueError:
-                    continue 
-        if found_z_in_this_line_scan:
-            break 
-    return last_z_line_global_idx, last_z_part_idx_in_line
-
-def process_gcode_variable_lh(input_filepath, layers_per_block_a, initial_lh_h, delta_lh_d):
-    try:
-        with open(input_filepath, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        print(f"错误：文件 '{input_filepath}' 未找到。")
-        return
-    except Exception as e:
-        print(f"读取文件时发生错误: {e}")
+        new_line = retarget_z_words(line_content, current_gcode_layer_num, target_z)
+        if pending:
+            pending.append(new_line)
+        else:
+            yield new_line
+
+    if not pending:
         return
+    yield retarget_last_z_line(*pending[0], pending_line_idx, target_z)
+    yield from pending[1:]
+
+def retarget_last_z_line(line_content, layer_num, line_idx, target_z):
+    """
+    Rewrites the line holding the very last Z word of the file, keeping that Z word.
+    """
+    last_z_part_idx = last_z_part_index(line_content)
+    print(f"调试信息: 最后一个Z指令位于原始文件行 {line_idx + 1}, Z参数索引 {last_z_part_idx}.")
+    print(f"         内容: '{line_content.strip()}'")
+    print(f"         Z部分: '{line_content.strip().split()[last_z_part_idx]}'")
+    return retarget_z_words(line_content, layer_num, target_z, keep_part_idx=last_z_part_idx)
 
-    total_layers = get_total_layers(lines)
+def process_variable_lh_lines(lines, layers_per_block_a, initial_lh_h, delta_lh_d, total_layers=None):
+    """
+    Rewrites the Z values of every layer in lines (any iterable of text lines) according to the block
+    schedule (a, h, d). Returns a lazy iterator over the modified lines, or None if the file or the
+    parameters are invalid.
+
+    total_layers is only needed for the schedule table and the zero-layer-height warning; when it is None
+    (e.g. for stdin) the input is read just up to its first layer comment before returning and the target
+    Z of each layer is computed when that layer is reached.
+    """
+    lines = iter(lines)
+    lines_read = []
+    if total_layers is None:
+        for line in lines:
+            lines_read.append(line)
+            if gcode_io.LAYER_COMMENT_PATTERN.search(line):
+                total_layers = -1 # unknown, but at least one layer comment exists
+                break
+        else:
+            total_layers = 0
+
+    target_z = make_target_z(total_layers, layers_per_block_a, initial_lh_h, delta_lh_d)
+    if target_z is None:
+        return None
+    return iter_variable_lh_lines(itertools.chain(lines_read, lines), target_z)
+
+def make_target_z(total_layers, layers_per_block_a, initial_lh_h, delta_lh_d):
+    """
+    Checks the parameters and returns target_z(layer_number) for a file with total_layers layers
+    (-1 if unknown: the schedule is then extended lazily), or None.
+    """
     if total_layers == 0:
         print("错误：在文件中未找到任何 '; (--- Layer N ...' 格式的层注释。无法确定总层数。")
-        return
-    print(f"文件总层数: {total_layers}")
+        return None
+    if total_layers > 0:
+        print(f"文件总层数: {total_layers}")
 
     if layers_per_block_a <= 0:
         print("错误：每块的层数 (a) 必须是正整数。")
-        return
+        return None
     if initial_lh_h <= 0:
         print("错误：初始层高 (h) 必须是正数。")
-        return
-        
-    if delta_lh_d < 0:
-        num_blocks_before_zero_lh = -initial_lh_h / delta_lh_d if delta_lh_d != 0 else float('inf')
-        if num_blocks_before_zero_lh < (total_layers / layers_per_block_a):
-             print(f"警告: 根据输入参数，层高可能在第 {int(num_blocks_before_zero_lh) + 1} 个块变为零或负数。")
+        return None
 
-    target_z_values = calculate_target_z_for_layers(total_layers, layers_per_block_a, initial_lh_h, delta_lh_d)
-    if not target_z_values:
-        print("错误: 未能计算目标Z值。")
-        return
+    if total_layers < 0:
+        target_z = make_lazy_target_z(layers_per_block_a, initial_lh_h, delta_lh_d)
+    else:
+        if delta_lh_d < 0:
+            num_blocks_before_zero_lh = -initial_lh_h / delta_lh_d if delta_lh_d != 0 else float('inf')
+            if num_blocks_before_zero_lh < (total_layers / layers_per_block_a):
+                 print(f"警告: 根据输入参数，层高可能在第 {int(num_blocks_before_zero_lh) + 1} 个块变为零或负数。")
 
-    last_z_line_idx, last_z_part_idx = get_last_z_indices(lines)
-    if last_z_line_idx != -1:
-        print(f"调试信息: 最后一个Z指令位于原始文件行 {last_z_line_idx + 1}, Z参数索引 {last_z_part_idx}.")
-        print(f"         内容: '{lines[last_z_line_idx].strip()}'")
-        print(f"         Z部分: '{lines[last_z_line_idx].strip().split()[last_z_part_idx]}'")
+        target_z_values = calculate_target_z_for_layers(total_layers, layers_per_block_a, initial_lh_h, delta_lh_d)
+        if not target_z_values:
+            print("错误: 未能计算目标Z值。")
+            return None
+        target_z = lambda layer_num: target_z_values[layer_num - 1]
+    return target_z
 
-    final_output_lines = []
-    current_gcode_layer_num = 0 
 
-    for line_idx, line_content in enumerate(lines):
-        stripped_line = line_content.strip()
-        
-        layer_comment_match = re.search(r"; \(--- Layer (\d+)", stripped_line)
+def process_variable_lh_toolpath(tp, layers_per_block_a, initial_lh_h, delta_lh_d):
+    """
+    process_variable_lh_lines for a binary Toolpath (see toolpath.py): the layer table gives the total
+    layer count and the layer of each record, and only the records with a Z word are rewritten.
+    Returns a new Toolpath, or None.
+    """
+    total_layers = int(tp.layer_number.max()) if tp.layer_count else 0
+    target_z = make_target_z(total_layers, layers_per_block_a, initial_lh_h, delta_lh_d)
+    if target_z is None:
+        return None
+
+    # retarget_z_words rewrites every "Z..." word, even one that does not parse as a number
+    z_records = tp.z_records(has_z_word).tolist()
+    last_z_records = tp.z_records(lambda line: last_z_part_index(line) != -1)
+    last_record = int(last_z_records[-1]) if len(last_z_records) else -1
+    replacements = {}
+    for record, layer_num in zip(z_records, tp.record_layers(z_records).tolist()):
+        if record == last_record:
+            replacements[record] = retarget_last_z_line(tp.line(record), layer_num, record, target_z)
+        else:
+            replacements[record] = retarget_z_words(tp.line(record), layer_num, target_z)
+    return tp.with_lines(replacements)
+
+
+HORIZONTAL_NORMAL_Z = math.cos(math.radians(1.0)) # faces flatter than 1 degree count as horizontal
+
+
+def stl_layer_slopes(triangles, source_lh, total_layers):
+    """
+    Surface slope of an STL per interface between source layers: layer N is the band
+    ((N - 1) * source_lh, N * source_lh] above the lowest point of the mesh (as the slicers cut it), and
+    interface i joins layers i and i + 1. Returns (normal_z, breaks) with total_layers - 1 entries: the
+    largest |n_z| of the faces crossing the two bands, horizontal faces left out, and whether a horizontal
+    face lies at the interface, so that a layer has to end there. Vectorized over all (face, band) pairs.
+    """
+    z = triangles[:, :, 2] - triangles[:, :, 2].min()
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    valid = lengths > 0
+    normal_z = np.abs(normals[valid, 2]) / lengths[valid]
+    z = z[valid]
+    normal_z_per_layer = np.zeros(total_layers)
+    breaks = np.zeros(total_layers, dtype=bool)
+
+    horizontal = normal_z >= HORIZONTAL_NORMAL_Z
+    flat_layer = np.rint(z[horizontal].mean(axis=1) / source_lh).astype(np.int64) - 1
+    breaks[flat_layer[(flat_layer >= 0) & (flat_layer < total_layers)]] = True
+
+    sloped = ~horizontal
+    first = np.clip(np.floor(z[sloped].min(axis=1) / source_lh + 1e-9).astype(np.int64), 0, total_layers - 1)
+    last = np.clip(np.ceil(z[sloped].max(axis=1) / source_lh - 1e-9).astype(np.int64) - 1, 0, total_layers - 1)
+    counts = np.maximum(last - first + 1, 0)
+    offsets = np.cumsum(counts) - counts
+    layers = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(offsets, counts)
+    np.maximum.at(normal_z_per_layer, layers, np.repeat(normal_z[sloped], counts))
+    return np.maximum(normal_z_per_layer[:-1], normal_z_per_layer[1:]), breaks[:-1]
+
+
+def nc_layer_slopes(layer_boxes, source_lh):
+    """
+    Surface slope per interface between layers estimated from the printed contours: the largest
+    horizontal shift of the bounding box edges (xmin, xmax, ymin, ymax; (layers, 4) array) from one layer
+    to the next, over one layer height, as |n_z| of the wall. Returns (normal_z, breaks) like
+    stl_layer_slopes (no breaks).
+    """
+    shift = np.nan_to_num(np.abs(np.diff(layer_boxes, axis=0)).max(axis=1), nan=0.0)
+    return shift / np.hypot(shift, source_lh), np.zeros(len(shift), dtype=bool)
+
+
+def adaptive_layer_groups(normal_z, breaks, source_lh, cusp_height, max_lh):
+    """
+    Merges consecutive source layers into layers as thick as the cusp tolerance allows. normal_z and
+    breaks are given per interface (entry i between source layers i and i + 1): a layer of m source
+    layers (m * source_lh <= max_lh) may only span interfaces with m * source_lh * |n_z| <= cusp_height
+    and no break. Returns the index of the last source layer of every merged layer.
+    """
+    max_m = max(1, int(max_lh / source_lh + 1e-9))
+    with np.errstate(divide="ignore"):
+        allowed = np.clip(np.floor(cusp_height / (source_lh * normal_z) + 1e-9), 1, max_m).astype(np.int64)
+    allowed[breaks] = 1
+    total_layers = len(normal_z) + 1
+    group_ends = []
+    k = 0
+    while k < total_layers:
+        m = 1
+        limit = max_m
+        while k + m < total_layers:
+            limit = min(limit, allowed[k + m - 1])
+            if m + 1 > limit:
+                break
+            m += 1
+        group_ends.append(k + m - 1)
+        k += m
+    return group_ends
+
+
+def adaptive_layer_plan(tp, cusp_height, max_lh=None, triangles=None):
+    """
+    Plans the adaptive layers of a Toolpath (see toolpath.py) sliced at a constant layer height: the
+    slope comes from triangles (an STL, see slicer.load_stl) if given, else from the layer contours.
+    Every merged layer prints the contour of its top source layer at its top Z, m source layers thick;
+    the other layers are dropped. Returns a dict with target_z {layer_number: z} of the kept layers,
+    merge_factor {layer_number: m}, start_xy {layer_number: (x, y)} where the previous layer (now
+    dropped) ended, the source layer height and the estimated print minutes before and after (with the
+    G1 feedrate of every merged layer divided by m, see scale_merged_feedrates); None if the file has no
+    layers.
+    """
+    from toolpath import KIND_G1, KIND_TEXT
+
+    if not tp.layer_count:
+        print("错误：在文件中未找到任何 '; (--- Layer N ...' 格式的层注释。无法确定总层数。")
+        return None
+    layer_numbers = np.asarray(tp.layer_number, dtype=np.int64)
+    layer_z = np.asarray(tp.layer_z, dtype=float)
+    steps = np.diff(layer_z)
+    source_lh = float(np.median(steps)) if len(steps) else float(layer_z[0])
+    if source_lh <= 0:
+        source_lh = float(tp.metadata.get("layer_height") or 0)
+    if source_lh <= 0:
+        print("错误：无法确定原始层高。")
+        return None
+    if max_lh is None:
+        max_lh = 2 * source_lh
+
+    x, y, z, f = tp.positions()
+    record_layer = np.searchsorted(np.asarray(tp.layer_start), np.arange(len(tp)), side="right") - 1
+    moves = tp.kind != KIND_TEXT
+    printing = moves & (tp.kind == KIND_G1) & (record_layer >= 0)
+    boxes = np.full((tp.layer_count, 4), np.nan)
+    for column, (values, reduce) in enumerate(((x, np.fmin), (x, np.fmax), (y, np.fmin), (y, np.fmax))):
+        reduce.at(boxes[:, column], record_layer[printing], values[printing])
+    length = np.sqrt(np.diff(x, prepend=np.nan) ** 2 + np.diff(y, prepend=np.nan) ** 2
+                     + np.diff(z, prepend=np.nan) ** 2)
+    minutes = np.nan_to_num(np.where(moves & (f > 0), length / f, 0.0))
+    layer_minutes = np.bincount(record_layer[record_layer >= 0], minutes[record_layer >= 0],
+                                minlength=tp.layer_count)
+    print_minutes = np.bincount(record_layer[printing], minutes[printing], minlength=tp.layer_count)
+
+    if triangles is not None:
+        normal_z, breaks = stl_layer_slopes(triangles, source_lh, tp.layer_count)
+    else:
+        normal_z, breaks = nc_layer_slopes(boxes, source_lh)
+    group_ends = adaptive_layer_groups(normal_z, breaks, source_lh, cusp_height, max_lh)
+
+    layer_ends = np.append(np.asarray(tp.layer_start)[1:], len(tp)) - 1
+    target_z, start_xy, merge_factor = {}, {}, {}
+    previous_end = -1
+    print("\n自适应层高: 每个输出层由若干原始层合并, 打印最上面一层的轮廓, G1 速度除以合并层数")
+    print("----------------------------------------------------")
+    print("| Layer # | 原始层     | Individual LH | Cumulative Z |")
+    print("|---------|------------|---------------|--------------|")
+    for i, end in enumerate(group_ends):
+        number = int(layer_numbers[end])
+        z_top = (end + 1) * source_lh
+        target_z[number] = z_top
+        merge_factor[number] = end - previous_end
+        if end - previous_end > 1 and np.isfinite(x[layer_ends[end - 1]]) and np.isfinite(y[layer_ends[end - 1]]):
+            start_xy[number] = (float(x[layer_ends[end - 1]]), float(y[layer_ends[end - 1]]))
+        first_number = int(layer_numbers[previous_end + 1])
+        print(f"| {i + 1:<7} | {f'{first_number}-{number}':<10} | {(end - previous_end) * source_lh:<13.3f} | {z_top:<12.3f} |")
+        previous_end = end
+    print("----------------------------------------------------\n")
+    factors = np.diff(group_ends, prepend=-1)
+    return {
+        "target_z": target_z,
+        "start_xy": start_xy,
+        "merge_factor": merge_factor,
+        "source_layer_height": source_lh,
+        "layers_before": tp.layer_count,
+        "layers_after": len(group_ends),
+        "layers_slowed": int(np.count_nonzero(factors > 1)),
+        "max_merge_factor": int(factors.max()),
+        "minutes_before": float(layer_minutes.sum()),
+        # a merged layer prints its top contour m times slower
+        "minutes_after": float((layer_minutes[group_ends] + (factors - 1) * print_minutes[group_ends]).sum()),
+    }
+
+
+def drop_merged_layers(lines, plan):
+    """
+    Generator over lines without the layers the plan merged into the layer above them. A kept layer
+    that follows dropped ones first travels (G0) to where the dropped layer ended, so its first move
+    starts from the same place as before.
+    """
+    target_z, start_xy = plan["target_z"], plan["start_xy"]
+    keeping = True
+    for line in lines:
+        layer_comment_match = gcode_io.LAYER_COMMENT_PATTERN.search(line)
         if layer_comment_match:
-            current_gcode_layer_num = int(layer_comment_match.group(1))
+            layer_num = int(layer_comment_match.group(1))
+            keeping = layer_num in target_z
+            if keeping:
+                yield line
+                if layer_num in start_xy:
+                    x, y = start_xy[layer_num]
+                    yield f"G0 X{x:.3f} Y{y:.3f} Z{target_z[layer_num]:.3f}\n"
+                continue
+        if keeping:
+            yield line
 
-        if not stripped_line or stripped_line.startswith(";") or stripped_line.startswith("("):
-            final_output_lines.append(line_content)
-            continue
 
-        parts = stripped_line.split()
-        modified_parts = []
-        line_has_changed = False
-
-        for part_idx, part_val in enumerate(parts):
-            if part_val.startswith("Z"):
-                is_the_globally_last_z = (line_idx == last_z_line_idx and part_idx == last_z_part_idx)
-                
-                if is_the_globally_last_z:
-                    modified_parts.append(part_val)
-                elif current_gcode_layer_num > 0 and current_gcode_layer_num <= total_layers:
-                    new_z_for_current_layer = target_z_values[current_gcode_layer_num - 1]
-                    modified_parts.append(f"Z{new_z_for_current_layer:.3f}")
-                    line_has_changed = True
-                else:
-                    modified_parts.append(part_val) 
-            else:
-                modified_parts.append(part_val)
-        
-        if line_has_changed:
-            final_output_lines.append(" ".join(modified_parts) + "\n")
+def _format_feed(value):
+    return f"{value:.3f}".rstrip("0").rstrip(".")
+
+
+def scale_merged_feedrates(lines, merge_factor):
+    """
+    Generator over lines with the G1/G2/G3 feedrate of every layer divided by its merge_factor
+    ({layer_number: m}, layers not in it keep their feedrate). The material flow of a DIW nozzle is set
+    by the pressure, not by the program, so a bead m source layers thick needs the nozzle to move m times
+    slower. F is modal: a print move without an F word gets one wherever the feedrate in effect differs
+    from the one the source program expects there.
+    """
+    factor = 1
+    source_f = machine_f = None
+    for line in lines:
+        layer_comment_match = gcode_io.LAYER_COMMENT_PATTERN.search(line)
+        if layer_comment_match:
+            factor = merge_factor.get(int(layer_comment_match.group(1)), 1)
+        body = line.rstrip("\r\n")
+        code, separator, comment = body.partition(";")
+        f_match = next((match for match in gcode_io.WORD_PATTERN.finditer(code) if match.group(1) in "Ff"), None)
+        if f_match:
+            source_f = float(f_match.group(2))
+        motion_match = gcode_io.MOTION_PATTERN.match(code)
+        if source_f is None or motion_match is None or motion_match.group(1) == "0":
+            if f_match:
+                machine_f = source_f
+            yield line
+            continue
+        wanted = round(source_f / factor, 3)
+        if f_match and factor != 1:
+            code = code[:f_match.start(2)] + _format_feed(wanted) + code[f_match.end(2):]
+        elif not f_match and wanted != machine_f:
+            code = f"{code.rstrip()} F{_format_feed(wanted)}" + (" " if separator else "")
         else:
-            final_output_lines.append(line_content)
+            machine_f = wanted
+            yield line
+            continue
+        machine_f = wanted
+        yield code + separator + comment + line[len(body):]
 
-    # --- Filename Generation START ---
+
+def print_adaptive_report(plan):
+    before, after = plan["minutes_before"], plan["minutes_after"]
+    saved = before - after
+    percent = 100.0 * saved / before if before else 0.0
+    print(f"自适应层高: 层数 {plan['layers_before']} -> {plan['layers_after']} "
+          f"(删除 {plan['layers_before'] - plan['layers_after']} 个原始层, 每个输出层打印其最上面原始层的轮廓)")
+    print(f"合并层的 G1 速度除以合并层数以保持每层的挤出量: {plan['layers_slowed']} 层降速, "
+          f"最多 1/{plan['max_merge_factor']}")
+    print(f"预计打印时间 (按 F 估算, 不含加减速): {before:.1f} -> {after:.1f} 分钟 "
+          f"(节省 {saved:.1f} 分钟, {percent:.1f}%, 来自减少的层数、空行程和 Z 移动)")
+
+
+def process_adaptive_lh_toolpath(tp, cusp_height, max_lh=None, triangles=None):
+    """
+    Adaptive mode of the rewrite for a Toolpath: plans the layers (adaptive_layer_plan) and returns a
+    generator over the kept layers with their print feedrate scaled to the merged thickness
+    (scale_merged_feedrates) and their new Z, through the same rewrite as the block schedule; None on error.
+    """
+    plan = adaptive_layer_plan(tp, cusp_height, max_lh=max_lh, triangles=triangles)
+    if plan is None:
+        return None
+    print_adaptive_report(plan)
+    lines = scale_merged_feedrates(drop_merged_layers(tp.iter_nc_lines(), plan), plan["merge_factor"])
+    return iter_variable_lh_lines(lines, plan["target_z"].__getitem__)
+
+
+def process_adaptive_lh_stream(infile, outfile, cusp_height, max_lh=None, triangles=None):
+    """
+    process_adaptive_lh_toolpath for NC text: the whole input is read into a Toolpath first, since the
+    plan needs the slope of every layer. Returns True on success.
+    """
+    import toolpath
+
+    output_lines = process_adaptive_lh_toolpath(toolpath.toolpath_from_nc_lines(infile), cusp_height,
+                                                max_lh=max_lh, triangles=triangles)
+    if output_lines is None:
+        return False
+    outfile.writelines(output_lines)
+    return True
+
+
+def process_variable_lh_stream(infile, outfile, layers_per_block_a, initial_lh_h, delta_lh_d):
+    """
+    Stream version of process_gcode_variable_lh: infile may be any iterable of text lines, the output is
+    written to outfile as it is produced. A seekable infile is read twice (layer count first), so that the
+    schedule table is printed just like for files. Returns True on success.
+    """
+    total_layers = None
+    if hasattr(infile, "seekable") and infile.seekable():
+        total_layers = get_total_layers(infile)
+        infile.seek(0)
+    final_output_lines = process_variable_lh_lines(infile, layers_per_block_a, initial_lh_h, delta_lh_d,
+                                                   total_layers=total_layers)
+    if final_output_lines is None:
+        return False
+    outfile.writelines(final_output_lines)
+    return True
+
+
+def default_output_path(input_filepath, initial_lh_h, delta_lh_d):
     dir_name = os.path.dirname(input_filepath)
-    original_full_basename = os.path.basename(input_filepath)
-    original_basename_no_ext, _ = os.path.splitext(original_full_basename)
+    # Keep the compression extension (part.gcode.gz -> ..._part.nc.gz) and binary toolpaths (.diwtp)
+    original_full_basename, compression_ext = gcode_io.split_compression_suffix(os.path.basename(input_filepath))
+    original_basename_no_ext, original_ext = os.path.splitext(original_full_basename)
+    output_ext = original_ext if original_ext.lower() == gcode_io.TOOLPATH_EXTENSION else ".nc"
     
     h_formatted = str(initial_lh_h).replace('.', 'p')
     
@@ -175,19 +556,93 @@ def process_gcode_variable_lh(input_filepath, layers_per_block_a, initial_lh_h,
     if delta_lh_d >= 0 and d_formatted.startswith('neg'):
         d_formatted = d_formatted.replace('neg', '', 1)
 
-    output_filename = f"{h_formatted}_{d_formatted}_{original_basename_no_ext}.nc" # MODIFIED LINE
-    output_filepath = os.path.join(dir_name, output_filename)
-    # --- Filename Generation END ---
+    output_filename = f"{h_formatted}_{d_formatted}_{original_basename_no_ext}{output_ext}{compression_ext}" # MODIFIED LINE
+    return os.path.join(dir_name, output_filename)
+
+
+def process_gcode_variable_lh(input_filepath, layers_per_block_a, initial_lh_h, delta_lh_d, output_filepath=None,
+                              compact=False, precision=None):
+    if output_filepath is None:
+        output_filepath = default_output_path(input_filepath, initial_lh_h, delta_lh_d)
 
     try:
-        with open(output_filepath, 'w', encoding='utf-8') as f_out:
-            f_out.writelines(final_output_lines)
-        print(f"\n处理完成！可变层高G-code已保存为: {output_filepath}")
+        if gcode_io.is_toolpath_file(input_filepath):
+            import toolpath
+            modified = process_variable_lh_toolpath(toolpath.load_toolpath(input_filepath),
+                                                    layers_per_block_a, initial_lh_h, delta_lh_d)
+            if modified is None:
+                return None
+            toolpath.write_output(modified, output_filepath, compact=compact, precision=precision)
+        else:
+            # Two streaming passes; reopening (rather than seeking) keeps this cheap for compressed input.
+            with gcode_io.open_input(input_filepath) as f:
+                total_layers = get_total_layers(f)
+            with gcode_io.open_input(input_filepath) as f:
+                final_output_lines = process_variable_lh_lines(f, layers_per_block_a, initial_lh_h, delta_lh_d,
+                                                               total_layers=total_layers)
+                if final_output_lines is None:
+                    return None
+                with gcode_io.open_output(output_filepath, compact=compact, precision=precision) as f_out:
+                    f_out.writelines(final_output_lines)
+    except FileNotFoundError:
+        print(f"错误：文件 '{input_filepath}' 未找到。")
+        return None
     except Exception as e:
-        print(f"写入输出文件时发生错误: {e}")
+        print(f"处理文件时发生错误: {e}")
+        return None
 
+    print(f"\n处理完成！可变层高G-code已保存为: {output_filepath}")
+    return output_filepath
 
-if __name__ == "__main__":
+
+def adaptive_output_path(input_filepath, cusp_height):
+    dir_name = os.path.dirname(input_filepath)
+    original_full_basename, compression_ext = gcode_io.split_compression_suffix(os.path.basename(input_filepath))
+    original_basename_no_ext, original_ext = os.path.splitext(original_full_basename)
+    output_ext = original_ext if original_ext.lower() == gcode_io.TOOLPATH_EXTENSION else ".nc"
+    cusp_formatted = str(cusp_height).replace('.', 'p')
+    return os.path.join(dir_name, f"adaptive_{cusp_formatted}_{original_basename_no_ext}{output_ext}{compression_ext}")
+
+
+def process_gcode_adaptive_lh(input_filepath, cusp_height, max_lh=None, stl_filepath=None, output_filepath=None,
+                              compact=False, precision=None):
+    """
+    File-level wrapper of process_adaptive_lh_stream; the slope is taken from stl_filepath (the STL the
+    file was sliced from) if given, else from the layer contours of the file.
+    """
+    if output_filepath is None:
+        output_filepath = adaptive_output_path(input_filepath, cusp_height)
+    try:
+        triangles = None
+        if stl_filepath:
+            from slicer import load_stl
+            triangles = load_stl(stl_filepath)
+        import toolpath
+        if gcode_io.is_toolpath_file(input_filepath):
+            tp = toolpath.load_toolpath(input_filepath)
+        else:
+            with gcode_io.open_input(input_filepath) as f:
+                tp = toolpath.toolpath_from_nc_lines(f)
+        output_lines = process_adaptive_lh_toolpath(tp, cusp_height, max_lh=max_lh, triangles=triangles)
+        if output_lines is None:
+            return None
+        if gcode_io.is_toolpath_path(output_filepath):
+            toolpath.toolpath_from_nc_lines(output_lines).save(output_filepath)
+        else:
+            with gcode_io.open_output(output_filepath, compact=compact, precision=precision) as f_out:
+                f_out.writelines(output_lines)
+    except FileNotFoundError as e:
+        print(f"错误：文件 '{e.filename or input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"处理文件时发生错误: {e}")
+        return None
+
+    print(f"\n处理完成！自适应层高G-code已保存为: {output_filepath}")
+    return output_filepath
+
+
+def main():
     print("G-code 可变层高修改脚本")
     print("------------------------------------")
     
@@ -199,11 +654,26 @@ if __name__ == "__main__":
             if not os.path.isfile(input_file):
                  print(f"错误: 文件 '{input_file}' 不存在或不是一个文件。请重新输入。")
                  input_file = "" 
-            elif not input_file.lower().endswith((".nc", ".gcode", ".gco", ".txt")):
+            elif not gcode_io.split_compression_suffix(input_file)[0].lower().endswith((".nc", ".gcode", ".gco", ".txt")):
                  print(f"警告: 文件 '{os.path.basename(input_file)}' 的扩展名可能不是常见的G-code格式。")
         else:
             print("错误：文件路径不能为空。")
 
+    if input("使用自适应层高 (按模型坡度自动合并层)? (y/N): ").strip().lower() == "y":
+        try:
+            cusp_height = float(input("请输入台阶误差容限 (cusp, mm, 例如 0.1): "))
+            max_str = input("请输入最大层高 (mm, 留空则为原始层高的 2 倍): ").strip()
+            max_lh = float(max_str) if max_str else None
+        except ValueError:
+            print("错误：请输入一个有效的数字。")
+            return
+        if cusp_height <= 0 or (max_lh is not None and max_lh <= 0):
+            print("错误：容限和最大层高必须是正数。")
+            return
+        stl_path = input("请输入源 STL 文件路径 (留空则按 NC 文件的轮廓估算坡度): ").strip()
+        process_gcode_adaptive_lh(input_file, cusp_height, max_lh=max_lh, stl_filepath=stl_path or None)
+        return
+
     a_layers_per_block = 0
     while a_layers_per_block <= 0:
         try:
@@ -235,3 +705,7 @@ if __name__ == "__main__":
             print("错误：请输入一个有效的数字。")
             
     process_gcode_variable_lh(input_file, a_layers_per_block, h_initial_lh, d_lh_increment)
+
+
+if __name__ == "__main__":
+    run_main(main)
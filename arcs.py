@@ -0,0 +1,217 @@
+import math
+import os
+
+import numpy as np
+
+import gcode_io
+from gcode_io import parse_move
+from profiling import run_main
+from simplify import G1ChainBuffer
+
+DEFAULT_ARC_TOLERANCE = 0.01 # mm
+MIN_ARC_SEGMENTS = 3 # G1 moves replaced by one arc at least
+MAX_ARC_RADIUS = 1000.0 # mm, flatter runs are left to simplify.py
+MAX_CHORD_ANGLE = math.radians(15.0) # a polygon with coarser chords is not treated as a circle
+
+
+def circumcenters(a, m, b):
+    """
+    Centers of the circles through the points a, m, b ((n, 2) each); nan where they are collinear.
+    """
+    m = m - a
+    b = b - a
+    m2 = (m * m).sum(axis=1)
+    b2 = (b * b).sum(axis=1)
+    d = 2.0 * (m[:, 0] * b[:, 1] - m[:, 1] * b[:, 0])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ux = (b[:, 1] * m2 - m[:, 1] * b2) / d
+        uy = (m[:, 0] * b2 - b[:, 0] * m2) / d
+    return a + np.stack([ux, uy], axis=1)
+
+
+def fit_arc_windows(points, starts, length, tolerance):
+    """
+    Fits arcs to the windows points[s:s + length] for all s in starts at once. The circle goes through the
+    first, middle and last point of the window (so both ends are exactly on it, as GRBL requires); a window
+    fits if all its points are within tolerance of the circle, each chord spans at most MAX_CHORD_ANGLE of
+    it and the points turn around the center in one direction by less than a full turn. The chords are
+    taken as the slicer's tessellation of the arc, so their sagitta is not counted against the tolerance.
+    Returns (fits, centers, clockwise).
+    """
+    idx = np.asarray(starts)[:, None] + np.arange(length)
+    window = points[idx]
+    first, last = window[:, 0], window[:, -1]
+    centers = circumcenters(first, window[:, length // 2], last)
+    with np.errstate(invalid="ignore"):
+        radii = np.hypot(*(first - centers).T)
+        v = window - centers[:, None, :]
+        cross = v[:, :-1, 0] * v[:, 1:, 1] - v[:, :-1, 1] * v[:, 1:, 0]
+        dot = (v[:, :-1] * v[:, 1:]).sum(axis=2)
+        steps = np.arctan2(cross, dot)
+        radial = np.abs(np.hypot(v[..., 0], v[..., 1]) - radii[:, None]).max(axis=1)
+        fits = (np.isfinite(radii) & (radii <= MAX_ARC_RADIUS)
+                & ((steps > 0).all(axis=1) | (steps < 0).all(axis=1))
+                & (np.abs(steps) <= MAX_CHORD_ANGLE).all(axis=1)
+                & (np.abs(steps.sum(axis=1)) < 2 * math.pi - 1e-6)
+                & (radial <= tolerance))
+    return fits, centers, steps[:, 0] < 0
+
+
+def find_arcs(points, range_starts, range_ends, tolerance):
+    """
+    Greedy arc detection over the chains: returns [(i, j, center, clockwise)] for runs of points i..j
+    (at least MIN_ARC_SEGMENTS moves) that fit one arc. All minimal windows are fitted in one vectorized
+    pass; a run of overlapping fitting windows turning the same way is then checked as a whole and, if it
+    does not fit one circle, cut back by bisection.
+    """
+    ranges = [(lo, hi) for lo, hi in zip(range_starts.tolist(), range_ends.tolist()) if hi - lo >= MIN_ARC_SEGMENTS]
+    if not ranges:
+        return []
+    starts = np.concatenate([np.arange(lo, hi - MIN_ARC_SEGMENTS + 1) for lo, hi in ranges])
+    fits, centers, clockwise = fit_arc_windows(points, starts, MIN_ARC_SEGMENTS + 1, tolerance)
+    joins = fits[:-1] & fits[1:] & (clockwise[:-1] == clockwise[1:]) & (np.diff(starts) == 1)
+    # index of the last window of the joined run that window k belongs to
+    run_stop = np.where(np.append(joins, False), len(starts), np.arange(len(starts)))
+    run_last = np.minimum.accumulate(run_stop[::-1])[::-1]
+    window_of = {s: k for k, s in enumerate(starts.tolist())}
+    fits, clockwise, run_ends = fits.tolist(), clockwise.tolist(), (starts[run_last] + MIN_ARC_SEGMENTS).tolist()
+
+    def fit(i, j):
+        ok, centers, clockwise = fit_arc_windows(points, [i], j - i + 1, tolerance)
+        return (centers[0], bool(clockwise[0])) if ok[0] else None
+
+    arcs = []
+    for lo, hi in ranges:
+        i = lo
+        while i <= hi - MIN_ARC_SEGMENTS:
+            k = window_of[i]
+            if not fits[k]:
+                i += 1
+                continue
+            good, best = i + MIN_ARC_SEGMENTS, (centers[k], clockwise[k])
+            bad = run_ends[k]
+            if bad > good:
+                result = fit(i, bad)
+                if result is not None:
+                    good, best, bad = bad, result, None
+            while bad is not None and bad - good > 1:
+                j = (good + bad) // 2
+                result = fit(i, j)
+                if result is None:
+                    bad = j
+                else:
+                    good, best = j, result
+            arcs.append((i, good, best[0], best[1]))
+            i = good
+    return arcs
+
+
+def _offset(value):
+    text = f"{value:.3f}"
+    return "0.000" if text == "-0.000" else text
+
+
+class ArcFitter(G1ChainBuffer):
+    """
+    Replaces runs of G1 chords that lie on a common circle with G2/G3 moves (I/J center offsets).
+    """
+
+    def __init__(self, tolerance=DEFAULT_ARC_TOLERANCE, stats=None):
+        super().__init__(stats=stats)
+        self.tolerance = tolerance
+
+    def rewrite(self, lines, points, line_of_point, range_starts, range_ends, layer_of_line):
+        replaced = {}
+        for i, j, center, clockwise in find_arcs(points, range_starts, range_ends, self.tolerance):
+            run = line_of_point[i + 1:j + 1].tolist()
+            first, last = parse_move(lines[run[0]]), parse_move(lines[run[-1]])
+            start = points[i]
+            arc = (f"{'G2' if clockwise else 'G3'} X{last['X']} Y{last['Y']} "
+                   f"I{_offset(center[0] - start[0])} J{_offset(center[1] - start[1])}")
+            if first["F"] is not None:
+                arc += f" F{first['F']}"
+            for line_index in run[:-1]:
+                replaced[line_index] = None
+            replaced[run[-1]] = arc
+            entry = self.stats.setdefault(layer_of_line[run[-1]], [0, 0, 0])
+            entry[1] += len(run)
+            entry[2] += 1
+        for line_index, layer_num in layer_of_line.items():
+            self.stats.setdefault(layer_num, [0, 0, 0])[0] += 1
+        return [replaced.get(k, line) for k, line in enumerate(lines) if replaced.get(k, line) is not None]
+
+
+def fit_arcs_lines(lines, tolerance=DEFAULT_ARC_TOLERANCE, stats=None):
+    """
+    Generator over any iterable of NC lines (with or without newlines); yields the lines without newlines
+    with runs of G1 moves on a common circle (within tolerance, mm) replaced by G2/G3 arcs. stats (dict)
+    receives {layer: [g1_moves, g1_moves_replaced, arcs]}.
+    """
+    fitter = ArcFitter(tolerance=tolerance, stats=stats)
+    for line in gcode_io.strip_newlines(lines):
+        yield from fitter.push(line)
+    yield from fitter.flush()
+
+
+def print_arc_report(stats):
+    total = sum(entry[0] for entry in stats.values())
+    replaced = sum(entry[1] for entry in stats.values())
+    arcs = sum(entry[2] for entry in stats.values())
+    percent = 100.0 * (replaced - arcs) / total if total else 0.0
+    print(f"圆弧拟合: {replaced} 段 G1 (共 {total} 段) 合并为 {arcs} 条 G2/G3 圆弧, "
+          f"运动行数减少 {replaced - arcs} ({percent:.1f}%)")
+
+
+def fit_arcs_stream(infile, outfile, tolerance=DEFAULT_ARC_TOLERANCE):
+    """
+    Stream version of fit_arcs_lines; prints the arc report.
+    """
+    stats = {}
+    separator = ""
+    for line in fit_arcs_lines(infile, tolerance=tolerance, stats=stats):
+        outfile.write(separator + line)
+        separator = "\n"
+    print_arc_report(stats)
+    return True
+
+
+def default_output_path(input_file_path):
+    return gcode_io.default_output_path(input_file_path, "_arcs")
+
+
+def fit_arcs_file(input_filepath, output_filepath=None, tolerance=DEFAULT_ARC_TOLERANCE):
+    if output_filepath is None:
+        output_filepath = default_output_path(input_filepath)
+    try:
+        with gcode_io.open_input(input_filepath) as f_in, \
+             gcode_io.open_output(output_filepath) as f_out:
+            fit_arcs_stream(f_in, f_out, tolerance=tolerance)
+    except FileNotFoundError:
+        print(f"错误: 文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"错误: 处理文件 '{input_filepath}' 失败: {e}")
+        return None
+    print(f"处理完成！拟合后的文件已保存到: {output_filepath}")
+    return output_filepath
+
+
+def main():
+    input_file_path = input("请输入NC文件的完整路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    tolerance_str = input(f"请输入圆弧拟合公差 (mm, 留空则使用 {DEFAULT_ARC_TOLERANCE}): ").strip()
+    try:
+        tolerance = float(tolerance_str) if tolerance_str else DEFAULT_ARC_TOLERANCE
+    except ValueError:
+        print("错误：请输入有效的数字。")
+        return
+    if tolerance <= 0:
+        print("错误：公差必须是正数。")
+        return
+    fit_arcs_file(input_file_path, tolerance=tolerance)
+
+
+if __name__ == "__main__":
+    run_main(main)
@@ -1,6 +1,9 @@
 import os
 import re
 
+import gcode_io
+from profiling import run_main
+
 def parse_gcode_value(line, code):
     """Extracts the value associated with a G-code letter."""
     match = re.search(rf'{code}([-+]?\d*\.?\d+)', line, re.IGNORECASE)
@@ -18,19 +21,11 @@ def get_gcode_commands(lines, command_type):
                 cmds.append({'x': x, 'y': y, 'f': f})
     return cmds
 
-def modify_gcode(filepath, num_total_layers, layer_height, logical_left_top, logical_right_bottom):
+def modify_gcode_lines(lines, num_total_layers, layer_height, logical_left_top, logical_right_bottom):
     """
-    Modifies the G-code file according to the specified rules.
+    Rebuilds the layers of the G-code in lines according to the specified rules.
+    Returns the new G-code lines (without newlines), or None if no layer data could be parsed.
     """
-    if not os.path.exists(filepath):
-        print(f"错误：文件 {filepath} 不存在。")
-        return
-
-    base_dir = os.path.dirname(filepath)
-    original_filename = os.path.basename(filepath)
-    new_filename = f"better_{original_filename}"
-    output_filepath = os.path.join(base_dir, new_filename)
-
     header_lines = []
     footer_lines = []
     # Stores {'initial_g0_xyf': (x,y,f), 'g1_commands': [{'x':x,'y':y,'f':f}, ...], 'original_layer_number': int}
@@ -40,11 +35,17 @@ def modify_gcode(filepath, num_total_layers, layer_height, logical_left_top, log
     travel_feed_rate = 1750.0
     
     try:
-        with open(filepath, 'r') as f:
-            lines = [line.rstrip('\r\n') for line in f.readlines()] # Strip newlines early
+        # --- Phase 1: single pass over the input ---
+        # Collects the header, the G1 commands of every layer block, the G0 that starts each block's
+        # printing path and the lines after the last G1 (the footer), so the input is never held in memory.
+        temp_layer_blocks = [] # Stores {'g1_commands': [], 'first_g1_seen': bool, 'start_g0_line': str, 'original_layer_number': int}
+        current_block = None
+        lines_after_last_g1 = []
 
-        # Parse feed rates from comments
         for line in lines:
+            line = line.rstrip('\r\n') # Strip newlines early
+
+            # Parse feed rates from comments
             if "(G1 Z-only Feedrate set to:" in line:
                 match = re.search(r'(\d+)\s*mm/min', line) # CORRECTED REGEX
                 if match: z_feed_rate = float(match.group(1))
@@ -52,79 +53,39 @@ def modify_gcode(filepath, num_total_layers, layer_height, logical_left_top, log
                 match = re.search(r'(\d+)\s*mm/min', line) # CORRECTED REGEX
                 if match: travel_feed_rate = float(match.group(1))
 
-        layer_section_started_idx = -1
-        original_layer_counter = 0
-
-        # --- Phase 1: Identify layer blocks and their G1 commands ---
-        # We'll store G1s and the line index where the layer comment starts.
-        # initial_g0_xyf will be determined in a second pass for clarity.
-        
-        temp_layer_blocks = [] # Stores {'comment_line_idx': idx, 'g1_commands': []}
-        current_g1s_for_block = []
-        current_block_comment_idx = -1
-
-        for line_idx, line in enumerate(lines):
             stripped_line = line.strip()
             if stripped_line.startswith(";") and "--- Layer" in stripped_line:
-                original_layer_counter += 1
-                if current_block_comment_idx != -1 and current_g1s_for_block: # Save G1s of previous block
-                    temp_layer_blocks[-1]['g1_commands'] = current_g1s_for_block
-                
-                temp_layer_blocks.append({'comment_line_idx': line_idx, 'g1_commands': [], 'original_layer_number': original_layer_counter})
-                current_g1s_for_block = []
-                current_block_comment_idx = line_idx
-                if layer_section_started_idx == -1:
-                    layer_section_started_idx = line_idx
-            elif current_block_comment_idx != -1: # We are inside a layer block
+                current_block = {'g1_commands': [], 'first_g1_seen': False, 'start_g0_line': "",
+                                 'original_layer_number': len(temp_layer_blocks) + 1}
+                temp_layer_blocks.append(current_block)
+                lines_after_last_g1 = []
+            elif current_block is None:
+                header_lines.append(line)
+            else: # We are inside a layer block
+                lines_after_last_g1.append(line)
                 if stripped_line.startswith("G1") and parse_gcode_value(stripped_line, 'X') is not None:
+                    current_block['first_g1_seen'] = True
+                    lines_after_last_g1 = []
                     x = parse_gcode_value(stripped_line, 'X')
                     y = parse_gcode_value(stripped_line, 'Y')
                     f = parse_gcode_value(stripped_line, 'F') 
                     if x is not None and y is not None and f is not None:
-                         current_g1s_for_block.append({'x': x, 'y': y, 'f': f})
-        
-        if current_block_comment_idx != -1 and current_g1s_for_block: # Save G1s for the last block
-             temp_layer_blocks[-1]['g1_commands'] = current_g1s_for_block
+                         current_block['g1_commands'].append({'x': x, 'y': y, 'f': f})
+                elif not current_block['first_g1_seen'] and stripped_line.startswith("G0") and \
+                     parse_gcode_value(stripped_line, 'X') is not None and parse_gcode_value(stripped_line, 'Y') is not None:
+                    # Latest G0 X Y [Z F] before the first G1 of this block
+                    current_block['start_g0_line'] = stripped_line
         
-        if layer_section_started_idx != -1:
-            header_lines = lines[:layer_section_started_idx]
-        else: # No layer comments found, treat all as header (should not happen for valid file)
-            header_lines = lines
+        if not temp_layer_blocks: # No layer comments found, treat all as header (should not happen for valid file)
             print("警告: 未在文件中找到层注释。")
 
         # --- Phase 2: Determine initial_g0_xyf for each layer block and finalize original_layers_data ---
-        for i, block_info in enumerate(temp_layer_blocks):
-            layer_comment_idx = block_info['comment_line_idx']
+        for block_info in temp_layer_blocks:
             g1s = block_info['g1_commands']
             orig_layer_num = block_info['original_layer_number']
             
-            # Search for the G0 X Y [Z F] command that *immediately* precedes the first G1 of this block,
-            # but *after* the previous layer's G1s (or after header for the first layer).
-            search_start_idx = temp_layer_blocks[i-1]['comment_line_idx'] if i > 0 else 0
-            # More accurately, search between current layer comment and first G1 of current layer
-            
-            potential_start_g0_line_content = ""
-            # Find the first G1 line index *within the current block of lines*
-            # The lines for current block start from block_info['comment_line_idx']
-            # and end before temp_layer_blocks[i+1]['comment_line_idx'] or end of file
-            
-            current_block_lines_start = block_info['comment_line_idx']
-            current_block_lines_end = temp_layer_blocks[i+1]['comment_line_idx'] if i + 1 < len(temp_layer_blocks) else len(lines)
-
-            first_g1_abs_idx = -1
-            for idx_in_file in range(current_block_lines_start, current_block_lines_end):
-                line_content = lines[idx_in_file].strip()
-                if line_content.startswith("G1") and parse_gcode_value(line_content, "X") is not None:
-                    first_g1_abs_idx = idx_in_file
-                    break
-            
-            if first_g1_abs_idx != -1:
-                # Search backwards from the first G1 of this layer up to its layer comment
-                for l_idx_abs in range(first_g1_abs_idx - 1, block_info['comment_line_idx'] -1, -1): # Stop before layer comment
-                    l_content = lines[l_idx_abs].strip()
-                    if l_content.startswith("G0") and parse_gcode_value(l_content, 'X') is not None and parse_gcode_value(l_content, 'Y') is not None:
-                        potential_start_g0_line_content = l_content
-                        break # Found the G0 right before the G1s of this layer
+            # The G0 command that *immediately* precedes the first G1 of this block (after its layer comment)
+            potential_start_g0_line_content = block_info['start_g0_line'] if block_info['first_g1_seen'] else ""
 
             g0_x, g0_y, g0_f = None, None, None
             if potential_start_g0_line_content:
@@ -151,39 +112,21 @@ def modify_gcode(filepath, num_total_layers, layer_height, logical_left_top, log
             if not g1s:
                 print(f"Warning: Original layer {orig_layer_num} has no G1 printing commands.")
 
-        # Determine footer lines
-        last_content_line_idx = len(lines) -1 
-        if temp_layer_blocks: # If layers were found
-            last_layer_block = temp_layer_blocks[-1]
-            # Footer starts after all G1s of the last layer.
-            # Find the index of the last G1 command of the last layer.
-            last_g1_line_idx_in_file = -1
-            if last_layer_block['g1_commands']:
-                # Search from end of file backwards to find the last G1 command of the last layer
-                # This is a bit simplified, assumes G1s are contiguous after comment
-                start_search_for_last_g1 = last_layer_block['comment_line_idx']
-                for line_idx_from_end in range(len(lines) - 1, start_search_for_last_g1 -1, -1):
-                    if lines[line_idx_from_end].strip().startswith("G1") and parse_gcode_value(lines[line_idx_from_end], "X") is not None:
-                        last_g1_line_idx_in_file = line_idx_from_end
-                        break
-            
-            if last_g1_line_idx_in_file != -1:
-                last_content_line_idx = last_g1_line_idx_in_file
-
-        footer_lines = lines[last_content_line_idx + 1:]
+        # Footer lines: everything after the last G1 command of the last layer
+        if temp_layer_blocks and temp_layer_blocks[-1]['g1_commands']:
+            footer_lines = lines_after_last_g1
         if not footer_lines: # Generic footer if parsing failed to find one
              footer_lines = ["G0 Z12.000 F1750 ; Final safe Z lift", "G0 X0 Y0 F1750 ; Optional: Return to origin", "M30 ; Program End"]
 
-
         if not original_layers_data:
             print("错误：未能从原始文件中解析出任何层数据。")
-            return
+            return None
 
     except Exception as e:
         print(f"解析原始 G-code 文件时发生错误: {e}")
         import traceback
         traceback.print_exc()
-        return
+        return None
 
     # Generate new G-code
     new_gcode_lines = [line for line in header_lines] # Already stripped
@@ -269,17 +212,64 @@ def modify_gcode(filepath, num_total_layers, layer_height, logical_left_top, log
                 # End of even layer is at logical_left_top
 
     new_gcode_lines.extend([line for line in footer_lines]) # Already stripped
+    return new_gcode_lines
+
+
+def modify_gcode_stream(infile, outfile, num_total_layers, layer_height, logical_left_top, logical_right_bottom):
+    """
+    Stream version of modify_gcode: infile may be any iterable of text lines. Only the parsed moves of the
+    source layers are kept in memory (they are cycled through when generating). Returns True on success.
+    """
+    new_gcode_lines = modify_gcode_lines(infile, num_total_layers, layer_height,
+                                         logical_left_top, logical_right_bottom)
+    if new_gcode_lines is None:
+        return False
+    for line in new_gcode_lines:
+        outfile.write(line + "\n")
+    return True
+
+
+def default_output_path(filepath):
+    base_dir = os.path.dirname(filepath)
+    original_filename = os.path.basename(filepath)
+    new_filename = f"better_{original_filename}"
+    return os.path.join(base_dir, new_filename)
+
+
+def modify_gcode(filepath, num_total_layers, layer_height, logical_left_top, logical_right_bottom, output_filepath=None,
+                 compact=False, precision=None):
+    """
+    Modifies the G-code file according to the specified rules.
+    With compact, F/Z words that repeat the modal state are left out (see compact.py).
+    """
+    if not os.path.exists(filepath):
+        print(f"错误：文件 {filepath} 不存在。")
+        return None
+
+    if output_filepath is None:
+        output_filepath = default_output_path(filepath)
+
+    try:
+        with gcode_io.open_input(filepath) as f:
+            new_gcode_lines = modify_gcode_lines(f, num_total_layers, layer_height, logical_left_top, logical_right_bottom)
+    except OSError as e:
+        print(f"解析原始 G-code 文件时发生错误: {e}")
+        return None
+    if new_gcode_lines is None:
+        return None
 
     try:
-        with open(output_filepath, 'w') as f:
+        with gcode_io.open_output(output_filepath, compact=compact, precision=precision) as f:
             for line in new_gcode_lines:
                 f.write(line + "\n")
         print(f"成功！修改后的文件已保存到: {output_filepath}")
+        return output_filepath
     except Exception as e:
         print(f"写入输出文件时发生错误: {e}")
+        return None
 
 
-if __name__ == '__main__':
+def main():
     print("G-code 修改脚本")
     
     while True:
@@ -327,3 +317,6 @@ if __name__ == '__main__':
 
     modify_gcode(filepath_in, layers_in, layer_height_in, logical_left_top_in, logical_right_bottom_in)
 
+
+if __name__ == '__main__':
+    run_main(main)
@@ -0,0 +1,171 @@
+import json
+import os
+
+import gcode_io
+
+PARTIAL_SUFFIX = ".part" # output being written, renamed to the output path when the run is complete
+CHECKPOINT_SUFFIX = ".ckpt" # JSON progress record next to the output
+CHECKPOINT_VERSION = 1
+WRITE_CHUNK_PIECES = 4096 # output pieces joined per write between checkpoints
+
+
+def partial_path(output_path):
+    return output_path + PARTIAL_SUFFIX
+
+
+def checkpoint_path(output_path):
+    return output_path + CHECKPOINT_SUFFIX
+
+
+def _needs_finishing_pass(output_path, compression, compact, precision):
+    """
+    True if the plain text of the partial file still has to be compacted, compressed or packed into
+    a .diwtp toolpath; otherwise the partial file is renamed as it is.
+    """
+    if compact or precision or gcode_io.is_toolpath_path(output_path):
+        return True
+    return (gcode_io.normalize_compression(compression) or gcode_io.compression_from_path(output_path)) is not None
+
+
+def _input_signature(path):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _write_json_atomically(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+class CheckpointedRun:
+    """
+    Runs a line transform over a file so that a run that fails or is killed can continue where it
+    stopped. The output is written to output_path + ".part" and renamed to output_path (compacted or
+    compressed on the way if asked for) only once it is complete. At every layer boundary the output is
+    flushed and output_path + ".ckpt" is replaced by a record of the input offset, the output offset and
+    the state the transform carries at that point, so a killed run loses at most one layer of work.
+
+    job (a JSON-serialisable dict of the tool name and its parameters) and the size and modification
+    time of the input must match the checkpoint for it to be used; a stale checkpoint is discarded.
+
+        run = CheckpointedRun(input_path, output_path, {"tool": "layer", ...})
+        state = run.state                  # carried state to continue from, None for a fresh run
+        run.run(make_transform(state))
+
+    The transform has start() (lines written first on a fresh run), feed(line) (the output pieces for one
+    input line, newlines included), at_layer_boundary(line) (True if a checkpoint may be taken after line),
+    state() and finish() (the remaining output pieces).
+    """
+
+    def __init__(self, input_path, output_path, job, resume=True, encoding="utf-8"):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.partial_path = partial_path(output_path)
+        self.checkpoint_path = checkpoint_path(output_path)
+        self.encoding = encoding
+        self.job = json.loads(json.dumps(job))
+        self.signature = _input_signature(input_path)
+        self.saved = self._load() if resume else None
+
+    def _load(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            print(f"提示: 检查点文件 '{self.checkpoint_path}' 无法读取, 将从头开始。")
+            return None
+        if saved.get("version") != CHECKPOINT_VERSION or saved.get("job") != self.job or \
+                saved.get("input") != self.signature:
+            print("提示: 检查点与当前输入文件或参数不符, 将从头开始。")
+            return None
+        try:
+            partial_size = os.path.getsize(self.partial_path)
+        except OSError:
+            partial_size = -1
+        if partial_size < saved["output_offset"]:
+            print(f"提示: 临时输出文件 '{self.partial_path}' 不完整, 将从头开始。")
+            return None
+        return saved
+
+    @property
+    def state(self):
+        return None if self.saved is None else self.saved["state"]
+
+    def _save(self, input_offset, output_offset, state):
+        _write_json_atomically(self.checkpoint_path, {
+            "version": CHECKPOINT_VERSION,
+            "job": self.job,
+            "input": self.signature,
+            "input_offset": input_offset,
+            "output_offset": output_offset,
+            "state": state,
+        })
+
+    def _open_input(self, start):
+        binary, codec = gcode_io.open_binary_input(self.input_path)
+        if codec is None:
+            binary.seek(start)
+            return binary
+        # compressed input can only be skipped by decompressing it
+        remaining = start
+        while remaining > 0:
+            skipped = len(binary.read(min(remaining, gcode_io.IO_BUFFER_SIZE)))
+            if not skipped:
+                break
+            remaining -= skipped
+        return binary
+
+    def run(self, transform, compression=None, compact=False, precision=None):
+        """
+        Runs transform to the end (continuing from the loaded checkpoint, if any) and moves the result
+        to the output path. Errors are raised to the caller; the partial output and the checkpoint are
+        then kept for the next run.
+        """
+        input_offset = output_offset = 0
+        if self.saved is not None:
+            input_offset = self.saved["input_offset"]
+            output_offset = self.saved["output_offset"]
+            print(f"从检查点继续: 输入已处理 {input_offset} 字节, 输出已写入 {output_offset} 字节。")
+
+        with self._open_input(input_offset) as binary, \
+                open(self.partial_path, "r+b" if self.saved is not None else "wb",
+                     buffering=gcode_io.IO_BUFFER_SIZE) as out:
+            out.truncate(output_offset)
+            out.seek(output_offset)
+            chunk = [] if self.saved is not None else list(transform.start())
+            feed, at_layer_boundary, encoding = transform.feed, transform.at_layer_boundary, self.encoding
+            for raw in binary:
+                input_offset += len(raw)
+                line = raw.decode(encoding)
+                if line[-2:] == "\r\n": # as in a text-mode read
+                    line = line[:-2] + "\n"
+                chunk.extend(feed(line))
+                if at_layer_boundary(line):
+                    out.write("".join(chunk).encode(encoding))
+                    chunk = []
+                    out.flush()
+                    self._save(input_offset, out.tell(), transform.state())
+                elif len(chunk) >= WRITE_CHUNK_PIECES:
+                    out.write("".join(chunk).encode(encoding))
+                    chunk = []
+            chunk.extend(transform.finish())
+            out.write("".join(chunk).encode(encoding))
+
+        self._finish(compression, compact, precision)
+
+    def _finish(self, compression, compact, precision):
+        if _needs_finishing_pass(self.output_path, compression, compact, precision):
+            with gcode_io.open_input(self.partial_path) as infile, \
+                    gcode_io.open_output(self.output_path, compression=compression, compact=compact,
+                                         precision=precision) as outfile:
+                for block in iter(lambda: infile.read(gcode_io.IO_BUFFER_SIZE), ""):
+                    outfile.write(block)
+            os.remove(self.partial_path)
+        else:
+            os.replace(self.partial_path, self.output_path)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
@@ -0,0 +1,777 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+import gcode_io
+from profiling import add_profiling_arguments, run_profiled
+
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+class UsageError(Exception):
+    pass
+
+
+def _can_prompt(args):
+    """Interactive prompts are only a fallback: stdin must be a terminal and must not carry the G-code."""
+    if getattr(args, "input", None) is not None and gcode_io.is_stdio(args.input):
+        return False
+    return sys.stdin is not None and sys.stdin.isatty()
+
+
+def _resolve(args, name, prompt, cast=float, check=None, error=None):
+    """
+    Returns args.<name>, asking for it interactively if it was not given on the command line.
+    """
+    value = getattr(args, name)
+    if value is not None:
+        if check is not None and not check(value):
+            raise UsageError(error or f"参数 --{name.replace('_', '-')} 无效: {value}")
+        return value
+    if not _can_prompt(args):
+        raise UsageError(f"缺少参数 --{name.replace('_', '-')} (非交互模式下必须通过命令行指定)")
+    while True:
+        raw = input(prompt).strip()
+        try:
+            value = cast(raw)
+        except ValueError:
+            print("错误：请输入有效的数值。", file=sys.stderr)
+            continue
+        if check is None or check(value):
+            setattr(args, name, value)
+            return value
+        print(f"错误：{error or '输入无效'}", file=sys.stderr)
+
+
+def _resolve_output(args, auto_output_path):
+    if args.output is not None:
+        return args.output
+    if args.auto_output and not gcode_io.is_stdio(args.input):
+        return auto_output_path(args.input)
+    return gcode_io.STDIO_PATH
+
+
+def _run_stream(args, output_path, transform):
+    """
+    Opens args.input / output_path (either may be "-") and runs transform(infile, outfile).
+    Progress messages of the tools are sent to stderr so stdout only carries G-code.
+    """
+    precision = _output_precision(args)
+    with gcode_io.open_input(args.input) as infile, \
+            gcode_io.open_output(output_path, compression=args.compress,
+                                 compact=args.compact, precision=precision) as outfile:
+        with contextlib.redirect_stdout(sys.stderr):
+            ok = transform(infile, outfile)
+    return EXIT_OK if ok else EXIT_FAILURE
+
+
+def _output_precision(args):
+    if args.precision is None:
+        return None
+    import compact
+
+    try:
+        return compact.parse_precision(args.precision)
+    except ValueError as e:
+        raise UsageError(str(e))
+
+
+def _run_checkpointed(args, output_path, run):
+    """
+    Runs a checkpointed file-to-file job (see checkpoint.py): run(compression, compact, precision) returns
+    True on success. Stdin and stdout cannot be resumed, so both paths must be files.
+    """
+    if gcode_io.is_stdio(args.input) or gcode_io.is_stdio(output_path):
+        raise UsageError("--checkpoint 需要输入文件和输出文件 (不能使用 stdin/stdout)。")
+    precision = _output_precision(args)
+    with contextlib.redirect_stdout(sys.stderr):
+        ok = run(args.compress, args.compact, precision)
+    return EXIT_OK if ok else EXIT_FAILURE
+
+
+def _convert_output_path(input_path):
+    base, compression_ext = gcode_io.split_compression_suffix(input_path)
+    return os.path.splitext(base)[0] + ".nc" + compression_ext
+
+
+def cmd_convert(args):
+    import transGcode
+
+    layer_height = _resolve(args, "layer_height", "请输入你希望的层高 (mm): ",
+                            check=lambda v: v > 0, error="层高必须是正数。")
+    if args.simplify is not None and args.simplify < 0:
+        raise UsageError("公差不能为负数。")
+    if args.fit_arcs is not None and args.fit_arcs <= 0:
+        raise UsageError("圆弧拟合公差必须是正数。")
+    if (args.min_layer_time is not None and args.min_layer_time <= 0) or \
+            (args.max_feed is not None and args.max_feed <= 0):
+        raise UsageError("最小层时间和最高速度必须是正数。")
+    if args.max_feed is not None and args.min_layer_time is None:
+        raise UsageError("--max-feed 需要与 --min-layer-time 一起使用。")
+    if args.jobs is not None and args.jobs < 1:
+        raise UsageError("--jobs 必须是正整数。")
+    source_name = "stdin" if gcode_io.is_stdio(args.input) else os.path.basename(args.input)
+    output_path = _resolve_output(args, _convert_output_path)
+    builder = preview_path = None
+    if args.preview is not None:
+        import preview
+
+        preview_path = args.preview
+        if not preview_path:
+            if gcode_io.is_stdio(output_path):
+                raise UsageError("输出到 stdout 时 --preview 需要指定预览文件路径。")
+            preview_path = preview.preview_path(output_path)
+        builder = preview.PreviewBuilder()
+    if args.checkpoint:
+        if args.optimize_travel or args.simplify is not None or args.fit_arcs is not None or \
+                args.min_layer_time is not None:
+            raise UsageError("--checkpoint 不能与 --optimize-travel/--simplify/--fit-arcs/--min-layer-time 一起使用。")
+        status = _run_checkpointed(args, output_path, lambda compression, compact, precision:
+                                   transGcode.convert_marlin_checkpointed(
+            args.input, output_path, layer_height,
+            desired_g1_xy_feedrate=args.xy_feed,
+            desired_g1_z_feedrate=args.z_feed,
+            fixed_g0_feedrate=args.g0_feed,
+            source_name=source_name,
+            compression=compression,
+            compact=compact,
+            precision=precision,
+        ))
+        if builder is not None and status == EXIT_OK:
+            # a resumed run does not see the lines written before the interruption: read them back
+            result = preview.build_preview(output_path)
+            result.save(preview_path)
+            with contextlib.redirect_stdout(sys.stderr):
+                preview.print_preview_report(result, preview_path)
+        return status
+    status = _run_stream(args, output_path, lambda infile, outfile: transGcode.convert_marlin_stream(
+        infile, outfile, source_name, layer_height,
+        desired_g1_xy_feedrate=args.xy_feed,
+        desired_g1_z_feedrate=args.z_feed,
+        fixed_g0_feedrate=args.g0_feed,
+        optimize_travel=args.optimize_travel,
+        simplify_tolerance=args.simplify,
+        arc_tolerance=args.fit_arcs,
+        min_layer_time=args.min_layer_time,
+        max_layer_feedrate=args.max_feed,
+        workers=args.jobs,
+        preview=builder,
+    ))
+    if builder is not None and status == EXIT_OK:
+        result = builder.finish()
+        result.save(preview_path)
+        with contextlib.redirect_stdout(sys.stderr):
+            preview.print_preview_report(result, preview_path)
+    return status
+
+
+def _run_toolpath(args, output_path, transform):
+    """
+    Runs the native binary-toolpath version of a tool: transform(toolpath) returns the new toolpath or None.
+    """
+    import toolpath
+
+    with contextlib.redirect_stdout(sys.stderr):
+        result = transform(toolpath.load_toolpath(args.input))
+    if result is None:
+        return EXIT_FAILURE
+    toolpath.write_output(result, output_path)
+    return EXIT_OK
+
+
+def cmd_relayer(args):
+    import layer
+
+    new_height = _resolve(args, "new_height", "请输入新的层高 (mm，例如 0.2): ",
+                          check=lambda v: v > 0, error="层高必须是正数。")
+    output_path = _resolve_output(args, lambda p: layer.default_output_path(p, new_height))
+    if gcode_io.is_toolpath_file(args.input) and args.compress is None:
+        return _run_toolpath(args, output_path, lambda tp: layer.modify_z_values_in_toolpath(
+            tp, new_height,
+            original_layer_height_mm=args.original_height,
+            fallback_original_layer_height_mm=args.fallback_original_height,
+            interactive=False,
+        ))
+    if args.checkpoint:
+        return _run_checkpointed(args, output_path, lambda compression, compact, precision:
+                                 layer.modify_z_values_checkpointed(
+            args.input, output_path, new_height,
+            compression=compression,
+            compact=compact,
+            precision=precision,
+            original_layer_height_mm=args.original_height,
+            fallback_original_layer_height_mm=args.fallback_original_height,
+            interactive=False,
+        ))
+    return _run_stream(args, output_path, lambda infile, outfile: layer.modify_z_values_stream(
+        infile, outfile, new_height,
+        original_layer_height_mm=args.original_height,
+        fallback_original_layer_height_mm=args.fallback_original_height,
+        interactive=False,
+    ))
+
+
+def cmd_varheight(args):
+    import Variable_height
+
+    if args.adaptive is not None:
+        if args.adaptive <= 0 or (args.max_height is not None and args.max_height <= 0):
+            raise UsageError("容限和最大层高必须是正数。")
+        triangles = None
+        if args.stl:
+            import slicer
+            triangles = slicer.load_stl(args.stl)
+        output_path = _resolve_output(args, lambda p: Variable_height.adaptive_output_path(p, args.adaptive))
+        return _run_stream(args, output_path, lambda infile, outfile: Variable_height.process_adaptive_lh_stream(
+            infile, outfile, args.adaptive, max_lh=args.max_height, triangles=triangles))
+    a = _resolve(args, "layers_per_block", "请输入每块的层数 (a, 例如 15): ", cast=int,
+                 check=lambda v: v > 0, error="每块的层数 (a) 必须是正整数。")
+    h = _resolve(args, "initial_height", "请输入第一个块的初始层高 (h, mm, 例如 0.35): ",
+                 check=lambda v: v > 0, error="初始层高 (h) 必须是正数。")
+    d = _resolve(args, "delta", "请输入每个后续块层高的变化量 (d, mm, 例如 -0.05 或 0.02): ")
+    output_path = _resolve_output(args, lambda p: Variable_height.default_output_path(p, h, d))
+    if gcode_io.is_toolpath_file(args.input) and args.compress is None:
+        return _run_toolpath(args, output_path, lambda tp: Variable_height.process_variable_lh_toolpath(tp, a, h, d))
+    return _run_stream(args, output_path, lambda infile, outfile: Variable_height.process_variable_lh_stream(
+        infile, outfile, a, h, d))
+
+
+def cmd_layertime(args):
+    import layertime
+
+    if args.min_time <= 0 or args.min_feed <= 0 or (args.max_feed is not None and args.max_feed <= 0):
+        raise UsageError("最小层时间和速度必须是正数。")
+    output_path = _resolve_output(args, layertime.default_output_path)
+    options = dict(max_feedrate=args.max_feed, min_feedrate=args.min_feed)
+    if gcode_io.is_toolpath_file(args.input) and args.compress is None:
+        return _run_toolpath(args, output_path, lambda tp: layertime.layer_time_toolpath(tp, args.min_time, **options))
+    return _run_stream(args, output_path, lambda infile, outfile: layertime.layer_time_stream(
+        infile, outfile, args.min_time, **options))
+
+
+def cmd_mergez(args):
+    import betterNC
+
+    output_path = _resolve_output(args, betterNC.default_output_path)
+    return _run_stream(args, output_path, betterNC.process_nc_stream)
+
+
+def cmd_travel(args):
+    import travel
+
+    output_path = _resolve_output(args, travel.default_output_path)
+    return _run_stream(args, output_path, lambda infile, outfile: travel.optimize_travel_stream(
+        infile, outfile, reverse_chains=not args.no_reverse, two_opt=not args.no_2opt))
+
+
+def cmd_simplify(args):
+    import simplify
+
+    tolerance = simplify.DEFAULT_CHORD_TOLERANCE if args.tolerance is None else args.tolerance
+    if tolerance < 0:
+        raise UsageError("公差不能为负数。")
+    output_path = _resolve_output(args, simplify.default_output_path)
+    return _run_stream(args, output_path, lambda infile, outfile: simplify.simplify_stream(
+        infile, outfile, tolerance=tolerance))
+
+
+def cmd_arcs(args):
+    import arcs
+
+    tolerance = arcs.DEFAULT_ARC_TOLERANCE if args.tolerance is None else args.tolerance
+    if tolerance <= 0:
+        raise UsageError("圆弧拟合公差必须是正数。")
+    output_path = _resolve_output(args, arcs.default_output_path)
+    return _run_stream(args, output_path, lambda infile, outfile: arcs.fit_arcs_stream(
+        infile, outfile, tolerance=tolerance))
+
+
+def cmd_compact(args):
+    import compact
+
+    precision = _output_precision(args)
+    args.compact, args.precision = False, None  # compact_stream does the work itself and reports it
+    output_path = _resolve_output(args, compact.default_output_path)
+    return _run_stream(args, output_path, lambda infile, outfile: compact.compact_stream(
+        infile, outfile, precision=precision))
+
+
+def cmd_send(args):
+    import sender
+
+    if args.port is None and not args.simulate:
+        raise UsageError("请用 -p/--port 指定串口设备, 或用 --simulate 发送到本地 GRBL 模拟器")
+    if args.speedup < 0:
+        raise UsageError("--speedup 不能为负数。")
+    with gcode_io.open_input(args.input) as infile:
+        with contextlib.redirect_stdout(sys.stderr):
+            ok = sender.stream_lines(
+                infile, port=args.port, baud=args.baud, simulate=args.simulate, speedup=args.speedup,
+                ping_pong=args.ping_pong, stop_on_error=args.stop_on_error, interactive=_can_prompt(args))
+    return EXIT_OK if ok else EXIT_FAILURE
+
+
+def cmd_export(args):
+    import toolpath
+
+    output_path = _resolve_output(args, toolpath.default_output_path)
+    return _run_stream(args, output_path, lambda infile, outfile: outfile.writelines(infile) or True)
+
+
+def cmd_serpentine(args):
+    import better_number
+
+    layers = _resolve(args, "layers", "请输入您希望生成的总层数 (偶数, 4-20): ", cast=int,
+                      check=lambda v: v > 0, error="总层数必须是正整数。")
+    layer_height = _resolve(args, "layer_height", "请输入每层层高 (例如 0.5): ",
+                            check=lambda v: v > 0, error="层高必须是正数。")
+    if args.left_top is None or args.right_bottom is None:
+        if not _can_prompt(args):
+            raise UsageError("缺少参数 --left-top / --right-bottom (非交互模式下必须通过命令行指定)")
+        if args.left_top is None:
+            args.left_top = (float(input("  左上角 X 坐标 (例如 2.558): ")), float(input("  左上角 Y 坐标 (例如 18.790): ")))
+        if args.right_bottom is None:
+            args.right_bottom = (float(input("  右下角 X 坐标 (例如 18.558): ")), float(input("  右下角 Y 坐标 (例如 2.790): ")))
+    output_path = _resolve_output(args, better_number.default_output_path)
+    return _run_stream(args, output_path, lambda infile, outfile: better_number.modify_gcode_stream(
+        infile, outfile, layers, layer_height, tuple(args.left_top), tuple(args.right_bottom)))
+
+
+def cmd_pyramid(args):
+    import pyramid
+
+    x = _resolve(args, "wall", "请输入壁厚和层高 x (mm): ", check=lambda v: v > 0, error="壁厚和层高 x 必须大于 0 mm。")
+    r = _resolve(args, "inner", "请输入底层内正方形边长 r (mm): ", check=lambda v: v > 0, error="底层内正方形边长 r 必须大于 0 mm。")
+    y = _resolve(args, "indent", "请输入每层缩进值 y (mm): ", check=lambda v: v >= 0, error="每层缩进值 y 不能为负数。")
+    output_path = args.output
+    if output_path is not None and gcode_io.is_stdio(output_path):
+        output_path = sys.stdout.buffer
+    with contextlib.redirect_stdout(sys.stderr):
+        result = pyramid.generate_pyramid(x, r, y, output_dir=args.output_dir, output_path=output_path,
+                                          shell_only=args.shell, allow_invalid_mesh=args.allow_invalid_mesh)
+    if result is sys.stdout.buffer:
+        result.flush()
+    return EXIT_OK if result is not None else EXIT_FAILURE
+
+
+def cmd_kresling(args):
+    import kresling
+
+    if args.layer_height is not None:
+        if args.layer_height <= 0:
+            raise UsageError("层高必须是正数。")
+        if args.line_width is not None and args.line_width <= 0:
+            raise UsageError("线宽必须是正数。")
+        output_path = args.output if args.output is not None else "thick_kresling.nc"
+        with gcode_io.open_output(output_path, compact=args.compact,
+                                  precision=_output_precision(args)) as outfile:
+            with contextlib.redirect_stdout(sys.stderr):
+                kresling.kresling_toolpath_stream(
+                    outfile,
+                    n=args.sides,
+                    radius=args.radius,
+                    thickness=args.thickness,
+                    height=args.height,
+                    twist_angle=args.twist,
+                    layer_height=args.layer_height,
+                    print_feedrate=args.feed,
+                    g0_feedrate=args.g0_feed,
+                    line_width=args.line_width,
+                )
+        return EXIT_OK
+    output_path = args.output if args.output is not None else "thick_kresling.stl"
+    # the STL is only written out once the mesh check has passed
+    stl_text = io.StringIO()
+    with contextlib.redirect_stdout(sys.stderr):
+        result = kresling.generate_thick_kresling(
+            n=args.sides,
+            radius=args.radius,
+            thickness=args.thickness,
+            height=args.height,
+            twist_angle=args.twist,
+            filename=stl_text,
+            allow_invalid_mesh=args.allow_invalid_mesh,
+        )
+    if result is None:
+        return EXIT_FAILURE
+    with gcode_io.open_output(output_path) as outfile:
+        outfile.write(stl_text.getvalue())
+    return EXIT_OK
+
+
+def cmd_slice(args):
+    import slicer
+
+    layer_height = _resolve(args, "layer_height", "请输入层高 (mm): ", check=lambda v: v > 0, error="层高必须是正数。")
+    if args.feed <= 0 or args.g0_feed <= 0:
+        raise UsageError("速度必须是正数。")
+    source_name = "stdin" if gcode_io.is_stdio(args.input) else os.path.basename(args.input)
+    triangles = slicer.load_stl(args.input)
+    output_path = _resolve_output(args, slicer.default_output_path)
+    with gcode_io.open_output(output_path, compression=args.compress, compact=args.compact,
+                              precision=_output_precision(args)) as outfile:
+        with contextlib.redirect_stdout(sys.stderr):
+            ok = slicer.slice_stl_stream(triangles, outfile, source_name, layer_height,
+                                         print_feedrate=args.feed, g0_feedrate=args.g0_feed)
+    return EXIT_OK if ok else EXIT_FAILURE
+
+
+def cmd_check(args):
+    import meshcheck
+    import slicer
+
+    with contextlib.redirect_stdout(sys.stderr):
+        report = meshcheck.validate_triangles(slicer.load_stl(args.input))
+        meshcheck.print_mesh_report(report)
+    return EXIT_OK if report["closed_manifold"] else EXIT_FAILURE
+
+
+def cmd_estimate(args):
+    import estimate
+
+    if args.acceleration <= 0 or args.junction_deviation < 0 or (args.rapid_rate is not None and args.rapid_rate <= 0):
+        raise UsageError("加速度和 G0 速度必须是正数，转角偏差不能为负。")
+    tp = estimate.load_any_toolpath(args.input)
+    result = estimate.estimate_toolpath(tp, acceleration=args.acceleration, junction_deviation=args.junction_deviation,
+                                        rapid_rate=args.rapid_rate)
+    estimate.print_estimate_report(result, per_layer=not args.summary)
+    return EXIT_OK
+
+
+def cmd_nest(args):
+    import estimate
+    import nest
+    import toolpath
+
+    offsets = args.offset or []
+    if len(offsets) > len(args.inputs):
+        raise UsageError("--offset 的个数不能多于输入文件。")
+    offsets = [tuple(offset) for offset in offsets] + [(0.0, 0.0)] * (len(args.inputs) - len(offsets))
+    if args.lift < 0:
+        raise UsageError("零件间抬升高度不能为负数。")
+    if args.output is not None:
+        output_path = args.output
+    elif args.auto_output:
+        output_path = nest.default_output_path(args.inputs[0])
+    else:
+        output_path = gcode_io.STDIO_PATH
+    parts = [estimate.load_any_toolpath(path) for path in args.inputs]
+    names = [os.path.basename(path) for path in args.inputs]
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            result = nest.nest_toolpaths_report(parts, offsets, names=names, part_lift=args.lift,
+                                                estimate=not args.no_estimate)
+        except ValueError as e:
+            print(f"错误: {e}")
+            return EXIT_FAILURE
+    toolpath.write_output(result, output_path, compression=args.compress, compact=args.compact,
+                          precision=_output_precision(args))
+    return EXIT_OK
+
+
+def cmd_layers(args):
+    import ncreader
+
+    if gcode_io.is_stdio(args.input):
+        raise UsageError("layers 需要随机读取, 不能从 stdin 读取。")
+    with ncreader.LayerReader(args.input) as reader:
+        if args.range is None:
+            ncreader.print_layer_list(reader)
+            return EXIT_OK
+        try:
+            start, stop = ncreader.parse_layer_range(args.range, len(reader))
+        except ValueError as e:
+            raise UsageError(str(e))
+        with gcode_io.open_output(args.output, compression=args.compress) as outfile:
+            if not args.no_header:
+                outfile.writelines(reader.header_lines())
+            outfile.writelines(reader.lines(start, stop))
+    return EXIT_OK
+
+
+def cmd_preview(args):
+    import preview
+
+    if args.output is not None:
+        output_path = args.output
+    elif gcode_io.is_stdio(args.input):
+        raise UsageError("从 stdin 读取时需要用 -o 指定预览文件路径。")
+    else:
+        output_path = preview.preview_path(args.input)
+    tolerances = preview.DEFAULT_LOD_TOLERANCES
+    if args.levels is not None:
+        try:
+            tolerances = tuple(float(v) for v in args.levels.split(","))
+        except ValueError:
+            raise UsageError(f"细节级别无效: {args.levels}")
+        if not tolerances or min(tolerances) <= 0:
+            raise UsageError("细节级别的公差必须是正数。")
+    result = preview.build_preview(args.input, tolerances)
+    result.save(output_path)
+    with contextlib.redirect_stdout(sys.stderr):
+        preview.print_preview_report(result, output_path)
+    return EXIT_OK
+
+
+def _add_io_arguments(parser):
+    parser.add_argument("input", nargs="?", default=gcode_io.STDIO_PATH,
+                        help="输入文件路径, '-' 或省略时从 stdin 读取")
+    parser.add_argument("-o", "--output", default=None,
+                        help="输出文件路径, '-' 为 stdout (默认 stdout)")
+    parser.add_argument("--auto-output", action="store_true",
+                        help="按原脚本的命名规则在输入文件同目录下生成输出文件")
+    parser.add_argument("-z", "--compress", choices=("gz", "xz", "zst", "bz2", "none"), default=None,
+                        help="输出压缩格式 (默认按输出扩展名判断; stdout 默认不压缩). "
+                             "输入的 gzip/xz/bz2/zstd 压缩会自动识别")
+    parser.add_argument("--compact", action="store_true",
+                        help="紧凑输出: 省略与模态状态相同的 X/Y/Z/F 字, 去掉数字末尾的 0")
+    parser.add_argument("--precision", default=None, metavar="SPEC",
+                        help="紧凑输出时各轴保留的小数位数, 如 X=3,Y=3,Z=2,F=0 (隐含 --compact)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="DIW G-code 工具的统一命令行入口 (非交互, 支持 stdin/stdout 管道)",
+    )
+    add_profiling_arguments(parser)
+    sub = parser.add_subparsers(dest="command", metavar="COMMAND")
+    sub.required = True
+
+    p = sub.add_parser("convert", help="Marlin G-code -> GRBL NC (transGcode)")
+    _add_io_arguments(p)
+    p.add_argument("-l", "--layer-height", type=float, help="层高 (mm), 第N层 Z = 层高 * N")
+    p.add_argument("--xy-feed", type=float, default=None, help="G1 XY 速度 (mm/min), 默认保留原始 F 值")
+    p.add_argument("--z-feed", type=float, default=None, help="G1 纯 Z 移动速度 (mm/min), 同时用于所有 G0")
+    p.add_argument("--g0-feed", type=float, default=1750.0, help="未指定 --z-feed 时的 G0 速度 (默认 1750)")
+    p.add_argument("--optimize-travel", action="store_true", help="重新排列每层的打印路径以缩短空行程 (travel)")
+    p.add_argument("--simplify", type=float, default=None, metavar="TOL",
+                   help="合并弦高公差 TOL (mm) 内的共线 G1 短段 (simplify)")
+    p.add_argument("--fit-arcs", type=float, default=None, metavar="TOL",
+                   help="将公差 TOL (mm) 内共圆的 G1 短段替换为 G2/G3 圆弧 (arcs)")
+    p.add_argument("--min-layer-time", type=float, default=None, metavar="SEC",
+                   help="短于 SEC 秒的层降低 G1 速度 (layertime)")
+    p.add_argument("--max-feed", type=float, default=None,
+                   help="与 --min-layer-time 一起: 长层的 G1 速度最多提高到此值 (mm/min)")
+    p.add_argument("-j", "--jobs", type=int, default=None, metavar="N",
+                   help="用 N 个进程并行解析 Marlin 文件 (输出与单进程相同)")
+    p.add_argument("--preview", nargs="?", const="", default=None, metavar="PATH",
+                   help="转换的同时生成分层预览文件 (.diwpv); 默认与输出文件同名")
+    p.add_argument("--checkpoint", action="store_true",
+                   help="断点续传: 按层保存进度到 OUTPUT.ckpt, 中断后用相同参数重新运行即从最后一层继续 "
+                        "(不支持路径优化类选项和 stdin/stdout)")
+    p.set_defaults(handler=cmd_convert)
+
+    p = sub.add_parser("relayer", help="修改 NC 文件层高 (layer)")
+    p.add_argument("new_height", type=float, nargs="?", help="新的层高 (mm)")
+    _add_io_arguments(p)
+    p.add_argument("--original-height", type=float, default=None, help="原始层高 (mm), 默认从文件中推断")
+    p.add_argument("--fallback-original-height", type=float, default=None,
+                   help="无法推断原始层高时使用的值 (例如 0.5); 未指定则报错退出")
+    p.add_argument("--checkpoint", action="store_true",
+                   help="断点续传: 按层保存进度到 OUTPUT.ckpt, 中断后用相同参数重新运行即从最后一层继续 "
+                        "(不支持 stdin/stdout)")
+    p.set_defaults(handler=cmd_relayer)
+
+    p = sub.add_parser("varheight", help="可变层高 (Variable_height)")
+    _add_io_arguments(p)
+    p.add_argument("-a", "--layers-per-block", type=int, help="每块的层数 a")
+    p.add_argument("--initial-height", "-H", type=float, help="第一个块的初始层高 h (mm)")
+    p.add_argument("-d", "--delta", type=float, help="每个后续块层高的变化量 d (mm)")
+    p.add_argument("--adaptive", type=float, metavar="CUSP",
+                   help="自适应层高: 按模型坡度合并原始层, 台阶误差不超过 CUSP (mm); 不需要 a/h/d")
+    p.add_argument("--max-height", type=float, help="自适应层高的最大层高 (mm, 默认原始层高的 2 倍)")
+    p.add_argument("--stl", help="自适应层高: 用源 STL 的面法线计算坡度 (默认按 NC 轮廓估算)")
+    p.set_defaults(handler=cmd_varheight)
+
+    p = sub.add_parser("layertime", help="按最小层时间逐层调整 G1 速度 (layertime)")
+    _add_io_arguments(p)
+    p.add_argument("-t", "--min-time", type=float, default=10.0, help="最小层时间 (s, 默认 10)")
+    p.add_argument("--max-feed", type=float, default=None,
+                   help="长层的 G1 速度最多提高到此值 (mm/min), 默认不加速")
+    p.add_argument("--min-feed", type=float, default=60.0, help="短层的 G1 速度最低降到此值 (mm/min, 默认 60)")
+    p.set_defaults(handler=cmd_layertime)
+
+    p = sub.add_parser("mergez", help="从第2层起将层首行的 Z 合并到下一行 (betterNC)")
+    _add_io_arguments(p)
+    p.set_defaults(handler=cmd_mergez)
+
+    p = sub.add_parser("travel", help="重新排列每层的打印路径以缩短 G0 空行程 (travel)")
+    _add_io_arguments(p)
+    p.add_argument("--no-reverse", action="store_true", help="不反向打印路径段, 只调整顺序")
+    p.add_argument("--no-2opt", action="store_true", help="只用最近邻排序, 跳过 2-opt 改进")
+    p.set_defaults(handler=cmd_travel)
+
+    p = sub.add_parser("simplify", help="合并近似共线的 G1 短段以减少段数 (simplify)")
+    _add_io_arguments(p)
+    p.add_argument("-t", "--tolerance", type=float, default=None,
+                   help="弦高公差 (mm, 默认 0.01)")
+    p.set_defaults(handler=cmd_simplify)
+
+    p = sub.add_parser("arcs", help="将共圆的 G1 短段拟合为 G2/G3 圆弧 (arcs)")
+    _add_io_arguments(p)
+    p.add_argument("-t", "--tolerance", type=float, default=None,
+                   help="拟合公差 (mm, 默认 0.01)")
+    p.set_defaults(handler=cmd_arcs)
+
+    p = sub.add_parser("compact", help="省略重复的模态字, 压缩 NC 文件体积 (compact)")
+    _add_io_arguments(p)
+    p.set_defaults(handler=cmd_compact)
+
+    p = sub.add_parser("send", help="以 GRBL 字符计数协议流式发送 NC 文件到机床 (sender)")
+    p.add_argument("input", nargs="?", default=gcode_io.STDIO_PATH,
+                   help="输入文件路径, '-' 或省略时从 stdin 读取")
+    p.add_argument("-p", "--port", default=None, help="串口设备, 例如 /dev/ttyUSB0")
+    p.add_argument("-b", "--baud", type=int, default=115200, help="波特率 (默认 115200)")
+    p.add_argument("--simulate", action="store_true", help="发送到本地伪终端 GRBL 模拟器, 无需机床")
+    p.add_argument("--speedup", type=float, default=10.0,
+                   help="模拟器相对实际时间的加速倍数 (默认 10, 0 为不计运动时间)")
+    p.add_argument("--ping-pong", action="store_true", help="每行等待 ok 后再发下一行 (用于对比)")
+    p.add_argument("--stop-on-error", action="store_true", help="GRBL 返回 error 时停止发送")
+    p.set_defaults(handler=cmd_send)
+
+    p = sub.add_parser("export", help="NC 文本与二进制工具路径 (.diwtp) 互相转换 (toolpath)")
+    _add_io_arguments(p)
+    p.set_defaults(handler=cmd_export)
+
+    p = sub.add_parser("serpentine", help="# 字形逐层首尾相接 (better_number)")
+    _add_io_arguments(p)
+    p.add_argument("-n", "--layers", type=int, help="生成的总层数")
+    p.add_argument("-l", "--layer-height", type=float, help="每层层高 (mm)")
+    p.add_argument("--left-top", type=float, nargs=2, metavar=("X", "Y"), help="路径逻辑左上角坐标")
+    p.add_argument("--right-bottom", type=float, nargs=2, metavar=("X", "Y"), help="路径逻辑右下角坐标")
+    p.set_defaults(handler=cmd_serpentine)
+
+    p = sub.add_parser("slice", help="内置切片: STL -> 分层 NC 轮廓刀路 (slicer)")
+    _add_io_arguments(p)
+    p.add_argument("-l", "--layer-height", type=float, help="层高 (mm), 第N层 Z = 层高 * N")
+    p.add_argument("--feed", type=float, default=600.0, help="G1 打印速度 (mm/min, 默认 600)")
+    p.add_argument("--g0-feed", type=float, default=1750.0, help="G0 速度 (mm/min, 默认 1750)")
+    p.set_defaults(handler=cmd_slice)
+
+    p = sub.add_parser("check", help="检查 STL 网格: 封闭流形, 法线方向, 有向体积 (meshcheck)")
+    p.add_argument("input", nargs="?", default=gcode_io.STDIO_PATH,
+                   help="STL 文件路径, '-' 或省略时从 stdin 读取")
+    p.set_defaults(handler=cmd_check)
+
+    p = sub.add_parser("estimate", help="按加减速和转角限速估算 NC 文件的加工时间 (estimate)")
+    p.add_argument("input", nargs="?", default=gcode_io.STDIO_PATH,
+                   help="NC 或 .diwtp 文件路径, '-' 或省略时从 stdin 读取")
+    p.add_argument("-a", "--acceleration", type=float, default=500.0, help="加速度 (mm/s², 默认 500)")
+    p.add_argument("-j", "--junction-deviation", type=float, default=0.01,
+                   help="转角偏差 (mm, 即 GRBL 的 $11, 默认 0.01)")
+    p.add_argument("--rapid-rate", type=float, default=None,
+                   help="G0 的实际速度 (mm/min, 默认按文件中 G0 的 F)")
+    p.add_argument("--summary", action="store_true", help="只输出总计, 不输出每层时间")
+    p.set_defaults(handler=cmd_estimate)
+
+    p = sub.add_parser("preview", help="为 NC 文件生成分层、多细节级别的预览文件 .diwpv (preview)")
+    p.add_argument("input", nargs="?", default=gcode_io.STDIO_PATH,
+                   help="NC 或 .diwtp 文件路径, '-' 或省略时从 stdin 读取")
+    p.add_argument("-o", "--output", default=None, help="预览文件路径 (默认与输入文件同名的 .diwpv)")
+    p.add_argument("--levels", default=None, metavar="TOLS",
+                   help="各细节级别的弦高公差 (mm), 逗号分隔, 默认 0.01,0.1,1")
+    p.set_defaults(handler=cmd_preview)
+
+    p = sub.add_parser("layers", help="只读取并输出 NC 文件中的几层, 不加载整个文件 (ncreader)")
+    p.add_argument("input", help="NC (可压缩) 或 .diwtp 文件路径")
+    p.add_argument("range", nargs="?", default=None,
+                   help="第几层: N 或 N-M 或 N- (从 1 开始, 负数从最后一层倒数, 如 -1 或 -3-), "
+                        "或 a:b (同 reader[a:b], 从 0 开始, 不含 b); 省略时列出所有层的层号、Z 和大小")
+    p.add_argument("--no-header", action="store_true", help="不输出第一层之前的文件头")
+    p.add_argument("-o", "--output", default=gcode_io.STDIO_PATH, help="输出文件路径, '-' 为 stdout (默认 stdout)")
+    p.add_argument("-z", "--compress", choices=("gz", "xz", "zst", "bz2", "none"), default=None,
+                   help="输出压缩格式 (默认按输出扩展名判断)")
+    p.set_defaults(handler=cmd_layers)
+
+    p = sub.add_parser("nest", help="把多个零件的 NC 文件按层交错合并成一个程序, 一次打印一整板 (nest)")
+    p.add_argument("inputs", nargs="+", help="各零件的 NC 或 .diwtp 文件路径")
+    p.add_argument("--offset", type=float, nargs=2, action="append", metavar=("X", "Y"),
+                   help="零件的 XY 偏移 (mm), 按输入文件顺序每个文件给一次; 缺省为 0 0")
+    p.add_argument("--lift", type=float, default=1.0, help="零件之间移动时高出当前层的抬升 (mm, 默认 1)")
+    p.add_argument("--no-estimate", action="store_true", help="不估算合并前后的加工时间")
+    p.add_argument("-o", "--output", default=None, help="输出文件路径, '-' 为 stdout (默认 stdout)")
+    p.add_argument("--auto-output", action="store_true", help="输出到第一个输入文件同目录下的 *_plate 文件")
+    p.add_argument("-z", "--compress", choices=("gz", "xz", "zst", "bz2", "none"), default=None,
+                   help="输出压缩格式 (默认按输出扩展名判断)")
+    p.add_argument("--compact", action="store_true", help="紧凑输出 (同其他子命令)")
+    p.add_argument("--precision", default=None, metavar="SPEC", help="紧凑输出时各轴保留的小数位数")
+    p.set_defaults(handler=cmd_nest)
+
+    p = sub.add_parser("pyramid", help="生成中空四边形金字塔 STL (pyramid)")
+    p.add_argument("-x", "--wall", type=float, help="壁厚和层高 x (mm)")
+    p.add_argument("-r", "--inner", type=float, help="底层内正方形边长 r (mm)")
+    p.add_argument("-y", "--indent", type=float, help="每层缩进值 y (mm)")
+    p.add_argument("-o", "--output", default=None, help="输出 STL 路径, '-' 为 stdout; 默认按 r 和层数命名")
+    p.add_argument("--output-dir", default=".", help="未指定 -o 时的输出文件夹 (默认当前目录)")
+    p.add_argument("--shell", action="store_true",
+                   help="只生成一个封闭外壳 (内外壁和台阶面), 不在层间生成重合的内部面")
+    p.add_argument("--allow-invalid-mesh", action="store_true",
+                   help="外壳网格检查未通过时仍然保存 STL (分层模式总是保存, 未通过时给出警告)")
+    p.set_defaults(handler=cmd_pyramid)
+
+    p = sub.add_parser("kresling", help="生成厚壁 Kresling 折纸结构 STL (kresling)")
+    p.add_argument("-n", "--sides", type=int, default=8, help="多边形边数 (默认 8)")
+    p.add_argument("--radius", type=float, default=7.5, help="中性面半径 (mm, 默认 7.5)")
+    p.add_argument("--thickness", type=float, default=0.5, help="壁厚 (mm, 默认 0.5)")
+    p.add_argument("--height", type=float, default=20.0, help="高度 (mm, 默认 20)")
+    p.add_argument("--twist", type=float, default=15.0, help="扭转角 (度, 默认 15)")
+    p.add_argument("-l", "--layer-height", type=float, default=None,
+                   help="直接生成 NC 刀路 (无需切片) 的层高 (mm); 未指定则输出 STL")
+    p.add_argument("--feed", type=float, default=600.0, help="刀路的 G1 打印速度 (mm/min, 默认 600)")
+    p.add_argument("--g0-feed", type=float, default=1750.0, help="刀路的 G0 速度 (mm/min, 默认 1750)")
+    p.add_argument("--line-width", type=float, default=None,
+                   help="挤出线宽 (mm): 路径向壁内偏移半个线宽, 壁厚小于两倍线宽时只走中线; 默认沿内外表面")
+    p.add_argument("-o", "--output", default=None,
+                   help="输出路径, '-' 为 stdout (默认 thick_kresling.stl, 刀路为 thick_kresling.nc)")
+    p.add_argument("--compact", action="store_true", help="刀路紧凑输出 (同其他子命令)")
+    p.add_argument("--precision", default=None, metavar="SPEC", help="刀路紧凑输出时各轴保留的小数位数")
+    p.add_argument("--allow-invalid-mesh", action="store_true", help="网格检查未通过时仍然写入 STL")
+    p.set_defaults(handler=cmd_kresling)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extras = parser.parse_known_args(argv)
+    # argparse takes a layer range such as "-3-" or "-2:" for an unknown option
+    if args.handler is cmd_layers and args.range is None and len(extras) == 1 and extras[0][1:2].isdigit():
+        args.range, extras = extras[0], []
+    if extras:
+        parser.error(f"unrecognized arguments: {' '.join(extras)}")
+    try:
+        return run_profiled(
+            args.handler, args,
+            profile=args.profile,
+            profile_sort=args.profile_sort,
+            profile_limit=args.profile_limit,
+            trace_memory=args.trace_memory,
+        )
+    except UsageError as e:
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        print("已中断。", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    except BrokenPipeError:
+        # The downstream process closed the pipe early; silence the final flush of stdout.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return EXIT_FAILURE
+    except OSError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return EXIT_FAILURE
+    except Exception as e:
+        print(f"处理过程中发生错误: {e}", file=sys.stderr)
+        import traceback
+        traceback.print_exc()
+        return EXIT_FAILURE
+
+
+if __name__ == "__main__":
+    sys.exit(main())
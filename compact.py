@@ -0,0 +1,334 @@
+import os
+
+import gcode_io
+from profiling import run_main
+
+AXES = ("X", "Y", "Z")
+# G codes that leave the meaning of later X/Y/Z/F words unchanged; any other G code (G20/G21, G28,
+# G53, G54.., G92 handled apart) makes the writer forget the position it knows.
+_SAFE_G_CODES = {0.0, 1.0, 2.0, 3.0, 4.0, 17.0, 90.0, 91.0, 93.0, 94.0}
+_MOTION_CODES = {0.0: "G0", 1.0: "G1", 2.0: "G2", 3.0: "G3"}
+CHUNK_CHARS = gcode_io.IO_BUFFER_SIZE
+
+
+def format_number(text, decimals=None):
+    """
+    Shortest form of a number token: rounded to decimals places (if given), without trailing zeros.
+    """
+    if decimals is not None:
+        text = f"{float(text):.{decimals}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text.startswith("+"):
+        text = text[1:]
+    if text in ("", "-", "-0", "-."):
+        text = "0"
+    return text
+
+
+def parse_precision(spec):
+    """
+    Parses "X=3,Y=3,Z=2,F=0" (axes may be grouped: "XY=3") into {"X": 3, "Y": 3, "Z": 2, "F": 0}.
+    """
+    precision = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        axes, _, decimals = item.partition("=")
+        axes = axes.strip().upper()
+        if not axes or not axes.isalpha() or not decimals.strip().isdigit():
+            raise ValueError(f"无效的精度设置 '{item}', 格式应为 X=3,Y=3,Z=2,F=0")
+        for axis in axes:
+            precision[axis] = int(decimals)
+    return precision
+
+
+class ModalCompactor:
+    """
+    Rewrites NC lines with the fewest words: X/Y/Z/F words that repeat the modal state are left out and
+    all numbers are trimmed (and rounded to the per-axis precision, if given). G words are kept, so the
+    output still reads as G0/G1 moves.
+    """
+
+    def __init__(self, precision=None):
+        self.precision = {axis.upper(): decimals for axis, decimals in (precision or {}).items()}
+        self.motion = None
+        self.feed = None
+        self.axes = {}
+        self.absolute = True
+        self.inverse_time = False
+
+    def forget(self):
+        self.motion = None
+        self.feed = None
+        self.axes = {}
+
+    def compact(self, line):
+        """
+        Returns the compact form of one line (without newline), or None if the line has no effect.
+        """
+        match = gcode_io.CANONICAL_MOVE_PATTERN.match(line)
+        if match is not None and self.absolute and not self.inverse_time and self.precision.keys().isdisjoint("XYZF"):
+            return self._compact_move(match)
+        stripped = line.strip()
+        if not stripped or stripped[0] in ";(":
+            return line
+        code, semicolon, comment = line.partition(";")
+        words = []
+        for token in code.split():
+            match = gcode_io.WORD_PATTERN.fullmatch(token)
+            if match is None:
+                # unusual syntax (parenthesised comments, words without spaces, ...): keep it as it is
+                self.forget()
+                return line
+            letter = match.group(1).upper()
+            words.append([letter, match.group(2)])
+        motion = self.motion
+        motion_words = []
+        safe = True
+        for word in words:
+            letter, value = word
+            if letter == "G":
+                g = float(value)
+                if g in _MOTION_CODES:
+                    motion = _MOTION_CODES[g]
+                    motion_words.append(word)
+                elif g == 90.0:
+                    self.absolute = True
+                elif g == 91.0:
+                    self.absolute = False
+                elif g == 93.0:
+                    self.inverse_time = True
+                elif g == 94.0:
+                    self.inverse_time = False
+                if g not in _SAFE_G_CODES:
+                    safe = False
+            elif letter == "M" and float(value) in (2.0, 30.0):
+                safe = False
+            elif letter in self.precision or letter in AXES or letter in ("F", "I", "J"):
+                word[1] = format_number(value, self.precision.get(letter))
+        if any(letter == "G" and float(value) == 92.0 for letter, value in words):
+            # G92 sets the given axes to the given values without moving
+            for letter, value in words:
+                if letter in AXES:
+                    self.axes[letter] = value
+            return self._join(words, semicolon, comment)
+        if not safe:
+            self.forget()
+            return self._join(words, semicolon, comment)
+
+        previous_motion = self.motion
+        self.motion = motion
+        droppable_axes = self.absolute and motion in ("G0", "G1")
+        kept = []
+        dropped = False
+        for word in words:
+            letter, value = word
+            if letter in AXES:
+                if droppable_axes and self.axes.get(letter) == value:
+                    dropped = True
+                    continue
+                self.axes[letter] = value if self.absolute else None
+            elif letter == "F":
+                if self.inverse_time:
+                    self.feed = None
+                elif self.feed == value:
+                    dropped = True
+                    continue
+                else:
+                    self.feed = value
+            kept.append(word)
+        if dropped and all(word in motion_words for word in kept):
+            # nothing but the motion word is left: it only matters if it changes the modal motion
+            kept = [word for word in kept if _MOTION_CODES[float(word[1])] != previous_motion]
+            if not kept and not semicolon:
+                return None
+        return self._join(kept, semicolon, comment)
+
+    def _compact_move(self, match):
+        g, x, y, z, f, comment = match.groups()
+        motion = "G" + g
+        previous_motion, self.motion = self.motion, motion
+        axes = self.axes
+        words = [motion]
+        dropped = False
+        for letter, value in (("X", x), ("Y", y), ("Z", z)):
+            if value is None:
+                continue
+            value = format_number(value)
+            if axes.get(letter) == value:
+                dropped = True
+            else:
+                axes[letter] = value
+                words.append(letter + value)
+        if f is not None:
+            f = format_number(f)
+            if self.feed == f:
+                dropped = True
+            else:
+                self.feed = f
+                words.append("F" + f)
+        if dropped and len(words) == 1 and motion == previous_motion:
+            return comment
+        code = " ".join(words)
+        return code if comment is None else f"{code} {comment}"
+
+    @staticmethod
+    def _join(words, semicolon, comment):
+        code = " ".join(letter + value for letter, value in words)
+        if not semicolon:
+            return code
+        return f"{code} ;{comment}" if code else ";" + comment
+
+
+class CompactWriter:
+    """
+    File-like sink (write/writelines) that compacts the NC text written to it (see ModalCompactor) and
+    passes it on to outfile in chunks of about chunk_chars characters.
+    """
+
+    def __init__(self, outfile, precision=None, chunk_chars=CHUNK_CHARS, stats=None):
+        self.outfile = outfile
+        self.compactor = ModalCompactor(precision)
+        self.chunk_chars = chunk_chars
+        self.stats = stats if stats is not None else {}
+        for key in ("chars_in", "chars_out", "lines_in", "lines_out"):
+            self.stats.setdefault(key, 0)
+        self.closed = False
+        self._partial = ""
+        self._chunk = []
+        self._chunk_chars = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def write(self, text):
+        self.stats["chars_in"] += len(text)
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        compact = self.compactor.compact
+        self.stats["lines_in"] += len(lines)
+        for line in lines:
+            if line.endswith("\r"):
+                line = line[:-1]
+            line = compact(line)
+            if line is not None:
+                self._chunk.append(line + "\n")
+                self._chunk_chars += len(line) + 1
+                self.stats["lines_out"] += 1
+        if self._chunk_chars >= self.chunk_chars:
+            self._write_chunk()
+        return len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def _write_chunk(self):
+        if self._chunk:
+            self.outfile.write("".join(self._chunk))
+            self.stats["chars_out"] += self._chunk_chars
+            self._chunk = []
+            self._chunk_chars = 0
+
+    def flush(self):
+        self._write_chunk()
+        self.outfile.flush()
+
+    def close(self):
+        """
+        Writes the last (unterminated) line and everything buffered; outfile itself is left open.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self._partial:
+            line = self.compactor.compact(self._partial)
+            self._partial = ""
+            self.stats["lines_in"] += 1
+            if line is not None:
+                self._chunk.append(line)
+                self._chunk_chars += len(line)
+                self.stats["lines_out"] += 1
+        self.flush()
+
+
+def compact_lines(lines, precision=None, stats=None):
+    """
+    Generator over any iterable of NC lines (with or without newlines); yields the compacted lines
+    without newlines, skipping lines that only repeated the modal state. stats (dict) receives
+    {"lines_in": n, "lines_out": n}.
+    """
+    compactor = ModalCompactor(precision)
+    stats = stats if stats is not None else {}
+    stats.setdefault("lines_in", 0)
+    stats.setdefault("lines_out", 0)
+    for line in gcode_io.strip_newlines(lines):
+        stats["lines_in"] += 1
+        line = compactor.compact(line)
+        if line is not None:
+            stats["lines_out"] += 1
+            yield line
+
+
+def print_compact_report(stats):
+    chars_in, chars_out = stats["chars_in"], stats["chars_out"]
+    percent = 100.0 * (chars_in - chars_out) / chars_in if chars_in else 0.0
+    print(f"紧凑输出: {chars_in} -> {chars_out} 字符 (减少 {percent:.1f}%), "
+          f"行数 {stats['lines_in']} -> {stats['lines_out']}")
+
+
+def compact_stream(infile, outfile, precision=None):
+    """
+    Compacts infile into outfile through a CompactWriter; prints the size report.
+    """
+    stats = {}
+    writer = CompactWriter(outfile, precision=precision, stats=stats)
+    writer.writelines(infile)
+    writer.close()
+    print_compact_report(stats)
+    return True
+
+
+def default_output_path(input_file_path):
+    return gcode_io.default_output_path(input_file_path, "_compact")
+
+
+def compact_file(input_filepath, output_filepath=None, precision=None):
+    if output_filepath is None:
+        output_filepath = default_output_path(input_filepath)
+    try:
+        with gcode_io.open_input(input_filepath) as f_in, \
+             gcode_io.open_output(output_filepath) as f_out:
+            compact_stream(f_in, f_out, precision=precision)
+    except FileNotFoundError:
+        print(f"错误: 文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"错误: 处理文件 '{input_filepath}' 失败: {e}")
+        return None
+    print(f"处理完成！紧凑的文件已保存到: {output_filepath}")
+    return output_filepath
+
+
+def main():
+    input_file_path = input("请输入NC文件的完整路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    precision_str = input("请输入各轴保留的小数位数 (如 X=3,Y=3,Z=2,F=0, 留空则保留原始精度): ").strip()
+    try:
+        precision = parse_precision(precision_str)
+    except ValueError as e:
+        print(f"错误：{e}")
+        return
+    compact_file(input_file_path, precision=precision)
+
+
+if __name__ == "__main__":
+    run_main(main)
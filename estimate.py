@@ -0,0 +1,363 @@
+import math
+import os
+
+import numpy as np
+
+import gcode_io
+import toolpath
+from profiling import run_main
+from toolpath import HAS_F, HAS_X, HAS_Y, HAS_Z, KIND_G0, KIND_G1, KIND_TEXT
+
+DEFAULT_ACCELERATION = 500.0 # mm/s², the same for every direction
+DEFAULT_JUNCTION_DEVIATION = 0.01 # mm, GRBL's $11
+STRAIGHT_JUNCTION_COS = 0.999999 # GRBL's limits for straight and reversing junctions
+
+_AXIS_WORDS = {"X": 0, "Y": 1, "Z": 2, "F": 3}
+
+
+def _parse_text_records(tp, has_value):
+    """
+    Reads the records stored as text (moves not in the canonical form, arcs, dwells, M codes); marks
+    their axis words in has_value. Returns (motion {record: G code}, words (per X, Y, Z, F: (records,
+    values)), arcs {record: (i, j)}, dwells {record: seconds}, stops (records the machine stops at),
+    relative (number of lines that switch to G91)).
+    """
+    motion, arcs, dwells, stops = {}, {}, {}, []
+    words = tuple(([], []) for _ in _AXIS_WORDS)
+    relative = 0
+    for record in np.flatnonzero(np.asarray(tp.kind) == KIND_TEXT).tolist():
+        code = gcode_io.COMMENT_PATTERN.sub("", tp.string(int(tp.text[record]))).upper()
+        if not code.strip():
+            continue
+        offsets = {}
+        for letter, value in gcode_io.WORD_PATTERN.findall(code):
+            value = float(value)
+            if letter == "G":
+                if value in (0, 1, 2, 3):
+                    motion[record] = int(value)
+                elif value == 4:
+                    dwells[record] = 0.0
+                    stops.append(record)
+                elif value == 91:
+                    relative += 1
+            elif letter == "M":
+                stops.append(record)
+            elif letter in _AXIS_WORDS:
+                axis = _AXIS_WORDS[letter]
+                words[axis][0].append(record)
+                words[axis][1].append(value)
+                has_value[axis][record] = True
+            elif letter in "IJ":
+                offsets[letter] = value
+            elif letter == "P" and record in dwells:
+                dwells[record] = value
+        if offsets:
+            arcs[record] = (offsets.get("I", 0.0), offsets.get("J", 0.0))
+    words = tuple((np.asarray(records, dtype=np.int64), np.asarray(values, dtype=float)) for records, values in words)
+    return motion, words, arcs, dwells, stops, relative
+
+
+def _arc_blocks(start, end, centre_offset, clockwise):
+    """
+    Length and unit tangents (at the start and at the end) of XY-plane arcs (helical if Z changes).
+    """
+    centre = start[:, :2] + centre_offset
+    r0 = start[:, :2] - centre
+    r1 = end[:, :2] - centre
+    radius = np.hypot(r0[:, 0], r0[:, 1])
+    angle0 = np.arctan2(r0[:, 1], r0[:, 0])
+    angle1 = np.arctan2(r1[:, 1], r1[:, 0])
+    sweep = np.where(clockwise, angle0 - angle1, angle1 - angle0) % (2 * math.pi)
+    sweep[sweep <= 1e-12] = 2 * math.pi # same start and end point: a full circle
+    planar = radius * sweep
+    dz = end[:, 2] - start[:, 2]
+    length = np.hypot(planar, dz)
+    sign = np.where(clockwise, -1.0, 1.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        xy_share = planar / length
+        tangents = []
+        for r in (r0, r1):
+            # each radius by its own length: a rounded end point is rarely exactly on the circle
+            share = xy_share / np.hypot(r[:, 0], r[:, 1])
+            tangents.append(np.column_stack((-sign * r[:, 1] * share, sign * r[:, 0] * share, dz / length)))
+    return length, tangents[0], tangents[1]
+
+
+def estimate_toolpath(tp, acceleration=DEFAULT_ACCELERATION, junction_deviation=DEFAULT_JUNCTION_DEVIATION,
+                      rapid_rate=None):
+    """
+    Estimates the machine time of a Toolpath (see toolpath.py) the way GRBL plans it: every move is a
+    trapezoidal velocity profile (constant acceleration up to its feedrate, cruise, deceleration), the
+    speed through each corner is limited by the junction deviation, and the machine stops at dwells,
+    M codes and the end of the program. G0 moves run at their programmed F, or at rapid_rate (mm/min) if
+    given. Coordinates are absolute (G90), as the tools write them; arcs (G2/G3) are in the XY plane.
+
+    The planner passes are cumulative minima over the whole toolpath, so everything is vectorized.
+    Returns a dict with the total, print (G1/G2/G3), travel (G0) and dwell seconds, the print and travel
+    lengths, the time without acceleration (naive_seconds), the per-layer layer_numbers, layer_z,
+    layer_print_seconds and layer_travel_seconds (moves before the first layer comment only count in the
+    totals), and the move counts.
+    """
+    records = len(tp)
+    kind = np.asarray(tp.kind)
+    mask = np.asarray(tp.mask)
+    moves = kind != KIND_TEXT
+    has_value = [moves & ((mask & bit) != 0) for bit in (HAS_X, HAS_Y, HAS_Z, HAS_F)]
+    motion_code = np.where(kind == KIND_G0, 0, np.where(kind == KIND_G1, 1, -1)).astype(np.int8)
+    motion, words, arcs, dwells, stops, relative = _parse_text_records(tp, has_value)
+    if motion:
+        motion_code[list(motion)] = list(motion.values())
+
+    # modal state: every index below is a running maximum, so the "not set yet" (-1) entries come first
+    index = np.arange(records, dtype=np.int32)
+
+    def last_given(given):
+        source = np.where(given, index, -1)
+        np.maximum.accumulate(source, out=source)
+        return source
+
+    motion_source = last_given(motion_code >= 0)
+    blocks = np.flatnonzero((has_value[0] | has_value[1] | has_value[2]) & (motion_source >= 0))
+    count = len(blocks)
+    block_motion = motion_code[motion_source[blocks]]
+    feed_source = last_given(has_value[3])[blocks]
+    rate = np.asarray(tp.f)[feed_source].astype(float)
+    rate[:np.searchsorted(feed_source, 0)] = np.nan
+    feed_records, feed_values = words[3]
+    if len(feed_records):
+        low = np.searchsorted(feed_source, feed_records)
+        spans = np.searchsorted(feed_source, feed_records, side="right") - low
+        rate[np.repeat(low - np.cumsum(spans) + spans, spans) + np.arange(spans.sum())] = np.repeat(feed_values, spans)
+
+    # only moves set the axes, so each move starts where the previous one ended (the machine starts at 0)
+    block_index = np.arange(count, dtype=np.int32)
+    end, delta = [], []
+    for column, given, (word_records, word_values) in zip((tp.x, tp.y, tp.z), has_value, words):
+        axis_end = np.asarray(column)[blocks].astype(float)
+        if len(word_records):
+            position = np.minimum(np.searchsorted(blocks, word_records), max(count - 1, 0))
+            found = blocks[position] == word_records if count else np.zeros(0, dtype=bool)
+            axis_end[position[found]] = word_values[found]
+        axis_given = given[blocks]
+        if not axis_given.all():
+            source = np.where(axis_given, block_index, -1)
+            np.maximum.accumulate(source, out=source)
+            axis_end = axis_end[source]
+            axis_end[:np.searchsorted(source, 0)] = 0.0
+        axis_delta = np.empty(count)
+        axis_delta[:1] = axis_end[:1]
+        np.subtract(axis_end[1:], axis_end[:-1], out=axis_delta[1:])
+        end.append(axis_end)
+        delta.append(axis_delta)
+    length = delta[0] * delta[0]
+    length += delta[1] * delta[1]
+    length += delta[2] * delta[2]
+    np.sqrt(length, out=length)
+    # directions scaled by the length (the plain deltas for straight moves)
+    start_direction = delta
+    end_direction = delta
+    arc_blocks = np.flatnonzero(block_motion >= 2)
+    if len(arc_blocks):
+        start_direction = [d.copy() for d in delta]
+        end_direction = [d.copy() for d in delta]
+        offsets = np.array([arcs.get(record, (0.0, 0.0)) for record in blocks[arc_blocks].tolist()])
+        arc_end = np.column_stack([e[arc_blocks] for e in end])
+        arc_start = arc_end - np.column_stack([d[arc_blocks] for d in delta])
+        arc_length, arc_start_direction, arc_end_direction = _arc_blocks(
+            arc_start, arc_end, offsets, block_motion[arc_blocks] == 2)
+        length[arc_blocks] = arc_length
+        for axis in range(3):
+            start_direction[axis][arc_blocks] = arc_start_direction[:, axis] * arc_length
+            end_direction[axis][arc_blocks] = arc_end_direction[:, axis] * arc_length
+
+    travel = block_motion == 0
+    if rapid_rate is not None:
+        rate[travel] = rapid_rate
+    moving = length > 1e-9
+    unfed = ~(rate > 0) & moving
+    keep = moving & ~unfed
+    skipped = int(unfed.sum())
+    # the machine stops at dwells, M codes and moves that are left out for lack of a feedrate
+    stop_records = np.sort(np.concatenate((np.asarray(stops, dtype=np.int64), blocks[unfed])))
+    if not keep.all():
+        blocks, length, rate, travel = blocks[keep], length[keep], rate[keep], travel[keep]
+        start_direction = [d[keep] for d in start_direction]
+        end_direction = [d[keep] for d in end_direction]
+        count = len(blocks)
+
+    a = float(acceleration)
+    speed2 = rate * (1.0 / 60.0)
+    speed2 *= speed2
+    # squared entry speed of every block, and 0 after the last one; first the junction limits
+    entry = np.zeros(count + 1)
+    if count > 1:
+        cos_theta = end_direction[0][:-1] * start_direction[0][1:]
+        cos_theta += end_direction[1][:-1] * start_direction[1][1:]
+        cos_theta += end_direction[2][:-1] * start_direction[2][1:]
+        cos_theta /= length[:-1] * length[1:]
+        np.negative(cos_theta, out=cos_theta)
+        reverse = cos_theta > STRAIGHT_JUNCTION_COS
+        np.clip(cos_theta, -STRAIGHT_JUNCTION_COS, STRAIGHT_JUNCTION_COS, out=cos_theta)
+        sin_half = np.subtract(1.0, cos_theta, out=cos_theta)
+        sin_half *= 0.5
+        np.sqrt(sin_half, out=sin_half)
+        junction = np.subtract(1.0, sin_half)
+        np.divide(sin_half, junction, out=junction)
+        junction *= a * junction_deviation
+        junction[reverse] = 0.0
+        np.minimum(junction, speed2[:-1], out=junction)
+        np.minimum(junction, speed2[1:], out=junction)
+        stop_blocks = np.searchsorted(blocks, stop_records)
+        junction[stop_blocks[(stop_blocks > 0) & (stop_blocks < count)] - 1] = 0.0
+        entry[1:-1] = junction
+    # backward pass w[i] <= w[i + 1] + 2aL[i] and forward pass w[i + 1] <= w[i] + 2aL[i], unrolled into
+    # running minima over the distance travelled
+    distance = np.zeros(count + 1)
+    np.cumsum(length, out=distance[1:])
+    distance *= 2.0 * a
+    entry += distance
+    entry = np.minimum.accumulate(entry[::-1])[::-1]
+    entry -= distance
+    entry -= distance
+    np.minimum.accumulate(entry, out=entry)
+    entry += distance
+    np.maximum(entry, 0.0, out=entry)
+
+    # trapezoid of every block: accelerate from the entry speed to the peak, cruise, decelerate
+    peak2 = length * (2.0 * a)
+    peak2 += entry[:-1]
+    peak2 += entry[1:]
+    peak2 *= 0.5
+    np.minimum(peak2, speed2, out=peak2)
+    speed = np.sqrt(entry)
+    peak = np.sqrt(peak2)
+    seconds = peak * 2.0
+    seconds -= speed[:-1]
+    seconds -= speed[1:]
+    seconds *= 1.0 / a
+    ramp = peak2 * 2.0
+    ramp -= entry[:-1]
+    ramp -= entry[1:]
+    ramp *= 1.0 / (2.0 * a)
+    cruise = np.subtract(length, ramp, out=ramp)
+    np.maximum(cruise, 0.0, out=cruise)
+    cruise /= peak
+    seconds += cruise
+
+    # per layer: differences of the running times at the first move of every layer
+    print_time = np.where(travel, 0.0, seconds)
+    running_total = np.cumsum(seconds)
+    running_print = np.cumsum(print_time)
+    bounds = np.append(np.searchsorted(blocks, np.asarray(tp.layer_start, dtype=np.int64)), count)
+
+    def running_at(running):
+        return np.where(bounds > 0, running[np.maximum(bounds - 1, 0)] if count else 0.0, 0.0)
+
+    total_at, print_at = running_at(running_total), running_at(running_print)
+    layer_print = np.diff(print_at)
+    layer_travel = np.diff(total_at) - layer_print
+    dwell_seconds = float(sum(dwells.values()))
+    if dwells:
+        dwell_layer = np.searchsorted(np.asarray(tp.layer_start, dtype=np.int64), list(dwells), side="right") - 1
+        dwell_seconds_array = np.fromiter(dwells.values(), dtype=float)
+        layer_print += np.bincount(dwell_layer[dwell_layer >= 0], dwell_seconds_array[dwell_layer >= 0],
+                                   minlength=len(layer_print))
+
+    print_seconds = float(running_print[-1]) if count else 0.0
+    travel_seconds = (float(running_total[-1]) if count else 0.0) - print_seconds
+    print_length = float(np.where(travel, 0.0, length).sum())
+    return {
+        "total_seconds": print_seconds + travel_seconds + dwell_seconds,
+        "print_seconds": print_seconds,
+        "travel_seconds": travel_seconds,
+        "dwell_seconds": dwell_seconds,
+        "naive_seconds": float((60.0 * length / rate).sum()) + dwell_seconds,
+        "print_length": print_length,
+        "travel_length": float(length.sum()) - print_length,
+        "moves": len(blocks),
+        "skipped_moves": skipped,
+        "relative_lines": relative,
+        "layer_numbers": np.asarray(tp.layer_number, dtype=np.int64),
+        "layer_z": np.asarray(tp.layer_z, dtype=float),
+        "layer_print_seconds": layer_print,
+        "layer_travel_seconds": layer_travel,
+        "acceleration": a,
+        "junction_deviation": junction_deviation,
+    }
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def print_estimate_report(estimate, per_layer=True):
+    print(f"\n机器时间估算 (加速度 {estimate['acceleration']:g} mm/s², 转角偏差 {estimate['junction_deviation']:g} mm)")
+    if per_layer and len(estimate["layer_numbers"]):
+        print("-----------------------------------------------------------")
+        print("| Layer # | Z (mm)   | 打印 (s)   | 空行程 (s) | 合计 (s)   |")
+        print("|---------|----------|------------|------------|------------|")
+        for number, z, print_s, travel_s in zip(estimate["layer_numbers"].tolist(), estimate["layer_z"].tolist(),
+                                                estimate["layer_print_seconds"].tolist(),
+                                                estimate["layer_travel_seconds"].tolist()):
+            print(f"| {number:<7} | {z:<8.3f} | {print_s:<10.1f} | {travel_s:<10.1f} | {print_s + travel_s:<10.1f} |")
+        print("-----------------------------------------------------------")
+    total = estimate["total_seconds"]
+    print(f"预计总时间: {format_duration(total)} ({total:.1f} s), {estimate['moves']} 段移动")
+    print(f"  打印: {format_duration(estimate['print_seconds'])} ({estimate['print_length']:.1f} mm), "
+          f"空行程: {format_duration(estimate['travel_seconds'])} ({estimate['travel_length']:.1f} mm)"
+          + (f", 暂停: {format_duration(estimate['dwell_seconds'])}" if estimate["dwell_seconds"] else ""))
+    print(f"  不计加减速 (长度/进给速度) 为 {format_duration(estimate['naive_seconds'])}")
+    if estimate["skipped_moves"]:
+        print(f"警告: {estimate['skipped_moves']} 段移动没有进给速度 (F), 未计入。")
+    if estimate["relative_lines"]:
+        print("警告: 文件中有相对坐标 (G91) 指令, 估算按绝对坐标计算, 结果不可靠。")
+
+
+def load_any_toolpath(input_filepath):
+    """
+    A .diwtp file is memory-mapped, NC text (possibly compressed, "-" for stdin) is read into a Toolpath.
+    """
+    if gcode_io.is_toolpath_file(input_filepath):
+        return toolpath.load_toolpath(input_filepath)
+    with gcode_io.open_input(input_filepath) as f:
+        return toolpath.toolpath_from_nc_lines(f)
+
+
+def estimate_file(input_filepath, acceleration=DEFAULT_ACCELERATION, junction_deviation=DEFAULT_JUNCTION_DEVIATION,
+                  rapid_rate=None, per_layer=True):
+    try:
+        tp = load_any_toolpath(input_filepath)
+        estimate = estimate_toolpath(tp, acceleration=acceleration, junction_deviation=junction_deviation,
+                                     rapid_rate=rapid_rate)
+    except FileNotFoundError:
+        print(f"错误: 文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"错误: 处理文件 '{input_filepath}' 失败: {e}")
+        return None
+    print_estimate_report(estimate, per_layer=per_layer)
+    return estimate
+
+
+def main():
+    input_file_path = input("请输入NC文件的完整路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    try:
+        acceleration_str = input(f"请输入加速度 (mm/s², 默认 {DEFAULT_ACCELERATION:g}): ").strip()
+        deviation_str = input(f"请输入转角偏差 (mm, 默认 {DEFAULT_JUNCTION_DEVIATION:g}): ").strip()
+        acceleration = float(acceleration_str) if acceleration_str else DEFAULT_ACCELERATION
+        junction_deviation = float(deviation_str) if deviation_str else DEFAULT_JUNCTION_DEVIATION
+    except ValueError:
+        print("错误：请输入一个有效的数字。")
+        return
+    if acceleration <= 0 or junction_deviation < 0:
+        print("错误：加速度必须是正数，转角偏差不能为负。")
+        return
+    estimate_file(input_file_path, acceleration=acceleration, junction_deviation=junction_deviation)
+
+
+if __name__ == "__main__":
+    run_main(main)
@@ -0,0 +1,556 @@
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+import os
+import queue
+import re
+import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for .zst files
+    zstandard = None
+
+STDIO_PATH = "-"
+TEMP_SUFFIX = ".tmp" # open_output writes a file under this suffix and renames it when it is complete
+
+# Large raw buffers keep the number of read/write syscalls low on slow network mounts.
+IO_BUFFER_SIZE = 1 << 20
+# write_lines() joins about this many characters per write call
+WRITE_CHUNK_CHARS = 1 << 16
+# open_input / open_output read ahead and write behind in background threads (see ReadAheadReader and
+# WriteBehindWriter), so the transforms overlap with disk, network mount and (de)compression latency.
+THREADED_IO = True
+# chunks of IO_BUFFER_SIZE bytes queued between a background thread and the transform
+THREAD_QUEUE_CHUNKS = 8
+
+COMPRESSION_SUFFIXES = {
+    ".gz": "gzip",
+    ".gzip": "gzip",
+    ".xz": "xz",
+    ".lzma": "xz",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+    ".bz2": "bz2",
+}
+CODEC_NAMES = {"gz": "gzip", "gzip": "gzip", "xz": "xz", "zst": "zstd", "zstd": "zstd", "bz2": "bz2"}
+CODEC_SUFFIXES = {"gzip": ".gz", "xz": ".xz", "zstd": ".zst", "bz2": ".bz2"}
+DEFAULT_LEVELS = {"gzip": 6, "xz": 6, "zstd": 3, "bz2": 9}
+
+# Binary toolpath files (see toolpath.py) are recognised here so that every tool can read and write them.
+TOOLPATH_EXTENSION = ".diwtp"
+TOOLPATH_MAGIC = b"DIWTP\x00\x01\x00"
+
+_MAGIC_NUMBERS = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+    (b"BZh", "bz2"),
+)
+_MAGIC_LENGTH = max(len(TOOLPATH_MAGIC), *(len(magic) for magic, _ in _MAGIC_NUMBERS))
+
+# G-code tokens, shared by the line-based tools. A number is "1", "-1.5", "+1", "1." or ".5".
+NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)"
+# one word: a letter and its number ("X-1.5", "x 2"); findall on a code part gives (letter, number) pairs
+WORD_PATTERN = re.compile(rf"([A-Za-z])\s*({NUMBER})")
+# fast path for the "G1 X.. Y.. Z.. F.." word order written by the tools; the groups are the motion digit,
+# the X/Y/Z/F numbers and the comment with its ";" (None where absent)
+CANONICAL_MOVE_PATTERN = re.compile(
+    rf"\s*G0?([01])(?: +X({NUMBER}))?(?: +Y({NUMBER}))?(?: +Z({NUMBER}))?(?: +F({NUMBER}))? *(;.*)?$")
+# G0-G3 at the start of a code part; group 1 is the digit
+MOTION_PATTERN = re.compile(r"^\s*G0?([0-3])(?!\d)", re.IGNORECASE)
+# "; ..." and "( ... )" comments
+COMMENT_PATTERN = re.compile(r"\([^)]*\)|;.*")
+# the "; (--- Layer N @ Z=z ---)" markers written by the converters; group 1 is N
+LAYER_COMMENT_PATTERN = re.compile(r"; \(--- Layer (\d+)")
+
+
+def is_stdio(path):
+    return path is None or path == STDIO_PATH
+
+
+def split_compression_suffix(path):
+    """
+    Splits "part.nc.gz" into ("part.nc", ".gz"). Uncompressed paths get an empty suffix.
+    """
+    root, ext = os.path.splitext(path)
+    if ext.lower() in COMPRESSION_SUFFIXES:
+        return root, ext
+    return path, ""
+
+
+def default_output_path(path, suffix):
+    """
+    part.nc.gz -> part<suffix>.nc.gz next to it (the extension and compression suffix are kept).
+    """
+    directory, filename = os.path.split(path)
+    filename, compression_ext = split_compression_suffix(filename)
+    name_part, ext_part = os.path.splitext(filename)
+    return os.path.join(directory, f"{name_part}{suffix}{ext_part}{compression_ext}")
+
+
+def strip_newlines(lines):
+    """
+    Generator over any iterable of lines; yields them without their line ending (LF or CRLF).
+    """
+    for line in lines:
+        if line.endswith("\n"):
+            line = line[:-1]
+        if line.endswith("\r"):
+            line = line[:-1]
+        yield line
+
+
+def parse_move(line):
+    """
+    Returns {"cmd": "G0"/"G1", "X": token, "Y": ..., "Z": ..., "F": ...} (tokens are the number strings,
+    missing words are None) for a plain G0/G1 line, or None for anything else.
+    """
+    match = CANONICAL_MOVE_PATTERN.match(line)
+    if match:
+        cmd, x, y, z, f, comment = match.groups()
+        return {"cmd": "G" + cmd, "X": x, "Y": y, "Z": z, "F": f, "comment": comment or ""}
+    code = line.split(";", 1)[0]
+    words = code.split()
+    if not words or words[0].upper() not in ("G0", "G00", "G1", "G01"):
+        return None
+    move = {"cmd": "G0" if words[0].upper() in ("G0", "G00") else "G1", "X": None, "Y": None, "Z": None, "F": None}
+    for word in words[1:]:
+        axis = word[:1].upper()
+        if axis not in ("X", "Y", "Z", "F") or move[axis] is not None:
+            return None
+        try:
+            float(word[1:])
+        except ValueError:
+            return None
+        move[axis] = word[1:]
+    move["comment"] = line[len(code):] if ";" in line else ""
+    return move
+
+
+def is_comment_line(line):
+    stripped = line.strip()
+    return not stripped or stripped.startswith(";") or stripped.startswith("(")
+
+
+def track_modal_state(line, position, feed, absolute):
+    """
+    Returns the (position, feed, absolute) state after any line: position is (x, y) or None when unknown
+    (relative mode, G92 with a single axis), feed is the last F token.
+    """
+    code = line.split(";", 1)[0].upper()
+    for g in re.findall(r"G0*(\d+)", code):
+        if g == "91":
+            absolute = False
+        elif g == "90":
+            absolute = True
+        elif g == "92":
+            position = None
+    words = dict(WORD_PATTERN.findall(code))
+    if "X" in words or "Y" in words:
+        if position is not None or ("X" in words and "Y" in words):
+            x = float(words["X"]) if "X" in words else position[0]
+            y = float(words["Y"]) if "Y" in words else position[1]
+            position = (x, y)
+    if "F" in words:
+        feed = words["F"]
+    if not absolute:
+        position = None
+    return position, feed, absolute
+
+
+def compression_from_path(path):
+    """
+    Returns the codec name implied by the file extension, or None.
+    """
+    if is_stdio(path):
+        return None
+    return COMPRESSION_SUFFIXES.get(split_compression_suffix(path)[1].lower())
+
+
+def is_toolpath_path(path):
+    """
+    True if path names a binary toolpath file (by extension).
+    """
+    return not is_stdio(path) and path.lower().endswith(TOOLPATH_EXTENSION)
+
+
+def is_toolpath_file(path):
+    """
+    True if path is an existing binary toolpath file (by its magic bytes).
+    """
+    if is_stdio(path) or not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(TOOLPATH_MAGIC)) == TOOLPATH_MAGIC
+
+
+def detect_compression(head):
+    """
+    Returns the codec name for the leading bytes of a stream, or None for plain text.
+    """
+    for magic, codec in _MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def normalize_compression(compression):
+    """
+    Maps user-facing names (gz, xz, zst, bz2, ...) to a codec name; None/"none" means no compression.
+    """
+    if compression is None or compression == "none":
+        return None
+    codec = CODEC_NAMES.get(compression.lower().lstrip("."))
+    if codec is None:
+        raise ValueError(f"不支持的压缩格式: {compression} (可选: gz, xz, zst, bz2)")
+    return codec
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise OSError("读写 .zst 文件需要 zstandard 模块 (pip install zstandard)")
+
+
+def _decompressing_reader(raw, codec):
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    if codec == "xz":
+        return lzma.LZMAFile(raw, mode="rb")
+    if codec == "bz2":
+        return bz2.BZ2File(raw, mode="rb")
+    _require_zstandard()
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        raw, read_size=IO_BUFFER_SIZE, read_across_frames=True, closefd=False)
+    return io.BufferedReader(reader, buffer_size=IO_BUFFER_SIZE)
+
+
+def _compressing_writer(raw, codec, level=None):
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=level, mtime=0)
+    if codec == "xz":
+        return lzma.LZMAFile(raw, mode="wb", preset=level)
+    if codec == "bz2":
+        return bz2.BZ2File(raw, mode="wb", compresslevel=level)
+    _require_zstandard()
+    # threads=-1 compresses on every available core; the output is still a single standard frame.
+    compressor = zstandard.ZstdCompressor(level=level, threads=-1)
+    return compressor.stream_writer(raw, closefd=False)
+
+
+class ReadAheadReader(io.RawIOBase):
+    """
+    Raw binary reader that reads source in a background thread, chunk_size bytes at a time, into a
+    queue of at most max_chunks chunks (the thread waits while the queue is full). An error raised in
+    the thread is raised again by the read that reaches it. Seeking restarts the thread.
+    """
+
+    def __init__(self, source, chunk_size=IO_BUFFER_SIZE, max_chunks=THREAD_QUEUE_CHUNKS):
+        super().__init__()
+        self._source = source
+        self._chunk_size = chunk_size
+        self._max_chunks = max_chunks
+        self._position = 0
+        self._start()
+
+    def _start(self):
+        self._queue = queue.Queue(self._max_chunks)
+        self._stop = threading.Event()
+        self._current = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._run, name="gcode-read-ahead", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                data = self._source.read(self._chunk_size)
+                self._put(data)
+                if not data:
+                    return
+        except BaseException as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _halt(self):
+        self._stop.set()
+        # the thread may still be blocked on a read from a pipe or terminal; it is a daemon and its
+        # result is discarded
+        self._thread.join(timeout=1.0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._current:
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._current = memoryview(item)
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        self._position += size
+        return size
+
+    def seekable(self):
+        return self._source.seekable()
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("只支持从文件开头定位")
+        self._halt()
+        self._position = self._source.seek(offset)
+        self._start()
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._halt()
+        super().close()
+
+
+class WriteBehindWriter(io.RawIOBase):
+    """
+    Raw binary writer that hands every write to a background thread writing to target, through a queue
+    of at most max_chunks chunks: a writer that is faster than target waits for room (backpressure).
+    An error raised in the thread is raised again by the next write or by close(), which waits until
+    everything queued is written (target itself is left open).
+    """
+
+    def __init__(self, target, max_chunks=THREAD_QUEUE_CHUNKS):
+        super().__init__()
+        self._target = target
+        self._queue = queue.Queue(max_chunks)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="gcode-write-behind", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            if self._error is None:
+                try:
+                    self._target.write(data)
+                except BaseException as e:
+                    # keep draining the queue so that the writing side never blocks on a dead thread
+                    self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._raise_error()
+        data = bytes(data)
+        self._queue.put(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        super().close()
+        self._raise_error()
+
+
+@contextlib.contextmanager
+def open_input(path, encoding="utf-8", threaded=None):
+    """
+    Opens a G-code file for reading. "-" (or None) reads from stdin.
+
+    gzip, xz, bz2 and zstd input is recognised by its magic bytes (or, failing that, by the
+    file extension) and decompressed on the fly. A binary toolpath yields its NC lines.
+    Unless threaded is False (default: THREADED_IO), reading and decompression run ahead in a
+    background thread.
+    """
+    with contextlib.ExitStack() as stack:
+        if is_stdio(path):
+            if not hasattr(sys.stdin, "buffer"):
+                yield sys.stdin
+                return
+            raw = sys.stdin.buffer
+            if not hasattr(raw, "peek"):
+                raw = io.BufferedReader(raw, buffer_size=IO_BUFFER_SIZE)
+        else:
+            raw = stack.enter_context(open(path, "rb", buffering=IO_BUFFER_SIZE))
+        head = raw.peek(_MAGIC_LENGTH)[:_MAGIC_LENGTH]
+        if head.startswith(TOOLPATH_MAGIC):
+            import toolpath
+            if is_stdio(path):
+                loaded = toolpath.toolpath_from_bytes(raw.read())
+            else:
+                loaded = toolpath.load_toolpath(path)
+            yield loaded.iter_nc_lines()
+            return
+        codec = detect_compression(head) or compression_from_path(path)
+        binary = raw
+        if codec is not None:
+            binary = stack.enter_context(_decompressing_reader(raw, codec))
+        threaded = THREADED_IO if threaded is None else threaded
+        if threaded:
+            reader = stack.enter_context(ReadAheadReader(binary))
+            binary = io.BufferedReader(reader, buffer_size=IO_BUFFER_SIZE)
+        stream = io.TextIOWrapper(binary, encoding=encoding)
+        try:
+            yield stream
+        finally:
+            # Detach so that closing the wrapper never closes stdin; the ExitStack closes the rest.
+            buffer = stream.detach()
+            if threaded:
+                buffer.detach()
+
+
+def open_binary_input(path):
+    """
+    Opens a G-code file for binary reading, decompressed on the fly, without a read-ahead thread (for
+    readers that jump around in the file). Returns (file object, codec name or None); closing the file
+    object closes the file. Compressed data can only be read forwards, so a caller that needs an earlier
+    offset opens the file again.
+    """
+    raw = open(path, "rb", buffering=IO_BUFFER_SIZE)
+    codec = detect_compression(raw.peek(_MAGIC_LENGTH)[:_MAGIC_LENGTH]) or compression_from_path(path)
+    if codec is None:
+        return raw, None
+    if codec == "zstd":
+        try:
+            _require_zstandard()
+        except OSError:
+            raw.close()
+            raise
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, read_size=IO_BUFFER_SIZE, read_across_frames=True)
+        return io.BufferedReader(reader, buffer_size=IO_BUFFER_SIZE), codec
+    raw.close()
+    opener = {"gzip": gzip.open, "xz": lzma.open, "bz2": bz2.open}[codec]
+    return opener(path, "rb"), codec
+
+
+def write_lines(outfile, lines, chunk_chars=WRITE_CHUNK_CHARS):
+    """
+    Writes every line of the iterable followed by a newline, handing outfile one joined chunk of about
+    chunk_chars characters at a time instead of making one call per line.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line) + 1
+        if size >= chunk_chars:
+            chunk.append("")
+            outfile.write("\n".join(chunk))
+            chunk = []
+            size = 0
+    if chunk:
+        chunk.append("")
+        outfile.write("\n".join(chunk))
+
+
+@contextlib.contextmanager
+def open_output(path, encoding="utf-8", compression=None, level=None, compact=False, precision=None,
+                threaded=None):
+    """
+    Opens a G-code file for writing. "-" (or None) writes to stdout, which is flushed but not closed.
+
+    The codec comes from `compression` (gz, xz, zst, bz2) or else from the file extension;
+    stdout is only compressed when asked for explicitly. A .diwtp path packs the written NC text
+    into a binary toolpath, which is saved when the block exits without an error.
+    With compact (or a precision dict such as {"Z": 2, "F": 0}) the text goes through a
+    compact.CompactWriter, which leaves out the words that repeat the modal state.
+    Unless threaded is False (default: THREADED_IO), compression and writing run behind in a
+    background thread.
+    """
+    with _open_output(path, encoding, compression, level, THREADED_IO if threaded is None else threaded) as stream:
+        if not compact and not precision:
+            yield stream
+            return
+        from compact import CompactWriter
+        writer = CompactWriter(stream, precision=precision)
+        yield writer
+        writer.close()
+
+
+@contextlib.contextmanager
+def _open_output(path, encoding, compression, level, threaded):
+    if is_toolpath_path(path):
+        import toolpath
+        writer = toolpath.ToolpathWriter(path)
+        yield writer
+        writer.close()
+        return
+    codec = normalize_compression(compression) or compression_from_path(path)
+    temp_path = None
+    try:
+        with contextlib.ExitStack() as stack:
+            if is_stdio(path):
+                sys.stdout.flush()
+                if not hasattr(sys.stdout, "buffer"):
+                    if codec is not None:
+                        raise OSError("当前标准输出不支持二进制写入, 无法输出压缩数据")
+                    try:
+                        yield sys.stdout
+                    finally:
+                        sys.stdout.flush()
+                    return
+                raw = sys.stdout.buffer
+                newline = "\n"
+            else:
+                # A file is written under a temporary name and renamed into place once complete, so a run
+                # that fails partway leaves no half-written file under the output name. Devices and pipes
+                # (/dev/null, ...) are written directly.
+                if not os.path.exists(path) or os.path.isfile(path):
+                    temp_path = path + TEMP_SUFFIX
+                raw = stack.enter_context(open(temp_path or path, "wb", buffering=IO_BUFFER_SIZE))
+                newline = None
+            binary = raw
+            if codec is not None:
+                binary = stack.enter_context(_compressing_writer(raw, codec, level))
+            if threaded:
+                writer = stack.enter_context(WriteBehindWriter(binary))
+                binary = io.BufferedWriter(writer, buffer_size=IO_BUFFER_SIZE)
+            stream = io.TextIOWrapper(binary, encoding=encoding, newline=newline)
+            try:
+                yield stream
+            finally:
+                stream.flush()
+                buffer = stream.detach()
+                if threaded:
+                    buffer.detach()
+    except BaseException:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if temp_path is not None:
+        os.replace(temp_path, path)
+    elif is_stdio(path):
+        # The compressor has written its trailer by now; push it out of stdout's buffer.
+        sys.stdout.buffer.flush()
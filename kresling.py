@@ -1,7 +1,25 @@
+import contextlib
 import math
+import os
+
+import numpy as np
+
+import gcode_io
+import meshcheck
+import slicer
+from profiling import run_main
+from slicer import DEFAULT_G0_FEEDRATE, DEFAULT_PRINT_FEEDRATE
+
+DEFAULT_LAYER_HEIGHT = 0.5 # mm
+
 
 def generate_thick_kresling(n=6, radius=0.5, thickness=0.5, height=20, 
-                           twist_angle=15, filename="thick_kresling.stl"):
+                           twist_angle=15, filename="thick_kresling.stl", allow_invalid_mesh=False):
+    """
+    Writes the STL of the tube to filename (a path or an open text stream) and returns filename. A mesh
+    that is not a closed manifold with outward normals is not written (None is returned) unless
+    allow_invalid_mesh is set.
+    """
     twist = math.radians(twist_angle)
     outer_r = radius + thickness/2
     inner_r = radius - thickness/2
@@ -63,15 +81,19 @@ def generate_thick_kresling(n=6, radius=0.5, thickness=0.5, height=20,
         # 顶部连接
         triangles.append((top_outer[i], top_inner[next_i], top_inner[i]))
         triangles.append((top_outer[i], top_outer[next_i], top_inner[next_i]))
-        
-        # 侧边立柱
-        triangles.append((bottom_outer[i], bottom_inner[i], top_inner[i]))
-        triangles.append((bottom_outer[i], top_inner[i], top_outer[i]))
-        triangles.append((bottom_inner[i], bottom_inner[next_i], top_inner[next_i]))
-        triangles.append((bottom_inner[i], top_inner[next_i], top_inner[i]))
+    # (侧边立柱 faces from the creases to the inner wall are not generated: they were internal walls
+    # inside the tube, and the inner ones duplicated the inner wall with flipped winding)
+
+    # 写入前检查网格: 封闭流形, 法线朝外
+    mesh_report = meshcheck.validate_triangles(np.array(triangles))
+    meshcheck.print_mesh_report(mesh_report)
+    if not mesh_report["closed_manifold"] and not allow_invalid_mesh:
+        print("错误: 网格检查未通过, 未写入 STL 文件 (确需写入请使用 --allow-invalid-mesh 或 allow_invalid_mesh=True)。")
+        return None
     
-    # 写入STL文件
-    with open(filename, 'w') as f:
+    # 写入STL文件 (filename 也可以是已打开的文本流)
+    stl_output = contextlib.nullcontext(filename) if hasattr(filename, "write") else open(filename, 'w')
+    with stl_output as f:
         f.write("solid ThickKresling\n")
         for tri in triangles:
             v0, v1, v2 = tri
@@ -94,11 +116,134 @@ def generate_thick_kresling(n=6, radius=0.5, thickness=0.5, height=20,
             f.write("  endloop\n")
             f.write("endfacet\n")
         f.write("endsolid ThickKresling\n")
+    return filename
+
+def kresling_cross_sections(n, radius, height, twist_angle, z):
+    """
+    Cross-sections at the heights z (array) of the twisted n-gon wall of the given radius, i.e. the outer
+    or inner surface of generate_thick_kresling: (len(z), 2n, 2) counter-clockwise polygons. The panels are
+    split along bottom[i]-top[i+1] as in the STL, so vertex 2i lies on the crease bottom[i]-top[i] and
+    vertex 2i+1 on that diagonal; since the triangles are flat the section is exact.
+    """
+    t = np.clip(np.asarray(z, dtype=float) / height, 0.0, 1.0)[:, None, None]
+    angles = np.arange(n) * (2 * math.pi / n)
+    twist = math.radians(twist_angle)
+    bottom = radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    top = radius * np.stack([np.cos(angles + twist), np.sin(angles + twist)], axis=1)
+    crease = bottom + t * (top - bottom)
+    diagonal = bottom + t * (np.roll(top, -1, axis=0) - bottom)
+    return np.stack([crease, diagonal], axis=2).reshape(len(crease), 2 * n, 2)
+
+
+def offset_polygons(polygons, distance):
+    """
+    Shifts every edge of the counter-clockwise polygons ((layers, k, 2)) by distance to its left, i.e.
+    inwards (negative: outwards), and returns the polygons through the intersections of the shifted edges.
+    """
+    edges = np.roll(polygons, -1, axis=1) - polygons
+    normals = np.stack([-edges[..., 1], edges[..., 0]], axis=-1)
+    normals /= np.linalg.norm(normals, axis=-1, keepdims=True)
+    previous = np.roll(normals, 1, axis=1)
+    miter = (previous + normals) / (1.0 + (previous * normals).sum(axis=-1))[..., None]
+    return polygons + distance * miter
+
+
+def kresling_wall_paths(n, radius, thickness, height, twist_angle, z, line_width=None):
+    """
+    The closed perimeter paths of the wall at the heights z, each (len(z), 2n, 2). Without line_width these
+    are the outer and inner surfaces themselves; with it the two paths are moved into the wall by half a
+    line width, and a wall narrower than two lines gets a single path on its middle surface.
+    """
+    outer_r = radius + thickness / 2
+    inner_r = radius - thickness / 2
+    if line_width is not None and thickness < 2 * line_width:
+        return [kresling_cross_sections(n, radius, height, twist_angle, z)]
+    outer = kresling_cross_sections(n, outer_r, height, twist_angle, z)
+    inner = kresling_cross_sections(n, inner_r, height, twist_angle, z)
+    if line_width is not None:
+        outer = offset_polygons(outer, line_width / 2)
+        inner = offset_polygons(inner, -line_width / 2)
+    return [outer, inner]
+
+
+def kresling_toolpath_lines(n=6, radius=0.5, thickness=0.5, height=20, twist_angle=15,
+                            layer_height=DEFAULT_LAYER_HEIGHT, print_feedrate=DEFAULT_PRINT_FEEDRATE,
+                            g0_feedrate=DEFAULT_G0_FEEDRATE, line_width=None, stats=None):
+    """
+    Generator over the NC program of the thick Kresling tube of generate_thick_kresling, without the STL
+    and slicer: layer N is printed at Z = layer_height * N along the wall paths (kresling_wall_paths)
+    of the section through the middle of the layer, all layers computed at once, and written by
+    slicer.contour_toolpath_lines. stats (dict) receives {"layers": n, "paths": n, "print_length": mm}.
+    """
+    layer_count = int(height / layer_height + 1e-9)
+    layer_z = layer_height * np.arange(1, layer_count + 1)
+    paths = kresling_wall_paths(n, radius, thickness, height, twist_angle, layer_z - layer_height / 2,
+                                line_width=line_width)
+    layers = ((k + 1, z, [(path[k], True) for path in paths]) for k, z in enumerate(layer_z.tolist()))
+    header = (f"Generated from Kresling geometry: n={n}, radius={radius:.3f}mm, thickness={thickness:.3f}mm, "
+              f"height={height:.3f}mm, twist={twist_angle:.3f}deg")
+    return slicer.contour_toolpath_lines(layers, header, layer_height, print_feedrate, g0_feedrate, stats=stats)
+
+
+def print_toolpath_report(stats):
+    print(f"Kresling 刀路: {stats['layers']} 层, {stats['paths']} 条闭合路径, "
+          f"打印长度 {stats['print_length']:.1f} mm")
+
+
+def kresling_toolpath_stream(outfile, n=6, radius=0.5, thickness=0.5, height=20, twist_angle=15,
+                             layer_height=DEFAULT_LAYER_HEIGHT, print_feedrate=DEFAULT_PRINT_FEEDRATE,
+                             g0_feedrate=DEFAULT_G0_FEEDRATE, line_width=None):
+    """
+    Writes kresling_toolpath_lines to outfile; prints the report.
+    """
+    stats = {}
+    gcode_io.write_lines(outfile, kresling_toolpath_lines(
+        n, radius, thickness, height, twist_angle, layer_height=layer_height, print_feedrate=print_feedrate,
+        g0_feedrate=g0_feedrate, line_width=line_width, stats=stats))
+    print_toolpath_report(stats)
+    return True
+
+
+def generate_kresling_toolpath(n=6, radius=0.5, thickness=0.5, height=20, twist_angle=15,
+                               layer_height=DEFAULT_LAYER_HEIGHT, print_feedrate=DEFAULT_PRINT_FEEDRATE,
+                               g0_feedrate=DEFAULT_G0_FEEDRATE, line_width=None,
+                               output_filepath="thick_kresling.nc", compact=False, precision=None):
+    """
+    File-level wrapper of kresling_toolpath_stream; the output may be compressed (by extension) or a
+    .diwtp toolpath.
+    """
+    try:
+        directory = os.path.dirname(output_filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with gcode_io.open_output(output_filepath, compact=compact, precision=precision) as outfile:
+            kresling_toolpath_stream(outfile, n, radius, thickness, height, twist_angle,
+                                     layer_height=layer_height, print_feedrate=print_feedrate,
+                                     g0_feedrate=g0_feedrate, line_width=line_width)
+    except Exception as e:
+        print(f"错误: 生成刀路文件 '{output_filepath}' 失败: {e}")
+        return None
+    print(f"生成完成！刀路文件已保存到: {output_filepath}")
+    return output_filepath
+
+
+def main():
+    # 生成模型
+    generate_thick_kresling(n=8,
+                           radius=7.5,
+                           thickness=0.5,
+                           height=20,
+                           twist_angle=15,
+                           filename="thick_kresling.stl")
+    # 同一模型直接生成 NC 刀路, 无需切片软件
+    generate_kresling_toolpath(n=8,
+                               radius=7.5,
+                               thickness=0.5,
+                               height=20,
+                               twist_angle=15,
+                               layer_height=DEFAULT_LAYER_HEIGHT,
+                               output_filepath="thick_kresling.nc")
+
 
-# 生成模型
-generate_thick_kresling(n=8,
-                       radius=7.5,
-                       thickness=0.5,
-                       height=20,
-                       twist_angle=15,
-                       filename="thick_kresling.stl")
\ No newline at end of file
+if __name__ == "__main__":
+    run_main(main)
@@ -1,6 +1,10 @@
+import itertools
 import re
 import os
 
+import gcode_io
+from profiling import run_main
+
 def find_and_parse_original_layer_height(lines):
     """
     Tries to find the original layer height from comments or infer from G-code.
@@ -51,7 +55,7 @@ def find_and_parse_original_layer_height(lines):
                         layer_num = int(layer_match_with_z.group(1))
                         current_layer_num_from_comment = layer_num
                         break 
-                    layer_match_simple = re.search(r"; \(--- Layer (\d+)", context_line)
+                    layer_match_simple = gcode_io.LAYER_COMMENT_PATTERN.search(context_line)
                     if layer_match_simple and current_layer_num_from_comment == 0:
                          current_layer_num_from_comment = int(layer_match_simple.group(1))
 
@@ -72,99 +76,249 @@ def find_and_parse_original_layer_height(lines):
     return None
 
 
-def modify_z_values_in_file(input_filepath, new_layer_height_mm):
-    try:
-        with open(input_filepath, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        print(f"错误：文件 '{input_filepath}' 未找到。")
-        return
-    except Exception as e:
-        print(f"读取文件时发生错误: {e}")
-        return
+def last_z_part_index(line_content):
+    """
+    Returns the index (in line_content.split()) of the last parseable Z word of a G-code line, or -1.
+    Blank lines and comment lines never count.
+    """
+    stripped_line_scan = line_content.strip()
+    if not stripped_line_scan or stripped_line_scan.startswith(";") or stripped_line_scan.startswith("("):
+        return -1
+
+    parts_scan = stripped_line_scan.split()
+    for j in range(len(parts_scan) - 1, -1, -1):
+        if parts_scan[j].startswith("Z"):
+            try:
+                float(parts_scan[j][1:]) 
+                return j
+            except ValueError:
+                continue 
+    return -1
+
+
+def read_original_layer_height(lines_iter):
+    """
+    Reads just enough of lines_iter to determine the original layer height.
+    Returns (height or None, the lines that were read); the caller must output those lines first.
+
+    The header comment written by transGcode is normally found within the first few lines. Otherwise
+    reading stops at the start of Layer 2, and only if Layer 1 does not allow an inference either is
+    the rest of the file read.
+    """
+    prefix = []
+    stopped_early = False
+    for line in lines_iter:
+        prefix.append(line)
+        if "(User-defined layer height for Z calculation:" in line or line.startswith("; (--- Layer 2"):
+            stopped_early = True
+            break
+    height = find_and_parse_original_layer_height(prefix)
+    if height is None and stopped_early:
+        prefix.extend(lines_iter)
+        height = find_and_parse_original_layer_height(prefix)
+    return height, prefix
+
+
+def rescale_z_words(line_content, new_layer_height_mm, original_layer_height_mm, keep_part_idx=-1, line_number=0):
+    """
+    Rescales all Z words of one G-code line. The Z word at keep_part_idx is left unchanged.
+    """
+    stripped_line = line_content.strip()
+    if not stripped_line or stripped_line.startswith(";") or stripped_line.startswith("("):
+        return line_content
+
+    parts = stripped_line.split()
+    modified_parts = []
+    line_changed_this_iteration = False 
+    for current_part_idx, part_val in enumerate(parts):
+        if part_val.startswith("Z"):
+            if current_part_idx == keep_part_idx:
+                print(f"调试信息: 跳过修改识别出的最后一个Z指令: {part_val} 在行 {line_number}")
+                modified_parts.append(part_val)
+            else:
+                try:
+                    original_z_numeric = float(part_val[1:])
+                    a = 0
+                    if original_z_numeric != 0 : 
+                        a = original_z_numeric / original_layer_height_mm
+                    
+                    new_z_numeric = new_layer_height_mm * a
+                    modified_parts.append(f"Z{new_z_numeric:.3f}")
+                    line_changed_this_iteration = True
+                except ValueError: 
+                    modified_parts.append(part_val) 
+        else:
+            modified_parts.append(part_val)
+    
+    if line_changed_this_iteration:
+        return " ".join(modified_parts) + "\n"
+    return line_content
+
+
+class ZRescaler:
+    """
+    The rescaling of iter_rescaled_lines fed one line at a time. The very last Z word of the file (the
+    final safe Z lift) is kept, so the lines from the most recent Z-bearing line onwards are held back
+    until the next one arrives. Its state (those lines) can be saved between lines and given back as
+    state to continue a checkpointed run (see checkpoint.py).
+    """
+
+    def __init__(self, new_layer_height_mm, original_layer_height_mm, state=None):
+        state = state or {}
+        self.new_layer_height_mm = new_layer_height_mm
+        self.original_layer_height_mm = original_layer_height_mm
+        self.pending = list(state.get("pending", ())) # most recent line with a Z word, followed by the lines read after it
+        self.pending_line_number = state.get("pending_line_number", 0)
+        self.line_number = state.get("line_number", 0)
+        self._in_new_layer = False
+        self._layer_started = False
+
+    def state(self):
+        return {"original_layer_height": self.original_layer_height_mm, "pending": self.pending,
+                "pending_line_number": self.pending_line_number, "line_number": self.line_number}
+
+    def start(self):
+        return ()
+
+    def feed(self, line_content):
+        """
+        Returns the output lines that are complete once line_content has been read.
+        """
+        self.line_number += 1
+        self._layer_started = False
+        if last_z_part_index(line_content) != -1:
+            # the first Z line of a layer flushes the previous layer, so only this line is held back
+            self._layer_started = self._in_new_layer
+            self._in_new_layer = False
+            output = ()
+            if self.pending:
+                output = [rescale_z_words(self.pending[0], self.new_layer_height_mm, self.original_layer_height_mm)]
+                output.extend(self.pending[1:])
+            self.pending = [line_content]
+            self.pending_line_number = self.line_number
+            return output
+        if line_content.startswith("; (--- Layer"):
+            self._in_new_layer = True
+        if not self.pending:
+            return (line_content,)
+        self.pending.append(line_content)
+        return ()
+
+    def at_layer_boundary(self, line_content):
+        return self._layer_started
+
+    def finish(self):
+        if not self.pending:
+            print("调试信息: 文件中未找到有效的Z指令可作为'最后一个Z'。")
+            return ()
+        output = [rescale_last_z_line(self.pending[0], self.pending_line_number, self.new_layer_height_mm,
+                                      self.original_layer_height_mm)]
+        output.extend(self.pending[1:])
+        return output
+
+
+def iter_rescaled_lines(lines, new_layer_height_mm, original_layer_height_mm):
+    """
+    Generator over the rescaled lines (see ZRescaler).
+    """
+    rescaler = ZRescaler(new_layer_height_mm, original_layer_height_mm)
+    for line_content in lines:
+        yield from rescaler.feed(line_content)
+    yield from rescaler.finish()
+
+
+def rescale_last_z_line(line_content, line_number, new_layer_height_mm, original_layer_height_mm):
+    """
+    Rescales the line holding the very last Z word of the file, keeping that Z word.
+    """
+    last_z_part_idx_in_line = last_z_part_index(line_content)
+    print(f"调试信息: 最后一个Z指令位于原始文件行 {line_number}, 内容: '{line_content.strip()}', Z部分: '{line_content.strip().split()[last_z_part_idx_in_line]}'")
+    return rescale_z_words(line_content, new_layer_height_mm, original_layer_height_mm,
+                           keep_part_idx=last_z_part_idx_in_line, line_number=line_number)
+
+
+def resolve_original_layer_height(lines, original_layer_height_mm=None, fallback_original_layer_height_mm=None,
+                                  interactive=True):
+    """
+    Returns (original layer height or None, the lines read from the iterator lines while looking for it).
 
-    original_layer_height_mm = find_and_parse_original_layer_height(lines)
+    If the original layer height is neither given nor found in the file, fallback_original_layer_height_mm
+    is used; without it the user is asked interactively, unless interactive is False.
+    """
+    lines_read = []
+    if original_layer_height_mm is None:
+        original_layer_height_mm, lines_read = read_original_layer_height(lines)
     if original_layer_height_mm is None or original_layer_height_mm <= 0:
         print("错误：无法确定有效的原始层高或原始层高为零/负数，无法继续处理。")
         print("请确保文件中有类似 '; (User-defined layer height for Z calculation: 0.500mm)' 的注释，")
         print("或 Layer 1 有明确的 G1 Z 指令，或者文件中的 G-code Z 值允许合理推断。")
-        use_default = input("是否使用默认原始层高 0.5mm? (y/n): ").lower()
-        if use_default == 'y':
-            original_layer_height_mm = 0.5
-            print("已使用默认原始层高 0.5mm")
+        if fallback_original_layer_height_mm is not None and fallback_original_layer_height_mm > 0:
+            original_layer_height_mm = fallback_original_layer_height_mm
+            print(f"已使用默认原始层高 {original_layer_height_mm}mm")
+        elif interactive:
+            use_default = input("是否使用默认原始层高 0.5mm? (y/n): ").lower()
+            if use_default == 'y':
+                original_layer_height_mm = 0.5
+                print("已使用默认原始层高 0.5mm")
+            else:
+                return None, lines_read
         else:
-            return
-    
-    last_z_line_global_idx = -1
-    last_z_part_idx_in_line = -1
-    
-    for i in range(len(lines) - 1, -1, -1):
-        line_content_scan = lines[i]
-        stripped_line_scan = line_content_scan.strip()
-        if not stripped_line_scan or stripped_line_scan.startswith(";") or stripped_line_scan.startswith("("):
-            continue
+            return None, lines_read
+    return original_layer_height_mm, lines_read
 
-        parts_scan = stripped_line_scan.split()
-        found_z_in_this_line_scan = False
-        for j in range(len(parts_scan) - 1, -1, -1):
-            if parts_scan[j].startswith("Z"):
-                try:
-                    float(parts_scan[j][1:]) 
-                    last_z_line_global_idx = i
-                    last_z_part_idx_in_line = j
-                    found_z_in_this_line_scan = True
-                    break 
-                except ValueError:
-                    continue 
-        if found_z_in_this_line_scan:
-            break 
 
-    if last_z_line_global_idx != -1:
-        print(f"调试信息: 最后一个Z指令位于原始文件行 {last_z_line_global_idx + 1}, 内容: '{lines[last_z_line_global_idx].strip()}', Z部分: '{lines[last_z_line_global_idx].strip().split()[last_z_part_idx_in_line]}'")
-    else:
+def modify_z_values_in_lines(lines, new_layer_height_mm, original_layer_height_mm=None,
+                             fallback_original_layer_height_mm=None, interactive=True):
+    """
+    Rescales every Z value in lines (any iterable of text lines) except the final Z lift from the original
+    to the new layer height. Returns a lazy iterator over the modified lines, or None if the original layer
+    height cannot be determined (see resolve_original_layer_height for the fallbacks).
+    """
+    lines = iter(lines)
+    original_layer_height_mm, lines_read = resolve_original_layer_height(
+        lines, original_layer_height_mm, fallback_original_layer_height_mm, interactive)
+    if original_layer_height_mm is None:
+        return None
+    return iter_rescaled_lines(itertools.chain(lines_read, lines), new_layer_height_mm, original_layer_height_mm)
+
+
+def modify_z_values_in_toolpath(tp, new_layer_height_mm, original_layer_height_mm=None,
+                                fallback_original_layer_height_mm=None, interactive=True):
+    """
+    modify_z_values_in_lines for a binary Toolpath (see toolpath.py): only the records with a Z word are
+    rewritten, all other records are copied column-wise. Returns a new Toolpath, or None.
+    """
+    original_layer_height_mm, _ = resolve_original_layer_height(
+        tp.iter_nc_lines(), original_layer_height_mm, fallback_original_layer_height_mm, interactive)
+    if original_layer_height_mm is None:
+        return None
+
+    z_records = tp.z_records(lambda line: last_z_part_index(line) != -1).tolist()
+    if not z_records:
         print("调试信息: 文件中未找到有效的Z指令可作为'最后一个Z'。")
+        return tp
+    replacements = {record: rescale_z_words(tp.line(record), new_layer_height_mm, original_layer_height_mm)
+                    for record in z_records[:-1]}
+    last_record = z_records[-1]
+    replacements[last_record] = rescale_last_z_line(tp.line(last_record), last_record + 1,
+                                                    new_layer_height_mm, original_layer_height_mm)
+    return tp.with_lines(replacements)
 
-    final_output_lines = []
-    for current_line_idx, line_content in enumerate(lines):
-        stripped_line = line_content.strip()
-        if not stripped_line or stripped_line.startswith(";") or stripped_line.startswith("("):
-            final_output_lines.append(line_content)
-            continue
 
-        parts = stripped_line.split()
-        modified_parts = []
-        line_changed_this_iteration = False 
-        for current_part_idx, part_val in enumerate(parts):
-            if part_val.startswith("Z"):
-                if current_line_idx == last_z_line_global_idx and current_part_idx == last_z_part_idx_in_line:
-                    print(f"调试信息: 跳过修改识别出的最后一个Z指令: {part_val} 在行 {current_line_idx + 1}")
-                    modified_parts.append(part_val)
-                else:
-                    try:
-                        original_z_numeric = float(part_val[1:])
-                        if original_layer_height_mm <= 0: 
-                            print(f"警告: 原始层高无效 ({original_layer_height_mm}), 无法计算Z的乘数 'a' 对于: {part_val}。保留原值。")
-                            modified_parts.append(part_val)
-                            continue
-                        
-                        a = 0
-                        if original_z_numeric != 0 : 
-                            a = original_z_numeric / original_layer_height_mm
-                        
-                        new_z_numeric = new_layer_height_mm * a
-                        modified_parts.append(f"Z{new_z_numeric:.3f}")
-                        line_changed_this_iteration = True
-                    except ValueError: 
-                        modified_parts.append(part_val) 
-            else:
-                modified_parts.append(part_val)
-        
-        if line_changed_this_iteration:
-             final_output_lines.append(" ".join(modified_parts) + "\n")
-        else:
-            final_output_lines.append(line_content)
+def modify_z_values_stream(infile, outfile, new_layer_height_mm, **kwargs):
+    """
+    Stream version of modify_z_values_in_file: reads lines from infile (any iterable of text lines) and
+    writes them to outfile as they are produced. Keyword arguments are passed on to modify_z_values_in_lines.
+    Returns True on success.
+    """
+    final_output_lines = modify_z_values_in_lines(infile, new_layer_height_mm, **kwargs)
+    if final_output_lines is None:
+        return False
+    outfile.writelines(final_output_lines)
+    return True
 
-    # Output to new file
+
+def default_output_path(input_filepath, new_layer_height_mm):
     dir_name = os.path.dirname(input_filepath)
     base_name = os.path.basename(input_filepath)
     
@@ -173,16 +327,75 @@ def modify_z_values_in_file(input_filepath, new_layer_height_mm):
     layer_height_filename_prefix = str(new_layer_height_mm).replace('.', 'p')
     
     output_filename = f"{layer_height_filename_prefix}_{base_name}" # MODIFIED LINE
-    output_filepath = os.path.join(dir_name, output_filename)
+    return os.path.join(dir_name, output_filename)
+
+
+def modify_z_values_checkpointed(input_filepath, output_filepath, new_layer_height_mm, compression=None,
+                                 compact=False, precision=None, original_layer_height_mm=None,
+                                 fallback_original_layer_height_mm=None, interactive=True):
+    """
+    modify_z_values_in_file with checkpoints at the layer comments (see checkpoint.py): a run that is
+    killed continues from the last completed layer when it is started again with the same arguments.
+    Returns True on success, False if the original layer height cannot be determined.
+    """
+    import checkpoint
+
+    run = checkpoint.CheckpointedRun(input_filepath, output_filepath, {
+        "tool": "layer", "new_layer_height": new_layer_height_mm, "original_layer_height": original_layer_height_mm,
+        "fallback_original_layer_height": fallback_original_layer_height_mm})
+    if run.state is not None:
+        original_layer_height_mm = run.state["original_layer_height"]
+    else:
+        with gcode_io.open_input(input_filepath) as f:
+            original_layer_height_mm, _ = resolve_original_layer_height(
+                f, original_layer_height_mm, fallback_original_layer_height_mm, interactive)
+        if original_layer_height_mm is None:
+            return False
+    run.run(ZRescaler(new_layer_height_mm, original_layer_height_mm, run.state),
+            compression=compression, compact=compact, precision=precision)
+    return True
+
+
+def modify_z_values_in_file(input_filepath, new_layer_height_mm, output_filepath=None, compact=False, precision=None,
+                            checkpoint=False, **kwargs):
+    """
+    File-level wrapper. With checkpoint, progress is saved at every layer of a text input and an
+    interrupted run resumes from it (see modify_z_values_checkpointed).
+    """
+    if output_filepath is None:
+        output_filepath = default_output_path(input_filepath, new_layer_height_mm)
 
     try:
-        with open(output_filepath, 'w', encoding='utf-8') as f_out:
-            f_out.writelines(final_output_lines)
-        print(f"\n处理完成！修改后的文件已保存为: {output_filepath}")
+        if checkpoint and not gcode_io.is_toolpath_file(input_filepath):
+            if not modify_z_values_checkpointed(input_filepath, output_filepath, new_layer_height_mm,
+                                                compact=compact, precision=precision, **kwargs):
+                return None
+        elif gcode_io.is_toolpath_file(input_filepath):
+            import toolpath
+            modified = modify_z_values_in_toolpath(toolpath.load_toolpath(input_filepath), new_layer_height_mm, **kwargs)
+            if modified is None:
+                return None
+            toolpath.write_output(modified, output_filepath, compact=compact, precision=precision)
+        else:
+            with gcode_io.open_input(input_filepath) as f:
+                final_output_lines = modify_z_values_in_lines(f, new_layer_height_mm, **kwargs)
+                if final_output_lines is None:
+                    return None
+                # Output to new file
+                with gcode_io.open_output(output_filepath, compact=compact, precision=precision) as f_out:
+                    f_out.writelines(final_output_lines)
+    except FileNotFoundError:
+        print(f"错误：文件 '{input_filepath}' 未找到。")
+        return None
     except Exception as e:
-        print(f"写入输出文件时发生错误: {e}")
+        print(f"处理文件时发生错误: {e}")
+        return None
 
-if __name__ == "__main__":
+    print(f"\n处理完成！修改后的文件已保存为: {output_filepath}")
+    return output_filepath
+
+
+def main():
     print("G-code Z值修改脚本")
     print("---------------------------------")
     
@@ -194,7 +407,7 @@ if __name__ == "__main__":
             if not os.path.isfile(input_file):
                  print(f"错误: 文件 '{input_file}' 不存在或不是一个文件。请重新输入。")
                  input_file = "" 
-            elif not input_file.lower().endswith((".nc", ".gcode", ".gco", ".txt")):
+            elif not gcode_io.split_compression_suffix(input_file)[0].lower().endswith((".nc", ".gcode", ".gco", ".txt")):
                  print(f"警告: 文件 '{os.path.basename(input_file)}' 的扩展名可能不是常见的G-code格式。请确保文件是G-code。")
         else:
             print("错误：文件路径不能为空。")
@@ -210,5 +423,9 @@ if __name__ == "__main__":
                 break
         except ValueError:
             print("错误：请输入有效的数字作为层高。")
-            
+
     modify_z_values_in_file(input_file, new_lh_float)
+
+
+if __name__ == "__main__":
+    run_main(main)
@@ -0,0 +1,255 @@
+import os
+
+import numpy as np
+
+import gcode_io
+import toolpath
+from estimate import DEFAULT_ACCELERATION, DEFAULT_JUNCTION_DEVIATION, estimate_toolpath, load_any_toolpath
+from profiling import run_main
+from toolpath import F_DECIMALS_SHIFT, HAS_F, HAS_X, HAS_Y, KIND_G1, KIND_TEXT
+
+DEFAULT_MIN_LAYER_TIME = 10.0 # s
+DEFAULT_MIN_FEEDRATE = 60.0 # mm/min, slowed moves stop here (moves that were slower keep their F)
+PLAN_ITERATIONS = 4 # re-estimates with the new feedrates (acceleration makes time not quite proportional to 1/F)
+TIME_TOLERANCE = 0.01 # relative; layers this close to their target time are not corrected further
+
+
+def _record_layers(tp):
+    """
+    Index into the layer table of every record (-1 before the first layer comment).
+    """
+    marks = np.zeros(len(tp), dtype=np.int32)
+    marks[np.asarray(tp.layer_start, dtype=np.int64)] = 1
+    return np.cumsum(marks, dtype=np.int32) - 1
+
+
+def _printing_moves(tp):
+    """
+    The G1 moves with an X or Y word; Z-only moves (layer changes, lifts) keep their feedrate.
+    """
+    return (np.asarray(tp.kind) == KIND_G1) & ((np.asarray(tp.mask) & (HAS_X | HAS_Y)) != 0)
+
+
+def scale_layer_feedrates(tp, factors, max_feedrate=None, min_feedrate=DEFAULT_MIN_FEEDRATE, record_layer=None):
+    """
+    Returns a copy of the Toolpath in which the feedrate of the G1 XY moves of every layer is multiplied
+    by factors[k] (rounded to whole mm/min). Raised feedrates stop at max_feedrate (moves already above it
+    keep their F), lowered ones at min_feedrate. Every scaled G1 gets an F word, and so does any move
+    whose modal F would otherwise come from a scaled layer before it. Returns (toolpath, new F of every record).
+    """
+    if record_layer is None:
+        record_layer = _record_layers(tp)
+    kind = np.asarray(tp.kind)
+    mask = np.asarray(tp.mask)
+    moves = kind != KIND_TEXT
+    index = np.arange(len(tp), dtype=np.int32)
+    feed_source = np.where(moves & ((mask & HAS_F) != 0), index, -1)
+    np.maximum.accumulate(feed_source, out=feed_source)
+    effective = np.where(feed_source >= 0, np.asarray(tp.f, dtype=float)[feed_source], np.nan)
+
+    factor = np.where(record_layer >= 0, np.asarray(factors, dtype=float)[np.maximum(record_layer, 0)], 1.0)
+    scaled = _printing_moves(tp) & (factor != 1.0) & (effective > 0)
+    new_f = effective.copy()
+    target = effective[scaled] * factor[scaled]
+    if max_feedrate is not None:
+        target = np.where(factor[scaled] > 1.0, np.minimum(target, np.maximum(effective[scaled], max_feedrate)), target)
+    floor = max(min_feedrate or 0.0, 1.0)
+    target = np.where(factor[scaled] < 1.0, np.maximum(target, np.minimum(effective[scaled], floor)), target)
+    new_f[scaled] = np.round(target)
+
+    # an F word wherever the new modal F differs from the one before (besides the F words already there)
+    move_records = np.flatnonzero(moves)
+    move_f = new_f[move_records]
+    changed = np.ones(len(move_records), dtype=bool)
+    changed[1:] = move_f[1:] != move_f[:-1]
+    changed &= ~np.isnan(move_f)
+    needs_f = np.zeros(len(tp), dtype=bool)
+    needs_f[move_records[changed]] = True
+    needs_f |= moves & ((mask & HAS_F) != 0)
+    # decimals of the F word: 0 for scaled values, else those of the F word the value came from
+    decimals = np.where(scaled, 0, (mask[np.maximum(feed_source, 0)] >> F_DECIMALS_SHIFT) & 3)
+    new_mask = np.where(needs_f, (mask & ~np.uint8(3 << F_DECIMALS_SHIFT)) | HAS_F | (decimals << F_DECIMALS_SHIFT),
+                        mask).astype(np.uint8)
+    f_column = np.where(needs_f, new_f, np.asarray(tp.f, dtype=float)).astype(np.float32)
+    return tp.with_columns(f=f_column, mask=new_mask), new_f
+
+
+def plan_layer_feedrates(tp, min_layer_time, max_feedrate=None, min_feedrate=DEFAULT_MIN_FEEDRATE,
+                         acceleration=DEFAULT_ACCELERATION, junction_deviation=DEFAULT_JUNCTION_DEVIATION):
+    """
+    Chooses a G1 feedrate factor per layer so that every layer takes min_layer_time (s): layers that are
+    faster are slowed down, and with max_feedrate (mm/min) slower layers are sped up, no move beyond that
+    feedrate. Layer times come from the kinematic estimate (estimate.py), and the factors are refined a
+    few times against the estimate with the new feedrates. Returns a dict with the factors, the new
+    Toolpath, the estimates before and after and the highest G1 F per layer before and after.
+    """
+    before = estimate_toolpath(tp, acceleration=acceleration, junction_deviation=junction_deviation)
+    record_layer = _record_layers(tp)
+    travel = before["layer_travel_seconds"]
+    # print time every layer should have; a layer whose travel alone takes longer cannot get there
+    target = np.maximum(min_layer_time - travel, 0.05 * min_layer_time)
+    factors = np.ones(tp.layer_count)
+    printing = _printing_moves(tp) & (record_layer >= 0)
+    scalable = np.bincount(record_layer[printing], minlength=tp.layer_count) > 0
+    result, after, new_f = tp, before, None
+    if max_feedrate is not None:
+        # beyond the factor that brings the slowest move of a layer to the cap nothing changes
+        cap_factors = _layer_cap_factors(tp, record_layer, max_feedrate)
+    for _ in range(PLAN_ITERATIONS):
+        print_seconds = after["layer_print_seconds"]
+        ratio = np.divide(print_seconds, target, out=np.ones(tp.layer_count), where=scalable & (print_seconds > 0))
+        if max_feedrate is None:
+            ratio = np.where(factors * ratio > 1.0, 1.0 / factors, ratio)
+        if np.all(np.abs(ratio - 1.0) <= TIME_TOLERANCE):
+            break
+        factors *= ratio
+        if max_feedrate is not None:
+            factors = np.minimum(factors, cap_factors)
+        result, new_f = scale_layer_feedrates(tp, factors, max_feedrate=max_feedrate, min_feedrate=min_feedrate,
+                                              record_layer=record_layer)
+        after = estimate_toolpath(result, acceleration=acceleration, junction_deviation=junction_deviation)
+    return {
+        "factors": factors,
+        "toolpath": result,
+        "before": before,
+        "after": after,
+        "min_layer_time": min_layer_time,
+        "feed_before": _layer_max_g1_feed(tp, record_layer, None),
+        "feed_after": _layer_max_g1_feed(result, record_layer, new_f),
+    }
+
+
+def _layer_g1_feeds(tp, record_layer, new_f):
+    kind = np.asarray(tp.kind)
+    if new_f is None:
+        mask = np.asarray(tp.mask)
+        index = np.arange(len(tp), dtype=np.int32)
+        source = np.where((kind != KIND_TEXT) & ((mask & HAS_F) != 0), index, -1)
+        np.maximum.accumulate(source, out=source)
+        new_f = np.where(source >= 0, np.asarray(tp.f, dtype=float)[source], np.nan)
+    g1 = _printing_moves(tp) & (record_layer >= 0) & (new_f > 0)
+    return record_layer[g1], new_f[g1]
+
+
+def _layer_max_g1_feed(tp, record_layer, new_f):
+    layers, feeds = _layer_g1_feeds(tp, record_layer, new_f)
+    result = np.zeros(tp.layer_count)
+    np.maximum.at(result, layers, feeds)
+    return result
+
+
+def _layer_cap_factors(tp, record_layer, max_feedrate):
+    layers, feeds = _layer_g1_feeds(tp, record_layer, None)
+    slowest = np.full(tp.layer_count, np.inf)
+    np.minimum.at(slowest, layers, feeds)
+    return np.where(np.isfinite(slowest), np.maximum(max_feedrate / slowest, 1.0), 1.0)
+
+
+def print_layer_time_report(plan, per_layer=True):
+    before, after = plan["before"], plan["after"]
+    layer_before = before["layer_print_seconds"] + before["layer_travel_seconds"]
+    layer_after = after["layer_print_seconds"] + after["layer_travel_seconds"]
+    if per_layer and len(layer_before):
+        print(f"\n最小层时间 {plan['min_layer_time']:g} s: 每层 G1 速度调整")
+        print("----------------------------------------------------------------")
+        print("| Layer # | 时间前 (s) | 时间后 (s) | F 前 (mm/min) | F 后 (mm/min) |")
+        print("|---------|------------|------------|---------------|---------------|")
+        for number, t0, t1, f0, f1 in zip(before["layer_numbers"].tolist(), layer_before.tolist(), layer_after.tolist(),
+                                          plan["feed_before"].tolist(), plan["feed_after"].tolist()):
+            print(f"| {number:<7} | {t0:<10.1f} | {t1:<10.1f} | {f0:<13.0f} | {f1:<13.0f} |")
+        print("----------------------------------------------------------------")
+    slowed = int((plan["factors"] < 1.0).sum())
+    sped_up = int((plan["factors"] > 1.0).sum())
+    short_after = int((layer_after < plan["min_layer_time"] * (1.0 - TIME_TOLERANCE)).sum())
+    print(f"最小层时间: {slowed} 层减速, {sped_up} 层加速; 预计总时间 {before['total_seconds']:.1f} -> "
+          f"{after['total_seconds']:.1f} s")
+    if short_after:
+        print(f"警告: {short_after} 层仍短于最小层时间 (空行程过长或已到最低速度)。")
+
+
+def layer_time_toolpath(tp, min_layer_time=DEFAULT_MIN_LAYER_TIME, max_feedrate=None,
+                        min_feedrate=DEFAULT_MIN_FEEDRATE, per_layer=True, **kinematics):
+    """
+    plan_layer_feedrates plus the report; returns the new Toolpath, or None if it has no layers.
+    """
+    if not tp.layer_count:
+        print("错误：在文件中未找到任何 '; (--- Layer N ...' 格式的层注释。")
+        return None
+    plan = plan_layer_feedrates(tp, min_layer_time, max_feedrate=max_feedrate, min_feedrate=min_feedrate,
+                                **kinematics)
+    print_layer_time_report(plan, per_layer=per_layer)
+    return plan["toolpath"]
+
+
+def layer_time_lines(lines, min_layer_time=DEFAULT_MIN_LAYER_TIME, max_feedrate=None,
+                     min_feedrate=DEFAULT_MIN_FEEDRATE, stats=None):
+    """
+    Generator over NC lines with the per-layer feedrates applied, without newlines. The whole input is
+    packed into a Toolpath first, since every layer time needs the moves of the whole file. stats (dict)
+    receives the plan for print_layer_time_report.
+    """
+    tp = toolpath.toolpath_from_nc_lines(lines)
+    stats = stats if stats is not None else {}
+    if tp.layer_count:
+        plan = plan_layer_feedrates(tp, min_layer_time, max_feedrate=max_feedrate, min_feedrate=min_feedrate)
+        stats.update(plan)
+        tp = plan["toolpath"]
+    for line in tp.iter_nc_lines():
+        yield line[:-1] if line.endswith("\n") else line
+
+
+def layer_time_stream(infile, outfile, min_layer_time=DEFAULT_MIN_LAYER_TIME, max_feedrate=None,
+                      min_feedrate=DEFAULT_MIN_FEEDRATE):
+    tp = toolpath.toolpath_from_nc_lines(infile)
+    result = layer_time_toolpath(tp, min_layer_time, max_feedrate=max_feedrate, min_feedrate=min_feedrate)
+    if result is None:
+        return False
+    outfile.writelines(result.iter_nc_lines())
+    return True
+
+
+def default_output_path(input_file_path):
+    return gcode_io.default_output_path(input_file_path, "_layertime")
+
+
+def layer_time_file(input_filepath, min_layer_time=DEFAULT_MIN_LAYER_TIME, max_feedrate=None,
+                    min_feedrate=DEFAULT_MIN_FEEDRATE, output_filepath=None, compact=False, precision=None):
+    if output_filepath is None:
+        output_filepath = default_output_path(input_filepath)
+    try:
+        result = layer_time_toolpath(load_any_toolpath(input_filepath), min_layer_time, max_feedrate=max_feedrate,
+                                     min_feedrate=min_feedrate)
+        if result is None:
+            return None
+        toolpath.write_output(result, output_filepath, compact=compact, precision=precision)
+    except FileNotFoundError:
+        print(f"错误: 文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"错误: 处理文件 '{input_filepath}' 失败: {e}")
+        return None
+    print(f"处理完成！调整速度后的文件已保存到: {output_filepath}")
+    return output_filepath
+
+
+def main():
+    input_file_path = input("请输入NC文件的完整路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    try:
+        time_str = input(f"请输入最小层时间 (s, 默认 {DEFAULT_MIN_LAYER_TIME:g}): ").strip()
+        max_str = input("请输入长层加速的最高 G1 速度 (mm/min, 留空则只给短层减速): ").strip()
+        min_layer_time = float(time_str) if time_str else DEFAULT_MIN_LAYER_TIME
+        max_feedrate = float(max_str) if max_str else None
+    except ValueError:
+        print("错误：请输入一个有效的数字。")
+        return
+    if min_layer_time <= 0 or (max_feedrate is not None and max_feedrate <= 0):
+        print("错误：最小层时间和最高速度必须是正数。")
+        return
+    layer_time_file(input_file_path, min_layer_time, max_feedrate=max_feedrate)
+
+
+if __name__ == "__main__":
+    run_main(main)
@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+
+from profiling import run_main
+from slicer import load_stl
+
+
+def _mix_bits(values):
+    """
+    splitmix64 finalizer over a uint64 array: every input bit affects every output bit.
+    """
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def index_triangles(triangles):
+    """
+    Welds the corners of triangles (n, 3, 3) that have the same coordinates: returns (vertices (v, 3),
+    faces (n, 3)) of the indexed mesh. The corners are sorted by a hash of their coordinate bits, which
+    is much faster than sorting the coordinate rows; should two different points share a hash, the rows
+    are sorted after all.
+    """
+    corners = np.ascontiguousarray(triangles, dtype=float).reshape(-1, 3)
+    corners = corners + 0.0 # -0.0 -> 0.0, so equal coordinates have equal bits
+    bits = corners.view(np.uint64)
+    hashes = _mix_bits(_mix_bits(_mix_bits(bits[:, 0]) ^ bits[:, 1]) ^ bits[:, 2])
+    order = np.argsort(hashes)
+    new_point = np.ones(len(order), dtype=bool)
+    new_point[1:] = np.diff(hashes[order]) != 0
+    same_hash = ~new_point[1:]
+    collision = any((sorted_bits[1:] != sorted_bits[:-1])[same_hash].any()
+                    for sorted_bits in (np.ascontiguousarray(column)[order] for column in bits.T))
+    if collision:
+        keys = corners.view(np.dtype((np.void, corners.dtype.itemsize * 3))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        return corners[first], inverse.reshape(-1, 3)
+    first = order[new_point]
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = np.cumsum(new_point) - 1
+    return corners[first], inverse.reshape(-1, 3)
+
+
+def _repeated_keys(keys):
+    """
+    Sorts keys; returns (number of distinct keys that occur more than once, occurrence count of every
+    distinct key).
+    """
+    keys = np.sort(keys)
+    new_key = np.ones(len(keys), dtype=bool)
+    new_key[1:] = keys[1:] != keys[:-1]
+    counts = np.diff(np.append(np.flatnonzero(new_key), len(keys)))
+    return int((counts > 1).sum()), counts
+
+
+def validate_mesh(vertices, faces):
+    """
+    Checks the indexed triangle mesh with sorts over integer edge keys. Returns a dict: faces,
+    degenerate_faces (repeated corner or zero area), duplicate_faces (same three vertices), boundary_edges
+    (used by one face), non_manifold_edges (by more than two), inconsistent_edges (two faces run through
+    the edge in the same direction, i.e. flipped winding), signed_volume (negative when the normals point
+    inwards), and closed_manifold (True if none of the defects is present and the volume is positive).
+    """
+    faces = np.asarray(faces, dtype=np.int64)
+    vertex_count = np.int64(max(len(vertices), 1))
+    # per coordinate, which gathers and multiplies much faster than (n, 3) rows
+    vx, vy, vz = (np.ascontiguousarray(column) for column in np.asarray(vertices, dtype=float).T)
+    f0, f1, f2 = faces.T
+    ax, ay, az = vx[f0], vy[f0], vz[f0]
+    ux, uy, uz = vx[f1] - ax, vy[f1] - ay, vz[f1] - az
+    wx, wy, wz = vx[f2] - ax, vy[f2] - ay, vz[f2] - az
+    nx, ny, nz = uy * wz - uz * wy, uz * wx - ux * wz, ux * wy - uy * wx
+    signed_volume = float((ax * nx + ay * ny + az * nz).sum() / 6.0)
+    area2 = nx * nx + ny * ny + nz * nz
+    repeated = (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 2] == faces[:, 0])
+    degenerate = repeated | (area2 <= 1e-24 * max(float(area2.max(initial=0.0)), 1.0))
+
+    sorted_faces = np.sort(faces, axis=1)
+    if len(vertices) < 1 << 21:
+        duplicate_faces, _ = _repeated_keys((sorted_faces[:, 0] * vertex_count + sorted_faces[:, 1])
+                                            * vertex_count + sorted_faces[:, 2])
+    else:
+        duplicate_faces = len(faces) - len(np.unique(sorted_faces, axis=0))
+
+    # one key per edge use: the undirected edge times 2, plus 1 if it is run through from the higher vertex
+    good = faces[~repeated]
+    start = good.ravel()
+    end = good[:, [1, 2, 0]].ravel()
+    low, high = np.minimum(start, end), np.maximum(start, end)
+    inconsistent, _ = _repeated_keys((low * vertex_count + high) * 2 + (start > end))
+    _, edge_counts = _repeated_keys(low * vertex_count + high)
+
+    report = {
+        "faces": len(faces),
+        "degenerate_faces": int(degenerate.sum()),
+        "duplicate_faces": duplicate_faces,
+        "boundary_edges": int((edge_counts == 1).sum()),
+        "non_manifold_edges": int((edge_counts > 2).sum()),
+        "inconsistent_edges": inconsistent,
+        "signed_volume": signed_volume,
+    }
+    report["closed_manifold"] = signed_volume > 0 and not any(
+        report[key] for key in ("degenerate_faces", "duplicate_faces", "boundary_edges", "non_manifold_edges",
+                                "inconsistent_edges"))
+    return report
+
+
+def validate_triangles(triangles):
+    """
+    validate_mesh for a triangle soup (n, 3, 3), e.g. as read from an STL.
+    """
+    return validate_mesh(*index_triangles(triangles))
+
+
+def print_mesh_report(report):
+    if report["closed_manifold"]:
+        print(f"网格检查通过: {report['faces']} 个三角形, 封闭流形, 法线朝外, 体积 {report['signed_volume']:.3f} mm³")
+        return
+    print(f"警告: 网格检查未通过 ({report['faces']} 个三角形): 边界边 {report['boundary_edges']}, "
+          f"非流形边 {report['non_manifold_edges']}, 方向不一致边 {report['inconsistent_edges']}, "
+          f"重复面 {report['duplicate_faces']}, 退化面 {report['degenerate_faces']}, "
+          f"有向体积 {report['signed_volume']:.3f} mm³")
+
+
+def check_stl_file(input_filepath):
+    try:
+        report = validate_triangles(load_stl(input_filepath))
+    except FileNotFoundError:
+        print(f"错误: 文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"错误: 检查文件 '{input_filepath}' 失败: {e}")
+        return None
+    print_mesh_report(report)
+    return report
+
+
+def main():
+    input_file_path = input("请输入STL文件的完整路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    check_stl_file(input_file_path)
+
+
+if __name__ == "__main__":
+    run_main(main)
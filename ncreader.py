@@ -0,0 +1,304 @@
+import collections
+import os
+import re
+
+import numpy as np
+
+import gcode_io
+import toolpath
+from profiling import run_main
+from toolpath import KIND_TEXT
+
+DEFAULT_CACHE_LAYERS = 32 # parsed layers kept by a reader
+SCAN_CHUNK_SIZE = 1 << 20 # bytes read at a time while looking for layer comments
+
+_LAYER_LINE_PATTERN = re.compile(rb"; \(--- Layer (\d+)[^\n]*")
+_LAYER_Z_PATTERN = re.compile(rb"@ Z=(-?\d+(?:\.\d+)?)")
+
+
+class LayerReader:
+    """
+    Random access to the layers of an NC file (plain or compressed) or a .diwtp toolpath without loading
+    the whole file. Layer k is the k-th layer comment up to the next one, as in Toolpath.layer_bounds.
+    The layer comments of a text file are found on demand (the file is only scanned as far as the
+    highest layer asked for) and their byte offsets are kept; parsed layers are kept in an LRU cache of
+    cache_layers entries. Compressed text can only be read forwards: going back decompresses from the start.
+
+        with LayerReader("part.nc") as reader:
+            top = reader.layer(len(reader) - 1)       # Toolpath of the last layer
+            for tp in reader[10:20]: ...               # layers 10..19
+            for kind, x, y, z, f in reader.moves(5): ...
+    """
+
+    def __init__(self, path, cache_layers=DEFAULT_CACHE_LAYERS, encoding="utf-8"):
+        self.path = path
+        self.encoding = encoding
+        self.cache_layers = max(int(cache_layers), 1)
+        self._cache = collections.OrderedDict()
+        self._toolpath = None
+        self._scan_file = self._read_file = None
+        self._read_position = 0
+        self.codec = None
+        if gcode_io.is_toolpath_file(path):
+            self._toolpath = toolpath.load_toolpath(path)
+            self.metadata = dict(self._toolpath.metadata)
+            return
+        self._layer_offsets = []
+        self._layer_numbers = []
+        self._layer_z = []
+        self._scan_file, self.codec = gcode_io.open_binary_input(path)
+        self._scan_position = 0
+        self._scan_rest = b""
+        self._size = None
+        self._scan_until(0)
+        self.metadata = toolpath.toolpath_from_nc_lines(self.header_lines()).metadata
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for handle in (self._scan_file, self._read_file):
+            if handle is not None:
+                handle.close()
+        self._scan_file = self._read_file = None
+        self._cache.clear()
+
+    def _scan_chunk(self):
+        """
+        Reads the next chunk of the file and records the layer comments in its complete lines.
+        """
+        data = self._scan_file.read(SCAN_CHUNK_SIZE)
+        base = self._scan_position - len(self._scan_rest)
+        if data:
+            self._scan_position += len(data)
+            data = self._scan_rest + data
+            end = data.rfind(b"\n") + 1
+            self._scan_rest = data[end:]
+        else:
+            data, end = self._scan_rest, len(self._scan_rest)
+            self._scan_rest = b""
+            self._size = self._scan_position
+            self._scan_file.close()
+            self._scan_file = None
+        for match in _LAYER_LINE_PATTERN.finditer(data, 0, end):
+            z_match = _LAYER_Z_PATTERN.search(match.group(0))
+            self._layer_offsets.append(base + data.rfind(b"\n", 0, match.start()) + 1)
+            self._layer_numbers.append(int(match.group(1)))
+            self._layer_z.append(float(z_match.group(1)) if z_match else float("nan"))
+
+    def _scan_until(self, k):
+        # the end of layer k is the start of layer k + 1
+        while self._size is None and len(self._layer_offsets) <= k + 1:
+            self._scan_chunk()
+
+    def _scan_all(self):
+        while self._size is None:
+            self._scan_chunk()
+
+    def __len__(self):
+        if self._toolpath is not None:
+            return self._toolpath.layer_count
+        self._scan_all()
+        return len(self._layer_offsets)
+
+    def _index(self, k):
+        if k < 0:
+            k += len(self)
+        if self._toolpath is None:
+            self._scan_until(k)
+        if not 0 <= k < (self._toolpath.layer_count if self._toolpath is not None else len(self._layer_offsets)):
+            raise IndexError(f"层索引超出范围: {k}")
+        return k
+
+    def layer_number(self, k):
+        """
+        N of the "; (--- Layer N" comment of layer k, without parsing the layer.
+        """
+        k = self._index(k)
+        return int(self._toolpath.layer_number[k]) if self._toolpath is not None else self._layer_numbers[k]
+
+    def layer_z(self, k):
+        """
+        Z of the layer comment of layer k (nan if it has none), without parsing the layer.
+        """
+        k = self._index(k)
+        return float(self._toolpath.layer_z[k]) if self._toolpath is not None else self._layer_z[k]
+
+    def byte_range(self, k):
+        """
+        (start, stop) offsets of layer k in the (decompressed) text.
+        """
+        k = self._index(k)
+        if k + 1 < len(self._layer_offsets):
+            return self._layer_offsets[k], self._layer_offsets[k + 1]
+        self._scan_all()
+        return self._layer_offsets[k], self._size
+
+    def _read_bytes(self, start, stop):
+        if self._read_file is None or (self.codec is not None and self._read_position > start):
+            if self._read_file is not None:
+                self._read_file.close()
+            self._read_file, _ = gcode_io.open_binary_input(self.path)
+            self._read_position = 0
+        if self.codec is None:
+            self._read_file.seek(start)
+        else:
+            while self._read_position < start:
+                skipped = len(self._read_file.read(min(start - self._read_position, SCAN_CHUNK_SIZE)))
+                if not skipped:
+                    break
+                self._read_position += skipped
+        data = self._read_file.read(stop - start)
+        self._read_position = start + len(data)
+        return data
+
+    def header_lines(self):
+        """
+        The NC lines (with newlines) in front of the first layer comment.
+        """
+        if self._toolpath is not None:
+            stop = int(self._toolpath.layer_start[0]) if self._toolpath.layer_count else len(self._toolpath)
+            return list(self._toolpath.iter_nc_lines(0, stop))
+        if not self._layer_offsets:
+            self._scan_all()
+        stop = self._layer_offsets[0] if self._layer_offsets else self._size
+        return self._read_bytes(0, stop).decode(self.encoding).splitlines(keepends=True)
+
+    def layer(self, k):
+        """
+        Layer k (negative counts from the end) as a Toolpath, from its layer comment up to the next one.
+        """
+        k = self._index(k)
+        cached = self._cache.get(k)
+        if cached is not None:
+            self._cache.move_to_end(k)
+            return cached
+        if self._toolpath is not None:
+            result = self._toolpath.records(*self._toolpath.layer_bounds(k))
+        else:
+            writer = toolpath.ToolpathWriter(metadata=self.metadata)
+            writer.write(self._read_bytes(*self.byte_range(k)).decode(self.encoding))
+            result = writer.to_toolpath()
+        self._cache[k] = result
+        if len(self._cache) > self.cache_layers:
+            self._cache.popitem(last=False)
+        return result
+
+    def layers(self, start=0, stop=None):
+        """
+        Yields the layers start..stop (stop None = up to the last layer) as Toolpaths.
+        """
+        k = start
+        while stop is None or k < stop:
+            try:
+                index = self._index(k)
+            except IndexError:
+                return
+            yield self.layer(index)
+            k += 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            return [self.layer(k) for k in range(start, stop, step)]
+        return self.layer(key)
+
+    def __iter__(self):
+        return self.layers()
+
+    def lines(self, start=0, stop=None):
+        """
+        Yields the NC lines (with newlines) of the layers start..stop, e.g. to pass a part of the file to the
+        line-based tools.
+        """
+        for layer in self.layers(start, stop):
+            yield from layer.iter_nc_lines()
+
+    def moves(self, k):
+        """
+        Yields (kind, x, y, z, f) for the G0/G1 moves of layer k (kind is toolpath.KIND_G0 or KIND_G1) with
+        the words a move leaves out taken from the moves before it in the layer (nan before the first value).
+        The values are the numbers written in the file (-0.938 for X-0.938, not its float32 approximation).
+        """
+        layer = self.layer(k)
+        records = np.flatnonzero(np.asarray(layer.kind) != KIND_TEXT)
+        # moves are only stored in the columns with at most 3 decimals, which float32 holds exactly enough
+        # for rounding to give back the written number
+        x, y, z, f = (np.round(values[records], 3).tolist() for values in layer.positions())
+        yield from zip(np.asarray(layer.kind)[records].tolist(), x, y, z, f)
+
+
+_LAYER_RANGE_PATTERN = re.compile(r"(-?\d+)(?:-(-?\d+)?)?")
+
+
+def parse_layer_range(text, layer_count):
+    """
+    Returns (start, stop) for LayerReader.lines of a range of layers given as text:
+    "N" is layer N counted from 1 (negative N counts from the end, -1 is the last layer), "N-M" the layers
+    N to M and "N-" the layers from N on; "a:b" selects reader[a:b] (counted from 0, b excluded, either
+    may be negative or left out). Raises ValueError if the text is not a range or selects no layers.
+    """
+    text = text.strip()
+    if ":" in text:
+        first, _, last = text.partition(":")
+        try:
+            bounds = slice(int(first) if first.strip() else None, int(last) if last.strip() else None)
+        except ValueError:
+            raise ValueError(f"层范围无效: {text}") from None
+        start, stop, _ = bounds.indices(layer_count)
+        if start >= stop:
+            raise ValueError(f"层范围 {text} 不包含任何层 (共 {layer_count} 层)。")
+        return start, stop
+    match = _LAYER_RANGE_PATTERN.fullmatch(text)
+    if match is None:
+        raise ValueError(f"层范围无效: {text} (应为 N, N-M, N- 或 a:b)")
+    first = int(match.group(1))
+    if match.group(2) is not None:
+        last = int(match.group(2))
+    else:
+        last = -1 if text.endswith("-") else first
+    indices = [k - 1 if k > 0 else layer_count + k for k in (first, last)]
+    if 0 in (first, last) or not 0 <= indices[0] <= indices[1] < layer_count:
+        raise ValueError(f"层号必须在 1 到 {layer_count} (或 -{layer_count} 到 -1) 之间, 且起始层不能在结束层之后。")
+    return indices[0], indices[1] + 1
+
+
+def print_layer_list(reader):
+    print("----------------------------------------------")
+    print("| #     | Layer # | Z (mm)   | 大小 (bytes)   |")
+    print("|-------|---------|----------|----------------|")
+    for k in range(len(reader)):
+        if reader._toolpath is not None:
+            start, stop = reader._toolpath.layer_bounds(k)
+            size = f"{stop - start} 行"
+        else:
+            start, stop = reader.byte_range(k)
+            size = str(stop - start)
+        print(f"| {k + 1:<5} | {reader.layer_number(k):<7} | {reader.layer_z(k):<8.3f} | {size:<14} |")
+    print("----------------------------------------------")
+
+
+def main():
+    input_file_path = input("请输入NC文件的完整路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    with LayerReader(input_file_path) as reader:
+        print(f"共 {len(reader)} 层。")
+        while True:
+            raw = input("请输入要显示的层 (第几层, 从 1 开始, 如 5, 5-7, -1 或 -3-; 留空结束): ").strip()
+            if not raw:
+                return
+            try:
+                start, stop = parse_layer_range(raw, len(reader))
+            except ValueError as e:
+                print(f"错误：{e}")
+                continue
+            print("".join(reader.lines(start, stop)), end="")
+
+
+if __name__ == "__main__":
+    run_main(main)
@@ -0,0 +1,419 @@
+import heapq
+import math
+import os
+import re
+
+import numpy as np
+
+import gcode_io
+import toolpath
+from estimate import estimate_toolpath, format_duration, load_any_toolpath
+from profiling import run_main
+from slicer import DEFAULT_G0_FEEDRATE, FINAL_Z_LIFT
+from toolpath import HAS_F, HAS_X, HAS_Y, HAS_Z, KIND_G1, KIND_TEXT
+
+DEFAULT_PART_LIFT = 1.0 # mm above the current layer for the travel from one part to the next
+Z_TOLERANCE = 0.001 # mm, layers of different parts closer than this are printed as one layer
+
+_XY_PATTERN = re.compile(rf"([XY])(\s*)({gcode_io.NUMBER})", re.IGNORECASE)
+_END_PATTERN = re.compile(r"^\s*M(?:0?2|30)(?!\d)|; Final safe Z lift", re.IGNORECASE)
+_AXES = ("x", "y", "z", "f")
+
+
+def _text_motion(line):
+    """
+    (G code 0-3 or None, {axis: value}) of a line stored as text; comments are ignored.
+    """
+    code = gcode_io.COMMENT_PATTERN.sub("", line)
+    match = gcode_io.MOTION_PATTERN.match(code)
+    words = {letter.lower(): float(value) for letter, value in gcode_io.WORD_PATTERN.findall(code)
+             if letter in "XYZFxyzf"}
+    return (int(match.group(1)) if match else None), words
+
+
+def _shift_text(line, dx, dy):
+    """
+    Adds the offset to the X/Y words of a G0-G3 text line (keeping their number of decimals, at least 3);
+    I/J arc offsets are relative and stay as they are.
+    """
+    code = gcode_io.COMMENT_PATTERN.sub("", line)
+    if not gcode_io.MOTION_PATTERN.match(code):
+        return line
+    comment_start = gcode_io.COMMENT_PATTERN.search(line)
+    cut = comment_start.start() if comment_start else len(line)
+
+    def shift(match):
+        letter, space, value = match.groups()
+        decimals = max(len(value) - value.index(".") - 1 if "." in value else 0, 3)
+        return f"{letter}{space}{float(value) + (dx if letter in 'Xx' else dy) + 0.0:.{decimals}f}"
+
+    return _XY_PATTERN.sub(shift, line[:cut]) + line[cut:]
+
+
+def shift_toolpath(tp, dx, dy):
+    """
+    Returns a copy of the Toolpath moved by (dx, dy) in XY, for absolute (G90) programs. Returns
+    (toolpath, {string index: (G code, axis words)} of the text lines that are moves).
+    """
+    mask = np.asarray(tp.mask)
+    columns = {}
+    for name, bit, offset in (("x", HAS_X, dx), ("y", HAS_Y, dy)):
+        values = np.asarray(getattr(tp, name), dtype=float)
+        shifted = np.round(values + offset, 3)
+        present = (np.asarray(tp.kind) != KIND_TEXT) & ((mask & bit) != 0)
+        if np.any(np.abs(shifted[present]) >= 2 ** 13):
+            raise ValueError(f"偏移后 {name.upper()} 坐标超出范围")
+        columns[name] = np.where(present, shifted, values).astype(np.float32)
+    strings, text_moves = [], {}
+    for index in range(len(tp.string_offsets) - 1):
+        line = tp.string(index)
+        motion, words = _text_motion(line)
+        if motion is not None:
+            line = _shift_text(line, dx, dy)
+            text_moves[index] = (motion, _text_motion(line)[1])
+        strings.append(line)
+    columns["string_offsets"], columns["string_data"] = toolpath._encode_strings(strings)
+    return tp.with_columns(**columns), text_moves
+
+
+def _part_state(tp, text_moves):
+    """
+    (x, y, z, f) in effect after every record like Toolpath.positions(), but also following the axis words of
+    moves stored as text (arcs, non-canonical moves); and the printing records (G1-G3 with an X or Y word).
+    """
+    kind = np.asarray(tp.kind)
+    mask = np.asarray(tp.mask)
+    text_index = np.asarray(tp.text)
+    moves = kind != KIND_TEXT
+    printing = (kind == KIND_G1) & ((mask & (HAS_X | HAS_Y)) != 0)
+    text_records = np.flatnonzero(~moves)
+    text_words = {}
+    for record, string in zip(text_records.tolist(), text_index[text_records].tolist()):
+        move = text_moves.get(string)
+        if move is not None:
+            motion, words = move
+            text_words[record] = words
+            if motion > 0 and ("x" in words or "y" in words):
+                printing[record] = True
+    index = np.arange(len(tp))
+    state = []
+    for name, bit in zip(_AXES, (HAS_X, HAS_Y, HAS_Z, HAS_F)):
+        values = np.asarray(getattr(tp, name), dtype=float).copy()
+        has = moves & ((mask & bit) != 0)
+        for record, words in text_words.items():
+            if name in words:
+                has[record] = True
+                values[record] = words[name]
+        source = np.where(has, index, -1)
+        np.maximum.accumulate(source, out=source)
+        result = values[np.maximum(source, 0)]
+        result[source < 0] = np.nan
+        state.append(result)
+    return tuple(state), printing
+
+
+def _part_layers(tp, state, printing):
+    """
+    The layers of one part as dicts: Z it prints at, record range (without the layer comment, and without
+    the end of program in the last layer), the machine state the layer starts from (x, y, z, f before its
+    first printing move) and the one it leaves.
+    """
+    layers = []
+    last_stop = len(tp)
+    tail_z = np.nan
+    if tp.layer_count:
+        start, stop = tp.layer_bounds(tp.layer_count - 1)
+        for record in range(start + 1, stop):
+            if tp.kind[record] == KIND_TEXT and _END_PATTERN.search(tp.string(int(tp.text[record]))):
+                last_stop = record
+                tail = state[2][record:stop]
+                tail = tail[~np.isnan(tail)]
+                tail_z = float(tail.max()) if len(tail) else np.nan
+                break
+    for k in range(tp.layer_count):
+        start, stop = tp.layer_bounds(k)
+        if k == tp.layer_count - 1:
+            stop = last_stop
+        # the blank line in front of the next layer comment is written with the merged layer comments
+        while stop > start + 1 and tp.kind[stop - 1] == KIND_TEXT and not tp.string(int(tp.text[stop - 1])).strip():
+            stop -= 1
+        first_print = np.flatnonzero(printing[start + 1:stop])
+        entry = start + first_print[0] if len(first_print) else start
+        entry_state = tuple(float(axis[entry]) for axis in state)
+        z = float(state[2][entry + 1]) if len(first_print) else float(tp.layer_z[k])
+        if math.isnan(z):
+            z = float(tp.layer_z[k])
+        layers.append({
+            "z": z,
+            "start": start + 1,
+            "stop": stop,
+            "entry": entry_state,
+            "exit": tuple(float(axis[stop - 1]) for axis in state),
+        })
+    return layers, tail_z
+
+
+def _merge_layers(part_layers):
+    """
+    Interleaves the layers of all parts by Z, keeping the order of each part: a list of merged layers, each
+    [z, [(part, layer dict), ...]] with at most one layer per part. Parts with fewer (or thicker) layers
+    simply take part in fewer merged layers.
+    """
+    streams = ([(layer["z"], part, k, layer) for k, layer in enumerate(layers)]
+               for part, layers in enumerate(part_layers))
+    merged = []
+    for z, part, _, layer in heapq.merge(*streams, key=lambda item: (item[0], item[1], item[2])):
+        if merged and abs(z - merged[-1][0]) <= Z_TOLERANCE and all(p != part for p, _ in merged[-1][1]):
+            merged[-1][1].append((part, layer))
+        else:
+            merged.append([z, [(part, layer)]])
+    return merged
+
+
+def _distance(a, b):
+    if any(math.isnan(v) for v in (*a[:2], *b[:2])):
+        return 0.0
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def order_layer_parts(entries, position):
+    """
+    Nearest-neighbour order of the parts of one layer: entries is a list of (part, layer dict), position the
+    machine (x, y) before the layer. Returns (ordered entries, travel length between the parts).
+    """
+    remaining = list(entries)
+    ordered = []
+    travel = 0.0
+    while remaining:
+        best = min(range(len(remaining)), key=lambda i: _distance(position, remaining[i][1]["entry"]))
+        part, layer = remaining.pop(best)
+        travel += _distance(position, layer["entry"])
+        ordered.append((part, layer))
+        position = layer["exit"]
+    return ordered, travel
+
+
+def _format_number(value):
+    return f"{value:.3f}"
+
+
+def _switch_lines(machine, layer, z, part_lift, g0_feed):
+    """
+    Moves from another part to the entry state of layer: lift above both, travel, then lower to the Z (and
+    set the F) that the part expects before it starts printing.
+    """
+    mx, my, mz, _ = machine
+    ex, ey, ez, ef = layer["entry"]
+    clearance = max(v for v in (mz, ez, z) if not math.isnan(v)) + part_lift
+    lines = [f"G0 Z{_format_number(clearance)} {g0_feed}"]
+    words = [f"{axis}{_format_number(value)}" for axis, value in (("X", ex), ("Y", ey)) if not math.isnan(value)]
+    if words:
+        lines.append(f"G0 {' '.join(words)} {g0_feed}")
+    words = []
+    if not math.isnan(ez):
+        words.append(f"Z{_format_number(ez)}")
+    if not math.isnan(ef):
+        words.append(f"F{ef:g}")
+    if words:
+        lines.append(f"G1 {' '.join(words)}")
+    return lines
+
+
+def nest_toolpaths(parts, offsets, names=None, part_lift=DEFAULT_PART_LIFT):
+    """
+    Merges the Toolpaths of several parts, each moved by its (dx, dy) offset, into one layer-synchronised
+    program: the layers of all parts are interleaved by Z, and within each layer the parts are printed in
+    nearest-neighbour order. Between two parts the nozzle lifts by part_lift (mm), travels and restores the
+    Z and F the next part expects. Returns a dict with the toolpath, the number of merged layers, the
+    travel between parts (in the chosen and in the given order) and the order of every layer.
+    """
+    names = names or [f"part {i + 1}" for i in range(len(parts))]
+    shifted, part_layers, tail_zs, preambles = [], [], [], []
+    for tp, (dx, dy) in zip(parts, offsets):
+        if not tp.layer_count:
+            raise ValueError("在文件中未找到任何 '; (--- Layer N ...' 格式的层注释")
+        moved, text_moves = shift_toolpath(tp, dx, dy)
+        state, printing = _part_state(moved, text_moves)
+        layers, tail_z = _part_layers(moved, state, printing)
+        shifted.append(moved)
+        part_layers.append(layers)
+        tail_zs.append(tail_z)
+        preambles.append([moved.line(i) for i in range(int(moved.layer_start[0]))])
+
+    metadata = {key: parts[0].metadata.get(key) for key in ("layer_height", "xy_feedrate", "g0_feedrate")}
+    for key in metadata:
+        if any(tp.metadata.get(key) != metadata[key] for tp in parts):
+            metadata[key] = None
+    g0_feedrate = metadata["g0_feedrate"] or DEFAULT_G0_FEEDRATE
+    g0_feed = f"F{g0_feedrate:.0f}"
+
+    extra_lines = []
+    pieces = [] # (source, start, stop); source len(parts) is extra_lines
+    layer_records = []
+    record_count = 0
+
+    def add_lines(lines):
+        nonlocal record_count
+        pieces.append((len(parts), len(extra_lines), len(extra_lines) + len(lines)))
+        extra_lines.extend(lines)
+        record_count += len(lines)
+
+    header = ["G21 ; 设置单位为毫米", "G90 ; 使用绝对坐标模式",
+              f"; (Nested plate: {len(parts)} parts, layer-synchronised)"]
+    header += [f"; (Part {i + 1}: {name} offset X{_format_number(dx)} Y{_format_number(dy)})"
+               for i, (name, (dx, dy)) in enumerate(zip(names, offsets))]
+    if metadata["layer_height"]:
+        header.append(f"; (User-defined layer height for Z calculation: {metadata['layer_height']:.3f}mm)")
+    if metadata["xy_feedrate"]:
+        header.append(f"; (G1 XY Feedrate set to: {metadata['xy_feedrate']:.0f} mm/min)")
+    header.append(f"; (ALL G0 Feedrates will use default G0 speed: {g0_feedrate:.0f} mm/min)")
+    # setup codes of the parts (anything in front of the first layer that is not a comment or G21/G90)
+    for preamble in preambles:
+        for line in preamble:
+            code = gcode_io.COMMENT_PATTERN.sub("", line).strip().upper()
+            if code and code not in ("G21", "G90") and line not in header:
+                header.append(line)
+    add_lines(header + [""])
+
+    merged = _merge_layers(part_layers)
+    position = (np.nan, np.nan, np.nan, np.nan)
+    given_position = position
+    current_part = None
+    travel = given_travel = 0.0
+    orders = []
+    top_z = 0.0
+    for number, (z, entries) in enumerate(merged, start=1):
+        ordered, layer_travel = order_layer_parts(entries, position)
+        _, given_layer_travel = order_layer_parts(entries[:1], given_position)
+        for (_, a), (_, b) in zip(entries, entries[1:]):
+            given_layer_travel += _distance(a["exit"], b["entry"])
+        given_position = entries[-1][1]["exit"]
+        travel += layer_travel
+        given_travel += given_layer_travel
+        orders.append([part for part, _ in ordered])
+        top_z = max(top_z, z)
+        layer_records.append((record_count + 1, number, z))
+        add_lines(["", f"; (--- Layer {number} @ Z={z:.3f} ---)"])
+        for part, layer in ordered:
+            lines = [f"; (Part {part + 1})"]
+            if current_part is not None and current_part != part:
+                lines += _switch_lines(position, layer, z, part_lift, g0_feed)
+            add_lines(lines)
+            pieces.append((part, layer["start"], layer["stop"]))
+            record_count += layer["stop"] - layer["start"]
+            position = layer["exit"]
+            current_part = part
+    final_z = max([top_z + FINAL_Z_LIFT] + [z for z in tail_zs if not math.isnan(z)])
+    add_lines(["", f"G0 Z{final_z:.3f} {g0_feed} ; Final safe Z lift", f"G0 X0 Y0 {g0_feed} ; Optional: Return to origin",
+               "M30 ; Program End"])
+
+    sources = shifted + [toolpath.toolpath_from_nc_lines(extra_lines)]
+    columns = {}
+    string_bases = np.cumsum([0] + [len(tp.string_offsets) - 1 for tp in sources])
+    record_bases = np.cumsum([0] + [len(tp) for tp in sources])
+    for name, dtype in toolpath.RECORD_COLUMNS:
+        values = [np.asarray(getattr(tp, name)) for tp in sources]
+        if name == "text":
+            values = [np.where(v >= 0, v + base, v) for v, base in zip(values, string_bases.tolist())]
+        columns[name] = np.concatenate(values).astype(dtype)
+    take = np.concatenate([np.arange(start, stop, dtype=np.int64) + record_bases[source]
+                           for source, start, stop in pieces])
+    for name, _ in toolpath.RECORD_COLUMNS:
+        columns[name] = columns[name][take]
+    data = [np.asarray(tp.string_data) for tp in sources]
+    data_bases = np.cumsum([0] + [len(d) for d in data])
+    columns["string_offsets"] = np.concatenate(
+        [np.asarray(tp.string_offsets[:-1]) + base for tp, base in zip(sources, data_bases.tolist())]
+        + [np.array([data_bases[-1]])]).astype("<i8")
+    columns["string_data"] = np.concatenate(data).astype("u1")
+    columns["layer_start"] = np.array([record for record, _, _ in layer_records], dtype="<i8")
+    columns["layer_number"] = np.array([number for _, number, _ in layer_records], dtype="<i4")
+    columns["layer_z"] = np.array([z for _, _, z in layer_records], dtype="<f4")
+    metadata = {key: value for key, value in metadata.items() if value is not None}
+    metadata["source"] = ", ".join(names)
+    return {
+        "toolpath": toolpath.Toolpath(columns, metadata),
+        "parts": len(parts),
+        "layers": len(merged),
+        "part_layers": [len(layers) for layers in part_layers],
+        "travel": travel,
+        "given_travel": given_travel,
+        "orders": orders,
+    }
+
+
+def print_nest_report(result, part_estimates=None, merged_estimate=None):
+    print(f"合并 {result['parts']} 个零件 (各 {', '.join(map(str, result['part_layers']))} 层) -> "
+          f"{result['layers']} 层")
+    print(f"零件间空行程: {result['travel']:.1f} mm (按输入顺序为 {result['given_travel']:.1f} mm)")
+    if part_estimates and merged_estimate:
+        separate = sum(estimate["total_seconds"] for estimate in part_estimates)
+        merged = merged_estimate["total_seconds"]
+        print(f"预计时间: 合并后 {format_duration(merged)} ({merged:.1f} s), 逐个打印合计 "
+              f"{format_duration(separate)} ({separate:.1f} s)")
+
+
+def nest_toolpaths_report(parts, offsets, names=None, part_lift=DEFAULT_PART_LIFT, estimate=True):
+    """
+    nest_toolpaths plus the report (with the time estimates if estimate); returns the merged Toolpath.
+    """
+    result = nest_toolpaths(parts, offsets, names=names, part_lift=part_lift)
+    part_estimates = merged_estimate = None
+    if estimate:
+        part_estimates = [estimate_toolpath(tp) for tp in parts]
+        merged_estimate = estimate_toolpath(result["toolpath"])
+    print_nest_report(result, part_estimates, merged_estimate)
+    return result["toolpath"]
+
+
+def default_output_path(input_file_path):
+    return gcode_io.default_output_path(input_file_path, "_plate")
+
+
+def nest_files(input_filepaths, offsets, output_filepath=None, part_lift=DEFAULT_PART_LIFT, compact=False,
+               precision=None):
+    if output_filepath is None:
+        output_filepath = default_output_path(input_filepaths[0])
+    parts = []
+    for input_filepath in input_filepaths:
+        try:
+            parts.append(load_any_toolpath(input_filepath))
+        except FileNotFoundError:
+            print(f"错误: 文件 '{input_filepath}' 未找到。")
+            return None
+    try:
+        result = nest_toolpaths_report(parts, offsets, names=[os.path.basename(p) for p in input_filepaths],
+                                       part_lift=part_lift)
+        toolpath.write_output(result, output_filepath, compact=compact, precision=precision)
+    except Exception as e:
+        print(f"错误: 合并文件失败: {e}")
+        return None
+    print(f"处理完成！合并后的文件已保存到: {output_filepath}")
+    return output_filepath
+
+
+def main():
+    input_filepaths, offsets = [], []
+    while True:
+        path = input(f"请输入第 {len(input_filepaths) + 1} 个NC文件的完整路径 (留空结束): ").strip()
+        if not path:
+            break
+        if not os.path.isfile(path):
+            print(f"错误: 文件 '{path}' 不存在或不是一个文件。")
+            continue
+        try:
+            offset = input("请输入该零件的 XY 偏移 (mm, 如 40,0; 默认 0,0): ").strip() or "0,0"
+            dx, dy = (float(v) for v in offset.split(","))
+        except ValueError:
+            print("错误：请输入两个用逗号分隔的数字。")
+            continue
+        input_filepaths.append(path)
+        offsets.append((dx, dy))
+    if len(input_filepaths) < 2:
+        print("错误：至少需要两个文件。")
+        return
+    nest_files(input_filepaths, offsets)
+
+
+if __name__ == "__main__":
+    run_main(main)
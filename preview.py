@@ -0,0 +1,332 @@
+import math
+import os
+
+import numpy as np
+
+import gcode_io
+import toolpath
+from profiling import run_main
+from simplify import rdp_keep_mask
+from toolpath import HAS_X, HAS_Y, KIND_G0, KIND_G1, KIND_TEXT
+
+PREVIEW_EXTENSION = ".diwpv"
+PREVIEW_MAGIC = b"DIWPV\x00\x01\x00"
+DEFAULT_LOD_TOLERANCES = (0.01, 0.1, 1.0) # mm, chord tolerance of every level of detail (finest first)
+BATCH_LINES = 200000 # whole layers are collected until a batch has at least this many lines
+
+
+class Preview:
+    """
+    Levels of detail of a toolpath for viewers: per layer its number, Z, bounding box of the printed
+    moves, print and travel length and extrusion density (print length per mm² of the bounding box), and
+    per level the printed paths decimated to that level's chord tolerance. Level l stores the points of all
+    paths in points{l} (x, y pairs), the first point of every path in path_starts{l} and the first path of
+    every layer in layer_paths{l}.
+    """
+
+    def __init__(self, columns, tolerances, metadata=None):
+        self.columns = columns
+        self.tolerances = tuple(tolerances)
+        self.metadata = dict(metadata or {})
+
+    @property
+    def layer_count(self):
+        return len(self.columns["layer_number"])
+
+    def level_for(self, tolerance):
+        """
+        The coarsest level whose chord tolerance is within tolerance (e.g. the size of a pixel in mm).
+        """
+        fitting = [level for level, t in enumerate(self.tolerances) if t <= tolerance]
+        return max(fitting, key=lambda level: self.tolerances[level]) if fitting else 0
+
+    def layer_paths(self, k, level=0):
+        """
+        The printed paths of layer k at the given level, as a list of (n, 2) float32 arrays.
+        """
+        points = self.columns[f"points{level}"].reshape(-1, 2)
+        path_starts = self.columns[f"path_starts{level}"]
+        first, last = (int(v) for v in self.columns[f"layer_paths{level}"][k:k + 2])
+        bounds = np.asarray(path_starts[first:last + 1]).tolist()
+        return [points[a:b] for a, b in zip(bounds, bounds[1:])]
+
+    def layer_bbox(self, k):
+        """
+        (x min, y min, x max, y max) of the printed moves of layer k (nan if it prints nothing).
+        """
+        return tuple(float(v) for v in self.columns["layer_bbox"][4 * k:4 * k + 4])
+
+    def save(self, path):
+        header = {"layers": self.layer_count, "tolerances": list(self.tolerances), "metadata": self.metadata}
+        return toolpath.save_columns(path, PREVIEW_MAGIC, header, self.columns)
+
+
+def load_preview(path, mmap=True):
+    header, columns = toolpath.load_columns(path, PREVIEW_MAGIC, mmap=mmap, kind="预览")
+    return Preview(columns, header["tolerances"], header["metadata"])
+
+
+class PreviewBuilder:
+    """
+    Builds a Preview from NC lines as they stream past (add_line, or tee() around a line generator), so a
+    conversion can write the preview in the same pass. Lines are collected a batch of whole layers at a
+    time and every batch is packed into a Toolpath and decimated in numpy; the modal position is carried
+    from batch to batch. Arcs (G2/G3) are sampled within the finest tolerance.
+    """
+
+    def __init__(self, tolerances=DEFAULT_LOD_TOLERANCES, batch_lines=BATCH_LINES):
+        self.tolerances = tuple(sorted(tolerances))
+        self.batch_lines = batch_lines
+        self.metadata = {}
+        self._lines = []
+        self._state = np.full(2, np.nan) # x, y after the last batch
+        self._layers = {name: [] for name in ("layer_number", "layer_z", "layer_bbox", "layer_print_length",
+                                                "layer_travel_length", "layer_density")}
+        self._levels = [{"points": [], "path_starts": [], "layer_paths": []} for _ in self.tolerances]
+        self._point_counts = [0] * len(self.tolerances)
+        self._path_counts = [0] * len(self.tolerances)
+
+    def add_line(self, line):
+        """
+        Adds one NC line (with or without newline).
+        """
+        if len(self._lines) >= self.batch_lines and gcode_io.LAYER_COMMENT_PATTERN.search(line):
+            self._flush()
+        self._lines.append(line)
+
+    def tee(self, lines):
+        """
+        Yields the lines unchanged, adding each of them to the preview.
+        """
+        for line in lines:
+            self.add_line(line)
+            yield line
+
+    def add_toolpath(self, tp):
+        """
+        Adds a whole Toolpath (e.g. a loaded .diwtp), a batch of layers at a time.
+        """
+        self._flush()
+        start = 0
+        boundaries = np.asarray(tp.layer_start, dtype=np.int64)
+        while start < len(tp):
+            after = boundaries[boundaries >= start + self.batch_lines]
+            stop = int(after[0]) if len(after) else len(tp)
+            self._add_batch(tp.records(start, stop))
+            start = stop
+
+    def _flush(self):
+        if self._lines:
+            self._add_batch(toolpath.toolpath_from_nc_lines(self._lines))
+            self._lines = []
+
+    def _add_batch(self, tp):
+        if not self.metadata and tp.metadata:
+            self.metadata = dict(tp.metadata)
+        n = len(tp)
+        kind = np.asarray(tp.kind)
+        mask = np.asarray(tp.mask)
+        moves_xy = (kind != KIND_TEXT) & ((mask & (HAS_X | HAS_Y)) != 0)
+        printing = moves_xy & (kind == KIND_G1)
+        travel = moves_xy & (kind == KIND_G0)
+        xy = np.stack([np.asarray(tp.x, dtype=float), np.asarray(tp.y, dtype=float)])
+        has = np.stack([moves_xy & ((mask & HAS_X) != 0), moves_xy & ((mask & HAS_Y) != 0)])
+        # G0-G3 moves stored as text (arcs, non-canonical moves)
+        arcs = {}
+        for record in np.flatnonzero(kind == KIND_TEXT).tolist():
+            code = gcode_io.COMMENT_PATTERN.sub("", tp.string(int(tp.text[record])))
+            match = gcode_io.MOTION_PATTERN.match(code)
+            if match is None:
+                continue
+            words = {letter.upper(): float(value) for letter, value in gcode_io.WORD_PATTERN.findall(code)}
+            for axis, letter in enumerate("XY"):
+                if letter in words:
+                    xy[axis, record] = words[letter]
+                    has[axis, record] = True
+            motion = int(match.group(1))
+            moved = has[0, record] or has[1, record]
+            if motion == 0:
+                travel[record] = moved
+            else:
+                printing[record] = moved or motion > 1
+            if motion in (2, 3):
+                arcs[record] = (words.get("I", 0.0), words.get("J", 0.0), motion == 2)
+        index = np.arange(n)
+        position = np.empty((2, n))
+        for axis in range(2):
+            source = np.where(has[axis], index, -1)
+            np.maximum.accumulate(source, out=source)
+            position[axis] = np.where(source >= 0, xy[axis][np.maximum(source, 0)], self._state[axis])
+        before = np.concatenate([self._state[:, None], position[:, :-1]], axis=1)
+        if n:
+            self._state = position[:, -1].copy()
+
+        marks = np.zeros(n, dtype=np.int64)
+        marks[np.asarray(tp.layer_start, dtype=np.int64)] = 1
+        record_layer = np.cumsum(marks) - 1
+        layer_count = tp.layer_count
+        in_layer = record_layer >= 0
+        travel_records = np.flatnonzero(travel & in_layer)
+        travel_length = np.bincount(record_layer[travel_records], minlength=layer_count,
+                                    weights=np.nan_to_num(np.hypot(*(position - before)[:, travel_records])))
+
+        # printed segments: one per G1, arcs sampled within the finest tolerance
+        records = np.flatnonzero(printing & in_layer & ~np.isnan(before).any(axis=0))
+        arc_points = {record: self._sample_arc(before[:, record], position[:, record], *arcs[record])
+                      for record in records.tolist() if record in arcs}
+        reps = np.ones(len(records), dtype=np.int64)
+        if arc_points:
+            arc_rows = np.searchsorted(records, list(arc_points))
+            reps[arc_rows] = [len(p) for p in arc_points.values()]
+        segment_record = np.repeat(records, reps)
+        ends = position[:, segment_record].T.copy()
+        first_of_record = np.cumsum(reps) - reps
+        for row, samples in zip(arc_rows.tolist() if arc_points else [], arc_points.values()):
+            ends[first_of_record[row]:first_of_record[row] + len(samples)] = samples
+        starts = np.empty_like(ends)
+        starts[1:] = ends[:-1]
+        starts[first_of_record] = before[:, records].T
+        print_length = np.bincount(record_layer[segment_record], minlength=layer_count,
+                                   weights=np.hypot(*(ends - starts).T))
+
+        # paths: runs of printed segments in one layer without a travel move in between
+        travels_before = np.cumsum(travel)
+        new_path = np.ones(len(segment_record), dtype=bool)
+        new_path[1:] = ((record_layer[segment_record[1:]] != record_layer[segment_record[:-1]])
+                        | (travels_before[segment_record[1:]] != travels_before[segment_record[:-1]])
+                        | np.any(ends[:-1] != starts[1:], axis=1))
+        path_id = np.cumsum(new_path) - 1
+        path_count = int(path_id[-1]) + 1 if len(path_id) else 0
+        points = np.empty((len(segment_record) + path_count, 2))
+        start_index = np.flatnonzero(new_path) + np.arange(path_count)
+        points[np.arange(len(segment_record)) + path_id + 1] = ends
+        points[start_index] = starts[new_path]
+        path_layer = record_layer[segment_record[new_path]]
+
+        bbox = np.full((layer_count, 4), np.nan)
+        if len(points):
+            point_layer = np.repeat(path_layer, np.diff(np.append(start_index, len(points))))
+            lo = np.full((layer_count, 2), np.inf)
+            hi = np.full((layer_count, 2), -np.inf)
+            np.minimum.at(lo, point_layer, points)
+            np.maximum.at(hi, point_layer, points)
+            found = np.isfinite(lo[:, 0])
+            bbox[found] = np.concatenate([lo, hi], axis=1)[found]
+        area = (bbox[:, 2] - bbox[:, 0]) * (bbox[:, 3] - bbox[:, 1])
+        density = np.divide(print_length, area, out=np.zeros(layer_count), where=area > 0)
+
+        layers = self._layers
+        layers["layer_number"].append(np.asarray(tp.layer_number, dtype="<i4"))
+        layers["layer_z"].append(np.asarray(tp.layer_z, dtype="<f4"))
+        layers["layer_bbox"].append(bbox.astype("<f4").ravel())
+        layers["layer_print_length"].append(print_length.astype("<f4"))
+        layers["layer_travel_length"].append(travel_length.astype("<f4"))
+        layers["layer_density"].append(density.astype("<f4"))
+        layer_first_path = np.searchsorted(path_layer, np.arange(layer_count))
+        # every level is decimated from the previous (finer) one, which is much faster on long paths; the
+        # error of a level stays below its tolerance plus that of the level before
+        for level, tolerance in enumerate(self.tolerances):
+            if len(points):
+                range_ends = np.append(start_index[1:], len(points)) - 1
+                keep = rdp_keep_mask(points, start_index, range_ends, tolerance)
+                start_index = (np.cumsum(keep) - keep)[start_index]
+                points = points[keep]
+            data = self._levels[level]
+            data["points"].append(points.astype("<f4").ravel())
+            data["path_starts"].append(start_index + self._point_counts[level])
+            data["layer_paths"].append(layer_first_path + self._path_counts[level])
+            self._point_counts[level] += len(points)
+            self._path_counts[level] += path_count
+
+    def _sample_arc(self, start, end, i, j, clockwise):
+        """
+        Points (k, 2) along the arc from start to end around start + (i, j), ending exactly at end, with
+        chords within the finest tolerance.
+        """
+        centre = start + (i, j)
+        radius = math.hypot(i, j)
+        a0 = math.atan2(start[1] - centre[1], start[0] - centre[0])
+        a1 = math.atan2(end[1] - centre[1], end[0] - centre[0])
+        sweep = (a0 - a1) % (2 * math.pi) if clockwise else (a1 - a0) % (2 * math.pi)
+        if sweep < 1e-9:
+            sweep = 2 * math.pi
+        tolerance = self.tolerances[0]
+        step = 2 * math.acos(1 - tolerance / radius) if radius > tolerance else math.pi / 2
+        count = max(int(math.ceil(sweep / step)), 1)
+        angles = a0 + (-sweep if clockwise else sweep) * np.arange(1, count + 1) / count
+        samples = centre + radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        samples[-1] = end
+        return samples
+
+    def finish(self):
+        """
+        Adds the lines still pending and returns the Preview.
+        """
+        self._flush()
+        columns = {name: np.concatenate(parts).astype(parts[0].dtype) if parts else np.zeros(0, "<f4")
+                   for name, parts in self._layers.items()}
+        columns["layer_number"] = columns["layer_number"].astype("<i4")
+        for level, data in enumerate(self._levels):
+            columns[f"points{level}"] = np.concatenate(data["points"] or [np.zeros(0)]).astype("<f4")
+            columns[f"path_starts{level}"] = np.append(
+                np.concatenate(data["path_starts"] or [np.zeros(0)]), self._point_counts[level]).astype("<i8")
+            columns[f"layer_paths{level}"] = np.append(
+                np.concatenate(data["layer_paths"] or [np.zeros(0)]), self._path_counts[level]).astype("<i8")
+        return Preview(columns, self.tolerances, self.metadata)
+
+
+def preview_path(nc_path):
+    """
+    part.nc (or part.nc.gz, part.diwtp) -> part.diwpv next to it.
+    """
+    base, _ = gcode_io.split_compression_suffix(nc_path)
+    return os.path.splitext(base)[0] + PREVIEW_EXTENSION
+
+
+def print_preview_report(preview, path=None):
+    levels = ", ".join(f"{t:g} mm: {len(preview.columns[f'points{level}']) // 2} 点"
+                       for level, t in enumerate(preview.tolerances))
+    paths = len(preview.columns["path_starts0"]) - 1
+    print(f"预览: {preview.layer_count} 层, {paths} 条路径; 细节级别 {levels}")
+    if path is not None and os.path.isfile(path):
+        print(f"预览文件大小 {os.path.getsize(path) / 1024:.1f} KiB")
+
+
+def build_preview(input_filepath, tolerances=DEFAULT_LOD_TOLERANCES):
+    builder = PreviewBuilder(tolerances)
+    if gcode_io.is_toolpath_file(input_filepath):
+        builder.add_toolpath(toolpath.load_toolpath(input_filepath))
+    else:
+        with gcode_io.open_input(input_filepath) as f:
+            for line in f:
+                builder.add_line(line)
+    return builder.finish()
+
+
+def preview_file(input_filepath, output_filepath=None, tolerances=DEFAULT_LOD_TOLERANCES):
+    if output_filepath is None:
+        output_filepath = preview_path(input_filepath)
+    try:
+        preview = build_preview(input_filepath, tolerances)
+        preview.save(output_filepath)
+    except FileNotFoundError:
+        print(f"错误: 文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"错误: 处理文件 '{input_filepath}' 失败: {e}")
+        return None
+    print_preview_report(preview, output_filepath)
+    print(f"处理完成！预览文件已保存到: {output_filepath}")
+    return output_filepath
+
+
+def main():
+    input_file_path = input("请输入NC文件的完整路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    preview_file(input_file_path)
+
+
+if __name__ == "__main__":
+    run_main(main)
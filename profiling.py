@@ -0,0 +1,106 @@
+import argparse
+import cProfile
+import pstats
+import sys
+import tracemalloc
+
+
+def add_profiling_arguments(parser):
+    """
+    Adds the shared --profile / --trace-memory options to an argparse parser.
+    """
+    group = parser.add_argument_group("性能分析 (profiling)")
+    group.add_argument("--profile", nargs="?", const="-", default=None, metavar="FILE",
+                       help="使用 cProfile 分析本次运行; 指定 FILE 时同时保存原始 pstats 数据")
+    group.add_argument("--profile-sort", default="cumulative", metavar="KEY",
+                       help="cProfile 统计的排序字段 (默认 cumulative)")
+    group.add_argument("--profile-limit", type=int, default=30, metavar="N",
+                       help="打印的 cProfile 函数条数 (默认 30)")
+    group.add_argument("--trace-memory", nargs="?", type=int, const=15, default=None, metavar="N",
+                       help="使用 tracemalloc 跟踪内存, 打印前 N 个分配位置 (默认 15)")
+    return parser
+
+
+def parse_profiling_args(argv=None):
+    """
+    Picks the profiling options out of argv, leaving everything else alone.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_profiling_arguments(parser)
+    options, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    return options
+
+
+def run_profiled(func, *args, profile=None, profile_sort="cumulative", profile_limit=30,
+                 trace_memory=None, report_stream=None, **kwargs):
+    """
+    Runs func(*args, **kwargs) under cProfile and/or tracemalloc.
+
+    Reports go to stderr by default so they never mix with G-code written to stdout.
+    The reports are printed even if func raises.
+    """
+    if report_stream is None:
+        report_stream = sys.stderr
+    if profile is None and trace_memory is None:
+        return func(*args, **kwargs)
+
+    profiler = cProfile.Profile() if profile is not None else None
+    if trace_memory is not None:
+        tracemalloc.start()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    finally:
+        if trace_memory is not None:
+            snapshot = tracemalloc.take_snapshot()
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _report_memory(snapshot, current_bytes, peak_bytes, trace_memory, report_stream)
+        if profiler is not None:
+            _report_profile(profiler, profile, profile_sort, profile_limit, report_stream)
+
+
+def run_main(func, argv=None):
+    """
+    Entry-point helper: reads the profiling options from argv and runs func() with them.
+    """
+    options = parse_profiling_args(argv)
+    return run_profiled(
+        func,
+        profile=options.profile,
+        profile_sort=options.profile_sort,
+        profile_limit=options.profile_limit,
+        trace_memory=options.trace_memory,
+    )
+
+
+def _report_profile(profiler, profile_path, sort_key, limit, stream):
+    print("\n===== cProfile 统计 =====", file=stream)
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats(sort_key).print_stats(limit)
+    if profile_path and profile_path != "-":
+        try:
+            profiler.dump_stats(profile_path)
+            print(f"cProfile 原始数据已保存到: {profile_path}", file=stream)
+        except OSError as e:
+            print(f"错误: 无法保存 cProfile 数据到 '{profile_path}': {e}", file=stream)
+
+
+def _report_memory(snapshot, current_bytes, peak_bytes, limit, stream):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    print("\n===== tracemalloc 内存统计 =====", file=stream)
+    print(f"当前占用: {current_bytes / 1024:.1f} KiB, 峰值: {peak_bytes / 1024:.1f} KiB", file=stream)
+    print(f"前 {limit} 个分配位置:", file=stream)
+    for rank, stat in enumerate(snapshot.statistics("lineno")[:limit], start=1):
+        frame = stat.traceback[0]
+        print(f"  #{rank:<3} {frame.filename}:{frame.lineno}: "
+              f"{stat.size / 1024:.1f} KiB in {stat.count} blocks", file=stream)
@@ -2,6 +2,9 @@ import numpy as np
 from stl import mesh
 import os
 
+import meshcheck
+from profiling import run_main
+
 # Helper function to create faces for a quadrilateral (four vertices in CCW order)
 def make_quad_faces(v0_idx, v1_idx, v2_idx, v3_idx):
     return [np.array([v0_idx, v1_idx, v2_idx]), np.array([v0_idx, v2_idx, v3_idx])]
@@ -71,6 +74,78 @@ def create_solid_cuboid_faces():
     faces.extend(make_quad_faces(3,0,4,7)) 
     return faces
 
+def _square_corners(side):
+    half = side / 2.0
+    return [(-half, -half), (half, -half), (half, half), (-half, half)]
+
+
+def create_stepped_shell(layer_footprints):
+    """
+    One closed outer shell for stacked square layers, given as (inner_side, outer_side, z_bottom, z_top)
+    from bottom to top (inner_side 0 for a solid layer). Only the exposed surface is generated: the outer
+    and inner walls, with the walls of consecutive layers of the same size merged, and at every layer
+    interface the ledges where exactly one of the two layers is solid (facing up or down). Vertices are
+    shared, so the faces of coincident edges line up. Returns (vertices (n, 3), faces (m, 3)).
+    """
+    vertex_index = {}
+    faces = []
+
+    def vertex(x, y, z):
+        return vertex_index.setdefault((x, y, z), len(vertex_index))
+
+    def add_quad(a, b, c, d):
+        faces.append((a, b, c))
+        faces.append((a, c, d))
+
+    def add_wall(side, z_bottom, z_top, outward):
+        corners = _square_corners(side)
+        for i in range(4):
+            (x0, y0), (x1, y1) = corners[i], corners[(i + 1) % 4]
+            quad = (vertex(x0, y0, z_bottom), vertex(x1, y1, z_bottom), vertex(x1, y1, z_top), vertex(x0, y0, z_top))
+            add_quad(*(quad if outward else quad[::-1]))
+
+    def add_ledge(inner_side, outer_side, z, up):
+        outer = [vertex(x, y, z) for x, y in _square_corners(outer_side)]
+        if inner_side == 0:
+            add_quad(*(outer if up else outer[::-1]))
+            return
+        inner = [vertex(x, y, z) for x, y in _square_corners(inner_side)]
+        for i in range(4):
+            quad = (outer[i], outer[(i + 1) % 4], inner[(i + 1) % 4], inner[i])
+            add_quad(*(quad if up else quad[::-1]))
+
+    # walls: runs of layers with the same side become one wall
+    for side_index, outward in ((1, True), (0, False)):
+        run_start = None
+        for k, footprint in enumerate(layer_footprints):
+            side = footprint[side_index]
+            if run_start is None:
+                run_start = k
+            following = layer_footprints[k + 1][side_index] if k + 1 < len(layer_footprints) else None
+            if following != side:
+                if side > 0:
+                    add_wall(side, layer_footprints[run_start][2], footprint[3], outward)
+                run_start = None
+
+    # horizontal faces at the bottom, at every interface and at the top
+    empty = (0.0, 0.0)
+    for k in range(len(layer_footprints) + 1):
+        below = layer_footprints[k - 1][:2] if k > 0 else empty
+        above = layer_footprints[k][:2] if k < len(layer_footprints) else empty
+        z = layer_footprints[k][2] if k < len(layer_footprints) else layer_footprints[-1][3]
+        sides = sorted({0.0, *below, *above})
+        for a, b in zip(sides, sides[1:]):
+            solid_below = below[0] <= a and b <= below[1]
+            solid_above = above[0] <= a and b <= above[1]
+            if solid_below != solid_above:
+                add_ledge(a, b, z, up=solid_below)
+
+    vertices = np.zeros((len(vertex_index), 3))
+    for (x, y, z), i in vertex_index.items():
+        vertices[i] = (x, y, z)
+    return vertices, np.array(faces, dtype=np.int64)
+
+
 def main():
     print("--- 中空四边形金字塔 STL 生成器 (V5) ---")
     print("所有长度单位均为毫米 (mm)。")
@@ -81,28 +156,43 @@ def main():
     except ValueError:
         print("输入无效，请输入数字。")
         return
+    shell_only = input("只生成外壳 (去掉层间重合的内部面)? (y/N): ").strip().lower() == "y"
+
+    generate_pyramid(x_param, r_param, y_param, shell_only=shell_only)
 
+
+def generate_pyramid(x_param, r_param, y_param, output_dir="/Users/ericxu/Downloads/", output_path=None,
+                     shell_only=False, allow_invalid_mesh=False):
+    """
+    Generates the hollow stepped pyramid STL for wall thickness/layer height x, base inner side r and indent y.
+    output_path may be a file path or a binary stream; by default the file is named after r and the layer count
+    inside output_dir. Returns the output path (or stream), or None on failure.
+    With shell_only the layers are not written as separate closed rings but as one watertight shell without
+    the coincident faces between layers (see create_stepped_shell). The mesh is checked (meshcheck.py)
+    before it is saved. The stacked rings are saved with a warning if they fail the check; a shell that
+    fails it is not saved unless allow_invalid_mesh is set.
+    """
     if x_param <= 0:
         print("错误：壁厚和层高 x 必须大于 0 mm。")
-        return
+        return None
     if r_param <= 0: 
         print("错误：底层内正方形边长 r 必须大于 0 mm。") # Though technically it could be very small
-        return
+        return None
     if y_param < 0: 
         print("错误：每层缩进值 y 不能为负数。")
-        return
+        return None
 
-    output_dir = "/Users/ericxu/Downloads/"
-    if not os.path.exists(output_dir):
+    if output_path is None and not os.path.exists(output_dir):
         try:
             os.makedirs(output_dir)
             print(f"已创建输出文件夹: {output_dir}")
         except OSError as e:
             print(f"错误：无法创建输出文件夹 {output_dir}: {e}")
-            return
+            return None
 
     all_vertices_list = []
     all_faces_list = []
+    layer_footprints = [] # (inner_side, outer_side, z_bottom, z_top) of every layer, for shell_only
     vertex_offset = 0
     
     current_layer_idx = 1
@@ -143,6 +233,7 @@ def main():
             print(f"        生成实心六面体: 底边长 {top_cuboid_actual_side_length:.2f}mm, 高 {x_param:.2f}mm。")
             layer_vertices_local = create_solid_cuboid_vertices(top_cuboid_actual_side_length, z_bottom, z_top)
             layer_faces_local_indices = create_solid_cuboid_faces()
+            layer_footprint = (0.0, top_cuboid_actual_side_length)
 
         # Condition 2: If NOT the top solid layer, can it be a HOLLOW layer?
         # True if potential_outer_side > threshold AND current_inner_r for *this* layer is positive.
@@ -154,6 +245,7 @@ def main():
                 print(f"        内边长 ({current_inner_r:.2f}mm) > 0mm。")
                 layer_vertices_local = create_hollow_layer_vertices(current_inner_r, actual_outer_side_for_hollow, z_bottom, z_top)
                 layer_faces_local_indices = create_hollow_layer_faces()
+                layer_footprint = (current_inner_r, actual_outer_side_for_hollow)
             else: # Cannot be hollow because inner_r is not positive (and it wasn't a top layer)
                 print(f"  终止: 第 {current_layer_idx} 层不是顶层 (外边长 "
                       f"{potential_outer_side_of_layer:.2f}mm > {top_layer_outer_threshold_mm}mm)。")
@@ -181,6 +273,7 @@ def main():
                 global_face_indices = [idx + vertex_offset for idx in face_indices]
                 all_faces_list.append(np.array(global_face_indices))
             vertex_offset += len(layer_vertices_local)
+            layer_footprints.append((*layer_footprint, z_bottom, z_top))
             n_total_completed_layers = current_layer_idx
         else:
             # This should not be reached if breaks are working correctly, but as a safeguard:
@@ -206,7 +299,7 @@ def main():
         # Only print this if no layers were made and no specific termination message already printed.
         # Most termination messages are now within the loop.
         print("最终：未能生成任何几何数据。请检查输入参数是否合理。")
-        return
+        return None
     elif not all_vertices_list and n_total_completed_layers > 0 :
         # Should ideally not happen if n_total_completed_layers is only incremented when geometry is added
         print("警告：层数计数与实际几何数据不符。")
@@ -215,25 +308,48 @@ def main():
     if not all_vertices_list: # Final check if really nothing was generated
         if n_total_completed_layers == 0: # To avoid double message if already printed
              print("最终：确实未能生成任何几何数据。")
-        return
+        return None
 
 
     final_vertices_np = np.array(all_vertices_list)
     final_faces_np = np.array(all_faces_list)
+    if shell_only:
+        final_vertices_np, final_faces_np = create_stepped_shell(layer_footprints)
+        print(f"外壳模式: {len(final_faces_np)} 个三角形 (分层模式 {len(all_faces_list)} 个)。")
+        mesh_report = meshcheck.validate_mesh(final_vertices_np, final_faces_np)
+    else:
+        # the rings do not share vertices: weld them by position to find the coincident faces
+        mesh_report = meshcheck.validate_triangles(final_vertices_np[final_faces_np])
+    meshcheck.print_mesh_report(mesh_report)
+    if not shell_only:
+        # the stacked rings are saved as before; the check compares edges, so rings that only touch the
+        # layer below over part of a face (y > 0) pass, and rings of the same size (y = 0) fail
+        if mesh_report["closed_manifold"]:
+            print("注意: 分层模式的每层是独立的闭合环, 与相邻层上下面接触; 网格检查只比较边, 有缩进时因此能通过, "
+                  "并不说明层间没有接触面。需要单一封闭外壳请使用外壳模式。")
+        else:
+            print("警告: 网格检查未通过 (相邻层的环有重合面), 仍按分层模式保存 STL; 外壳模式可生成封闭流形。")
+    elif not mesh_report["closed_manifold"] and not allow_invalid_mesh:
+        print("错误: 外壳网格检查未通过, 未保存 STL 文件 (确需保存请使用 --allow-invalid-mesh 或 allow_invalid_mesh=True)。")
+        return None
 
     pyramid_stl_mesh = mesh.Mesh(np.zeros(final_faces_np.shape[0], dtype=mesh.Mesh.dtype))
-    for i, f_indices in enumerate(final_faces_np):
-        for j in range(3): 
-            pyramid_stl_mesh.vectors[i][j] = final_vertices_np[f_indices[j],:]
+    pyramid_stl_mesh.vectors[:] = final_vertices_np[final_faces_np]
 
-    r_for_filename = str(r_param).replace('.', '_')
-    filename = os.path.join(output_dir, f"pyramid_{r_for_filename}_{n_total_completed_layers}.stl")
+    if output_path is None:
+        r_for_filename = str(r_param).replace('.', '_')
+        output_path = os.path.join(output_dir, f"pyramid_{r_for_filename}_{n_total_completed_layers}.stl")
     
     try:
-        pyramid_stl_mesh.save(filename)
-        print(f"\nSTL 文件已成功保存到: {filename}")
+        if hasattr(output_path, "write"):
+            pyramid_stl_mesh.save(f"pyramid_{n_total_completed_layers}.stl", fh=output_path)
+        else:
+            pyramid_stl_mesh.save(output_path)
+            print(f"\nSTL 文件已成功保存到: {output_path}")
+        return output_path
     except Exception as e:
         print(f"\n错误：保存 STL 文件失败: {e}")
+        return None
 
 if __name__ == '__main__':
-    main()
+    run_main(main)
@@ -0,0 +1,580 @@
+import collections
+import itertools
+import math
+import random
+import sys
+
+import gcode_io
+from profiling import run_main
+
+ROUNDS = 5 # random programs per check, seeds 0..ROUNDS-1
+
+
+def _first_difference(expected, actual):
+    """
+    Describes the first line where actual differs from expected, or returns None if they are equal.
+    """
+    for index, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            return f"第 {index + 1} 行不同: {a!r} != {b!r}"
+    if len(expected) != len(actual):
+        return f"行数不同: {len(expected)} != {len(actual)}"
+    return None
+
+
+def _random_marlin_lines(rng, layers=6, moves_per_layer=60):
+    """
+    A small Marlin program in the style of the slicers (with newlines): extrusion moves, travels,
+    retractions, Z hops, E resets, comments and blank lines, and now and then an M30 before the end.
+    """
+    lines = [";FLAVOR:Marlin", "M140 S60", "M104 S200", "M82 ;absolute extrusion mode", "G28 ;Home", "G92 E0",
+             "G1 Z2.0 F3000", f";LAYER_COUNT:{layers}"]
+    e = 0.0
+    for layer in range(layers):
+        z = 0.2 * (layer + 1)
+        lines.append(f";LAYER:{layer}")
+        lines.append(f"G0 F6000 X{rng.uniform(0, 50):.3f} Y{rng.uniform(0, 50):.3f} Z{z:.3f}")
+        for _ in range(moves_per_layer):
+            choice = rng.random()
+            if choice < 0.05:
+                lines.append(f"G1 F2400 E{e - 1:.5f}")
+            elif choice < 0.12:
+                lines.append(f"G0 X{rng.uniform(0, 50):.3f} Y{rng.uniform(0, 50):.3f}")
+            elif choice < 0.15:
+                lines.append(f"G1 Z{z + 0.4:.3f} F3000")
+                lines.append(f"G0 X{rng.uniform(0, 50):.3f} Y{rng.uniform(0, 50):.3f}")
+                lines.append(f"G1 Z{z:.3f}")
+            elif choice < 0.17:
+                lines.append("G92 E0")
+                e = 0.0
+            elif choice < 0.19:
+                lines.append(rng.choice(("", ";TYPE:FILL", "M106 S255")))
+            else:
+                e += rng.uniform(0.01, 0.2)
+                lines.append(f"G1 F{rng.choice((900, 1200, 1500))} X{rng.uniform(0, 50):.3f} "
+                             f"Y{rng.uniform(0, 50):.3f} E{e:.5f} ;move")
+        if rng.random() < 0.1:
+            lines.append("M30")
+    lines += ["M107", "G1 Z10 F3000", "M84"]
+    return [line + "\n" for line in lines]
+
+
+def check_parallel_parsing(rng):
+    """
+    transGcode.convert_marlin_lines with workers=3 and chunks of a few lines (so that layers, Z hops and
+    M30 fall across chunk boundaries) against the sequential conversion.
+    """
+    import transGcode
+
+    lines = _random_marlin_lines(rng)
+    args = ("part.gcode", rng.choice((0.2, 0.5)), rng.choice((None, 1000.0)), rng.choice((None, 300.0)), 1750.0)
+    sequential = list(transGcode.convert_marlin_lines(iter(lines), *args))
+    saved_chunk_lines = transGcode.PARALLEL_CHUNK_LINES
+    transGcode.PARALLEL_CHUNK_LINES = rng.randint(1, 9)
+    try:
+        parallel = list(transGcode.convert_marlin_lines(iter(lines), *args, workers=3))
+    finally:
+        transGcode.PARALLEL_CHUNK_LINES = saved_chunk_lines
+    return _first_difference(sequential, parallel)
+
+
+def _random_nc_lines(rng, layers=4, islands=30, moves=8):
+    """
+    An NC program in the format of the converters (without newlines): per layer a run of islands, each a
+    G0 travel and a chain of up to moves G1 moves along a wandering curve, some without F or Y, with
+    comments or after a dwell.
+    """
+    lines = ["G21", "G90", "; (User-defined layer height for Z calculation: 0.500mm)", "", ""]
+    z = 0.0
+    for layer in range(1, layers + 1):
+        z = 0.5 * layer
+        lines.append(f"; (--- Layer {layer} @ Z={z:.3f} ---)")
+        for island in range(islands):
+            x, y = rng.uniform(0, 80), rng.uniform(0, 80)
+            if rng.random() < 0.03:
+                lines.append("G4 P0.2")
+            lines.append(f"G0 X{x:.3f} Y{y:.3f}" + (f" Z{z:.3f}" if island == 0 else "") + " F1750")
+            heading = rng.uniform(0, 2 * math.pi)
+            for _ in range(rng.randint(1, moves)):
+                choice = rng.random()
+                heading += rng.gauss(0, 0.3)
+                step = rng.uniform(0.2, 3)
+                x += step * math.cos(heading)
+                if choice < 0.05:
+                    lines.append(f"G1 X{x:.3f} F600")
+                    continue
+                y += step * math.sin(heading)
+                if choice < 0.1:
+                    lines.append(f"G1 X{x:.3f} Y{y:.3f}")
+                elif choice < 0.13:
+                    lines.append("; note")
+                    lines.append(f"G1 X{x:.3f} Y{y:.3f} F600")
+                elif choice < 0.16:
+                    lines.append(f"G1 X{x:.3f} Y{y:.3f} F900 ; fast")
+                else:
+                    lines.append(f"G1 X{x:.3f} Y{y:.3f} F600")
+    lines += ["", f"G0 Z{z + 10:.3f} F1750 ; Final safe Z lift", "G0 X0 Y0 F1750 ; Optional: Return to origin",
+              "M30 ; Program End"]
+    return lines
+
+
+def _machine_layers(lines):
+    """
+    What the machine does in every layer of an absolute NC program, read line by line:
+    {layer: {"segments": Counter of printed G1 segments (end points in either order, feedrate),
+    "travel": G0 XY distance, "barriers": the other commands in order, "comments": Counter of the comment
+    and blank lines}}.
+    """
+    layers = collections.defaultdict(lambda: {"segments": collections.Counter(), "travel": 0.0, "barriers": [],
+                                              "comments": collections.Counter()})
+    layer, position, feed = 0, None, None
+    for line in lines:
+        match = gcode_io.LAYER_COMMENT_PATTERN.match(line)
+        if match:
+            layer = int(match.group(1))
+        code = gcode_io.COMMENT_PATTERN.sub("", line).strip().upper()
+        if not code:
+            layers[layer]["comments"][line] += 1
+            continue
+        words = {letter: float(value) for letter, value in gcode_io.WORD_PATTERN.findall(code)}
+        motion = words.get("G")
+        if "F" in words:
+            feed = words["F"]
+        if motion not in (0, 1) or ("X" not in words and "Y" not in words):
+            layers[layer]["barriers"].append(line)
+            if motion == 92:
+                position = None
+            continue
+        if position is None and not ("X" in words and "Y" in words):
+            layers[layer]["barriers"].append(line)
+            continue
+        target = (round(words["X"], 3) if "X" in words else position[0],
+                  round(words["Y"], 3) if "Y" in words else position[1])
+        if "Z" in words:
+            layers[layer]["barriers"].append(line)
+        if position is not None and motion == 0:
+            layers[layer]["travel"] += math.hypot(target[0] - position[0], target[1] - position[1])
+        elif position is not None and "Z" not in words:
+            layers[layer]["segments"][(min(position, target), max(position, target), feed)] += 1
+        position = target
+    return layers
+
+
+def check_travel_optimization(rng):
+    """
+    travel.optimize_travel_lines against a line-by-line reading of its input and output: every layer
+    prints the same G1 segments at the same feedrates with the same other commands in the same order, the
+    G0 travel of the program is not longer (one layer may travel further when the end of the layer before
+    moved closer to the next one), and the reported travel before and after is the one measured here.
+    """
+    import travel
+
+    lines = _random_nc_lines(rng)
+    stats = {}
+    output = list(travel.optimize_travel_lines(lines, reverse_chains=rng.random() < 0.7, two_opt=rng.random() < 0.7,
+                                               stats=stats))
+    before, after = _machine_layers(lines), _machine_layers(output)
+    if sorted(before) != sorted(after):
+        return f"层不同: {sorted(before)} != {sorted(after)}"
+    for layer in sorted(before):
+        old, new = before[layer], after[layer]
+        for key, name in (("segments", "打印段"), ("barriers", "其他指令"), ("comments", "注释")):
+            if old[key] != new[key]:
+                return f"第 {layer} 层的{name}不同"
+        reported = stats.get(layer, [0.0, 0.0])
+        if abs(reported[0] - old["travel"]) > 1e-6 or abs(reported[1] - new["travel"]) > 1e-6:
+            return (f"第 {layer} 层报告的空行程 {reported[0]:.3f} -> {reported[1]:.3f} mm, "
+                    f"实际 {old['travel']:.3f} -> {new['travel']:.3f} mm")
+    old_travel = sum(layer["travel"] for layer in before.values())
+    new_travel = sum(layer["travel"] for layer in after.values())
+    if new_travel > old_travel + 1e-6:
+        return f"空行程变长: {old_travel:.3f} -> {new_travel:.3f} mm"
+    return None
+
+
+def _reference_rdp(points, first, last, tolerance, keep):
+    """
+    Textbook recursive Ramer-Douglas-Peucker of points[first..last] (list of (x, y)); marks the kept
+    interior points in keep.
+    """
+    if last - first < 2:
+        return
+    farthest, farthest_distance = None, -1.0
+    for k in range(first + 1, last):
+        distance = _segment_distance(points[k], points[first], points[last])
+        if distance > farthest_distance:
+            farthest, farthest_distance = k, distance
+    if farthest_distance > tolerance:
+        keep[farthest] = True
+        _reference_rdp(points, first, farthest, tolerance, keep)
+        _reference_rdp(points, farthest, last, tolerance, keep)
+
+
+def _segment_distance(point, a, b):
+    abx, aby = b[0] - a[0], b[1] - a[1]
+    length2 = abx * abx + aby * aby
+    t = ((point[0] - a[0]) * abx + (point[1] - a[1]) * aby) / length2 if length2 > 0 else 0.0
+    t = min(max(t, 0.0), 1.0)
+    return math.hypot(point[0] - (a[0] + t * abx), point[1] - (a[1] + t * aby))
+
+
+def _dropped_lines(lines, output):
+    """
+    Indices of the lines left out of output, or None if output is not lines with some lines left out.
+    """
+    dropped, j = [], 0
+    for i, line in enumerate(lines):
+        if j < len(output) and output[j] == line:
+            j += 1
+        else:
+            dropped.append(i)
+    return dropped if j == len(output) else None
+
+
+def check_simplification(rng):
+    """
+    simplify.rdp_keep_mask (all polylines at once) against a recursive Ramer-Douglas-Peucker per polyline,
+    and simplify.simplify_lines against a line-by-line reading of its input and output: only G1 lines
+    are left out, each of them within the tolerance of the kept move that replaces it and at its feedrate,
+    the reported counts match, and batches of one layer give the same output as one batch.
+    """
+    import numpy as np
+    import simplify
+
+    tolerance = rng.choice((0.0, 0.01, 0.2, 1.0))
+    polylines = [[(rng.uniform(0, 5), rng.uniform(0, 5))] for _ in range(20)]
+    for polyline in polylines:
+        heading = rng.uniform(0, 2 * math.pi)
+        for _ in range(rng.randint(1, 40)):
+            heading += rng.gauss(0, 0.3)
+            x, y = polyline[-1]
+            polyline.append((x + math.cos(heading), y + math.sin(heading)))
+    points = [point for polyline in polylines for point in polyline]
+    range_ends = list(itertools.accumulate(len(polyline) for polyline in polylines))
+    range_starts = [0] + range_ends[:-1]
+    range_ends = [end - 1 for end in range_ends]
+    expected = [False] * len(points)
+    for first, last in zip(range_starts, range_ends):
+        expected[first] = expected[last] = True
+        _reference_rdp(points, first, last, tolerance, expected)
+    keep = simplify.rdp_keep_mask(np.array(points), range_starts, range_ends, tolerance).tolist()
+    if keep != expected:
+        return f"rdp_keep_mask 与递归 RDP 的结果不同 (公差 {tolerance:g} mm)"
+
+    lines = _random_nc_lines(rng, moves=40)
+    stats = {}
+    output = list(simplify.simplify_lines(lines, tolerance=tolerance, stats=stats))
+    saved_batch_lines = simplify.BATCH_LINES
+    simplify.BATCH_LINES = 1
+    try:
+        difference = _first_difference(output, list(simplify.simplify_lines(lines, tolerance=tolerance)))
+    finally:
+        simplify.BATCH_LINES = saved_batch_lines
+    if difference is not None:
+        return f"逐层分批与整体处理的结果不同: {difference}"
+    dropped = _dropped_lines(lines, output)
+    if dropped is None:
+        return "输出不是输入删去若干行的结果"
+    if sum(before - after for before, after in stats.values()) != len(dropped):
+        return f"报告删去 {sum(b - a for b, a in stats.values())} 段, 实际删去 {len(dropped)} 行"
+    # the position and feedrate before every input line
+    positions, feeds, position, feed = [], [], None, None
+    for line in lines:
+        positions.append(position)
+        feeds.append(feed)
+        words = dict(gcode_io.WORD_PATTERN.findall(gcode_io.COMMENT_PATTERN.sub("", line).upper()))
+        if "F" in words:
+            feed = float(words["F"])
+        if "X" in words or "Y" in words:
+            position = (float(words.get("X", position[0] if position else 0.0)),
+                        float(words.get("Y", position[1] if position else 0.0)))
+    positions.append(position)
+    feeds.append(feed)
+    dropped_set = set(dropped)
+    for i in dropped:
+        words = dict(gcode_io.WORD_PATTERN.findall(lines[i].upper()))
+        if words.get("G") != "1" or "Z" in words:
+            return f"删去了非 G1 的行: {lines[i]!r}"
+        if i - 1 in dropped_set:
+            continue
+        end = i
+        while end in dropped_set:
+            end += 1
+        # the kept move after the dropped run draws the chord from the start of the run to its end
+        if feeds[end + 1] != feeds[i + 1]:
+            return f"删去的行 {lines[i]!r} 与替代它的行 {lines[end]!r} 的进给速度不同"
+        for k in range(i, end):
+            distance = _segment_distance(positions[k + 1], positions[i], positions[end + 1])
+            if distance > tolerance + 1e-9:
+                return f"删去的行 {lines[k]!r} 离替代它的移动 {distance:.4f} mm, 超过公差 {tolerance:g} mm"
+    return None
+
+
+def _random_motion_lines(rng, layers=3, moves=150):
+    """
+    An NC program of G0, G1 and arc moves (some before any F, some that do not move, some changing Z)
+    with dwells and M codes in between, for the time estimate. Coordinates are multiples of 1/256 mm,
+    which the float32 columns of a Toolpath hold exactly.
+    """
+    lines = ["G21", "G90", "G0 X1.000 Y1.000"]
+    x = y = 1.0
+    for layer in range(1, layers + 1):
+        lines.append(f"; (--- Layer {layer} @ Z={0.5 * layer:.3f} ---)")
+        heading = rng.uniform(0, 2 * math.pi)
+        for _ in range(moves):
+            choice = rng.random()
+            if choice < 0.03:
+                lines.append(rng.choice(("G4 P0.5", "M400", "M106 S255")))
+                continue
+            feed = f" F{rng.choice((300, 600, 1200, 3000))}" if rng.random() < 0.3 else ""
+            if choice < 0.08:
+                lines.append(f"G1 X{x} Y{y}{feed}") # does not move
+                continue
+            if choice < 0.15:
+                # an arc around a centre next to the current point, ending on the same circle
+                i, j = rng.uniform(-4, 4), rng.uniform(-4, 4)
+                radius = math.hypot(i, j)
+                angle = math.atan2(-j, -i) + rng.uniform(-3, 3)
+                x, y = round((x + i + radius * math.cos(angle)) * 256) / 256, round((y + j + radius * math.sin(angle)) * 256) / 256
+                lines.append(f"G{rng.choice((2, 3))} X{x} Y{y} I{i:.3f} J{j:.3f}{feed}")
+                continue
+            heading += rng.choice((0.0, 0.0, rng.gauss(0, 0.4), math.pi, rng.uniform(0, 2 * math.pi)))
+            step = rng.uniform(0.05, 8)
+            x, y = round((x + step * math.cos(heading)) * 256) / 256, round((y + step * math.sin(heading)) * 256) / 256
+            command = "G0" if choice < 0.3 else "G1"
+            z = f" Z{0.5 * layer + rng.choice((0.0, 0.0, 0.25))}" if choice < 0.35 else ""
+            lines.append(f"{command} X{x} Y{y}{z}{feed}")
+    lines.extend(["M30"])
+    return lines
+
+
+def _reference_estimate(lines, acceleration, junction_deviation, rapid_rate):
+    """
+    A block-by-block GRBL planner over NC lines: (print seconds, travel seconds, dwell seconds,
+    {layer: print and dwell seconds}, {layer: travel seconds}).
+    """
+    blocks, position, feed, motion, stop, layer, dwell, layer_dwell = [], (0.0, 0.0, 0.0), None, None, True, None, \
+        0.0, collections.Counter()
+    for line in lines:
+        match = gcode_io.LAYER_COMMENT_PATTERN.match(line)
+        if match:
+            layer = int(match.group(1))
+        words = {}
+        for letter, value in gcode_io.WORD_PATTERN.findall(gcode_io.COMMENT_PATTERN.sub("", line).upper()):
+            value = float(value)
+            if letter == "G" and value in (0, 1, 2, 3):
+                motion = int(value)
+            elif letter == "G" and value == 4 or letter == "M":
+                stop = True
+            words[letter] = value
+        if words.get("G") == 4:
+            dwell += words["P"]
+            if layer is not None:
+                layer_dwell[layer] += words["P"]
+        if "F" in words:
+            feed = words["F"]
+        if not {"X", "Y", "Z"} & set(words) or motion is None:
+            continue
+        end = tuple(words.get(axis, position[k]) for k, axis in enumerate("XYZ"))
+        delta = [e - p for e, p in zip(end, position)]
+        length = math.sqrt(sum(d * d for d in delta))
+        start_direction = end_direction = [d / length for d in delta] if length else delta
+        if motion >= 2 and length:
+            centre = (position[0] + words.get("I", 0.0), position[1] + words.get("J", 0.0))
+            radius = math.hypot(position[0] - centre[0], position[1] - centre[1])
+            angles = [math.atan2(p[1] - centre[1], p[0] - centre[0]) for p in (position, end)]
+            sweep = (angles[0] - angles[1] if motion == 2 else angles[1] - angles[0]) % (2 * math.pi)
+            sweep = sweep if sweep > 1e-12 else 2 * math.pi
+            length = math.hypot(radius * sweep, delta[2])
+            turn = -1.0 if motion == 2 else 1.0
+            # tangents: the radius turned a quarter in the direction of motion, tilted by the climb
+            start_direction, end_direction = [
+                [-turn * math.sin(angle) * radius * sweep / length, turn * math.cos(angle) * radius * sweep / length,
+                 delta[2] / length] for angle in angles]
+        position = end
+        rate = rapid_rate if motion == 0 and rapid_rate is not None else feed
+        if length <= 1e-9:
+            continue
+        if not (rate or 0) > 0:
+            stop = True
+            continue
+        blocks.append({"length": length, "speed2": (rate / 60.0) ** 2, "travel": motion == 0, "layer": layer,
+                       "start": start_direction, "end": end_direction, "after_stop": stop})
+        stop = False
+
+    a = acceleration
+    entry = [0.0] * (len(blocks) + 1)
+    for k in range(1, len(blocks)):
+        previous, block = blocks[k - 1], blocks[k]
+        cos_theta = -sum(p * q for p, q in zip(previous["end"], block["start"]))
+        if block["after_stop"] or cos_theta > 0.999999:
+            continue
+        sin_half = math.sqrt(0.5 * (1.0 - max(cos_theta, -0.999999)))
+        entry[k] = min(a * junction_deviation * sin_half / (1.0 - sin_half), previous["speed2"], block["speed2"])
+    for k in reversed(range(len(blocks))):
+        entry[k] = min(entry[k], entry[k + 1] + 2 * a * blocks[k]["length"])
+    for k in range(len(blocks)):
+        entry[k + 1] = min(entry[k + 1], entry[k] + 2 * a * blocks[k]["length"])
+
+    print_seconds = travel_seconds = 0.0
+    layer_print, layer_travel = collections.Counter(layer_dwell), collections.Counter()
+    for k, block in enumerate(blocks):
+        peak2 = min(block["speed2"], (2 * a * block["length"] + entry[k] + entry[k + 1]) / 2)
+        peak = math.sqrt(peak2)
+        ramp = (2 * peak2 - entry[k] - entry[k + 1]) / (2 * a)
+        seconds = (2 * peak - math.sqrt(entry[k]) - math.sqrt(entry[k + 1])) / a + max(block["length"] - ramp, 0) / peak
+        if block["travel"]:
+            travel_seconds += seconds
+        else:
+            print_seconds += seconds
+        if block["layer"] is not None:
+            (layer_travel if block["travel"] else layer_print)[block["layer"]] += seconds
+    return print_seconds, travel_seconds, dwell, layer_print, layer_travel
+
+
+def check_time_estimate(rng):
+    """
+    estimate.estimate_toolpath (vectorized planner passes) against a block-by-block planner reading the
+    same lines: the same print, travel and dwell seconds in total and per layer.
+    """
+    import estimate
+    import toolpath
+
+    lines = _random_motion_lines(rng)
+    acceleration = rng.choice((100.0, 500.0, 3000.0))
+    junction_deviation = rng.choice((0.002, 0.01, 0.05))
+    rapid_rate = rng.choice((None, 6000.0))
+    result = estimate.estimate_toolpath(toolpath.toolpath_from_nc_lines(lines), acceleration=acceleration,
+                                        junction_deviation=junction_deviation, rapid_rate=rapid_rate)
+    print_seconds, travel_seconds, dwell_seconds, layer_print, layer_travel = _reference_estimate(
+        lines, acceleration, junction_deviation, rapid_rate)
+    compared = [("打印时间", result["print_seconds"], print_seconds),
+                ("空行程时间", result["travel_seconds"], travel_seconds),
+                ("暂停时间", result["dwell_seconds"], dwell_seconds)]
+    for layer, printing, travelling in zip(result["layer_numbers"].tolist(), result["layer_print_seconds"].tolist(),
+                                           result["layer_travel_seconds"].tolist()):
+        compared.append((f"第 {layer} 层的打印时间", printing, layer_print[layer]))
+        compared.append((f"第 {layer} 层的空行程时间", travelling, layer_travel[layer]))
+    for name, actual, expected in compared:
+        if not math.isclose(actual, expected, rel_tol=1e-9, abs_tol=1e-9):
+            return f"{name}: {actual:.6f} s, 逐段计算 {expected:.6f} s"
+    return None
+
+
+def _layer_points(lines):
+    """
+    {layer number: [(x, y) of every G1 move]} of an NC program.
+    """
+    layers, layer = collections.defaultdict(list), None
+    for line in lines:
+        match = gcode_io.LAYER_COMMENT_PATTERN.match(line)
+        if match:
+            layer = int(match.group(1))
+        words = dict(gcode_io.WORD_PATTERN.findall(gcode_io.COMMENT_PATTERN.sub("", line)))
+        if layer is not None and words.get("G") == "1" and "X" in words and "Y" in words:
+            layers[layer].append((float(words["X"]), float(words["Y"])))
+    return layers
+
+
+def check_slicing(rng):
+    """
+    slicer (segment chaining by pointer jumping and list ranking, contour cleanup) on the STL of
+    kresling.generate_thick_kresling, triangles shuffled, against kresling.kresling_toolpath_lines, which
+    computes the same sections in closed form: every layer has the same points, its two contours are
+    closed, the outer one counter-clockwise and the inner one clockwise. Also slices a rotated box whose
+    walls are strips of triangles, which must come out as its four corners (no seam left on an edge).
+    """
+    import contextlib
+    import io
+
+    import numpy as np
+
+    import kresling
+    import slicer
+
+    n, radius, twist_angle = rng.randint(3, 8), rng.uniform(2, 10), rng.uniform(5, 40)
+    thickness, layer_height = rng.uniform(0.3, 1.5), rng.choice((0.3, 0.5))
+    height = layer_height * rng.randint(4, 20)
+    stl = io.StringIO()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if kresling.generate_thick_kresling(n, radius, thickness, height, twist_angle, filename=stl) is None:
+            return "generate_thick_kresling 的网格检查未通过"
+    triangles = slicer.load_stl(io.BytesIO(stl.getvalue().encode()))
+    triangles = triangles[np.random.default_rng(rng.getrandbits(32)).permutation(len(triangles))]
+    expected = _layer_points(kresling.kresling_toolpath_lines(n, radius, thickness, height, twist_angle,
+                                                              layer_height=layer_height))
+    saved_block_pairs = slicer.BLOCK_PAIRS
+    slicer.BLOCK_PAIRS = rng.choice((len(triangles), saved_block_pairs)) # several layers per block or all at once
+    try:
+        sliced = [(number, slicer.clean_contours(contours))
+                  for number, z, contours in slicer.slice_triangles(triangles, layer_height)]
+    finally:
+        slicer.BLOCK_PAIRS = saved_block_pairs
+    if [number for number, _ in sliced] != sorted(expected):
+        return f"层号不同: {len(sliced)} 层, 预期 {len(expected)} 层"
+    for number, contours in sliced:
+        if len(contours) != 2 or not all(closed for _, closed in contours):
+            return f"第 {number} 层有 {len(contours)} 条轮廓, 未闭合 {sum(not closed for _, closed in contours)} 条"
+        areas = [0.5 * float(np.sum(points[:, 0] * np.roll(points[:, 1], -1) - np.roll(points[:, 0], -1) * points[:, 1]))
+                 for points, _ in contours]
+        if max(areas, key=abs) <= 0 or min(areas, key=abs) >= 0:
+            return f"第 {number} 层的轮廓方向不对 (有向面积 {areas[0]:.3f}, {areas[1]:.3f})"
+        # the G1 points of both (a closed path ends where it starts); the STL is written to 6 decimals
+        points = np.array(sorted(set(map(tuple, np.round(np.concatenate([p for p, _ in contours]), 3).tolist()))))
+        reference = np.array(sorted(set(expected[number])))
+        if len(points) != len(reference):
+            return f"第 {number} 层有 {len(points)} 个点, 预期 {len(reference)} 个"
+        distances = np.hypot(*(points[:, None, :] - reference[None, :, :]).transpose(2, 0, 1)).min(axis=1)
+        if distances.max() > 2e-3:
+            return f"第 {number} 层的点 {tuple(points[distances.argmax()])} 离预期的点 {distances.max():.4f} mm"
+
+    angle, size, columns = rng.uniform(0, 2 * math.pi), rng.uniform(2, 20), rng.randint(2, 9)
+    corners = np.array([(size * math.cos(angle + k * math.pi / 2), size * math.sin(angle + k * math.pi / 2))
+                        for k in range(4)])
+    walls = []
+    for a, b in zip(corners, np.roll(corners, -1, axis=0)):
+        for c in range(columns):
+            p, q = a + (b - a) * c / columns, a + (b - a) * (c + 1) / columns
+            # outward (to the right of the counter-clockwise edge) facing triangles
+            walls.append([(*p, 0.0), (*q, 0.0), (*q, height)])
+            walls.append([(*p, 0.0), (*q, height), (*p, height)])
+    walls = np.array(walls)[np.random.default_rng(rng.getrandbits(32)).permutation(8 * columns)]
+    for number, z, contours in slicer.slice_triangles(walls, layer_height):
+        contours = slicer.clean_contours(contours)
+        if len(contours) != 1 or not contours[0][1] or len(contours[0][0]) != 4:
+            return f"方盒第 {number} 层应为 4 个角点的闭合轮廓, 实为 {[(len(p), c) for p, c in contours]}"
+        distances = np.hypot(*(contours[0][0][:, None, :] - corners[None, :, :]).transpose(2, 0, 1)).min(axis=1)
+        if distances.max() > 1e-6:
+            return f"方盒第 {number} 层的轮廓点不是角点 (相差 {distances.max():.4f} mm)"
+    return None
+
+
+# (name, check): a check takes a random.Random and returns None or a description of what went wrong
+CHECKS = (
+    ("并行解析 Marlin (transGcode)", check_parallel_parsing),
+    ("空行程优化 (travel)", check_travel_optimization),
+    ("路径简化 (simplify)", check_simplification),
+    ("时间估算 (estimate)", check_time_estimate),
+    ("切片 (slicer, Kresling 管)", check_slicing),
+)
+
+
+def main():
+    """
+    Runs every check on ROUNDS random programs; returns 1 if any of them failed, else 0.
+    """
+    failed = 0
+    for name, check in CHECKS:
+        problems = [(seed, check(random.Random(seed))) for seed in range(ROUNDS)]
+        problems = [(seed, problem) for seed, problem in problems if problem is not None]
+        if problems:
+            failed += 1
+            seed, problem = problems[0]
+            print(f"失败: {name} ({len(problems)}/{ROUNDS} 个随机程序; 种子 {seed}: {problem})")
+        else:
+            print(f"通过: {name} ({ROUNDS} 个随机程序)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main(main))
@@ -0,0 +1,607 @@
+import asyncio
+import collections
+import math
+import os
+import signal
+import sys
+import time
+
+try:
+    import pty
+    import termios
+    import tty
+except ImportError:  # not available on Windows
+    pty = termios = tty = None
+
+import gcode_io
+from profiling import run_main
+
+RX_BUFFER_SIZE = 128 # bytes, GRBL's serial receive buffer
+DEFAULT_BAUD = 115200
+WAKE_DELAY = 2.0 # s, GRBL resets when the port is opened and needs a moment before it accepts lines
+REPORT_INTERVAL = 1.0 # s
+STATUS_INTERVAL = 0.2 # s between status queries while waiting for the machine to finish
+READ_CHUNK = 4096
+
+PLANNER_BLOCKS = 15 # GRBL's planner buffer (16 blocks, one is kept free)
+SIMULATOR_RAPID_RATE = 3000.0 # mm/min used for G0 moves
+DEFAULT_SPEEDUP = 10.0 # the simulated machine runs this many times faster than real time
+SIMULATOR_BANNER = "Grbl 1.1h ['$' for help]"
+
+FEED_HOLD = b"!"
+CYCLE_START = b"~"
+STATUS_QUERY = b"?"
+SOFT_RESET = b"\x18"
+_REALTIME_COMMANDS = frozenset(FEED_HOLD + CYCLE_START + STATUS_QUERY + SOFT_RESET)
+
+
+def clean_line(line):
+    """
+    The part of an NC line GRBL has to see: comments and surrounding whitespace removed (they would only
+    take up room in the receive buffer).
+    """
+    return gcode_io.COMMENT_PATTERN.sub("", line).strip()
+
+
+def open_port(path, baud=DEFAULT_BAUD):
+    """
+    Opens a serial device (or pseudo-terminal) in raw, non-blocking mode and returns its file descriptor.
+    """
+    if termios is None:
+        raise OSError("当前系统不支持串口发送 (需要 POSIX termios)")
+    speed = getattr(termios, f"B{baud}", None)
+    if speed is None:
+        raise ValueError(f"不支持的波特率: {baud}")
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        attrs = termios.tcgetattr(fd)
+        attrs[2] |= termios.CLOCAL | termios.CREAD
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    except termios.error:
+        # plain files and FIFOs (handy for dry runs) have no terminal settings
+        if os.isatty(fd):
+            os.close(fd)
+            raise
+    return fd
+
+
+class SerialLink:
+    """
+    asyncio wrapper around a non-blocking file descriptor: read() returns the next chunk of bytes,
+    readline() the next line without line ending, write() waits until all bytes are written.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.loop = asyncio.get_running_loop()
+        self._chunks = asyncio.Queue()
+        self._partial = b""
+        self._closed = False
+        self.loop.add_reader(fd, self._on_readable)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, READ_CHUNK)
+        except BlockingIOError:
+            return
+        except OSError:  # EIO: the other end of a pseudo-terminal was closed
+            data = b""
+        if not data:
+            self.loop.remove_reader(self.fd)
+        self._chunks.put_nowait(data)
+
+    async def read(self):
+        data = await self._chunks.get()
+        if not data:
+            self._chunks.put_nowait(data)
+            raise ConnectionError("串口连接已断开")
+        return data
+
+    async def readline(self):
+        while b"\n" not in self._partial:
+            self._partial += await self.read()
+        line, self._partial = self._partial.split(b"\n", 1)
+        return line.rstrip(b"\r").decode("ascii", errors="replace")
+
+    async def write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self.fd, view)
+            except BlockingIOError:
+                written = 0
+            view = view[written:]
+            if view:
+                ready = self.loop.create_future()
+                self.loop.add_writer(self.fd, ready.set_result, None)
+                try:
+                    await ready
+                finally:
+                    self.loop.remove_writer(self.fd)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+
+
+class GrblStreamer:
+    """
+    Streams NC lines to GRBL with the character-counting protocol: lines are sent as long as the bytes
+    not yet acknowledged (by "ok" or "error:n") fit into the controller's receive buffer, so the buffer
+    never runs dry between lines. With ping_pong every line waits for its "ok" (for comparison).
+    """
+
+    def __init__(self, link, rx_buffer_size=RX_BUFFER_SIZE, ping_pong=False, stop_on_error=False):
+        self.link = link
+        self.rx_buffer_size = rx_buffer_size
+        self.ping_pong = ping_pong
+        self.stop_on_error = stop_on_error
+        self.in_flight = collections.deque() # (bytes, line number, line) sent but not acknowledged
+        self.buffered = 0
+        self.paused = False
+        self.failure = None
+        self.errors = []
+        self.messages = []
+        self.status = None
+        self.stats = {"lines_sent": 0, "lines_acked": 0, "bytes_sent": 0, "start": None, "end": None,
+                      "fill_integral": 0.0}
+        self._last_change = None
+        self._changed = asyncio.Condition()
+
+    async def wake(self, delay=WAKE_DELAY):
+        """
+        Wakes the controller up and discards whatever it sends during delay seconds (reset banner, ok).
+        """
+        await self.link.write(b"\r\n\r\n")
+        deadline = time.monotonic() + delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                line = await asyncio.wait_for(self.link.readline(), remaining)
+            except asyncio.TimeoutError:
+                return
+            if line.strip():
+                self.messages.append(line)
+
+    async def stream(self, lines, wait_idle=True):
+        """
+        Sends the lines (any iterable of NC lines); returns when all of them are acknowledged and, with
+        wait_idle, the machine has finished the last move. Raises RuntimeError if the controller raises an alarm, the stream is aborted or (with
+        stop_on_error) a line is rejected.
+        """
+        self.stats["start"] = self._last_change = time.monotonic()
+        reader = asyncio.create_task(self._read_responses())
+        try:
+            for number, line in enumerate(lines, 1):
+                line = clean_line(line)
+                if not line:
+                    continue
+                data = (line + "\n").encode("ascii")
+                if len(data) > self.rx_buffer_size:
+                    raise ValueError(f"第 {number} 行长度超过 GRBL 接收缓冲区 ({self.rx_buffer_size} 字节): {line}")
+                async with self._changed:
+                    await self._changed.wait_for(lambda: self.failure is not None or self._has_room(len(data)))
+                    self._check_failure()
+                    self._account()
+                    self.in_flight.append((len(data), number, line))
+                    self.buffered += len(data)
+                await self.link.write(data)
+                self.stats["lines_sent"] += 1
+                self.stats["bytes_sent"] += len(data)
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.failure is not None or not self.in_flight)
+                self._check_failure()
+            while wait_idle:
+                self.status = None
+                await self.link.write(STATUS_QUERY)
+                async with self._changed:
+                    await self._changed.wait_for(lambda: self.failure is not None or self.status is not None)
+                    self._check_failure()
+                if self.status.startswith("<Idle"):
+                    break
+                await asyncio.sleep(STATUS_INTERVAL)
+        finally:
+            reader.cancel()
+            self.stats["end"] = time.monotonic()
+            self._account()
+
+    def _has_room(self, size):
+        if self.paused:
+            return False
+        if self.ping_pong:
+            return not self.in_flight
+        return self.buffered + size <= self.rx_buffer_size
+
+    def _check_failure(self):
+        if self.failure is not None:
+            raise RuntimeError(self.failure)
+
+    def _account(self):
+        now = time.monotonic()
+        self.stats["fill_integral"] += self.buffered * (now - self._last_change)
+        self._last_change = now
+
+    async def _read_responses(self):
+        try:
+            while True:
+                line = (await self.link.readline()).strip()
+                if not line:
+                    continue
+                async with self._changed:
+                    self._handle_response(line)
+                    self._changed.notify_all()
+        except ConnectionError as e:
+            async with self._changed:
+                self.failure = str(e)
+                self._changed.notify_all()
+
+    def _handle_response(self, line):
+        if line == "ok" or line.startswith("error"):
+            if not self.in_flight:
+                return
+            self._account()
+            size, number, text = self.in_flight.popleft()
+            self.buffered -= size
+            self.stats["lines_acked"] += 1
+            if line != "ok":
+                self.errors.append((number, text, line))
+                print(f"\n警告: 第 {number} 行被 GRBL 拒绝 ({line}): {text}")
+                if self.stop_on_error:
+                    self.failure = f"第 {number} 行出错 ({line}), 已停止发送"
+        elif line.startswith("<"):
+            self.status = line
+        elif line.startswith("ALARM"):
+            self.failure = f"GRBL 报警 ({line}), 已停止发送"
+        elif line.startswith("Grbl ") and self.stats["lines_sent"]:
+            self.failure = "GRBL 在发送过程中被复位, 已停止发送"
+        else:
+            self.messages.append(line)
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def pause(self):
+        """
+        Feed hold: the machine decelerates to a stop and no further lines are sent.
+        """
+        self.paused = True
+        await self.link.write(FEED_HOLD)
+        await self._notify()
+
+    async def resume(self):
+        self.paused = False
+        await self.link.write(CYCLE_START)
+        await self._notify()
+
+    async def abort(self, reason="已中止发送"):
+        """
+        Soft reset: GRBL stops immediately and discards its buffers.
+        """
+        await self.link.write(SOFT_RESET)
+        self.failure = reason
+        await self._notify()
+
+    def progress(self):
+        elapsed = max(time.monotonic() - self.stats["start"], 1e-9)
+        return (f"已发送 {self.stats['lines_sent']} 行, 已确认 {self.stats['lines_acked']} 行, "
+                f"{self.stats['bytes_sent'] / elapsed / 1024:.1f} kB/s, "
+                f"接收缓冲区 {self.buffered}/{self.rx_buffer_size} 字节" + (" [暂停]" if self.paused else ""))
+
+
+def print_stream_report(streamer):
+    stats = streamer.stats
+    elapsed = max(stats["end"] - stats["start"], 1e-9)
+    fill = 100.0 * stats["fill_integral"] / elapsed / streamer.rx_buffer_size
+    print(f"发送完成: {stats['lines_acked']} 行, {stats['bytes_sent']} 字节, 用时 {elapsed:.2f} s, "
+          f"{stats['lines_acked'] / elapsed:.0f} 行/s, {stats['bytes_sent'] / elapsed / 1024:.1f} kB/s, "
+          f"接收缓冲区平均占用 {fill:.0f}%, 被拒绝 {len(streamer.errors)} 行")
+
+
+class GrblSimulator:
+    """
+    Stand-in for a GRBL controller on a pseudo-terminal (port is the device path to open). It models the
+    128-byte receive buffer (overflows are counted, a real controller would lose the bytes), the serial
+    line rate, a planner of PLANNER_BLOCKS moves that sends "ok" when a line is planned, and the motion
+    time of every move (arcs are timed as their chord), speedup times faster than real time (0: no motion time). Realtime commands
+    ! ~ ? and Ctrl-X are handled. stats counts planner underruns: the machine waiting for the next move
+    after it has started.
+    """
+
+    def __init__(self, speedup=DEFAULT_SPEEDUP, baud=DEFAULT_BAUD, rx_buffer_size=RX_BUFFER_SIZE,
+                 planner_blocks=PLANNER_BLOCKS):
+        self.speedup = speedup
+        self.baud = baud
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_blocks = planner_blocks
+        self.port = None
+        self.stats = {"lines": 0, "errors": 0, "moves": 0, "motion_time": 0.0, "underruns": 0,
+                      "idle_time": 0.0, "overflows": 0, "max_rx": 0}
+        self._rx = bytearray()
+        self._planner = collections.deque()
+        self._position = [0.0, 0.0, 0.0]
+        self._planned_position = [0.0, 0.0, 0.0]
+        self._motion = 0
+        self._feed = SIMULATOR_RAPID_RATE
+        self._absolute = True
+        self._tasks = []
+        self._slave = None
+        self._link = None
+
+    async def start(self):
+        if pty is None:
+            raise OSError("当前系统不支持伪终端, 无法启动 GRBL 模拟器")
+        master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(master, False)
+        self.port = os.ttyname(self._slave)
+        self._link = SerialLink(master)
+        self._line_ready = asyncio.Event()
+        self._block_ready = asyncio.Event()
+        self._planner_room = asyncio.Event()
+        self._running = asyncio.Event()
+        self._running.set()
+        self._tasks = [asyncio.create_task(coro) for coro in (self._receive(), self._parse(), self._execute())]
+        await self._link.write(f"\r\n{SIMULATOR_BANNER}\r\n".encode("ascii"))
+        return self
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._link.close()
+        os.close(self._slave)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+    async def _receive(self):
+        while True:
+            data = await self._link.read()
+            if self.speedup > 0:
+                # bytes arrive no faster than the serial line carries them (10 bits per byte)
+                await asyncio.sleep(len(data) * 10.0 / self.baud / self.speedup)
+            for byte in data:
+                if byte in _REALTIME_COMMANDS:
+                    await self._realtime(byte)
+                    continue
+                if len(self._rx) >= self.rx_buffer_size:
+                    self.stats["overflows"] += 1
+                self._rx.append(byte)
+            self.stats["max_rx"] = max(self.stats["max_rx"], len(self._rx))
+            if b"\n" in self._rx:
+                self._line_ready.set()
+
+    async def _realtime(self, byte):
+        if byte == SOFT_RESET[0]:
+            self._rx.clear()
+            self._planner.clear()
+            self._planned_position = list(self._position)
+            self._planner_room.set()
+            self._running.set()
+            await self._link.write(f"\r\n{SIMULATOR_BANNER}\r\n".encode("ascii"))
+        elif byte == FEED_HOLD[0]:
+            self._running.clear()
+        elif byte == CYCLE_START[0]:
+            self._running.set()
+        elif byte == STATUS_QUERY[0]:
+            state = "Hold" if not self._running.is_set() else ("Run" if self._planner else "Idle")
+            x, y, z = self._position
+            await self._link.write(
+                f"<{state}|MPos:{x:.3f},{y:.3f},{z:.3f}|Bf:{self.planner_blocks - len(self._planner)},"
+                f"{self.rx_buffer_size - len(self._rx)}>\r\n".encode("ascii"))
+
+    async def _parse(self):
+        while True:
+            await self._line_ready.wait()
+            end = self._rx.find(b"\n")
+            if end < 0:
+                self._line_ready.clear()
+                continue
+            line = self._rx[:end].decode("ascii", errors="replace").strip().upper()
+            del self._rx[:end + 1]
+            self.stats["lines"] += 1
+            response = "ok"
+            if line and not line.startswith("$"):
+                target = self._plan_line(line)
+                if target is None:
+                    response = "error:1"
+                    self.stats["errors"] += 1
+                elif target:
+                    while len(self._planner) >= self.planner_blocks:
+                        self._planner_room.clear()
+                        await self._planner_room.wait()
+                    self._planner.append(target)
+                    self._block_ready.set()
+            await self._link.write(f"{response}\r\n".encode("ascii"))
+
+    def _plan_line(self, line):
+        """
+        Returns (duration_s, end_position) for a move, () for other valid lines, None for invalid ones.
+        """
+        code = line.replace(" ", "").upper()
+        words = gcode_io.WORD_PATTERN.findall(code)
+        if sum(len(letter) + len(value) for letter, value in words) != len(code):
+            return None
+        axes = {}
+        for letter, value in words:
+            value = float(value)
+            if letter == "G":
+                if value in (0, 1, 2, 3):
+                    self._motion = int(value)
+                elif value == 90:
+                    self._absolute = True
+                elif value == 91:
+                    self._absolute = False
+            elif letter == "F":
+                self._feed = value
+            elif letter in "XYZ":
+                axes["XYZ".index(letter)] = value
+        if not axes:
+            return ()
+        start = self._planned_position
+        end = list(start)
+        for index, value in axes.items():
+            end[index] = value if self._absolute else start[index] + value
+        self._planned_position = end
+        rate = SIMULATOR_RAPID_RATE if self._motion == 0 else self._feed
+        distance = math.dist(start, end)
+        return (60.0 * distance / rate if rate > 0 else 0.0, end)
+
+    async def _execute(self):
+        waiting_since = None
+        while True:
+            if not self._planner:
+                self._block_ready.clear()
+                if waiting_since is None and self.stats["moves"]:
+                    waiting_since = time.monotonic()
+                await self._block_ready.wait()
+                continue
+            if waiting_since is not None:
+                self.stats["underruns"] += 1
+                self.stats["idle_time"] += time.monotonic() - waiting_since
+                waiting_since = None
+            await self._running.wait()
+            duration, end = self._planner[0]
+            if self.speedup > 0 and duration > 0:
+                await asyncio.sleep(duration / self.speedup)
+            if self._planner and self._planner[0][1] is end:
+                self._planner.popleft()
+                self._position = end
+                self.stats["moves"] += 1
+                self.stats["motion_time"] += duration
+                self._planner_room.set()
+
+
+def print_simulator_report(simulator):
+    stats = simulator.stats
+    print(f"模拟器: 执行 {stats['moves']} 段运动 (运动时间 {stats['motion_time']:.1f} s), "
+          f"规划队列断流 {stats['underruns']} 次 (空等 {stats['idle_time'] * simulator.speedup:.2f} s 实际时间), "
+          f"接收缓冲区最高 {stats['max_rx']}/{simulator.rx_buffer_size} 字节, 溢出 {stats['overflows']} 次")
+
+
+async def _watch_keyboard(streamer):
+    """
+    Terminal control while streaming: p + Enter pauses (feed hold), r + Enter resumes, q + Enter aborts.
+    """
+    loop = asyncio.get_running_loop()
+    commands = asyncio.Queue()
+    loop.add_reader(sys.stdin.fileno(), lambda: commands.put_nowait(sys.stdin.readline().strip().lower()))
+    try:
+        while True:
+            command = await commands.get()
+            if command == "p":
+                await streamer.pause()
+                print("\n已暂停 (进给保持), 输入 r 回车继续")
+            elif command == "r":
+                await streamer.resume()
+                print("\n继续发送")
+            elif command == "q":
+                await streamer.abort()
+    finally:
+        loop.remove_reader(sys.stdin.fileno())
+
+
+async def _report_progress(streamer):
+    while True:
+        await asyncio.sleep(REPORT_INTERVAL)
+        print("\r" + streamer.progress(), end="", flush=True)
+
+
+async def stream_lines_async(lines, port=None, baud=DEFAULT_BAUD, simulate=False, speedup=DEFAULT_SPEEDUP,
+                             ping_pong=False, stop_on_error=False, interactive=False, wake_delay=None):
+    """
+    Streams lines to the GRBL controller on port, or to a GrblSimulator when simulate is set.
+    Returns (streamer, simulator); simulator is None for a real port.
+    """
+    simulator = None
+    if simulate:
+        simulator = await GrblSimulator(speedup=speedup, baud=baud).start()
+        port = simulator.port
+        if wake_delay is None:
+            wake_delay = 0.1
+    link = SerialLink(open_port(port, baud))
+    streamer = GrblStreamer(link, ping_pong=ping_pong, stop_on_error=stop_on_error)
+    loop = asyncio.get_running_loop()
+    helpers = []
+    try:
+        await streamer.wake(WAKE_DELAY if wake_delay is None else wake_delay)
+        try:
+            loop.add_signal_handler(signal.SIGINT, lambda: helpers.append(
+                asyncio.ensure_future(streamer.abort("已中断 (Ctrl-C), GRBL 已软复位"))))
+        except (NotImplementedError, RuntimeError):
+            pass
+        if sys.stdout.isatty():
+            helpers.append(asyncio.create_task(_report_progress(streamer)))
+        if interactive:
+            print("提示: 输入 p 回车暂停, r 回车继续, q 回车中止")
+            helpers.append(asyncio.create_task(_watch_keyboard(streamer)))
+        await streamer.stream(lines)
+    finally:
+        try:
+            loop.remove_signal_handler(signal.SIGINT)
+        except (NotImplementedError, RuntimeError):
+            pass
+        for task in helpers:
+            task.cancel()
+        await asyncio.gather(*helpers, return_exceptions=True)
+        if sys.stdout.isatty():
+            print()
+        link.close()
+        if simulator is not None:
+            await simulator.stop()
+    return streamer, simulator
+
+
+def stream_lines(lines, **kwargs):
+    """
+    Synchronous wrapper of stream_lines_async; prints the reports. Returns True when every line was
+    acknowledged without an error.
+    """
+    streamer, simulator = asyncio.run(stream_lines_async(lines, **kwargs))
+    print_stream_report(streamer)
+    if simulator is not None:
+        print_simulator_report(simulator)
+    return not streamer.errors
+
+
+def stream_file(input_filepath, port=None, **kwargs):
+    try:
+        with gcode_io.open_input(input_filepath) as f:
+            ok = stream_lines(f, port=port, **kwargs)
+    except FileNotFoundError:
+        print(f"错误: 文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"\n错误: 发送文件 '{input_filepath}' 失败: {e}")
+        return None
+    return ok
+
+
+def main():
+    input_file_path = input("请输入要发送的NC文件路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    port = input("请输入串口设备 (例如 /dev/ttyUSB0, 留空则发送到本地 GRBL 模拟器): ").strip()
+    baud_str = input(f"请输入波特率 (留空则使用 {DEFAULT_BAUD}): ").strip()
+    try:
+        baud = int(baud_str) if baud_str else DEFAULT_BAUD
+    except ValueError:
+        print("错误：请输入有效的整数。")
+        return
+    stream_file(input_file_path, port=port or None, baud=baud, simulate=not port, interactive=sys.stdin.isatty())
+
+
+if __name__ == "__main__":
+    run_main(main)
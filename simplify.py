@@ -0,0 +1,240 @@
+import os
+
+import numpy as np
+
+import gcode_io
+from gcode_io import is_comment_line, parse_move, track_modal_state
+from profiling import run_main
+
+DEFAULT_CHORD_TOLERANCE = 0.01 # mm
+BATCH_LINES = 20000 # whole layers are buffered until a batch has at least this many lines
+MAX_BUFFERED_LINES = 200000
+
+
+def segment_distances(points, a, b):
+    """
+    Distances of points (n, 2) from the segments a-b ((n, 2) each), clamped to the segment ends.
+    """
+    ab = b - a
+    ap = points - a
+    length2 = (ab * ab).sum(axis=1)
+    t = np.divide((ap * ab).sum(axis=1), length2, out=np.zeros(len(points)), where=length2 > 0)
+    closest = a + np.clip(t, 0.0, 1.0)[:, None] * ab
+    return np.hypot(*(points - closest).T)
+
+
+def rdp_keep_mask(points, range_starts, range_ends, tolerance):
+    """
+    Ramer-Douglas-Peucker over many polylines at once: points (n, 2) holds the polylines, range_starts /
+    range_ends the index of their first/last point. Returns a bool mask of the points to keep; every
+    dropped point lies within tolerance of the kept chord that replaces it. Each iteration handles the
+    pending sub-ranges of all polylines with a single vectorized distance computation.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    lo = np.asarray(range_starts, dtype=np.int64)
+    hi = np.asarray(range_ends, dtype=np.int64)
+    keep[lo] = True
+    keep[hi] = True
+    while True:
+        wide = hi - lo >= 2
+        lo, hi = lo[wide], hi[wide]
+        if not len(lo):
+            return keep
+        interior = hi - lo - 1
+        group_starts = np.cumsum(interior) - interior
+        group = np.repeat(np.arange(len(lo)), interior)
+        idx = lo[group] + 1 + np.arange(len(group)) - group_starts[group]
+        d = segment_distances(points[idx], points[lo[group]], points[hi[group]])
+        # farthest interior point of every range (the first one on ties); the groups are contiguous
+        group_max = np.maximum.reduceat(d, group_starts)
+        farthest = np.minimum.reduceat(np.where(d == group_max[group], np.arange(len(d)), len(d)), group_starts)
+        split = d[farthest] > tolerance
+        mid = idx[farthest[split]]
+        keep[mid] = True
+        lo, hi = np.concatenate([lo[split], mid]), np.concatenate([mid, hi[split]])
+
+
+class G1ChainBuffer:
+    """
+    Collects NC lines in batches of whole layers and finds the runs of G1 XY moves ("chains") with the same
+    feedrate in them; subclasses rewrite the chains in rewrite().
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats if stats is not None else {}
+        self.position = None
+        self.feed = None
+        self.absolute = True
+        self.layer = 0
+        self.lines = []
+
+    def push(self, line):
+        """
+        Feeds one line (without newline); returns the list of lines that can be output now.
+        """
+        output = []
+        if len(self.lines) >= MAX_BUFFERED_LINES or \
+                (len(self.lines) >= BATCH_LINES and is_comment_line(line) and gcode_io.LAYER_COMMENT_PATTERN.search(line)):
+            output = self.flush()
+        self.lines.append(line)
+        return output
+
+    def flush(self):
+        """
+        Rewrites and returns the buffered lines.
+        """
+        lines, self.lines = self.lines, []
+        # points of all chains; every chain starts at the position before its first G1
+        points, line_of_point, range_starts, range_ends = [], [], [], []
+        layer_of_line = {}
+        chain_open = False
+        for i, line in enumerate(lines):
+            move = parse_move(line)
+            if move is None and is_comment_line(line):
+                layer_match = gcode_io.LAYER_COMMENT_PATTERN.search(line)
+                if layer_match:
+                    self.layer = int(layer_match.group(1))
+            feed_before = self.feed
+            if self._is_chain_move(move):
+                if not chain_open:
+                    range_starts.append(len(points))
+                    points.append(self.position)
+                    line_of_point.append(-1)
+                    chain_open = True
+                changes_feed = move["F"] is not None and (feed_before is None or float(move["F"]) != float(feed_before))
+                if changes_feed:
+                    # the segment with the new feedrate stays on its own: both of its ends are kept
+                    range_ends.append(len(points) - 1)
+                    range_starts.append(len(points) - 1)
+                self.position = (float(move["X"]), float(move["Y"]))
+                points.append(self.position)
+                line_of_point.append(i)
+                layer_of_line[i] = self.layer
+                if changes_feed:
+                    range_ends.append(len(points) - 1)
+                    range_starts.append(len(points) - 1)
+                    self.feed = move["F"]
+                continue
+            if chain_open:
+                range_ends.append(len(points) - 1)
+                chain_open = False
+            self.position, self.feed, self.absolute = track_modal_state(line, self.position, self.feed, self.absolute)
+        if chain_open:
+            range_ends.append(len(points) - 1)
+        if not range_starts:
+            return lines
+        return self.rewrite(lines, np.array(points, dtype=float), np.array(line_of_point),
+                            np.array(range_starts), np.array(range_ends), layer_of_line)
+
+    def rewrite(self, lines, points, line_of_point, range_starts, range_ends, layer_of_line):
+        """
+        Returns the new lines of the batch. points (n, 2) holds the chains one after another, each starting
+        with the position before its first G1; line_of_point gives the line index of every point (-1 for
+        the starts). Point range_starts[k] .. range_ends[k] is the k-th chain; a G1 that changes the
+        feedrate is a chain of its own, sharing its end points with the neighbouring chains.
+        layer_of_line maps the index of every chain line to its layer number.
+        """
+        raise NotImplementedError
+
+    def _is_chain_move(self, move):
+        if move is None or move["cmd"] != "G1" or move["comment"] or move["Z"] is not None:
+            return False
+        if move["X"] is None or move["Y"] is None:
+            return False
+        return self.absolute and self.position is not None and (move["F"] is not None or self.feed is not None)
+
+
+class ChainSimplifier(G1ChainBuffer):
+    """
+    Simplifies the G1 chains. Only whole lines are dropped, the kept ones are output unchanged.
+    """
+
+    def __init__(self, tolerance=DEFAULT_CHORD_TOLERANCE, stats=None):
+        super().__init__(stats=stats)
+        self.tolerance = tolerance
+
+    def rewrite(self, lines, points, line_of_point, range_starts, range_ends, layer_of_line):
+        keep = rdp_keep_mask(points, range_starts, range_ends, self.tolerance)
+        chain_lines = line_of_point >= 0
+        dropped = set(line_of_point[chain_lines & ~keep].tolist())
+        for i, layer_num in layer_of_line.items():
+            entry = self.stats.setdefault(layer_num, [0, 0])
+            entry[0] += 1
+            entry[1] += i not in dropped
+        return [line for i, line in enumerate(lines) if i not in dropped]
+
+
+def simplify_lines(lines, tolerance=DEFAULT_CHORD_TOLERANCE, stats=None):
+    """
+    Generator over any iterable of NC lines (with or without newlines); yields the lines without newlines,
+    dropping the G1 moves of each layer that lie within tolerance (mm) of the simplified path
+    (Ramer-Douglas-Peucker per run of equal-feedrate G1 moves). stats (dict) receives
+    {layer: [g1_segments_before, g1_segments_after]}.
+    """
+    simplifier = ChainSimplifier(tolerance=tolerance, stats=stats)
+    for line in gcode_io.strip_newlines(lines):
+        yield from simplifier.push(line)
+    yield from simplifier.flush()
+
+
+def print_simplify_report(stats):
+    total_before = sum(before for before, _ in stats.values())
+    total_after = sum(after for _, after in stats.values())
+    removed = total_before - total_after
+    percent = 100.0 * removed / total_before if total_before else 0.0
+    print(f"路径简化: G1 段数 {total_before} -> {total_after} (减少 {removed} 段, {percent:.1f}%)")
+
+
+def simplify_stream(infile, outfile, tolerance=DEFAULT_CHORD_TOLERANCE):
+    """
+    Stream version of simplify_lines; prints the segment count report.
+    """
+    stats = {}
+    separator = ""
+    for line in simplify_lines(infile, tolerance=tolerance, stats=stats):
+        outfile.write(separator + line)
+        separator = "\n"
+    print_simplify_report(stats)
+    return True
+
+
+def default_output_path(input_file_path):
+    return gcode_io.default_output_path(input_file_path, "_simplified")
+
+
+def simplify_file(input_filepath, output_filepath=None, tolerance=DEFAULT_CHORD_TOLERANCE):
+    if output_filepath is None:
+        output_filepath = default_output_path(input_filepath)
+    try:
+        with gcode_io.open_input(input_filepath) as f_in, \
+             gcode_io.open_output(output_filepath) as f_out:
+            simplify_stream(f_in, f_out, tolerance=tolerance)
+    except FileNotFoundError:
+        print(f"错误: 文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"错误: 处理文件 '{input_filepath}' 失败: {e}")
+        return None
+    print(f"处理完成！简化后的文件已保存到: {output_filepath}")
+    return output_filepath
+
+
+def main():
+    input_file_path = input("请输入NC文件的完整路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    tolerance_str = input(f"请输入弦高公差 (mm, 留空则使用 {DEFAULT_CHORD_TOLERANCE}): ").strip()
+    try:
+        tolerance = float(tolerance_str) if tolerance_str else DEFAULT_CHORD_TOLERANCE
+    except ValueError:
+        print("错误：请输入有效的数字。")
+        return
+    if tolerance < 0:
+        print("错误：公差不能为负数。")
+        return
+    simplify_file(input_file_path, tolerance=tolerance)
+
+
+if __name__ == "__main__":
+    run_main(main)
@@ -0,0 +1,340 @@
+import os
+import re
+import sys
+
+import numpy as np
+
+import gcode_io
+from profiling import run_main
+from simplify import rdp_keep_mask
+
+DEFAULT_PRINT_FEEDRATE = 600.0 # mm/min
+DEFAULT_G0_FEEDRATE = 1750.0 # mm/min
+DEFAULT_CLEANUP_TOLERANCE = 0.001 # mm, contour points closer than this to the chord are dropped
+FINAL_Z_LIFT = 10.0 # mm above the last layer
+KEY_RESOLUTION = 1e-5 # mm, segment ends closer than this are joined
+BLOCK_PAIRS = 1 << 21 # triangle/layer pairs intersected at once
+
+_BINARY_STL_DTYPE = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attributes", "<u2")])
+_ASCII_VERTEX_PATTERN = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+
+
+def load_stl(source):
+    """
+    Reads a binary or ASCII STL (file path, "-" for stdin, or a binary stream) into an (n, 3, 3) float array
+    of triangles; the stored normals are ignored, the winding defines the outside.
+    """
+    if hasattr(source, "read"):
+        data = source.read()
+    elif gcode_io.is_stdio(source):
+        data = sys.stdin.buffer.read()
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+    if len(data) >= 84:
+        count = int(np.frombuffer(data, dtype="<u4", count=1, offset=80)[0])
+        if len(data) == 84 + count * _BINARY_STL_DTYPE.itemsize:
+            facets = np.frombuffer(data, dtype=_BINARY_STL_DTYPE, count=count, offset=84)
+            return facets["vertices"].astype(float)
+    if data.lstrip().startswith(b"solid"):
+        vertices = np.array(_ASCII_VERTEX_PATTERN.findall(data), dtype=float)
+        if len(vertices) % 3 == 0:
+            return vertices.reshape(-1, 3, 3)
+    raise ValueError("无法识别的 STL 文件 (既不是二进制也不是 ASCII 格式)")
+
+
+def _layer_pairs(k_lo, k_hi, active, ka, kb):
+    """
+    (triangle, layer) pairs of the active triangles for the layers ka .. kb - 1.
+    """
+    lo = np.maximum(k_lo[active], ka)
+    hi = np.minimum(k_hi[active], kb - 1)
+    counts = np.maximum(hi - lo + 1, 0)
+    offsets = np.cumsum(counts) - counts
+    triangles = np.repeat(active, counts)
+    layers = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(offsets, counts)
+    order = np.argsort(layers, kind="stable")
+    return triangles[order], layers[order]
+
+
+def intersect_triangles(triangles, z):
+    """
+    Intersects triangles (n, 3, 3) with the planes at heights z (n,). Returns (starts, ends, crossing):
+    the segment ends (n, 2) and the mask of the triangles that cross their plane. A vertex on the plane
+    counts as above it, so every crossing triangle has exactly one edge going down and one going up (in
+    winding order); the segment runs from the first to the second, which puts the outside of the solid
+    on its right: outer contours come out counter-clockwise, holes clockwise. Both triangles sharing an
+    edge compute its point from the lower vertex, so they get exactly the same coordinates.
+    """
+    above = triangles[:, :, 2] >= z[:, None]
+    above_next = np.roll(above, -1, axis=1)
+    crossing = above.any(axis=1) & ~above.all(axis=1)
+    rows = np.arange(len(triangles))
+
+    def edge_point(edge):
+        a = triangles[rows, edge]
+        b = triangles[rows, (edge + 1) % 3]
+        low = np.where((a[:, 2] <= b[:, 2])[:, None], a, b)
+        high = np.where((a[:, 2] <= b[:, 2])[:, None], b, a)
+        dz = high[:, 2] - low[:, 2]
+        t = np.divide(z - low[:, 2], dz, out=np.zeros(len(dz)), where=dz > 0)
+        return low[:, :2] + t[:, None] * (high[:, :2] - low[:, :2])
+
+    starts = edge_point(np.argmax(above & ~above_next, axis=1))
+    ends = edge_point(np.argmax(~above & above_next, axis=1))
+    return starts, ends, crossing
+
+
+def _point_keys(points, layers):
+    """
+    Ids of the distinct (layer, point) pairs, points quantized to KEY_RESOLUTION.
+    """
+    quantized = np.round(points / KEY_RESOLUTION).astype(np.int64)
+    xy = (quantized[:, 0] << 32) ^ (quantized[:, 1] & 0xFFFFFFFF)
+    order = np.lexsort((xy, layers))
+    new_key = np.ones(len(order), dtype=bool)
+    new_key[1:] = (np.diff(xy[order]) != 0) | (np.diff(layers[order]) != 0)
+    ids = np.empty(len(order), dtype=np.int64)
+    ids[order] = np.cumsum(new_key) - 1
+    return ids
+
+
+def chain_segments(starts, ends, layers):
+    """
+    Joins the segments of every layer into contours: a segment is followed by the one starting where it
+    ends (a hash join on the quantized end points, made with one sort); points where more than two
+    segments meet are not joined. Returns (order, contour_starts, closed): the segment indices contour by contour,
+    the position in order where every contour starts and whether it is closed. Contours are ordered by
+    layer.
+    """
+    m = len(starts)
+    ids = _point_keys(np.concatenate([starts, ends]), np.concatenate([layers, layers]))
+    start_ids, end_ids = ids[:m], ids[m:]
+    key_count = ids.max() + 1 if m else 0
+    start_count = np.bincount(start_ids, minlength=key_count)
+    end_count = np.bincount(end_ids, minlength=key_count)
+    segment_of_start = np.full(key_count, -1, dtype=np.int64)
+    segment_of_start[start_ids] = np.arange(m)
+    unique_join = (start_count[end_ids] == 1) & (end_count[end_ids] == 1)
+    successor = np.where(unique_join, segment_of_start[end_ids], -1)
+
+    # cycles are cut before their smallest segment, found by pointer jumping along the successors
+    index = np.arange(m)
+    jump = np.where(successor >= 0, successor, index)
+    smallest = index.copy()
+    for _ in range(max(1, int(m).bit_length())):
+        smallest = np.minimum(smallest, smallest[jump])
+        jump = jump[jump]
+    in_cycle = successor[jump] >= 0
+    closed_heads = index[in_cycle & (smallest == index)]
+    predecessor = np.full(m, -1, dtype=np.int64)
+    linked = successor >= 0
+    predecessor[successor[linked]] = index[linked]
+    predecessor[closed_heads] = -1
+
+    # list ranking: head of every segment and its distance from it
+    jump = np.where(predecessor >= 0, predecessor, index)
+    rank = (predecessor >= 0).astype(np.int64)
+    while True:
+        next_jump = jump[jump]
+        if np.array_equal(next_jump, jump):
+            break
+        rank = rank + rank[jump]
+        jump = next_jump
+    heads = jump
+    order = np.lexsort((rank, heads, layers[heads]))
+    contour_starts = np.flatnonzero(rank[order] == 0)
+    is_closed = np.zeros(m, dtype=bool)
+    is_closed[closed_heads] = True
+    return order, contour_starts, is_closed[order[contour_starts]]
+
+
+def slice_triangles(triangles, layer_height, stats=None):
+    """
+    Generator over the layers of a planar slice of triangles (n, 3, 3): yields (layer_number, z, contours)
+    with contours a list of (points (k, 2), closed). The mesh stands on z = 0 (its lowest point) and layer
+    N is cut through its middle, at (N - 0.5) * layer_height. Triangles are sorted by their lowest z and
+    swept through blocks of layers, so each block only intersects the triangles spanning it, all at once.
+    stats (dict) receives {"triangles": n, "segments": n, "open_contours": n}.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(triangles=len(triangles), segments=0, open_contours=0)
+    if not len(triangles):
+        return
+    z_all = triangles[:, :, 2]
+    base = z_all.min()
+    z_min = z_all.min(axis=1) - base
+    z_max = z_all.max(axis=1) - base
+    layer_count = int(np.ceil(z_max.max() / layer_height - 1e-9))
+    # layer k (0-based) is cut at (k + 0.5) * layer_height
+    k_lo = np.maximum(np.ceil(z_min / layer_height - 0.5), 0).astype(np.int64)
+    k_hi = np.minimum(np.floor(z_max / layer_height - 0.5), layer_count - 1).astype(np.int64)
+    by_bottom = np.argsort(z_min, kind="stable")
+    k_lo, k_hi = k_lo[by_bottom], k_hi[by_bottom]
+    triangles = triangles[by_bottom]
+    pairs_per_layer = max(1, int(np.maximum(k_hi - k_lo + 1, 0).sum() // max(layer_count, 1)))
+    block_layers = max(1, BLOCK_PAIRS // pairs_per_layer)
+
+    active = np.empty(0, dtype=np.int64)
+    swept = 0
+    for ka in range(0, layer_count, block_layers):
+        kb = min(ka + block_layers, layer_count)
+        entering = int(np.searchsorted(k_lo, kb, side="left"))
+        active = np.concatenate([active[k_hi[active] >= ka], np.arange(swept, entering)])
+        swept = entering
+        triangle_index, layer_index = _layer_pairs(k_lo, k_hi, active, ka, kb)
+        z = (layer_index + 0.5) * layer_height + base
+        starts, ends, crossing = intersect_triangles(triangles[triangle_index], z)
+        keep = crossing & (np.abs(starts - ends).max(axis=1) > KEY_RESOLUTION)
+        starts, ends, layer_index = starts[keep], ends[keep], layer_index[keep]
+        stats["segments"] += len(starts)
+        order, contour_starts, closed = chain_segments(starts, ends, layer_index)
+        contour_stops = np.append(contour_starts[1:], len(order))
+        contour_layers = layer_index[order[contour_starts]]
+        contours_by_layer = {}
+        for start, stop, k, is_closed in zip(contour_starts.tolist(), contour_stops.tolist(),
+                                             contour_layers.tolist(), closed.tolist()):
+            segments = order[start:stop]
+            points = np.concatenate([starts[segments], ends[segments[-1:]]])
+            if is_closed:
+                points = points[:-1]
+            contours_by_layer.setdefault(k, []).append((points, is_closed))
+            stats["open_contours"] += not is_closed
+        for k in range(ka, kb):
+            yield k + 1, (k + 1) * layer_height, contours_by_layer.get(k, [])
+
+
+def clean_contours(contours, tolerance=DEFAULT_CLEANUP_TOLERANCE):
+    """
+    Drops the contour points within tolerance of the chord that replaces them (the collinear points one
+    per triangle of a flat face), all contours of a layer at once. A closed contour is simplified as a
+    loop that starts and ends at a real corner, so its seam is not kept in the middle of an edge.
+    """
+    if not contours or tolerance is None:
+        return contours
+    loops = []
+    for points, closed in contours:
+        if closed and len(points) > 2:
+            # the point farthest from any point lies on the convex hull, i.e. it is a corner
+            corner = int(np.argmax(((points - points[0]) ** 2).sum(axis=1)))
+            points = np.concatenate([points[corner:], points[:corner + 1]])
+        loops.append(points)
+    sizes = np.array([len(points) for points in loops])
+    range_ends = np.cumsum(sizes) - 1
+    keep = rdp_keep_mask(np.concatenate(loops), range_ends - sizes + 1, range_ends, tolerance)
+    kept = np.split(keep, range_ends[:-1] + 1)
+    return [(points[mask][:-1] if len(points) > len(original) else points[mask], closed)
+            for points, mask, (original, closed) in zip(loops, kept, contours)]
+
+
+def contour_toolpath_lines(layers, header_comment, layer_height, print_feedrate=DEFAULT_PRINT_FEEDRATE,
+                           g0_feedrate=DEFAULT_G0_FEEDRATE, stats=None):
+    """
+    Generator over the NC program (lines without newlines, in the format of transGcode) that prints the
+    contours of layers, an iterable of (layer_number, z, contours) with contours a list of (points (k, 2),
+    closed): per layer a "; (--- Layer N @ Z=... ---)" marker, then every contour as a G0 to its start
+    and G1 moves along it (back to the start if closed). stats (dict) receives
+    {"layers": n, "paths": n, "print_length": mm}.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(layers=0, paths=0, print_length=0.0)
+    g0_feed = f"F{g0_feedrate:.0f}"
+    g1_feed = f"F{print_feedrate:.0f}"
+    yield "G21 ; 设置单位为毫米"
+    yield "G90 ; 使用绝对坐标模式"
+    yield f"; ({header_comment})"
+    yield f"; (User-defined layer height for Z calculation: {layer_height:.3f}mm)"
+    yield f"; (G1 XY Feedrate set to: {print_feedrate:.0f} mm/min)"
+    yield f"; (ALL G0 Feedrates will use default G0 speed: {g0_feedrate:.0f} mm/min)"
+    yield ""
+    top_z = 0.0
+    for layer_number, z, contours in layers:
+        stats["layers"] += 1
+        top_z = z
+        yield ""
+        yield f"; (--- Layer {layer_number} @ Z={z:.3f} ---)"
+        for p, (points, closed) in enumerate(contours):
+            if closed:
+                points = np.concatenate([points, points[:1]])
+            # + 0.0 turns -0.0 into 0.0, so no "-0.000" is written
+            points = np.round(points, 3) + 0.0
+            stats["paths"] += 1
+            stats["print_length"] += float(np.hypot(*np.diff(points, axis=0).T).sum())
+            x, y = points[0]
+            if p == 0:
+                yield f"G0 X{x:.3f} Y{y:.3f} Z{z:.3f} {g0_feed}"
+            else:
+                yield f"G0 X{x:.3f} Y{y:.3f} {g0_feed}"
+            for x, y in points[1:].tolist():
+                yield f"G1 X{x:.3f} Y{y:.3f} {g1_feed}"
+    yield ""
+    yield f"G0 Z{top_z + FINAL_Z_LIFT:.3f} {g0_feed} ; Final safe Z lift"
+    yield f"G0 X0 Y0 {g0_feed} ; Optional: Return to origin"
+    yield "M30 ; Program End"
+
+
+def print_slice_report(stats):
+    print(f"切片: {stats['triangles']} 个三角形, {stats['layers']} 层, {stats['segments']} 条截线, "
+          f"{stats['paths']} 条路径 (未闭合 {stats['open_contours']}), 打印长度 {stats['print_length']:.1f} mm")
+    if stats["open_contours"]:
+        print("警告: 部分轮廓未闭合, 模型可能不是封闭的流形网格。")
+
+
+def slice_stl_stream(triangles, outfile, source_name, layer_height, print_feedrate=DEFAULT_PRINT_FEEDRATE,
+                     g0_feedrate=DEFAULT_G0_FEEDRATE, tolerance=DEFAULT_CLEANUP_TOLERANCE):
+    """
+    Slices triangles (see load_stl) and writes the NC program to outfile; prints the report.
+    """
+    stats = {}
+    layers = ((number, z, clean_contours(contours, tolerance))
+              for number, z, contours in slice_triangles(triangles, layer_height, stats=stats))
+    gcode_io.write_lines(outfile, contour_toolpath_lines(
+        layers, f"Sliced from STL: {source_name}", layer_height, print_feedrate, g0_feedrate, stats=stats))
+    print_slice_report(stats)
+    return True
+
+
+def default_output_path(input_file_path):
+    return os.path.splitext(input_file_path)[0] + ".nc"
+
+
+def slice_stl_file(input_filepath, output_filepath=None, layer_height=0.5, print_feedrate=DEFAULT_PRINT_FEEDRATE,
+                   g0_feedrate=DEFAULT_G0_FEEDRATE, tolerance=DEFAULT_CLEANUP_TOLERANCE, compact=False,
+                   precision=None):
+    if output_filepath is None:
+        output_filepath = default_output_path(input_filepath)
+    try:
+        triangles = load_stl(input_filepath)
+        with gcode_io.open_output(output_filepath, compact=compact, precision=precision) as f_out:
+            slice_stl_stream(triangles, f_out, os.path.basename(input_filepath), layer_height,
+                             print_feedrate=print_feedrate, g0_feedrate=g0_feedrate, tolerance=tolerance)
+    except FileNotFoundError:
+        print(f"错误: 文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"错误: 切片文件 '{input_filepath}' 失败: {e}")
+        return None
+    print(f"切片完成！NC 文件已保存到: {output_filepath}")
+    return output_filepath
+
+
+def main():
+    input_file_path = input("请输入STL文件的完整路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    try:
+        layer_height = float(input("请输入层高 (mm): "))
+        feed_str = input(f"请输入打印速度 (mm/min, 留空则使用 {DEFAULT_PRINT_FEEDRATE:.0f}): ").strip()
+        print_feedrate = float(feed_str) if feed_str else DEFAULT_PRINT_FEEDRATE
+    except ValueError:
+        print("错误：请输入有效的数字。")
+        return
+    if layer_height <= 0 or print_feedrate <= 0:
+        print("错误：层高和速度必须是正数。")
+        return
+    slice_stl_file(input_file_path, layer_height=layer_height, print_feedrate=print_feedrate)
+
+
+if __name__ == "__main__":
+    run_main(main)
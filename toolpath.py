@@ -0,0 +1,542 @@
+import array
+import json
+import os
+import re
+import struct
+
+import numpy as np
+
+import gcode_io
+from gcode_io import TOOLPATH_EXTENSION, TOOLPATH_MAGIC
+from profiling import run_main
+
+# File layout (little endian):
+#   magic (8 bytes) | JSON header size (uint64) | JSON header | column data
+# Each column starts at a 64-byte aligned offset inside the data section, so a file can be memory-mapped
+# and every column used as a numpy array without copying. There is one record per NC line: canonical
+# G0/G1 moves live in the numeric columns, any other line is kept verbatim in the string table, which
+# makes the NC export lossless.
+_ALIGNMENT = 64
+_HEAD = struct.Struct("<8sQ")
+
+KIND_TEXT = 0
+KIND_G0 = 1
+KIND_G1 = 2
+HAS_X = 1
+HAS_Y = 2
+HAS_Z = 4
+HAS_F = 8
+F_DECIMALS_SHIFT = 4 # bits 4-5 of the mask: number of decimals of the F word (0-3)
+
+RECORD_COLUMNS = (("kind", "u1"), ("mask", "u1"), ("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("f", "<f4"),
+                  ("text", "<i4"))
+LAYER_COLUMNS = (("layer_number", "<i4"), ("layer_z", "<f4"), ("layer_start", "<i8"))
+STRING_COLUMNS = (("string_offsets", "<i8"), ("string_data", "u1"))
+ALL_COLUMNS = RECORD_COLUMNS + LAYER_COLUMNS + STRING_COLUMNS
+
+# Below these magnitudes float32 reproduces a value with the given number of decimals exactly
+# (half an ulp stays below half of the last decimal place).
+_MAX_EXACT_MAGNITUDE = {0: float(2 ** 24), 1: float(2 ** 20), 2: float(2 ** 17), 3: float(2 ** 13)}
+
+_NUMBER = r"-?(?:0|[1-9]\d*)"
+_MOVE_PATTERN = re.compile(
+    rf"G([01])(?: X({_NUMBER}\.\d{{3}}))?(?: Y({_NUMBER}\.\d{{3}}))?(?: Z({_NUMBER}\.\d{{3}}))?"
+    rf"(?: F({_NUMBER}(?:\.\d{{1,3}})?))?(?: (;.*))?")
+_LAYER_Z_PATTERN = re.compile(r"@ Z=(-?\d+(?:\.\d+)?)")
+_METADATA_PATTERNS = (
+    ("source", re.compile(r"; \(Converted from Marlin: (.*)\)$"), str),
+    ("layer_height", re.compile(r"; \(User-defined layer height for Z calculation: (\d+\.\d+)mm\)"), float),
+    ("xy_feedrate", re.compile(r"; \(G1 XY Feedrate set to: (\d+) mm/min\)"), float),
+    ("z_feedrate", re.compile(r"; \(G1 Z-only Feedrate set to: (\d+) mm/min\)"), float),
+    ("g0_feedrate", re.compile(
+        r"; \(ALL G0 Feedrates will (?:also use this Z-axis speed|use default G0 speed): (\d+) mm/min"), float),
+)
+
+_RENDER_CHUNK = 65536
+
+
+def _is_plain_comment(comment):
+    # Z-rewriting tools split lines on whitespace and treat every "Z..." word as a Z value, and layer
+    # comments are found anywhere in a line, so such comments are stored as text to keep the semantics.
+    words = comment.split()
+    if " ".join(words) != comment or gcode_io.LAYER_COMMENT_PATTERN.search(comment):
+        return False
+    return not any(word.startswith("Z") for word in words)
+
+
+def parse_move(line):
+    """
+    Returns (kind, mask, x, y, z, f, comment) for a G0/G1 line in the canonical form written by the tools
+    ("G1 X1.000 Y2.000 F1200 ; TYPE:WALL-OUTER", "G1 X1.000 Y2.000 F300.0"), or None if the line must be stored as text.
+    """
+    match = _MOVE_PATTERN.fullmatch(line)
+    if match is None:
+        return None
+    command, *words, comment = match.groups()
+    if comment is not None and not _is_plain_comment(comment):
+        return None
+    mask = 0
+    values = [0.0, 0.0, 0.0, 0.0]
+    for i, word in enumerate(words):
+        if word is not None:
+            value = float(word)
+            decimals = len(word) - word.index(".") - 1 if "." in word else 0
+            if abs(value) >= _MAX_EXACT_MAGNITUDE[decimals]:
+                return None
+            mask |= 1 << i
+            values[i] = value
+            if i == 3:
+                mask |= decimals << F_DECIMALS_SHIFT
+    return (KIND_G0 if command == "0" else KIND_G1, mask, *values, comment)
+
+
+def render_move(kind, mask, x, y, z, f, comment=None):
+    """
+    Formats one move record as an NC line (without newline); the inverse of parse_move.
+    """
+    parts = ["G0" if kind == KIND_G0 else "G1"]
+    if mask & HAS_X:
+        parts.append(f"X{x:.3f}")
+    if mask & HAS_Y:
+        parts.append(f"Y{y:.3f}")
+    if mask & HAS_Z:
+        parts.append(f"Z{z:.3f}")
+    if mask & HAS_F:
+        parts.append(f"F{f:.{(mask >> F_DECIMALS_SHIFT) & 3}f}")
+    if comment is not None:
+        parts.append(comment)
+    return " ".join(parts)
+
+
+def _encode_strings(strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype="u1")
+
+
+class Toolpath:
+    """
+    A toolpath held as numpy columns (memory-mapped when loaded from a file):
+    per record kind/mask/x/y/z/f/text, the layer table layer_number/layer_z/layer_start (index of the
+    "; (--- Layer N" record) and the string table string_offsets/string_data.
+    """
+
+    def __init__(self, columns, metadata=None, trailing_newline=True):
+        for name, _ in ALL_COLUMNS:
+            setattr(self, name, columns[name])
+        self.metadata = dict(metadata or {})
+        self.trailing_newline = trailing_newline
+        self._string_cache = {}
+
+    def __len__(self):
+        return len(self.kind)
+
+    @property
+    def layer_count(self):
+        return len(self.layer_start)
+
+    def string(self, index):
+        text = self._string_cache.get(index)
+        if text is None:
+            start, stop = int(self.string_offsets[index]), int(self.string_offsets[index + 1])
+            text = bytes(self.string_data[start:stop]).decode("utf-8")
+            self._string_cache[index] = text
+        return text
+
+    def line(self, index):
+        """
+        The NC line of record index, without newline.
+        """
+        kind = int(self.kind[index])
+        text_index = int(self.text[index])
+        if kind == KIND_TEXT:
+            return self.string(text_index)
+        return render_move(kind, int(self.mask[index]), float(self.x[index]), float(self.y[index]),
+                           float(self.z[index]), float(self.f[index]),
+                           self.string(text_index) if text_index >= 0 else None)
+
+    def iter_nc_lines(self, start=0, stop=None):
+        """
+        Yields the NC lines (with newlines) of records start..stop, decoding the columns chunk by chunk.
+        The last line of the toolpath has no newline if the original text had none.
+        """
+        total = len(self)
+        stop = total if stop is None else min(stop, total)
+        without_newline = stop == total and total > 0 and not self.trailing_newline
+        string = self.string
+        for chunk_start in range(start, stop - without_newline, _RENDER_CHUNK):
+            chunk = slice(chunk_start, min(chunk_start + _RENDER_CHUNK, stop - without_newline))
+            rows = zip(self.kind[chunk].tolist(), self.mask[chunk].tolist(),
+                       self.x[chunk].astype(float).tolist(), self.y[chunk].astype(float).tolist(),
+                       self.z[chunk].astype(float).tolist(), self.f[chunk].astype(float).tolist(),
+                       self.text[chunk].tolist())
+            for kind, mask, x, y, z, f, text_index in rows:
+                if kind == KIND_TEXT:
+                    yield string(text_index) + "\n"
+                else:
+                    yield render_move(kind, mask, x, y, z, f, string(text_index) if text_index >= 0 else None) + "\n"
+        if without_newline and start < stop:
+            yield self.line(stop - 1)
+
+    def layer_bounds(self, k):
+        """
+        (start, stop) record range of the k-th entry of the layer table, from its layer comment up to the
+        next layer comment (or the end of the toolpath).
+        """
+        start = int(self.layer_start[k])
+        stop = int(self.layer_start[k + 1]) if k + 1 < self.layer_count else len(self)
+        return start, stop
+
+    def records(self, start, stop):
+        """
+        Records start..stop as a Toolpath of their own that shares the string table; its layer table holds
+        the layer comments inside the range.
+        """
+        columns = {name: getattr(self, name)[start:stop] for name, _ in RECORD_COLUMNS}
+        first, last = np.searchsorted(self.layer_start, [start, stop]).tolist()
+        columns["layer_number"] = self.layer_number[first:last]
+        columns["layer_z"] = self.layer_z[first:last]
+        columns["layer_start"] = np.asarray(self.layer_start[first:last]) - start
+        columns["string_offsets"], columns["string_data"] = self.string_offsets, self.string_data
+        return Toolpath(columns, self.metadata, self.trailing_newline or stop < len(self))
+
+    def record_layers(self, records):
+        """
+        Layer number in effect at each of the given record indices (0 before the first layer comment).
+        """
+        records = np.asarray(records, dtype=np.int64)
+        entries = np.searchsorted(self.layer_start, records, side="right") - 1
+        if not self.layer_count:
+            return np.zeros(len(records), dtype=np.int64)
+        return np.where(entries >= 0, self.layer_number[np.maximum(entries, 0)], 0)
+
+    def positions(self):
+        """
+        (x, y, z, f) in effect after every record, as float64 arrays: the words a move leaves out keep the
+        value of the previous move (nan before the first value). Text records (including G2/G3 arcs and
+        moves not in the canonical form) do not change the position.
+        """
+        moves = self.kind != KIND_TEXT
+        index = np.arange(len(self))
+        result = []
+        for name, bit in (("x", HAS_X), ("y", HAS_Y), ("z", HAS_Z), ("f", HAS_F)):
+            source = np.where(moves & ((self.mask & bit) != 0), index, -1)
+            np.maximum.accumulate(source, out=source)
+            values = np.asarray(getattr(self, name), dtype=float)[np.maximum(source, 0)]
+            values[source < 0] = np.nan
+            result.append(values)
+        return tuple(result)
+
+    def z_records(self, text_has_z):
+        """
+        Indices, in file order, of the moves with a Z word and of the text records for which
+        text_has_z(line) is true. Each distinct text line is tested only once.
+        """
+        moves = np.flatnonzero((self.kind != KIND_TEXT) & ((self.mask & HAS_Z) != 0))
+        text_records = np.flatnonzero(self.kind == KIND_TEXT)
+        text_indices = self.text[text_records]
+        distinct = np.unique(text_indices)
+        with_z = np.array([i for i in distinct.tolist() if text_has_z(self.string(i))], dtype=text_indices.dtype)
+        text_records = text_records[np.isin(text_indices, with_z)]
+        return np.union1d(moves, text_records)
+
+    def with_lines(self, replacements):
+        """
+        Returns a copy in which the records given as {index: line} are replaced by the new lines.
+        Lines may end with "\\n" as returned by the line-based tools. The layer table is kept, so
+        replacements must not add or remove layer comments.
+        """
+        columns = {name: np.array(getattr(self, name)) for name, _ in RECORD_COLUMNS + LAYER_COLUMNS}
+        trailing_newline = self.trailing_newline
+        new_strings = {}
+        base = len(self.string_offsets) - 1
+
+        def string_index(text):
+            if text not in new_strings:
+                new_strings[text] = base + len(new_strings)
+            return new_strings[text]
+
+        last_record = len(self) - 1
+        for index, line in replacements.items():
+            if line.endswith("\n"):
+                line = line[:-1]
+                if index == last_record:
+                    trailing_newline = True
+            if line == self.line(index):
+                continue
+            move = parse_move(line)
+            if move is None:
+                values = (KIND_TEXT, 0, 0.0, 0.0, 0.0, 0.0, string_index(line))
+            else:
+                comment = move[-1]
+                values = move[:-1] + (-1 if comment is None else string_index(comment),)
+            for (name, _), value in zip(RECORD_COLUMNS, values):
+                columns[name][index] = value
+
+        offsets, data = _encode_strings(new_strings)
+        columns["string_offsets"] = np.concatenate([self.string_offsets, self.string_offsets[-1] + offsets[1:]])
+        columns["string_data"] = np.concatenate([self.string_data, data])
+        return Toolpath(columns, self.metadata, trailing_newline)
+
+    def with_columns(self, **columns):
+        """
+        Returns a copy that uses the given record columns (e.g. f=..., mask=...) and shares all others.
+        """
+        merged = {name: getattr(self, name) for name, _ in ALL_COLUMNS}
+        merged.update(columns)
+        return Toolpath(merged, self.metadata, self.trailing_newline)
+
+    def save(self, path):
+        """
+        Writes the toolpath to path (via a temporary file that is renamed into place).
+        """
+        columns = {name: np.ascontiguousarray(getattr(self, name), dtype=dtype) for name, dtype in ALL_COLUMNS}
+        header = {
+            "records": len(self),
+            "layers": self.layer_count,
+            "trailing_newline": self.trailing_newline,
+            "metadata": self.metadata,
+        }
+        return save_columns(path, TOOLPATH_MAGIC, header, columns)
+
+
+class ToolpathWriter:
+    """
+    File-like sink (write/writelines) that packs NC text into a Toolpath. close() saves it to path;
+    without a path, use to_toolpath(). Header comments written by transGcode fill in the metadata.
+    """
+
+    def __init__(self, path=None, metadata=None):
+        self.path = path
+        self.metadata = dict(metadata or {})
+        self.closed = False
+        self._records = {name: array.array(code) for name, code in
+                         (("kind", "B"), ("mask", "B"), ("x", "f"), ("y", "f"), ("z", "f"), ("f", "f"), ("text", "i"))}
+        self._layers = {"layer_number": array.array("i"), "layer_z": array.array("f"), "layer_start": array.array("q")}
+        self._strings = {}
+        self._partial = ""
+        self._trailing_newline = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def _string_index(self, text):
+        index = self._strings.get(text)
+        if index is None:
+            index = self._strings[text] = len(self._strings)
+        return index
+
+    def add_line(self, line):
+        """
+        Appends one NC line (without newline).
+        """
+        records = self._records
+        move = parse_move(line)
+        if move is None:
+            self._scan_text(line, len(records["kind"]))
+            values = (KIND_TEXT, 0, 0.0, 0.0, 0.0, 0.0, self._string_index(line))
+        else:
+            comment = move[-1]
+            values = move[:-1] + (-1 if comment is None else self._string_index(comment),)
+        for column, value in zip(records.values(), values):
+            column.append(value)
+
+    def _scan_text(self, line, record_index):
+        layer_match = gcode_io.LAYER_COMMENT_PATTERN.search(line)
+        if layer_match:
+            z_match = _LAYER_Z_PATTERN.search(line)
+            self._layers["layer_number"].append(int(layer_match.group(1)))
+            self._layers["layer_z"].append(float(z_match.group(1)) if z_match else float("nan"))
+            self._layers["layer_start"].append(record_index)
+        elif not self._layers["layer_start"]:
+            for key, pattern, cast in _METADATA_PATTERNS:
+                match = pattern.search(line)
+                if match and key not in self.metadata:
+                    self.metadata[key] = cast(match.group(1))
+
+    def write(self, text):
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self.add_line(line)
+        return len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def to_toolpath(self):
+        if self._partial:
+            self.add_line(self._partial)
+            self._partial = ""
+            self._trailing_newline = False
+        columns = {name: np.frombuffer(self._records[name], dtype=dtype) for name, dtype in RECORD_COLUMNS}
+        columns.update((name, np.frombuffer(self._layers[name], dtype=dtype)) for name, dtype in LAYER_COLUMNS)
+        columns["string_offsets"], columns["string_data"] = _encode_strings(self._strings)
+        return Toolpath(columns, self.metadata, self._trailing_newline)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.path is not None:
+            self.to_toolpath().save(self.path)
+
+
+def save_columns(path, magic, header, columns):
+    """
+    Writes the numpy arrays in columns ({name: array}) in the layout described at the top of this file:
+    header (a dict, saved as JSON together with the column layout), then every column 64-byte aligned.
+    The file is written to a temporary file that is renamed into place.
+    """
+    layout = {}
+    position = 0
+    for name, column in columns.items():
+        position = -(-position // _ALIGNMENT) * _ALIGNMENT
+        layout[name] = [column.dtype.str.lstrip("|"), position, len(column)]
+        position += column.nbytes
+    header_bytes = json.dumps(dict(header, columns=layout), ensure_ascii=False).encode("utf-8")
+    data_start = -(-(_HEAD.size + len(header_bytes)) // _ALIGNMENT) * _ALIGNMENT
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_HEAD.pack(magic, len(header_bytes)))
+        f.write(header_bytes)
+        for name, column in columns.items():
+            f.write(b"\0" * (data_start + layout[name][1] - f.tell()))
+            f.write(memoryview(np.ascontiguousarray(column)).cast("B"))
+    os.replace(temp_path, path)
+    return path
+
+
+def load_columns(path, magic, mmap=True, kind="工具路径"):
+    """
+    Reads a file written by save_columns: returns (header, {name: array}), the arrays memory-mapped
+    read-only with mmap.
+    """
+    with open(path, "rb") as f:
+        header_size = _read_header(f.read(_HEAD.size), path, magic, kind)
+        header = json.loads(f.read(header_size).decode("utf-8"))
+    data_start = -(-(_HEAD.size + header_size) // _ALIGNMENT) * _ALIGNMENT
+    columns = {}
+    for name, (dtype, offset, count) in header["columns"].items():
+        if not count:
+            columns[name] = np.zeros(0, dtype=dtype)
+        elif mmap:
+            columns[name] = np.memmap(path, dtype=dtype, mode="r", offset=data_start + offset, shape=(count,))
+        else:
+            columns[name] = np.fromfile(path, dtype=dtype, count=count, offset=data_start + offset)
+    return header, columns
+
+
+def _read_header(head, source, magic=TOOLPATH_MAGIC, kind="工具路径"):
+    if len(head) < _HEAD.size:
+        raise ValueError(f"'{source}' 不是有效的{kind}文件 (文件过短)")
+    file_magic, header_size = _HEAD.unpack_from(head)
+    if file_magic != magic:
+        raise ValueError(f"'{source}' 不是有效的{kind}文件 (文件头不匹配)")
+    return header_size
+
+
+def _toolpath_from_header(header, data_start, load_column):
+    columns = {}
+    for name, (dtype, offset, count) in header["columns"].items():
+        columns[name] = load_column(dtype, data_start + offset, count) if count else np.zeros(0, dtype=dtype)
+    return Toolpath(columns, header["metadata"], header["trailing_newline"])
+
+
+def load_toolpath(path, mmap=True):
+    """
+    Loads a .diwtp file. With mmap the columns are memory-mapped read-only, so only the pages that are
+    actually used are ever read from disk.
+    """
+    header, columns = load_columns(path, TOOLPATH_MAGIC, mmap=mmap)
+    return Toolpath(columns, header["metadata"], header["trailing_newline"])
+
+
+def toolpath_from_bytes(data):
+    """
+    Loads a toolpath from an in-memory copy of a .diwtp file (e.g. read from stdin).
+    """
+    header_size = _read_header(data[:_HEAD.size], "stdin")
+    header = json.loads(data[_HEAD.size:_HEAD.size + header_size].decode("utf-8"))
+    data_start = -(-(_HEAD.size + header_size) // _ALIGNMENT) * _ALIGNMENT
+    return _toolpath_from_header(
+        header, data_start, lambda dtype, offset, count: np.frombuffer(data, dtype=dtype, count=count, offset=offset))
+
+
+def toolpath_from_nc_lines(lines, metadata=None):
+    """
+    Packs NC text lines (any iterable, with or without newlines) into a Toolpath in memory.
+    """
+    writer = ToolpathWriter(metadata=metadata)
+    unterminated = False
+    for line in lines:
+        if unterminated:
+            writer.write("\n")
+        writer.write(line)
+        unterminated = not line.endswith("\n")
+    return writer.to_toolpath()
+
+
+def write_output(toolpath, output_path, **options):
+    """
+    Saves toolpath as .diwtp, or exports it as NC text (compressed by extension, "-" for stdout);
+    options (compact, precision) are passed on to gcode_io.open_output.
+    """
+    if gcode_io.is_toolpath_path(output_path):
+        return toolpath.save(output_path)
+    with gcode_io.open_output(output_path, **options) as outfile:
+        outfile.writelines(toolpath.iter_nc_lines())
+    return output_path
+
+
+def default_output_path(input_filepath):
+    """
+    part.diwtp -> part.nc, anything else (part.nc, part.nc.gz, ...) -> part.diwtp
+    """
+    base = gcode_io.split_compression_suffix(input_filepath)[0]
+    root, ext = os.path.splitext(base)
+    if ext.lower() == TOOLPATH_EXTENSION:
+        return root + ".nc"
+    return root + TOOLPATH_EXTENSION
+
+
+def convert_file(input_filepath, output_filepath=None):
+    """
+    Converts between NC text and the binary toolpath format; the direction follows the file names.
+    Returns the output path or None.
+    """
+    if output_filepath is None:
+        output_filepath = default_output_path(input_filepath)
+    try:
+        with gcode_io.open_input(input_filepath) as infile, gcode_io.open_output(output_filepath) as outfile:
+            outfile.writelines(infile)
+    except FileNotFoundError:
+        print(f"错误：文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"转换文件时发生错误: {e}")
+        return None
+    print(f"转换完成。文件已保存到: {output_filepath}")
+    return output_filepath
+
+
+def main():
+    input_file = input("请输入 .nc 或 .diwtp 文件的完整路径: ").strip()
+    if not os.path.isfile(input_file):
+        print(f"错误: 文件 '{input_file}' 不存在或不是一个文件。")
+        return
+    convert_file(input_file)
+
+
+if __name__ == "__main__":
+    run_main(main)
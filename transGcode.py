@@ -1,26 +1,22 @@
+import collections
+import concurrent.futures
+import itertools
 import re
 import os
 import datetime
 
-def convert_marlin_to_simple_grbl(
-    input_filepath, 
-    output_directory, 
-    output_filename_base,
-    user_defined_layer_height, 
-    desired_g1_xy_feedrate=None, 
-    desired_g1_z_feedrate=None, # This is the "设置的z轴速度" user refers to
-    fixed_g0_feedrate=1500.0    # This acts as a fallback for G0 if desired_g1_z_feedrate is not set
-):
-    output_lines = []
-    effective_layer_number = 0 
-    current_target_z_for_output = 0.0 
-    last_original_z_that_started_a_layer = None 
-    initial_overall_z_setup_move_processed = False
-    first_actual_layer_z_processed = False
+import gcode_io
+from profiling import run_main
+
+PARALLEL_CHUNK_LINES = 20000 # Marlin lines per worker task in the parallel mode
+_STOP = object() # parse_marlin_line result for M30/M2: the rest of the file is ignored
 
+def _header_lines(source_name, user_defined_layer_height, desired_g1_xy_feedrate, desired_g1_z_feedrate,
+                  fixed_g0_feedrate):
+    output_lines = []
     output_lines.append("G21 ; 设置单位为毫米")
     output_lines.append("G90 ; 使用绝对坐标模式")
-    output_lines.append(f"; (Converted from Marlin: {os.path.basename(input_filepath)})")
+    output_lines.append(f"; (Converted from Marlin: {source_name})")
     output_lines.append(f"; (User-defined layer height for Z calculation: {user_defined_layer_height:.3f}mm)")
     if desired_g1_xy_feedrate:
         output_lines.append(f"; (G1 XY Feedrate set to: {desired_g1_xy_feedrate:.0f} mm/min)")
@@ -35,193 +31,524 @@ def convert_marlin_to_simple_grbl(
         output_lines.append(f"; (ALL G0 Feedrates will use default G0 speed: {fixed_g0_feedrate:.0f} mm/min as specific Z-axis speed was not set for G0s)")
     output_lines.append("; (G28 Home command removed)")
     output_lines.append("")
+    return output_lines
 
-    g28_found_and_removed_once = False
 
-    try:
-        with open(input_filepath, 'r', encoding='utf-8') as f:
-            for original_line_with_nl in f:
-                original_line = original_line_with_nl.strip()
-                line_to_parse = original_line
-                comment_original = ""
+def parse_marlin_line(original_line_with_nl, desired_g1_xy_feedrate=None, desired_g1_z_feedrate=None,
+                      fixed_g0_feedrate=1500.0):
+    """
+    Converts one Marlin line on its own. Returns None for a dropped line, _STOP at M30/M2, the output
+    line for comments and moves without Z, or (command, original_z, head, tail, layer_comment) for a
+    move with Z, whose output is f"{head} Z{z:.3f}{tail}" once LayerTracker has chosen z.
+    """
+    original_line = original_line_with_nl.strip()
+    line_to_parse = original_line
+    comment_original = ""
+            
+    if ';' in line_to_parse:
+        parts = line_to_parse.split(';', 1)
+        line_to_parse = parts[0].strip()
+        comment_original = "; " + parts[1].strip()
+
+    if not line_to_parse and not comment_original.startswith(";LAYER:") and not comment_original.startswith(";TYPE:") and not comment_original.startswith(";MESH:"):
+        return None
+
+    if line_to_parse.startswith("M104") or \
+       line_to_parse.startswith("M105") or \
+       line_to_parse.startswith("M109") or \
+       line_to_parse.startswith("M140") or \
+       line_to_parse.startswith("M190") or \
+       line_to_parse.startswith("M106") or \
+       line_to_parse.startswith("M107") or \
+       line_to_parse.startswith("M82") or \
+       line_to_parse.startswith("M83") or \
+       line_to_parse.startswith("M84") or \
+       re.match(r"^G92\s+E", line_to_parse, re.IGNORECASE) or \
+       line_to_parse.upper() == "G92":
+        return None
+            
+    if line_to_parse.upper().startswith("G28"):
+        return None
+            
+    if line_to_parse.upper().startswith("G0") or line_to_parse.upper().startswith("G1"):
+        command_match = re.match(r"(G[01])\s*(.*)", line_to_parse, re.IGNORECASE)
+        if not command_match:
+            return None
                 
-                if ';' in line_to_parse:
-                    parts = line_to_parse.split(';', 1)
-                    line_to_parse = parts[0].strip()
-                    comment_original = "; " + parts[1].strip()
-
-                if not line_to_parse and not comment_original.startswith(";LAYER:") and not comment_original.startswith(";TYPE:") and not comment_original.startswith(";MESH:"):
-                    continue
-
-                if line_to_parse.startswith("M104") or \
-                   line_to_parse.startswith("M105") or \
-                   line_to_parse.startswith("M109") or \
-                   line_to_parse.startswith("M140") or \
-                   line_to_parse.startswith("M190") or \
-                   line_to_parse.startswith("M106") or \
-                   line_to_parse.startswith("M107") or \
-                   line_to_parse.startswith("M82") or \
-                   line_to_parse.startswith("M83") or \
-                   line_to_parse.startswith("M84") or \
-                   re.match(r"^G92\s+E", line_to_parse, re.IGNORECASE) or \
-                   line_to_parse.upper() == "G92":
-                    continue
+        command = command_match.group(1).upper()
+        params_str = command_match.group(2)
                 
-                if line_to_parse.upper().startswith("G28"):
-                    if not g28_found_and_removed_once:
-                        g28_found_and_removed_once = True
-                    continue
+        params = {"X": None, "Y": None, "Z": None, "F": None}
+        original_z_in_current_line = None 
                 
-                if line_to_parse.upper().startswith("G0") or line_to_parse.upper().startswith("G1"):
-                    command_match = re.match(r"(G[01])\s*(.*)", line_to_parse, re.IGNORECASE)
-                    if not command_match:
-                        continue
-                    
-                    command = command_match.group(1).upper()
-                    params_str = command_match.group(2)
-                    
-                    params = {"X": None, "Y": None, "Z": None, "F": None}
-                    original_z_in_current_line = None 
-                    
-                    param_tokens = re.findall(r"([XYZF])([-\d.]+)", params_str, re.IGNORECASE)
-                    e_axis_present = "E" in params_str.upper()
-
-                    for axis_char, value_str in param_tokens:
-                        axis = axis_char.upper()
-                        try:
-                            value = float(value_str)
-                            if axis in params:
-                                params[axis] = value
-                                if axis == "Z":
-                                    original_z_in_current_line = value
-                        except ValueError:
-                            pass 
-                    
-                    if command == "G1" and params["X"] is None and params["Y"] is None and params["Z"] is None and e_axis_present:
-                        continue
-                    if params["X"] is None and params["Y"] is None and params["Z"] is None:
-                         if not (command == "G0" and e_axis_present):
-                             continue
-
-                    output_z_value = None 
-
-                    if original_z_in_current_line is not None:
-                        current_original_z_val_rounded = round(original_z_in_current_line, 3)
-
-                        if not initial_overall_z_setup_move_processed and command == "G0": 
-                            output_z_value = original_z_in_current_line 
-                            initial_overall_z_setup_move_processed = True
-                        
-                        elif not first_actual_layer_z_processed: 
-                            effective_layer_number = 1
-                            current_target_z_for_output = user_defined_layer_height * effective_layer_number
-                            output_z_value = current_target_z_for_output
-                            output_lines.append(f"\n; (--- Layer {effective_layer_number} @ Z={current_target_z_for_output:.3f} ---){comment_original if 'LAYER:' in comment_original.upper() else ''}")
-                            last_original_z_that_started_a_layer = current_original_z_val_rounded
-                            first_actual_layer_z_processed = True
-                        
-                        elif abs(current_original_z_val_rounded - last_original_z_that_started_a_layer) > 0.001: 
-                            effective_layer_number += 1
-                            current_target_z_for_output = user_defined_layer_height * effective_layer_number
-                            output_z_value = current_target_z_for_output
-                            output_lines.append(f"\n; (--- Layer {effective_layer_number} @ Z={current_target_z_for_output:.3f} ---){comment_original if 'LAYER:' in comment_original.upper() else ''}")
-                            last_original_z_that_started_a_layer = current_original_z_val_rounded
-                        
-                        elif first_actual_layer_z_processed: 
-                             output_z_value = current_target_z_for_output
-                    
-                    new_line_parts = [command]
-                    if params["X"] is not None: new_line_parts.append(f"X{params['X']:.3f}")
-                    if params["Y"] is not None: new_line_parts.append(f"Y{params['Y']:.3f}")
-                    if output_z_value is not None: new_line_parts.append(f"Z{output_z_value:.3f}")
-                    
-                    current_line_had_x_param = params["X"] is not None
-                    current_line_had_y_param = params["Y"] is not None
-                    current_line_outputs_z = output_z_value is not None
-
-                    is_z_only_move_based_on_current_gcode_params = current_line_outputs_z and \
-                                                                   not current_line_had_x_param and \
-                                                                   not current_line_had_y_param
-                    
-                    if command == "G0":
-                        if desired_g1_z_feedrate is not None:
-                            new_line_parts.append(f"F{desired_g1_z_feedrate:.0f}")
-                        else:
-                            new_line_parts.append(f"F{fixed_g0_feedrate:.0f}")
-                    elif command == "G1":
-                        if is_z_only_move_based_on_current_gcode_params:
-                            if desired_g1_z_feedrate is not None:
-                                new_line_parts.append(f"F{desired_g1_z_feedrate:.0f}")
-                            elif params["F"] is not None: 
-                                new_line_parts.append(f"F{params['F']:.0f}")
-                            elif desired_g1_xy_feedrate is not None: 
-                                new_line_parts.append(f"F{desired_g1_xy_feedrate:.0f}")
-                        else: 
-                            if desired_g1_xy_feedrate is not None:
-                                new_line_parts.append(f"F{desired_g1_xy_feedrate:.0f}")
-                            elif params["F"] is not None:
-                                new_line_parts.append(f"F{params['F']:.0f}")
-                    
-                    if len(new_line_parts) > 1 :
-                         output_lines.append(" ".join(new_line_parts) + (f" {comment_original}" if "TYPE:" in comment_original or "MESH:" in comment_original else ""))
-
-                elif line_to_parse.upper().startswith("M30") or line_to_parse.upper().startswith("M2"):
-                    break 
+        param_tokens = re.findall(r"([XYZF])([-\d.]+)", params_str, re.IGNORECASE)
+        e_axis_present = "E" in params_str.upper()
+
+        for axis_char, value_str in param_tokens:
+            axis = axis_char.upper()
+            try:
+                value = float(value_str)
+                if axis in params:
+                    params[axis] = value
+                    if axis == "Z":
+                        original_z_in_current_line = value
+            except ValueError:
+                pass 
                 
-                elif line_to_parse.startswith(";"):
-                    if "LAYER:" in line_to_parse.upper() or \
-                       "TYPE:" in line_to_parse.upper() or \
-                       "MESH:" in line_to_parse.upper() or \
-                       "TIME_ELAPSED" in line_to_parse.upper() or \
-                       line_to_parse.startswith(";FLAVOR:") or \
-                       line_to_parse.startswith(";TIME:") or \
-                       line_to_parse.startswith(";Filament used:") or \
-                       line_to_parse.startswith(";Layer height:"):
-                        output_lines.append(original_line)
-                    
-        add_m30 = True
-        for ln in reversed(output_lines):
-            if ln.strip().upper().startswith("M30"):
-                add_m30 = False
-                break
-        
-        if add_m30:
-            final_z_lift_val = 10.0 
-            if first_actual_layer_z_processed:
-                final_z_lift_val = current_target_z_for_output + 10.0
-            elif initial_overall_z_setup_move_processed :
-                temp_z_initial = 10.0 
-                for line_val in output_lines:
-                    if line_val.strip().startswith("G0 Z") or line_val.strip().startswith("G1 Z"):
-                         z_match = re.search(r'Z([-\d.]+)', line_val, re.IGNORECASE)
-                         if z_match:
-                            try:
-                                temp_z_initial = float(z_match.group(1)) + 10.0
-                                break 
-                            except ValueError:
-                                pass
-                final_z_lift_val = temp_z_initial
-
-            final_g0_feedrate_to_use = fixed_g0_feedrate 
+        if command == "G1" and params["X"] is None and params["Y"] is None and params["Z"] is None and e_axis_present:
+            return None
+        if params["X"] is None and params["Y"] is None and params["Z"] is None:
+             if not (command == "G0" and e_axis_present):
+                 return None
+
+        new_line_parts = [command]
+        if params["X"] is not None: new_line_parts.append(f"X{params['X']:.3f}")
+        if params["Y"] is not None: new_line_parts.append(f"Y{params['Y']:.3f}")
+        head_part_count = len(new_line_parts)
+                
+        current_line_had_x_param = params["X"] is not None
+        current_line_had_y_param = params["Y"] is not None
+        # every move with Z gets an output Z (see LayerTracker.z_move)
+        current_line_outputs_z = original_z_in_current_line is not None
+
+        is_z_only_move_based_on_current_gcode_params = current_line_outputs_z and \
+                                                       not current_line_had_x_param and \
+                                                       not current_line_had_y_param
+                
+        if command == "G0":
             if desired_g1_z_feedrate is not None:
-                final_g0_feedrate_to_use = desired_g1_z_feedrate
+                new_line_parts.append(f"F{desired_g1_z_feedrate:.0f}")
+            else:
+                new_line_parts.append(f"F{fixed_g0_feedrate:.0f}")
+        elif command == "G1":
+            if is_z_only_move_based_on_current_gcode_params:
+                if desired_g1_z_feedrate is not None:
+                    new_line_parts.append(f"F{desired_g1_z_feedrate:.0f}")
+                elif params["F"] is not None: 
+                    new_line_parts.append(f"F{params['F']:.0f}")
+                elif desired_g1_xy_feedrate is not None: 
+                    new_line_parts.append(f"F{desired_g1_xy_feedrate:.0f}")
+            else: 
+                if desired_g1_xy_feedrate is not None:
+                    new_line_parts.append(f"F{desired_g1_xy_feedrate:.0f}")
+                elif params["F"] is not None:
+                    new_line_parts.append(f"F{params['F']:.0f}")
+
+        comment_suffix = f" {comment_original}" if "TYPE:" in comment_original or "MESH:" in comment_original else ""
+        if current_line_outputs_z:
+            head = " ".join(new_line_parts[:head_part_count])
+            tail = "".join(" " + part for part in new_line_parts[head_part_count:]) + comment_suffix
+            layer_comment = comment_original if 'LAYER:' in comment_original.upper() else ''
+            return (command, original_z_in_current_line, head, tail, layer_comment)
+        if len(new_line_parts) > 1 :
+             return " ".join(new_line_parts) + comment_suffix
+        return None
+
+    elif line_to_parse.upper().startswith("M30") or line_to_parse.upper().startswith("M2"):
+        return _STOP
+            
+    elif line_to_parse.startswith(";"):
+        if "LAYER:" in line_to_parse.upper() or \
+           "TYPE:" in line_to_parse.upper() or \
+           "MESH:" in line_to_parse.upper() or \
+           "TIME_ELAPSED" in line_to_parse.upper() or \
+           line_to_parse.startswith(";FLAVOR:") or \
+           line_to_parse.startswith(";TIME:") or \
+           line_to_parse.startswith(";Filament used:") or \
+           line_to_parse.startswith(";Layer height:"):
+            return original_line
+    return None
+
+
+class LayerTracker:
+    """
+    The layer bookkeeping of the converter, the only state carried from line to line: layers are
+    numbered by the distinct Z heights of the Marlin moves and output at user_defined_layer_height * N.
+    """
+
+    def __init__(self, user_defined_layer_height):
+        self.user_defined_layer_height = user_defined_layer_height
+        self.effective_layer_number = 0 
+        self.current_target_z_for_output = 0.0 
+        self.last_original_z_that_started_a_layer = None 
+        self.initial_overall_z_setup_move_processed = False
+        self.first_actual_layer_z_processed = False
+
+    def z_move(self, command, original_z_in_current_line, layer_comment):
+        """
+        Returns (output_z, layer_marker) for a move with Z; layer_marker is the layer comment line to
+        write before the move when it starts a new layer, else None.
+        """
+        current_original_z_val_rounded = round(original_z_in_current_line, 3)
+
+        if not self.initial_overall_z_setup_move_processed and command == "G0": 
+            self.initial_overall_z_setup_move_processed = True
+            return original_z_in_current_line, None
+                
+        if not self.first_actual_layer_z_processed: 
+            self.first_actual_layer_z_processed = True
+        elif abs(current_original_z_val_rounded - self.last_original_z_that_started_a_layer) <= 0.001: 
+            return self.current_target_z_for_output, None
+        self.effective_layer_number += 1
+        self.current_target_z_for_output = self.user_defined_layer_height * self.effective_layer_number
+        self.last_original_z_that_started_a_layer = current_original_z_val_rounded
+        return self.current_target_z_for_output, \
+            f"\n; (--- Layer {self.effective_layer_number} @ Z={self.current_target_z_for_output:.3f} ---){layer_comment}"
+
+
+class MarlinConverter:
+    """
+    The part of the conversion that runs in file order: the output lines of the parse_marlin_line items,
+    with the layer bookkeeping, whether M30 was written and the Z of the first Z-only move for the final
+    lift. As the feed/state interface of checkpoint.py it converts raw Marlin lines (header included) and
+    its state can be saved between lines and given back as state to continue a checkpointed run.
+    """
+
+    def __init__(self, source_name, user_defined_layer_height, desired_g1_xy_feedrate=None,
+                 desired_g1_z_feedrate=None, fixed_g0_feedrate=1500.0, state=None):
+        self.user_defined_layer_height = user_defined_layer_height
+        self.feedrates = (desired_g1_xy_feedrate, desired_g1_z_feedrate, fixed_g0_feedrate)
+        self.source_name = source_name
+        self.tracker = LayerTracker(user_defined_layer_height)
+        self.m30_written = False
+        self.first_z_only_move_z = None
+        self.stopped = False
+        self._layer_started = False
+        if state is not None:
+            self.tracker.__dict__.update(state["tracker"])
+            self.m30_written = state["m30_written"]
+            self.first_z_only_move_z = state["first_z_only_move_z"]
+            self.stopped = state["stopped"]
+
+    def convert(self, item):
+        """
+        Returns the output lines (without newline) of one parse_marlin_line item other than None and _STOP.
+        """
+        if isinstance(item, str):
+            self.m30_written = self.m30_written or item.upper().startswith("M30")
+            return (item,)
+        command, original_z_in_current_line, head, tail, layer_comment = item
+        output_z_value, layer_marker = self.tracker.z_move(command, original_z_in_current_line, layer_comment)
+        z_text = f"{output_z_value:.3f}"
+        if self.first_z_only_move_z is None and head == command:
+            self.first_z_only_move_z = float(z_text)
+        if layer_marker is None:
+            return (f"{head} Z{z_text}{tail}",)
+        self._layer_started = True
+        return (*layer_marker.split("\n"), f"{head} Z{z_text}{tail}")
+
+    def end_lines(self):
+        """
+        The final lift, return to origin and M30 if the program did not write M30 itself.
+        """
+        if self.m30_written:
+            return ()
+        tracker = self.tracker
+        final_z_lift_val = 10.0 
+        if tracker.first_actual_layer_z_processed:
+            final_z_lift_val = tracker.current_target_z_for_output + 10.0
+        elif tracker.initial_overall_z_setup_move_processed and self.first_z_only_move_z is not None:
+            final_z_lift_val = self.first_z_only_move_z + 10.0
+
+        _, desired_g1_z_feedrate, fixed_g0_feedrate = self.feedrates
+        final_g0_feedrate_to_use = fixed_g0_feedrate 
+        if desired_g1_z_feedrate is not None:
+            final_g0_feedrate_to_use = desired_g1_z_feedrate
             
-            output_lines.append(f"\nG0 Z{final_z_lift_val:.3f} F{final_g0_feedrate_to_use:.0f} ; Final safe Z lift")
-            output_lines.append(f"G0 X0 Y0 F{final_g0_feedrate_to_use:.0f} ; Optional: Return to origin")
-            output_lines.append("M30 ; Program End")
+        return ("",
+                f"G0 Z{final_z_lift_val:.3f} F{final_g0_feedrate_to_use:.0f} ; Final safe Z lift",
+                f"G0 X0 Y0 F{final_g0_feedrate_to_use:.0f} ; Optional: Return to origin",
+                "M30 ; Program End")
+
+    def state(self):
+        return {"tracker": dict(self.tracker.__dict__), "m30_written": self.m30_written,
+                "first_z_only_move_z": self.first_z_only_move_z, "stopped": self.stopped}
+
+    def start(self):
+        return [line + "\n" for line in _header_lines(self.source_name, self.user_defined_layer_height,
+                                                       *self.feedrates)]
+
+    def feed(self, line):
+        self._layer_started = False
+        if self.stopped:
+            return ()
+        item = parse_marlin_line(line, *self.feedrates)
+        if item is None:
+            return ()
+        if item is _STOP:
+            self.stopped = True
+            return ()
+        return [output_line + "\n" for output_line in self.convert(item)]
+
+    def at_layer_boundary(self, line):
+        return self._layer_started
+
+    def finish(self):
+        return [line + "\n" for line in self.end_lines()]
 
-        output_filename = f"{output_filename_base}.nc"
-        full_output_path = os.path.join(output_directory, output_filename)
 
-        if not os.path.exists(output_directory):
-            os.makedirs(output_directory)
-            print(f"创建目录: {output_directory}")
+def _parse_marlin_chunk(lines, feedrates):
+    """
+    Worker of the parallel mode: parse_marlin_line over a chunk of lines. Returns (items, stopped),
+    without the dropped lines; stopped is True if the chunk reached M30/M2.
+    """
+    items = []
+    for line in lines:
+        item = parse_marlin_line(line, *feedrates)
+        if item is _STOP:
+            return items, True
+        if item is not None:
+            items.append(item)
+    return items, False
 
-        with open(full_output_path, 'w', encoding='utf-8') as outfile:
-            for out_line in output_lines:
-                outfile.write(out_line + "\n")
+
+def _parse_marlin_parallel(infile, feedrates, workers, chunk_lines=None):
+    """
+    parse_marlin_line over infile in worker processes, chunk_lines (default PARALLEL_CHUNK_LINES) at a
+    time; yields the items in file order (and _STOP at M30/M2). At most two chunks per worker are in flight.
+    """
+    chunk_lines = chunk_lines or PARALLEL_CHUNK_LINES
+    lines = iter(infile)
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    pending = collections.deque()
+    try:
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = list(itertools.islice(lines, chunk_lines))
+                if not chunk:
+                    break
+                pending.append(pool.submit(_parse_marlin_chunk, chunk, feedrates))
+            if not pending:
+                return
+            items, stopped = pending.popleft().result()
+            yield from items
+            if stopped:
+                yield _STOP
+                return
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def convert_marlin_lines(
+    infile,
+    source_name,
+    user_defined_layer_height, 
+    desired_g1_xy_feedrate=None, 
+    desired_g1_z_feedrate=None,
+    fixed_g0_feedrate=1500.0,
+    workers=None
+):
+    """
+    Generator over the converted GRBL program (lines without newline), produced while infile is read.
+    Only running state is kept (the layer bookkeeping, whether M30 was written and the Z of the first
+    Z-only move for the final lift; see MarlinConverter), so memory does not grow with the program size.
+    With workers > 1 the lines are parsed in that many processes; only the Z moves then go through
+    LayerTracker in order, so the output is the same as the sequential one.
+    """
+    yield from _header_lines(source_name, user_defined_layer_height, desired_g1_xy_feedrate,
+                             desired_g1_z_feedrate, fixed_g0_feedrate)
+    feedrates = (desired_g1_xy_feedrate, desired_g1_z_feedrate, fixed_g0_feedrate)
+    if workers is not None and workers > 1:
+        items = _parse_marlin_parallel(infile, feedrates, workers)
+    else:
+        items = (parse_marlin_line(line, *feedrates) for line in infile)
+
+    converter = MarlinConverter(source_name, user_defined_layer_height, *feedrates)
+    for item in items:
+        if item is None:
+            continue
+        if item is _STOP:
+            break
+        yield from converter.convert(item)
+    yield from converter.end_lines()
+
+
+def convert_marlin_stream(
+    infile,
+    outfile,
+    source_name,
+    user_defined_layer_height, 
+    desired_g1_xy_feedrate=None, 
+    desired_g1_z_feedrate=None, # This is the "设置的z轴速度" user refers to
+    fixed_g0_feedrate=1500.0,   # This acts as a fallback for G0 if desired_g1_z_feedrate is not set
+    optimize_travel=False,
+    simplify_tolerance=None,
+    arc_tolerance=None,
+    min_layer_time=None,
+    max_layer_feedrate=None,
+    workers=None,
+    preview=None
+):
+    """
+    Converts Marlin G-code read from the text stream infile and writes the GRBL program to outfile
+    as it is produced (see convert_marlin_lines). source_name is only used for the header comment.
+    Errors are raised to the caller.
+    With simplify_tolerance (mm) the G1 moves within that chord tolerance are merged (simplify.py); with
+    optimize_travel the extrusion paths of each layer are reordered to shorten the G0 travel (travel.py);
+    with min_layer_time (s) the G1 feedrate of each layer is lowered so that no layer is faster than that,
+    and raised up to max_layer_feedrate (mm/min, if given) on the slower layers (layertime.py);
+    with arc_tolerance (mm) runs of G1 chords on a common circle become G2/G3 arcs (arcs.py).
+    preview (a preview.PreviewBuilder) is given every output line, so the level-of-detail preview is
+    built in the same pass.
+    """
+    lines = convert_marlin_lines(infile, source_name, user_defined_layer_height, desired_g1_xy_feedrate,
+                                 desired_g1_z_feedrate, fixed_g0_feedrate, workers=workers)
+    if simplify_tolerance is not None or optimize_travel or arc_tolerance is not None or min_layer_time is not None:
+        import arcs
+        import simplify
+        import travel
+
+        simplify_stats, travel_stats, arc_stats, layer_time_stats = {}, {}, {}, {}
+        if simplify_tolerance is not None:
+            lines = simplify.simplify_lines(lines, simplify_tolerance, stats=simplify_stats)
+        if optimize_travel:
+            lines = travel.optimize_travel_lines(lines, stats=travel_stats)
+        if min_layer_time is not None:
+            import layertime
+            lines = layertime.layer_time_lines(lines, min_layer_time, max_feedrate=max_layer_feedrate,
+                                               stats=layer_time_stats)
+        if arc_tolerance is not None:
+            # last: the other stages only handle G0/G1 moves
+            lines = arcs.fit_arcs_lines(lines, arc_tolerance, stats=arc_stats)
+        if preview is not None:
+            lines = preview.tee(lines)
+        gcode_io.write_lines(outfile, lines)
+        if simplify_tolerance is not None:
+            simplify.print_simplify_report(simplify_stats)
+        if optimize_travel:
+            travel.print_travel_report(travel_stats)
+        if layer_time_stats:
+            layertime.print_layer_time_report(layer_time_stats)
+        if arc_tolerance is not None:
+            arcs.print_arc_report(arc_stats)
+        return True
+    if preview is not None:
+        lines = preview.tee(lines)
+    gcode_io.write_lines(outfile, lines)
+    return True
+
+
+def convert_marlin_checkpointed(
+    input_filepath,
+    output_path,
+    user_defined_layer_height,
+    desired_g1_xy_feedrate=None,
+    desired_g1_z_feedrate=None,
+    fixed_g0_feedrate=1500.0,
+    source_name=None,
+    compression=None,
+    compact=False,
+    precision=None
+):
+    """
+    The plain conversion of input_filepath to output_path with checkpoints at every new layer (see
+    checkpoint.py): a run that is killed continues from the last completed layer when it is started again
+    with the same arguments. The post-processing stages of convert_marlin_stream hold whole layers or the
+    whole program back and are not available here. Errors are raised to the caller.
+    """
+    import checkpoint
+
+    if source_name is None:
+        source_name = os.path.basename(input_filepath)
+    run = checkpoint.CheckpointedRun(input_filepath, output_path, {
+        "tool": "convert", "source_name": source_name, "layer_height": user_defined_layer_height,
+        "feedrates": [desired_g1_xy_feedrate, desired_g1_z_feedrate, fixed_g0_feedrate]})
+    converter = MarlinConverter(source_name, user_defined_layer_height, desired_g1_xy_feedrate,
+                                desired_g1_z_feedrate, fixed_g0_feedrate, state=run.state)
+    run.run(converter, compression=compression, compact=compact, precision=precision)
+    return True
+
+
+def convert_marlin_to_simple_grbl(
+    input_filepath, 
+    output_directory, 
+    output_filename_base,
+    user_defined_layer_height, 
+    desired_g1_xy_feedrate=None, 
+    desired_g1_z_feedrate=None,
+    fixed_g0_feedrate=1500.0,
+    output_compression=None,
+    binary_toolpath=False,
+    optimize_travel=False,
+    simplify_tolerance=None,
+    arc_tolerance=None,
+    min_layer_time=None,
+    max_layer_feedrate=None,
+    compact=False,
+    precision=None,
+    workers=None,
+    write_preview=False,
+    checkpoint=False
+):
+    """
+    File-level wrapper. Compressed input is detected automatically; output_compression
+    (gz, xz, zst, bz2) appends the matching extension and compresses the .nc output.
+    With binary_toolpath the result is saved as a .diwtp toolpath (see toolpath.py) instead.
+    With compact, words that repeat the modal state are left out of the output (see compact.py);
+    precision ({"X": 3, "F": 0, ...}) rounds the numbers of the given axes.
+    workers > 1 parses the Marlin file in that many processes (same output).
+    With write_preview the level-of-detail preview (preview.py) is saved next to the output as .diwpv.
+    With checkpoint the progress is saved at every layer and an interrupted conversion resumes from it
+    (see convert_marlin_checkpointed); the travel, simplify, arc and layer-time stages are then skipped.
+    """
+    output_filename = f"{output_filename_base}.nc"
+    codec = gcode_io.normalize_compression(output_compression)
+    if binary_toolpath:
+        output_filename = f"{output_filename_base}{gcode_io.TOOLPATH_EXTENSION}"
+    elif codec is not None:
+        output_filename += gcode_io.CODEC_SUFFIXES[codec]
+    full_output_path = os.path.join(output_directory, output_filename)
+    builder = None
+    if write_preview:
+        import preview
+        if not checkpoint:
+            builder = preview.PreviewBuilder()
+    if checkpoint and (optimize_travel or simplify_tolerance is not None or arc_tolerance is not None or
+                       min_layer_time is not None):
+        print("提示: 断点续传模式下不进行空行程优化、路径简化、圆弧拟合和层时间调整。")
+
+    try:
+        if checkpoint:
+            if not os.path.exists(output_directory):
+                os.makedirs(output_directory)
+                print(f"创建目录: {output_directory}")
+            convert_marlin_checkpointed(input_filepath, full_output_path, user_defined_layer_height,
+                                        desired_g1_xy_feedrate=desired_g1_xy_feedrate,
+                                        desired_g1_z_feedrate=desired_g1_z_feedrate,
+                                        fixed_g0_feedrate=fixed_g0_feedrate,
+                                        compact=compact, precision=precision)
+        else:
+            with gcode_io.open_input(input_filepath) as f:
+                if not os.path.exists(output_directory):
+                    os.makedirs(output_directory)
+                    print(f"创建目录: {output_directory}")
+
+                with gcode_io.open_output(full_output_path, compact=compact, precision=precision) as outfile:
+                    convert_marlin_stream(
+                        f,
+                        outfile,
+                        os.path.basename(input_filepath),
+                        user_defined_layer_height,
+                        desired_g1_xy_feedrate=desired_g1_xy_feedrate,
+                        desired_g1_z_feedrate=desired_g1_z_feedrate,
+                        fixed_g0_feedrate=fixed_g0_feedrate,
+                        optimize_travel=optimize_travel,
+                        simplify_tolerance=simplify_tolerance,
+                        arc_tolerance=arc_tolerance,
+                        min_layer_time=min_layer_time,
+                        max_layer_feedrate=max_layer_feedrate,
+                        workers=workers,
+                        preview=builder,
+                    )
         
         print(f"转换完成。文件已保存到: {full_output_path}")
+        if write_preview:
+            preview_output_path = preview.preview_path(full_output_path)
+            # a resumed run does not see the lines written before the interruption: read them back
+            result = builder.finish() if builder is not None else preview.build_preview(full_output_path)
+            result.save(preview_output_path)
+            preview.print_preview_report(result, preview_output_path)
+            print(f"预览文件已保存到: {preview_output_path}")
         return full_output_path
 
     except FileNotFoundError:
@@ -233,14 +560,66 @@ def convert_marlin_to_simple_grbl(
         traceback.print_exc() 
         return None
 
-if __name__ == '__main__':
+def _ask_advanced_options():
+    """
+    Asks for the optional stages of the conversion (also available as cli.py convert options); returns
+    them as keyword arguments of convert_marlin_to_simple_grbl.
+    """
+    str_optimize = input("是否优化空行程 (重新排列每层的打印路径)? (y/N): ").strip().lower()
+    optimize_travel = str_optimize in ("y", "yes")
+
+    str_tolerance = input("请输入路径简化的弦高公差 (mm, 留空则不简化): ").strip()
+    try:
+        simplify_tolerance = float(str_tolerance) if str_tolerance else None
+    except ValueError:
+        print("错误：请输入有效的数字作为公差，将不进行路径简化。")
+        simplify_tolerance = None
+
+    str_arc_tolerance = input("请输入圆弧拟合公差 (mm, 留空则不生成 G2/G3 圆弧): ").strip()
+    try:
+        arc_tolerance = float(str_arc_tolerance) if str_arc_tolerance else None
+    except ValueError:
+        print("错误：请输入有效的数字作为公差，将不进行圆弧拟合。")
+        arc_tolerance = None
+
+    str_min_layer_time = input("请输入最小层时间 (s, 短层自动减速; 留空则不调整): ").strip()
+    try:
+        min_layer_time = float(str_min_layer_time) if str_min_layer_time else None
+        str_max_feed = input("请输入长层加速的最高 G1 速度 (mm/min, 留空则不加速): ").strip() if min_layer_time else ""
+        max_layer_feedrate = float(str_max_feed) if str_max_feed else None
+    except ValueError:
+        print("错误：请输入有效的数字，将不调整层速度。")
+        min_layer_time = max_layer_feedrate = None
+
+    str_compact = input("是否输出紧凑 G-code (省略与模态状态相同的 X/Y/Z/F 字)? (y/N): ").strip().lower()
+    compact = str_compact in ("y", "yes")
+
+    str_preview = input("是否同时生成分层预览文件 (.diwpv, 供查看器快速显示)? (y/N): ").strip().lower()
+    write_preview = str_preview in ("y", "yes")
+
+    str_checkpoint = input("是否启用断点续传 (按层保存进度, 中断后重新运行即可继续)? (y/N): ").strip().lower()
+    checkpoint = str_checkpoint in ("y", "yes")
+
+    return {
+        "optimize_travel": optimize_travel,
+        "simplify_tolerance": simplify_tolerance,
+        "arc_tolerance": arc_tolerance,
+        "min_layer_time": min_layer_time,
+        "max_layer_feedrate": max_layer_feedrate,
+        "compact": compact,
+        "write_preview": write_preview,
+        "checkpoint": checkpoint,
+    }
+
+
+def main():
     raw_marlin_file_path = input("请输入Marlin G-code文件路径: ")
     marlin_file_path = raw_marlin_file_path.replace("\\\\", "/")
     print(f"提示：处理后的文件路径为: {marlin_file_path}")
 
     output_name_base_input = input("请输入输出文件的期望名称 (无需扩展名, 留空则使用原文件名): ")
     if not output_name_base_input: 
-        output_name_base_input = os.path.splitext(os.path.basename(marlin_file_path))[0]
+        output_name_base_input = os.path.splitext(gcode_io.split_compression_suffix(os.path.basename(marlin_file_path))[0])[0]
         print(f"提示：输出文件名将使用原文件名基础: '{output_name_base_input}'")
 
     default_save_dir = "/Users/ericxu/Downloads/"  # Make sure this path is correct for your system
@@ -263,6 +642,11 @@ if __name__ == '__main__':
     str_g1_z_feed = input("请输入G1 Z轴纯移动速度 (mm/min, 留空则尝试保留原始F值或使用XY速度): ")
     g1_z_feed = float(str_g1_z_feed) if str_g1_z_feed else None 
     
+    advanced_options = {}
+    str_advanced = input("是否配置高级选项 (空行程优化、路径简化、圆弧拟合、最小层时间、紧凑输出、预览、断点续传)? (y/N): ")
+    if str_advanced.strip().lower() in ("y", "yes"):
+        advanced_options = _ask_advanced_options()
+
     fixed_g0_speed = 1750.0 
     
     if g1_z_feed is not None:
@@ -281,7 +665,13 @@ if __name__ == '__main__':
             user_defined_layer_height=user_lh,
             desired_g1_xy_feedrate=g1_xy_feed,
             desired_g1_z_feedrate=g1_z_feed, 
-            fixed_g0_feedrate=fixed_g0_speed
+            fixed_g0_feedrate=fixed_g0_speed,
+            output_compression=gcode_io.compression_from_path(marlin_file_path),
+            **advanced_options
         )
     else:
         print(f"错误: 文件 '{marlin_file_path}' 不存在。请检查路径。")
+
+
+if __name__ == '__main__':
+    run_main(main)
@@ -0,0 +1,704 @@
+import collections
+import math
+import os
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # optional: the bucket grid below is used instead
+    cKDTree = None
+
+import gcode_io
+from gcode_io import is_comment_line, parse_move, track_modal_state
+from profiling import run_main
+
+NEIGHBOUR_COUNT = 6
+TWO_OPT_PASSES = 3
+TWO_OPT_MAX_SEGMENT = 3000
+MAX_HELD_LINES = 10000
+
+
+def _distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def _coordinate(axis, value, token):
+    return f"{axis}{token}" if token is not None else f"{axis}{value:.3f}"
+
+
+class PointGrid:
+    """
+    Uniform bucket grid over 2-D points for nearest-neighbour queries. Points can be removed; the grid is
+    rebuilt over the remaining points once most of them are gone, so queries stay cheap to the end.
+    """
+
+    def __init__(self, points):
+        self.xs = [float(p[0]) for p in points]
+        self.ys = [float(p[1]) for p in points]
+        self.alive = [True] * len(self.xs)
+        self.alive_count = len(self.xs)
+        self._build(range(len(self.xs)))
+
+    def _build(self, ids):
+        ids = list(ids)
+        self.built_count = len(ids)
+        xs = [self.xs[i] for i in ids]
+        ys = [self.ys[i] for i in ids]
+        self.min_x, self.min_y = min(xs), min(ys)
+        span = max(max(xs) - self.min_x, max(ys) - self.min_y)
+        self.cells = max(1, int(math.sqrt(len(ids) / 2.0)))
+        self.cell_size = span / self.cells if span > 0 else 1.0
+        self.buckets = collections.defaultdict(list)
+        for i, x, y in zip(ids, xs, ys):
+            self.buckets[self._key(x, y)].append(i)
+
+    def _key(self, x, y):
+        return int(math.floor((x - self.min_x) / self.cell_size)), int(math.floor((y - self.min_y) / self.cell_size))
+
+    def _ring(self, cx, cy, r):
+        if r == 0:
+            yield cx, cy
+            return
+        for dx in range(-r, r + 1):
+            yield cx + dx, cy - r
+            yield cx + dx, cy + r
+        for dy in range(-r + 1, r):
+            yield cx - r, cy + dy
+            yield cx + r, cy + dy
+
+    def _max_ring(self, cx, cy):
+        return max(abs(cx), abs(cy), abs(self.cells - cx), abs(self.cells - cy)) + 1
+
+    def remove(self, i):
+        if self.alive[i]:
+            self.alive[i] = False
+            self.alive_count -= 1
+            if self.alive_count and self.built_count > 64 and self.alive_count * 4 < self.built_count:
+                self._build(j for j, alive in enumerate(self.alive) if alive)
+
+    def nearest(self, x, y):
+        """
+        Index of the nearest remaining point, or -1 if none is left.
+        """
+        if not self.alive_count:
+            return -1
+        cx, cy = self._key(x, y)
+        best, best_d2 = -1, math.inf
+        xs, ys, alive, buckets = self.xs, self.ys, self.alive, self.buckets
+        for r in range(self._max_ring(cx, cy) + 1):
+            for key in self._ring(cx, cy, r):
+                bucket = buckets.get(key)
+                if not bucket:
+                    continue
+                for i in bucket:
+                    if alive[i]:
+                        d2 = (xs[i] - x) ** 2 + (ys[i] - y) ** 2
+                        if d2 < best_d2 or (d2 == best_d2 and i < best):
+                            best, best_d2 = i, d2
+            # every point outside rings 0..r is at least r cells away
+            if best >= 0 and best_d2 <= (r * self.cell_size) ** 2:
+                break
+        return best
+
+
+def _neighbour_lists(points, k):
+    """
+    For every point, the indices of its k nearest other points (KD-tree if scipy is available).
+    """
+    k = min(k, len(points) - 1)
+    if k <= 0:
+        return [[] for _ in range(len(points))]
+    if cKDTree is not None:
+        _, neighbours = cKDTree(points).query(points, k + 1)
+        return [row[1:] for row in np.atleast_2d(neighbours).tolist()]
+    # bucket grid with ~4 points per cell; the points of a cell are searched against the surrounding cells at once
+    n = len(points)
+    lows = points.min(axis=0)
+    span = float((points.max(axis=0) - lows).max())
+    cell_size = span / max(1.0, math.sqrt(n / 4.0)) or 1.0
+    cells = np.floor((points - lows) / cell_size).astype(np.int64)
+    by_cell = np.lexsort((cells[:, 1], cells[:, 0]))
+    sorted_cells = cells[by_cell]
+    breaks = np.flatnonzero((np.diff(sorted_cells, axis=0) != 0).any(axis=1)) + 1
+    members = {tuple(sorted_cells[ids[0]].tolist()): by_cell[ids]
+               for ids in np.split(np.arange(n), breaks)}
+    neighbours = [None] * n
+    for (cx, cy), ids in members.items():
+        # grow the square around the cell until it holds enough candidates
+        radius = 1
+        while True:
+            candidates = np.concatenate([members[(x, y)] for x in range(cx - radius, cx + radius + 1)
+                                         for y in range(cy - radius, cy + radius + 1) if (x, y) in members])
+            if len(candidates) > k:
+                break
+            radius *= 2
+        d2 = ((points[ids, None, :] - points[None, candidates, :]) ** 2).sum(axis=2)
+        d2[ids[:, None] == candidates[None, :]] = np.inf
+        nearest = np.argsort(d2, axis=1, kind="stable")[:, :k]
+        for i, row in zip(ids.tolist(), candidates[nearest].tolist()):
+            neighbours[i] = row
+    return neighbours
+
+
+def plan_chain_order(origin, starts, ends, reversible, two_opt=True):
+    """
+    Orders chains (given by their start/end points, (n, 2) arrays) for minimal travel from origin:
+    greedy nearest neighbour over a bucket grid, then 2-opt segment reversals restricted to reversible
+    chains using k-nearest-neighbour candidate lists. Returns (order, flipped) where flipped[c] means
+    chain c is printed from its end to its start.
+    """
+    n = len(starts)
+    order, flipped = [], [False] * n
+    if n == 0:
+        return order, flipped
+
+    # point 2c is the start of chain c, point 2c+1 its end (only usable as an entry if c is reversible)
+    points = np.empty((2 * n, 2))
+    points[0::2] = starts
+    points[1::2] = ends
+    grid = PointGrid(points)
+    for c in range(n):
+        if not reversible[c]:
+            grid.remove(2 * c + 1)
+    position = (float(origin[0]), float(origin[1]))
+    while grid.alive_count:
+        p = grid.nearest(*position)
+        c = p // 2
+        flipped[c] = bool(p % 2)
+        order.append(c)
+        grid.remove(2 * c)
+        grid.remove(2 * c + 1)
+        exit_point = points[2 * c + (0 if flipped[c] else 1)]
+        position = (float(exit_point[0]), float(exit_point[1]))
+
+    if two_opt and n > 2 and any(reversible):
+        _two_opt(origin, points, reversible, order, flipped)
+    return order, flipped
+
+
+def _two_opt(origin, points, reversible, order, flipped):
+    n = len(order)
+    coords = [tuple(p) for p in points.tolist()]
+    position = [0] * n
+    for p, c in enumerate(order):
+        position[c] = p
+    # reversing a segment of reversible chains leaves this prefix count unchanged
+    fixed_before = [0]
+    for c in order:
+        fixed_before.append(fixed_before[-1] + (0 if reversible[c] else 1))
+
+    def entry(c):
+        return coords[2 * c + 1] if flipped[c] else coords[2 * c]
+
+    def exit_(c):
+        return coords[2 * c] if flipped[c] else coords[2 * c + 1]
+
+    def reverse(lo, hi):
+        order[lo:hi + 1] = order[lo:hi + 1][::-1]
+        for p in range(lo, hi + 1):
+            c = order[p]
+            position[c] = p
+            flipped[c] = not flipped[c]
+
+    neighbours = _neighbour_lists(points, NEIGHBOUR_COUNT)
+    origin = (float(origin[0]), float(origin[1]))
+    origin_d2 = ((points - np.asarray(origin)) ** 2).sum(axis=1)
+    origin_candidates = np.argsort(origin_d2, kind="stable")[:NEIGHBOUR_COUNT].tolist()
+    for _ in range(TWO_OPT_PASSES):
+        improved = False
+        for i in range(n):
+            a = exit_(order[i - 1]) if i else origin
+            b = entry(order[i])
+            if i:
+                candidate_points = neighbours[2 * order[i - 1] + (0 if flipped[order[i - 1]] else 1)]
+            else:
+                candidate_points = origin_candidates
+            for point in candidate_points:
+                j = position[point // 2]
+                if j >= i:
+                    # reverse i..j: a -> exit(order[j]) ... entry(order[i]) -> entry(order[j + 1])
+                    lo, hi = i, j
+                    new_a = exit_(order[j])
+                    following = entry(order[j + 1]) if j + 1 < n else None
+                    delta = _distance(a, new_a) - _distance(a, b)
+                    if following is not None:
+                        delta += _distance(b, following) - _distance(new_a, following)
+                elif j < i - 1:
+                    # reverse j+1..i-1: exit(order[j]) -> a ... -> b
+                    lo, hi = j + 1, i - 1
+                    c_exit = exit_(order[j])
+                    c_next = entry(order[j + 1])
+                    delta = (_distance(c_exit, a) + _distance(c_next, b)
+                             - _distance(c_exit, c_next) - _distance(a, b))
+                else:
+                    continue
+                if delta < -1e-9 and hi - lo < TWO_OPT_MAX_SEGMENT and fixed_before[hi + 1] == fixed_before[lo]:
+                    reverse(lo, hi)
+                    improved = True
+                    break
+        if not improved:
+            break
+
+
+def _new_chain(prefix):
+    return {"prefix": prefix, "travel": [], "body": [], "lead": 0, "start": None, "end": None,
+            "start_tokens": (None, None), "first_target": None, "travel_length": 0.0, "travel_feed": None,
+            "travel_resets_position": False, "movable": True, "reversible": True, "segments": [],
+            "exit_feed": None}
+
+
+def _same_feed(a, b):
+    if a is None or b is None:
+        return a is b
+    return float(a) == float(b)
+
+
+class TravelOptimizer:
+    """
+    Line-by-line travel optimizer. A run is the stretch between two "barrier" lines (layer comments, Z
+    moves, other commands); inside it, the extrusion chains (G1 moves after a G0 travel) may be reordered
+    and reversed. A chain is only moved if its feedrate is set by its own travel or first G1, only reversed
+    if every G1 has explicit X, Y and F, and a reordering that leaves a different position or feedrate
+    behind is only kept if the following lines set both again before using them.
+    """
+
+    def __init__(self, reverse_chains=True, two_opt=True):
+        self.reverse_chains = reverse_chains
+        self.two_opt = two_opt
+        self.position = None # (x, y) as emitted so far, None if unknown
+        self.feed = None
+        self.absolute = True
+        self.layer = 0
+        self._queue = collections.deque()
+        self._held = None
+        self._reset_run()
+
+    def _reset_run(self):
+        self.run_start = self.position
+        self.head = []
+        self.head_end = None
+        self.chains = []
+        self.pending = []
+
+    def push(self, line):
+        """
+        Feeds one line (without newline); returns the list of lines that can be output now.
+        """
+        output = []
+        self._queue.append(line)
+        self._drain(output)
+        return output
+
+    def finish(self):
+        """
+        Returns the remaining lines at the end of the input.
+        """
+        output = []
+        while True:
+            self._drain(output)
+            if self._held is not None:
+                self._release(True, output)
+            elif self.head or self.chains or self.pending:
+                self._close_run(None, output)
+            else:
+                return output
+
+    def _drain(self, output):
+        while self._queue:
+            line = self._queue.popleft()
+            if self._held is not None:
+                self._hold(line, output)
+            else:
+                self._process(line, output)
+
+    # --- collecting -------------------------------------------------------------------------------------
+
+    def _process(self, line, output):
+        if is_comment_line(line):
+            layer_match = gcode_io.LAYER_COMMENT_PATTERN.search(line)
+            if layer_match:
+                self._close_run(line, output)
+                self.layer = int(layer_match.group(1))
+            else:
+                self.pending.append(line)
+            return
+
+        move = parse_move(line)
+        if move is None or move["Z"] is not None or (move["X"] is None and move["Y"] is None) \
+                or self.run_start is None or not self.absolute:
+            self._close_run(line, output)
+            return
+        x = float(move["X"]) if move["X"] is not None else self.position[0]
+        y = float(move["Y"]) if move["Y"] is not None else self.position[1]
+        if move["cmd"] == "G0":
+            self._add_travel(line, move, (x, y))
+        else:
+            self._add_extrusion(line, move, (x, y))
+        self.position = (x, y)
+        if move["F"] is not None:
+            self.feed = move["F"]
+
+    def _add_travel(self, line, move, point):
+        chain = self.chains[-1] if self.chains else None
+        if chain is None or chain["body"]:
+            chain = _new_chain(self.pending)
+            chain["first_target"] = point
+            chain["travel_resets_position"] = move["X"] is not None and move["Y"] is not None
+            self.chains.append(chain)
+        else:
+            chain["prefix"].extend(self.pending)
+        self.pending = []
+        chain["travel"].append(line)
+        chain["travel_length"] += _distance(self.position, point)
+        chain["start"] = point
+        chain["start_tokens"] = (move["X"], move["Y"])
+        if move["F"] is not None:
+            chain["travel_feed"] = move["F"]
+
+    def _add_extrusion(self, line, move, point):
+        if not self.chains:
+            # extrusion straight after a barrier continues from there and stays in place
+            self.head.extend(self.pending)
+            self.head.append(line)
+            self.head_end = point
+            self.pending = []
+            return
+        chain = self.chains[-1]
+        if not chain["body"]:
+            chain["lead"] = len(self.pending)
+            if chain["travel_feed"] is None and move["F"] is None:
+                chain["movable"] = False
+        elif self.pending:
+            chain["reversible"] = False
+        chain["body"].extend(self.pending)
+        self.pending = []
+        chain["body"].append(line)
+        chain["segments"].append((move["X"], move["Y"], move["F"]))
+        if move["X"] is None or move["Y"] is None or move["F"] is None or move["comment"]:
+            chain["reversible"] = False
+        chain["end"] = point
+        if move["F"] is not None:
+            chain["exit_feed"] = move["F"]
+        elif chain["exit_feed"] is None:
+            chain["exit_feed"] = chain["travel_feed"]
+
+    # --- optimizing -------------------------------------------------------------------------------------
+
+    def _groups(self):
+        """
+        Splits the run's chains into (fixed_chain, None) and (None, [movable chains]) entries.
+        """
+        groups = []
+        for chain in self.chains:
+            if chain["movable"] and chain["body"]:
+                if groups and groups[-1][0] is None:
+                    groups[-1][1].append(chain)
+                else:
+                    groups.append((None, [chain]))
+            else:
+                groups.append((chain, None))
+        return groups
+
+    def _close_run(self, barrier, output):
+        """
+        Emits the collected run (optimized where possible) followed by the barrier line. If the last group
+        of chains now ends somewhere else, the run is held back until the following lines decide.
+        """
+        groups = self._groups()
+        original, optimized = list(self.head), list(self.head)
+        position = self.head_end if self.head else self.run_start
+        tail_group = None
+        for k, (fixed, group) in enumerate(groups):
+            if fixed is not None:
+                original.extend(_chain_lines(fixed))
+                optimized.extend(_chain_lines(fixed))
+                position = fixed["end"] if fixed["body"] else fixed["start"]
+                continue
+            group_lines = [line for chain in group for line in _chain_lines(chain)]
+            plan = self._plan(position, group)
+            next_fixed = groups[k + 1][0] if k + 1 < len(groups) else None
+            if plan is not None:
+                order, flipped, old_travel, new_travel = plan
+                new_end = _chain_exit(group[order[-1]], flipped[order[-1]])
+                old_end = (group[-1]["end"], group[-1]["exit_feed"])
+                end_changed = new_end[0] != old_end[0] or not _same_feed(new_end[1], old_end[1])
+                if end_changed and next_fixed is not None:
+                    # the following unmovable chain uses the feedrate and travels from the new end
+                    target = next_fixed["first_target"]
+                    new_travel += _distance(new_end[0], target) - _distance(old_end[0], target)
+                    if not next_fixed["travel_resets_position"] or not _same_feed(new_end[1], old_end[1]) \
+                            or new_travel >= old_travel - 1e-6:
+                        plan = None
+            if plan is None:
+                original.extend(group_lines)
+                optimized.extend(group_lines)
+                position = group[-1]["end"]
+                continue
+            new_lines = _emit(position, group, order, flipped)
+            position = new_end[0]
+            if end_changed and next_fixed is None:
+                tail_group = (new_end, old_end, old_travel, new_travel)
+                original.extend(group_lines)
+            else:
+                original.extend(new_lines)
+            optimized.extend(new_lines)
+
+        tail = self.pending
+        if barrier is not None:
+            tail.append(barrier)
+        if tail_group is None:
+            output.extend(optimized)
+            for line in tail:
+                output.append(line)
+                self._track(line)
+            self._reset_run()
+            return
+
+        new_end, old_end, old_travel, new_travel = tail_group
+        self._held = {
+            "optimized": optimized, "original": original, "new_end": new_end, "old_end": old_end,
+            "saved": old_travel - new_travel, "lines": [],
+            "need_position": new_end[0] != old_end[0], "need_feed": not _same_feed(new_end[1], old_end[1]),
+        }
+        self.position, self.feed = new_end
+        self._reset_run()
+        self._queue.extendleft(reversed(tail))
+
+    def _plan(self, origin, group):
+        """
+        Returns (order, flipped, old_travel, new_travel) if reordering the group shortens its travel.
+        """
+        if origin is None or len(group) < 2:
+            return None
+        starts = np.array([chain["start"] for chain in group], dtype=float)
+        ends = np.array([chain["end"] for chain in group], dtype=float)
+        reversible = [self.reverse_chains and chain["reversible"] for chain in group]
+        order, flipped = plan_chain_order(origin, starts, ends, reversible, two_opt=self.two_opt)
+        position, new_travel = origin, 0.0
+        for c in order:
+            new_travel += _distance(position, ends[c] if flipped[c] else starts[c])
+            position = starts[c] if flipped[c] else ends[c]
+        old_travel = sum(chain["travel_length"] for chain in group)
+        if new_travel >= old_travel - 1e-6:
+            return None
+        return order, flipped, old_travel, new_travel
+
+    # --- deciding a held run ----------------------------------------------------------------------------
+
+    def _hold(self, line, output):
+        held = self._held
+        held["lines"].append(line)
+        decision = self._decide(line)
+        if decision is None and len(held["lines"]) > MAX_HELD_LINES:
+            decision = False
+        if decision is not None:
+            self._release(decision, output)
+
+    def _decide(self, line):
+        """
+        True once the held run's new end position/feedrate are both overwritten, False as soon as one of
+        them is used, None while undecided.
+        """
+        held = self._held
+        if is_comment_line(line):
+            return None
+        move = parse_move(line)
+        if move is None:
+            # arcs, G92, G91, ... depend on the current position; M/T/S commands do not
+            return False if line.lstrip()[:1].upper() == "G" else None
+        if held["need_position"] and (move["X"] is not None or move["Y"] is not None):
+            if move["cmd"] != "G0" or move["X"] is None or move["Y"] is None:
+                return False
+            # the travel that leaves the run now starts from the new end point
+            target = (float(move["X"]), float(move["Y"]))
+            held["saved"] += _distance(held["old_end"][0], target) - _distance(held["new_end"][0], target)
+            if held["saved"] <= 1e-6:
+                return False
+            held["need_position"] = False
+        if held["need_feed"]:
+            if move["F"] is not None:
+                held["need_feed"] = False
+            elif move["cmd"] == "G1":
+                return False
+        if not held["need_position"] and not held["need_feed"]:
+            return True
+        return None
+
+    def _release(self, accepted, output):
+        held = self._held
+        self._held = None
+        if accepted:
+            output.extend(held["optimized"])
+        else:
+            output.extend(held["original"])
+            self.position, self.feed = held["old_end"]
+        self._reset_run()
+        self._queue.extendleft(reversed(held["lines"]))
+
+    def _track(self, line):
+        """
+        Updates the modal state for a line that is passed through unchanged.
+        """
+        self.position, self.feed, self.absolute = track_modal_state(line, self.position, self.feed, self.absolute)
+
+
+def _chain_lines(chain):
+    return chain["prefix"] + chain["travel"] + chain["body"]
+
+
+def _chain_exit(chain, flipped):
+    if flipped:
+        return chain["start"], chain["segments"][0][2]
+    return chain["end"], chain["exit_feed"]
+
+
+def _emit(origin, group, order, flipped):
+    """
+    Lines of the group in the new order. A chain keeps its original travel lines when it is entered from
+    the same point as before; otherwise the travel becomes a single G0 to its (new) entry point.
+    """
+    lines = []
+    previous_exit = origin
+    for c in order:
+        chain = group[c]
+        original_previous = group[c - 1]["end"] if c else origin
+        lines.extend(chain["prefix"])
+        if not flipped[c] and previous_exit == original_previous:
+            lines.extend(chain["travel"])
+            lines.extend(chain["body"])
+        else:
+            if flipped[c]:
+                (x_token, y_token, _), target = chain["segments"][-1], chain["end"]
+            else:
+                (x_token, y_token), target = chain["start_tokens"], chain["start"]
+            travel = f"G0 {_coordinate('X', target[0], x_token)} {_coordinate('Y', target[1], y_token)}"
+            if chain["travel_feed"] is not None:
+                travel += f" F{chain['travel_feed']}"
+            lines.append(travel)
+            lines.extend(_reversed_body(chain) if flipped[c] else chain["body"])
+        previous_exit = chain["start"] if flipped[c] else chain["end"]
+    return lines
+
+
+def _reversed_body(chain):
+    lines = chain["body"][:chain["lead"]]
+    segments = chain["segments"]
+    for m in range(len(segments) - 1, -1, -1):
+        if m:
+            x_token, y_token = segments[m - 1][0], segments[m - 1][1]
+            target = (float(x_token), float(y_token))
+        else:
+            (x_token, y_token), target = chain["start_tokens"], chain["start"]
+        lines.append(f"G1 {_coordinate('X', target[0], x_token)} {_coordinate('Y', target[1], y_token)} "
+                     f"F{segments[m][2]}")
+    return lines
+
+
+class TravelMeter:
+    """
+    The G0 travel distance (XY, mm) per layer of a stream of NC lines as the machine moves it; moves from
+    an unknown position (start of the program, relative mode, after G92) are not counted.
+    """
+
+    def __init__(self):
+        self.travel = collections.defaultdict(float)
+        self.position = None
+        self.feed = None
+        self.absolute = True
+        self.layer = 0
+
+    def add(self, line):
+        if line.startswith("; (--- Layer"):
+            self.layer = int(gcode_io.LAYER_COMMENT_PATTERN.match(line).group(1))
+        position = self.position
+        self.position, self.feed, self.absolute = track_modal_state(line, position, self.feed, self.absolute)
+        if position is not None and self.position is not None and self.position != position:
+            move = parse_move(line)
+            if move is not None and move["cmd"] == "G0":
+                self.travel[self.layer] += _distance(position, self.position)
+
+
+def optimize_travel_lines(lines, reverse_chains=True, two_opt=True, stats=None):
+    """
+    Generator over any iterable of NC lines (with or without newlines); yields the lines without newlines
+    with the extrusion chains of every layer reordered (nearest neighbour + 2-opt) to shorten the G0
+    travel. stats (dict) receives {layer: [travel_before, travel_after]}: the G0 distance in mm of the
+    input and of the output in every layer, measured on the lines themselves (see TravelMeter).
+    """
+    optimizer = TravelOptimizer(reverse_chains=reverse_chains, two_opt=two_opt)
+    before, after = TravelMeter(), TravelMeter()
+    for line in gcode_io.strip_newlines(lines):
+        before.add(line)
+        for output_line in optimizer.push(line):
+            after.add(output_line)
+            yield output_line
+    for output_line in optimizer.finish():
+        after.add(output_line)
+        yield output_line
+    if stats is not None:
+        for layer_num in before.travel.keys() | after.travel.keys():
+            stats[layer_num] = [before.travel[layer_num], after.travel[layer_num]]
+
+
+def print_travel_report(stats):
+    if not any(after < before - 1e-6 for before, after in stats.values()):
+        print("空行程优化: 没有可以缩短的空行程。")
+        return
+    total_before = total_after = 0.0
+    for layer_num in sorted(stats):
+        before, after = stats[layer_num]
+        total_before += before
+        total_after += after
+        if after < before - 1e-6:
+            print(f"  第 {layer_num} 层: 空行程 {before:.1f} mm -> {after:.1f} mm (节省 {before - after:.1f} mm)")
+    saved = total_before - total_after
+    percent = 100.0 * saved / total_before if total_before else 0.0
+    print(f"空行程优化: G0 空行程共 {total_before:.1f} mm -> {total_after:.1f} mm, 节省 {saved:.1f} mm ({percent:.1f}%)")
+
+
+def optimize_travel_stream(infile, outfile, reverse_chains=True, two_opt=True):
+    """
+    Stream version of optimize_travel_lines; prints the per-layer travel report.
+    """
+    stats = {}
+    separator = ""
+    for line in optimize_travel_lines(infile, reverse_chains=reverse_chains, two_opt=two_opt, stats=stats):
+        outfile.write(separator + line)
+        separator = "\n"
+    print_travel_report(stats)
+    return True
+
+
+def default_output_path(input_file_path):
+    return gcode_io.default_output_path(input_file_path, "_travel")
+
+
+def optimize_travel_in_file(input_filepath, output_filepath=None, reverse_chains=True, two_opt=True):
+    if output_filepath is None:
+        output_filepath = default_output_path(input_filepath)
+    try:
+        with gcode_io.open_input(input_filepath) as f_in, \
+             gcode_io.open_output(output_filepath) as f_out:
+            optimize_travel_stream(f_in, f_out, reverse_chains=reverse_chains, two_opt=two_opt)
+    except FileNotFoundError:
+        print(f"错误: 文件 '{input_filepath}' 未找到。")
+        return None
+    except Exception as e:
+        print(f"错误: 处理文件 '{input_filepath}' 失败: {e}")
+        return None
+    print(f"处理完成！优化后的文件已保存到: {output_filepath}")
+    return output_filepath
+
+
+def main():
+    input_file_path = input("请输入NC文件的完整路径: ")
+    if not os.path.isfile(input_file_path):
+        print(f"错误: 文件 '{input_file_path}' 不存在或不是一个文件。")
+        return
+    reverse_input = input("是否允许反向打印路径段? (Y/n): ").strip().lower()
+    optimize_travel_in_file(input_file_path, reverse_chains=reverse_input not in ("n", "no"))
+
+
+if __name__ == "__main__":
+    run_main(main)